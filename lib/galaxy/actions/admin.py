@@ -52,6 +52,7 @@ class AdminActions( object ):
                     gqa = self.app.model.GroupQuotaAssociation( group, quota )
                     self.sa_session.add( gqa )
             self.sa_session.flush()
+            self.app.quota_agent.invalidate()
             message = "Quota '%s' has been created with %d associated users and %d associated groups." % \
                       ( quota.name, len( params.in_users ), len( params.in_groups ) )
             return quota, message
@@ -100,6 +101,7 @@ class AdminActions( object ):
             quota.operation = params.operation
             self.sa_session.add( quota )
             self.sa_session.flush()
+            self.app.quota_agent.invalidate()
             message = "Quota '%s' is now '%s'" % ( quota.name, quota.operation + quota.display_amount )
             return message
 
@@ -116,6 +118,7 @@ class AdminActions( object ):
                     for dqa in quota.default:
                         self.sa_session.delete( dqa )
                     self.sa_session.flush()
+                    self.app.quota_agent.invalidate()
                 else:
                     message = "Quota '%s' is not a default." % quota.name
             return message
@@ -128,6 +131,7 @@ class AdminActions( object ):
             for dqa in quota.default:
                 self.sa_session.delete( dqa )
             self.sa_session.flush()
+            self.app.quota_agent.invalidate()
             return message
 
     def _mark_quota_deleted( self, quota, params ):
@@ -146,6 +150,7 @@ class AdminActions( object ):
             self.sa_session.add( q )
             names.append( q.name )
         self.sa_session.flush()
+        self.app.quota_agent.invalidate()
         message += ', '.join( names )
         return message
 
@@ -165,6 +170,7 @@ class AdminActions( object ):
             self.sa_session.add( q )
             names.append( q.name )
         self.sa_session.flush()
+        self.app.quota_agent.invalidate()
         message += ', '.join( names )
         return message
         
@@ -192,5 +198,6 @@ class AdminActions( object ):
                 self.sa_session.delete( gqa )
             names.append( q.name )
         self.sa_session.flush()
+        self.app.quota_agent.invalidate()
         message += ', '.join( names )
         return message
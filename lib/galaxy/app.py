@@ -114,7 +114,7 @@ class UniverseApplication( object ):
         self.host_security_agent = galaxy.security.HostAgent( model=self.security_agent.model, permitted_actions=self.security_agent.permitted_actions )
         # Load quota management.
         if self.config.enable_quotas:
-            self.quota_agent = galaxy.quota.QuotaAgent( self.model )
+            self.quota_agent = galaxy.quota.QuotaAgent( self.model, check_interval=self.config.quota_cache_check_interval )
         else:
             self.quota_agent = galaxy.quota.NoQuotaAgent( self.model )
         # Heartbeat and memdump for thread / heap profiling
@@ -149,11 +149,15 @@ class UniverseApplication( object ):
         # FIXME: These are exposed directly for backward compatibility
         self.job_queue = self.job_manager.job_queue
         self.job_stop_queue = self.job_manager.job_stop_queue
+        # Start the workflow scheduler
+        from galaxy.workflow.scheduler import WorkflowScheduler
+        self.workflow_scheduler = WorkflowScheduler( self )
         # Initialize the external service types
         self.external_service_types = external_service_types.ExternalServiceTypesCollection( self.config.external_service_type_config_file, self.config.external_service_type_path, self )
 
     def shutdown( self ):
         self.job_manager.shutdown()
+        self.workflow_scheduler.shutdown()
         self.object_store.shutdown()
         if self.heartbeat:
             self.heartbeat.shutdown()
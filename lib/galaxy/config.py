@@ -49,8 +49,10 @@ class Configuration( object ):
         self.enable_openid = string_as_bool( kwargs.get( 'enable_openid', False ) )
         self.openid_config = kwargs.get( 'openid_config_file', 'openid_conf.xml' )
         self.enable_quotas = string_as_bool( kwargs.get( 'enable_quotas', False ) )
+        self.quota_cache_check_interval = int( kwargs.get( 'quota_cache_check_interval', 10 ) )
         self.tool_sheds_config = kwargs.get( 'tool_sheds_config_file', 'tool_sheds_conf.xml' )
         self.enable_unique_workflow_defaults = string_as_bool( kwargs.get( 'enable_unique_workflow_defaults', False ) )
+        self.workflow_scheduler_batch_size = int( kwargs.get( 'workflow_scheduler_batch_size', 20 ) )
         self.tool_path = resolve_path( kwargs.get( "tool_path", "tools" ), self.root )
         self.tool_data_path = resolve_path( kwargs.get( "tool_data_path", "tool-data" ), os.getcwd() )
         self.len_file_path = kwargs.get( "len_file_path", resolve_path(os.path.join(self.tool_data_path, 'shared','ucsc','chrom'), self.root) )
@@ -79,6 +81,7 @@ class Configuration( object ):
         self.id_secret = kwargs.get( "id_secret", "USING THE DEFAULT IS NOT SECURE!" )
         self.set_metadata_externally = string_as_bool( kwargs.get( "set_metadata_externally", "False" ) )
         self.retry_metadata_internally = string_as_bool( kwargs.get( "retry_metadata_internally", "True" ) )
+        self.metadata_worker_socket = kwargs.get( "metadata_worker_socket", None )
         self.use_remote_user = string_as_bool( kwargs.get( "use_remote_user", "False" ) )
         self.remote_user_maildomain = kwargs.get( "remote_user_maildomain", None )
         self.remote_user_logout_href = kwargs.get( "remote_user_logout_href", None )
@@ -93,6 +96,8 @@ class Configuration( object ):
         self.template_cache = resolve_path( kwargs.get( "template_cache_path", "database/compiled_templates" ), self.root )
         self.local_job_queue_workers = int( kwargs.get( "local_job_queue_workers", "5" ) )
         self.cluster_job_queue_workers = int( kwargs.get( "cluster_job_queue_workers", "3" ) )
+        self.cluster_job_status_min_interval = int( kwargs.get( "cluster_job_status_min_interval", "1" ) )
+        self.cluster_job_status_max_interval = int( kwargs.get( "cluster_job_status_max_interval", "30" ) )
         self.job_queue_cleanup_interval = int( kwargs.get("job_queue_cleanup_interval", "5") )
         self.cluster_files_directory = os.path.abspath( kwargs.get( "cluster_files_directory", "database/pbs" ) )
         self.job_working_directory = resolve_path( kwargs.get( "job_working_directory", "database/job_working_directory" ), self.root )
@@ -112,6 +117,8 @@ class Configuration( object ):
         self.smtp_username = kwargs.get( 'smtp_username', None )
         self.smtp_password = kwargs.get( 'smtp_password', None )
         self.track_jobs_in_database = kwargs.get( 'track_jobs_in_database', None )
+        self.job_readiness_reconcile_interval = int( kwargs.get( 'job_readiness_reconcile_interval', 60 ) )
+        self.job_concurrency_reconcile_interval = int( kwargs.get( 'job_concurrency_reconcile_interval', 300 ) )
         self.start_job_runners = kwargs.get( 'start_job_runners', None )
         self.expose_dataset_path = string_as_bool( kwargs.get( 'expose_dataset_path', 'False' ) )
         # External Service types used in sample tracking
@@ -134,6 +141,7 @@ class Configuration( object ):
         self.pbs_stage_path = kwargs.get('pbs_stage_path', "" )
         self.drmaa_external_runjob_script = kwargs.get('drmaa_external_runjob_script', None )
         self.drmaa_external_killjob_script = kwargs.get('drmaa_external_killjob_script', None)
+        self.drmaa_bulk_status_command = kwargs.get('drmaa_bulk_status_command', None)
         self.external_chown_script = kwargs.get('external_chown_script', None)
         self.environment_setup_file = kwargs.get( 'environment_setup_file', None )
         self.use_heartbeat = string_as_bool( kwargs.get( 'use_heartbeat', 'False' ) )
@@ -170,6 +178,7 @@ class Configuration( object ):
             self.use_tool_dependencies = False
         # Configuration options for taking advantage of nginx features
         self.upstream_gzip = string_as_bool( kwargs.get( 'upstream_gzip', False ) )
+        self.archive_compression_level = int( kwargs.get( 'archive_compression_level', 6 ) )
         self.apache_xsendfile = string_as_bool( kwargs.get( 'apache_xsendfile', False ) )
         self.nginx_x_accel_redirect_base = kwargs.get( 'nginx_x_accel_redirect_base', False )
         self.nginx_x_archive_files_base = kwargs.get( 'nginx_x_archive_files_base', False )
@@ -194,9 +203,17 @@ class Configuration( object ):
         self.os_is_secure = string_as_bool( kwargs.get( 'os_is_secure', True ) )
         self.os_conn_path = kwargs.get( 'os_conn_path', '/' )
         self.object_store_cache_size = float(kwargs.get( 'object_store_cache_size', -1 ))
+        self.os_transfer_part_size = float( kwargs.get( 'os_transfer_part_size', 16 ) )
+        self.os_transfer_concurrency = int( kwargs.get( 'os_transfer_concurrency', 4 ) )
         self.distributed_object_store_config_file = kwargs.get( 'distributed_object_store_config_file', None )
         if self.distributed_object_store_config_file is not None:
             self.distributed_object_store_config_file = resolve_path( self.distributed_object_store_config_file, self.root )
+        self.hierarchical_object_store_config_file = kwargs.get( 'hierarchical_object_store_config_file', None )
+        if self.hierarchical_object_store_config_file is not None:
+            self.hierarchical_object_store_config_file = resolve_path( self.hierarchical_object_store_config_file, self.root )
+        self.object_store_cache_path = kwargs.get( 'object_store_cache_path', None )
+        if self.object_store_cache_path is not None:
+            self.object_store_cache_path = resolve_path( self.object_store_cache_path, self.root )
         # Parse global_conf and save the parser
         global_conf = kwargs.get( 'global_conf', None )
         global_conf_parser = ConfigParser.ConfigParser()
@@ -320,6 +337,9 @@ class Configuration( object ):
         else:
             return default
     def check( self ):
+        # Compressors only reject bad levels once a download has started
+        if not 0 <= self.archive_compression_level <= 9:
+            raise ConfigurationError( "archive_compression_level must be between 0 and 9, not %d" % self.archive_compression_level )
         paths_to_check = [ self.root, self.tool_path, self.tool_data_path, self.template_path ]
         # Check that required directories exist
         for path in paths_to_check:
@@ -20,7 +20,7 @@ class Amos( data.Text ):
     """Class describing the AMOS assembly file """
     file_ext = 'afg'
 
-    def sniff( self, filename ):
+    def sniff_prefix( self, file_prefix ):
         # FIXME: this method will read the entire file.
         # It should call get_headers() like other sniff methods.
         """
@@ -48,7 +48,7 @@ class Amos( data.Text ):
         """
         isAmos = False
         try:
-            fh = open( filename )
+            fh = file_prefix.string_io()
             while not isAmos:
                 line = fh.readline()
                 if not line:
@@ -66,7 +66,7 @@ class Amos( data.Text ):
 class Sequences( sequence.Fasta ):
     """Class describing the Sequences file generated by velveth """
 
-    def sniff( self, filename ):
+    def sniff_prefix( self, file_prefix ):
         """
         Determines whether the file is a velveth produced  fasta format
         The id line has 3 fields separated by tabs: sequence_name  sequence_index cataegory::
@@ -78,7 +78,7 @@ class Sequences( sequence.Fasta ):
         """
 
         try:
-            fh = open( filename )
+            fh = file_prefix.string_io()
             while True:
                 line = fh.readline()
                 if not line:
@@ -103,7 +103,7 @@ class Sequences( sequence.Fasta ):
 class Roadmaps( data.Text ):
     """Class describing the Sequences file generated by velveth """
 
-    def sniff( self, filename ):
+    def sniff_prefix( self, file_prefix ):
         """
         Determines whether the file is a velveth produced RoadMap::
           142858  21      1
@@ -113,7 +113,7 @@ class Roadmaps( data.Text ):
         """
 
         try:
-            fh = open( filename )
+            fh = file_prefix.string_io()
             while True:
                 line = fh.readline()
                 if not line:
@@ -11,7 +11,7 @@ import pkg_resources
 pkg_resources.require( "bx-python" )
 from bx.seq.twobit import TWOBIT_MAGIC_NUMBER, TWOBIT_MAGIC_NUMBER_SWAP, TWOBIT_MAGIC_SIZE
 from urllib import urlencode, quote_plus
-import zipfile, gzip
+import zipfile
 import os, subprocess, tempfile
 import struct
 
@@ -34,8 +34,13 @@ class Binary( data.Data ):
 
     @staticmethod
     def is_sniffable_binary(filename):
+        # filename may also be a FilePrefix already read by the caller
+        if isinstance(filename, FilePrefix):
+            file_prefix = filename
+        else:
+            file_prefix = FilePrefix(filename)
         for format in Binary.sniffable_binary_formats:
-            if format["class"]().sniff(filename):
+            if run_sniffer(format["class"](), file_prefix):
                 return (format["type"], format["ext"])
         return None
 
@@ -216,11 +221,11 @@ class Bam( Binary ):
         dataset.metadata.bam_index = index_file
         # Remove temp file
         os.unlink( stderr_name )
-    def sniff( self, filename ):
+    def sniff_prefix( self, file_prefix ):
         # BAM is compressed in the BGZF format, and must not be uncompressed in Galaxy.
         # The first 4 bytes of any bam file is 'BAM\1', and the file is binary. 
         try:
-            header = gzip.open( filename ).read(4)
+            header = file_prefix.gzip_header( 4 )
             if binascii.b2a_hex( header ) == binascii.hexlify( 'BAM\1' ):
                 return True
             return False
@@ -287,11 +292,11 @@ class Sff( Binary ):
 
     def __init__( self, **kwd ):
         Binary.__init__( self, **kwd )
-    def sniff( self, filename ):
+    def sniff_prefix( self, file_prefix ):
         # The first 4 bytes of any sff file is '.sff', and the file is binary. For details
         # about the format, see http://www.ncbi.nlm.nih.gov/Traces/trace.cgi?cmd=show&f=formats&m=doc&s=format
         try:
-            header = open( filename ).read(4)
+            header = file_prefix.contents_header[:4]
             if binascii.b2a_hex( header ) == binascii.hexlify( '.sff' ):
                 return True
             return False
@@ -324,9 +329,9 @@ class BigWig(Binary):
         self._name = "BigWig"
     def _unpack( self, pattern, handle ):
         return struct.unpack( pattern, handle.read( struct.calcsize( pattern ) ) )
-    def sniff( self, filename ):
+    def sniff_prefix( self, file_prefix ):
         try:
-            magic = self._unpack( "I", open( filename ) )
+            magic = self._unpack( "I", file_prefix.binary_io() )
             return magic[0] == self._magic
         except:
             return False
@@ -363,13 +368,12 @@ class TwoBit (Binary):
     
     file_ext = "twobit"
     
-    def sniff(self, filename):
+    def sniff_prefix(self, file_prefix):
         try:
-            input = file(filename)
-            magic = struct.unpack(">L", input.read(TWOBIT_MAGIC_SIZE))[0]
+            magic = struct.unpack(">L", file_prefix.contents_header[:TWOBIT_MAGIC_SIZE])[0]
             if magic == TWOBIT_MAGIC_NUMBER or magic == TWOBIT_MAGIC_NUMBER_SWAP:
                 return True
-        except IOError:
+        except struct.error:
             return False
     def set_peek(self, dataset, is_multi_byte=False):
         if not dataset.dataset.purged:
@@ -4,6 +4,9 @@ from galaxy.util.odict import odict
 from galaxy.util.bunch import Bunch
 from galaxy.util import inflector
 from galaxy.util.sanitize_html import sanitize_html
+from galaxy.util.json import to_json_string
+from galaxy.datatypes.checkers import is_gzip
+from galaxy.datatypes.util.file_prefix import FilePrefix
 from cgi import escape
 import mimetypes
 import metadata
@@ -165,6 +168,14 @@ class Data( object ):
             return -1
         return rval
     max_optional_metadata_filesize = property( get_max_optional_metadata_filesize, set_max_optional_metadata_filesize )
+    def sniff( self, filename ):
+        """
+        Returns True if the file is in this datatype's format.  Sniffable
+        datatypes implement `sniff_prefix`, which is given the start of the
+        file as a FilePrefix rather than its name, so that a file is only read
+        once when many datatypes are sniffed.
+        """
+        return self.sniff_prefix( FilePrefix( filename ) )
     def set_peek( self, dataset, is_multi_byte=False ):
         """Set the peek and blurb text"""
         if not dataset.dataset.purged:
@@ -212,19 +223,13 @@ class Data( object ):
         else:
             error = False
             try:
+                compresslevel = trans.app.config.archive_compression_level
                 if (params.do_action == 'zip'):
-                    # Can't use mkstemp - the file must not exist first
-                    tmpd = tempfile.mkdtemp()
-                    tmpf = os.path.join( tmpd, 'library_download.' + params.do_action )
-                    if ziptype == '64':
-                        archive = zipfile.ZipFile( tmpf, 'w', zipfile.ZIP_DEFLATED, True )
-                    else:
-                        archive = zipfile.ZipFile( tmpf, 'w', zipfile.ZIP_DEFLATED )
-                    archive.add = lambda x, y: archive.write( x, y.encode('CP437') )
+                    archive = util.streamball.ZipBall( compresslevel=compresslevel, allow_zip64=( ziptype == '64' ) )
                 elif params.do_action == 'tgz':
-                    archive = util.streamball.StreamBall( 'w|gz' )
+                    archive = util.streamball.StreamBall( 'w|gz', compresslevel=compresslevel )
                 elif params.do_action == 'tbz':
-                    archive = util.streamball.StreamBall( 'w|bz2' )
+                    archive = util.streamball.StreamBall( 'w|bz2', compresslevel=compresslevel )
             except (OSError, zipfile.BadZipFile):
                 error = True
                 log.exception( "Unable to create archive for download" )
@@ -261,12 +266,11 @@ class Data( object ):
                             continue
                 if not error:
                     if params.do_action == 'zip':
-                        archive.close()
-                        tmpfh = open( tmpf )
-                        # CANNOT clean up - unlink/rmdir was always failing because file handle retained to return - must rely on a cron job to clean up tmp
                         trans.response.set_content_type( "application/x-zip-compressed" )
                         trans.response.headers[ "Content-Disposition" ] = 'attachment; filename="%s.zip"' % outfname 
-                        return tmpfh
+                        archive.wsgi_status = trans.response.wsgi_status()
+                        archive.wsgi_headeritems = trans.response.wsgi_headeritems()
+                        return archive.stream
                     else:
                         trans.response.set_content_type( "application/x-tar" )
                         outext = 'tgz'
@@ -624,6 +628,33 @@ class Text( Data ):
             if line and not line.startswith( '#' ):
                 data_lines += 1
         return data_lines
+    def seek_line( self, dataset, fh, line_number ):
+        """
+        Move the open file `fh` of dataset to the start of line `line_number`
+        (counting from 0), or to its end if it has fewer lines.
+        """
+        fh.seek( 0 )
+        for i in xrange( line_number ):
+            if not fh.readline():
+                break
+    def get_lines( self, dataset, offset=0, limit=None ):
+        """
+        Return up to `limit` (or all the) lines of dataset from line number
+        `offset` (counting from 0, and including comments), without their
+        newlines.
+        """
+        fh = open( dataset.file_name )
+        try:
+            self.seek_line( dataset, fh, offset )
+            lines = []
+            while limit is None or len( lines ) < limit:
+                line = fh.readline()
+                if not line:
+                    break
+                lines.append( line.rstrip( '\r\n' ) )
+            return lines
+        finally:
+            fh.close()
     def set_peek( self, dataset, line_count=None, is_multi_byte=False, WIDTH=256, skipchars=[] ):
         """
         Set the peek.  This method is used by various subclasses of Text.
@@ -728,6 +759,131 @@ class Text( Data ):
         f.close()
     split = classmethod(split)
 
+    def iter_record_offsets( cls, f ):
+        """
+        Yield the byte offset of the start of each record in the open file f.
+        A record is a line; subclasses with multi-line records override this
+        and find_record_start.
+        """
+        offset = 0
+        for line in f:
+            yield offset
+            offset += len( line )
+    iter_record_offsets = classmethod( iter_record_offsets )
+
+    def find_record_start( cls, f, offset ):
+        """
+        Return the offset of the first record starting at or after offset in
+        the open file f, or the end of the file if there is none.
+        """
+        if offset == 0:
+            return 0
+        # Finish the line offset falls in.
+        f.seek( offset - 1 )
+        f.readline()
+        return f.tell()
+    find_record_start = classmethod( find_record_start )
+
+    def split_ranges( cls, input_datasets, split_params ):
+        """
+        Yield ( start, end ) byte ranges of the single input dataset, one per
+        part, beginning at record boundaries. Parts are computed as they are
+        needed rather than up front, so the first parts can be processed while
+        later ones are still being found, and the input is never rewritten:
+        each task extracts its own range with process_split_file.
+
+        Returns None if the input cannot be split into ranges, in which case
+        split is used instead.
+        """
+        if split_params is None or len( input_datasets ) != 1:
+            return None
+        input_file = input_datasets[0].file_name
+        if is_gzip( input_file ):
+            return None
+        if split_params['split_mode'] == 'number_of_parts':
+            return cls._size_ranges( input_file, int( split_params['split_size'] ) )
+        elif split_params['split_mode'] == 'to_size':
+            return cls._count_ranges( input_file, long( split_params['split_size'] ) )
+        raise Exception( 'Unsupported split mode %s' % split_params['split_mode'] )
+    split_ranges = classmethod( split_ranges )
+
+    def _size_ranges( cls, input_file, parts ):
+        """ Ranges of roughly equal size, seeking to find each boundary. """
+        file_size = os.path.getsize( input_file )
+        if file_size == 0:
+            yield 0, 0
+            return
+        parts = max( parts, 1 )
+        f = open( input_file, 'rb' )
+        try:
+            start = 0
+            for part in range( 1, parts + 1 ):
+                if part == parts:
+                    end = file_size
+                else:
+                    end = cls.find_record_start( f, max( start, file_size * part // parts ) )
+                if end > start:
+                    yield start, end
+                    start = end
+                if start >= file_size:
+                    break
+        finally:
+            f.close()
+    _size_ranges = classmethod( _size_ranges )
+
+    def _count_ranges( cls, input_file, records_per_part ):
+        """ Ranges of records_per_part records, found by scanning (but not copying) the input. """
+        file_size = os.path.getsize( input_file )
+        f = open( input_file, 'rb' )
+        try:
+            start = 0
+            for count, offset in enumerate( cls.iter_record_offsets( f ) ):
+                if count and count % records_per_part == 0:
+                    yield start, offset
+                    start = offset
+            if start < file_size or start == 0:
+                yield start, file_size
+        finally:
+            f.close()
+    _count_ranges = classmethod( _count_ranges )
+
+    def write_range_split_info( cls, input_file, part_dir, start, end ):
+        """ Write the instructions for a task to extract bytes start to end of input_file. """
+        base_name = os.path.basename( input_file )
+        split_data = dict( class_name='%s.%s' % ( cls.__module__, cls.__name__ ),
+                           output_name=os.path.join( part_dir, base_name ),
+                           input_name=input_file,
+                           args=dict( start_offset=start, end_offset=end ) )
+        f = open( os.path.join( part_dir, 'split_info_%s.json' % base_name ), 'w' )
+        f.write( to_json_string( split_data ) )
+        f.close()
+    write_range_split_info = classmethod( write_range_split_info )
+
+    def process_split_file( data ):
+        """
+        Called by scripts/extract_dataset_part.py, in the task's environment, to
+        copy the byte range written by write_range_split_info into the task's
+        working directory.
+        """
+        CHUNK_SIZE = 2 ** 20
+        args = data[ 'args' ]
+        remaining = long( args[ 'end_offset' ] ) - long( args[ 'start_offset' ] )
+        in_file = open( data[ 'input_name' ], 'rb' )
+        out_file = open( data[ 'output_name' ], 'wb' )
+        try:
+            in_file.seek( long( args[ 'start_offset' ] ) )
+            while remaining > 0:
+                chunk = in_file.read( min( CHUNK_SIZE, remaining ) )
+                if not chunk:
+                    break
+                out_file.write( chunk )
+                remaining -= len( chunk )
+        finally:
+            in_file.close()
+            out_file.close()
+        return True
+    process_split_file = staticmethod( process_split_file )
+
 class LineCount( Text ):
     """
     Dataset contains a single line with a single integer that denotes the
@@ -11,7 +11,7 @@ from galaxy.datatypes.sniff import *
 from galaxy.datatypes.util.image_util import *
 from urllib import urlencode, quote_plus
 import zipfile
-import os, subprocess, tempfile, imghdr
+import os, subprocess, tempfile
 
 try:
     import Image as PIL
@@ -35,6 +35,8 @@ log = logging.getLogger(__name__)
 
 class Image( data.Data ):
     """Class describing an image"""
+    # Image formats, as named by PIL, recognised by this datatype's sniffer
+    image_formats = None
     def set_peek( self, dataset, is_multi_byte=False ):
         if not dataset.dataset.purged:
             dataset.peek = 'Image in %s format' % dataset.extension
@@ -42,111 +44,73 @@ class Image( data.Data ):
         else:
             dataset.peek = 'file does not exist'
             dataset.blurb = 'file purged from disk'
-    def sniff( self, filename ):
-        # First check if we can  use PIL
-        if PIL is not None:
-            try:
-                im = PIL.open( filename )
-                im.close()
-                return True
-            except:
-                return False
-        else:
-            if imghdr.what( filename ) is not None:
-                return True
-            else:
-                return False
+    def sniff_prefix( self, file_prefix ):
+        """
+        Determine if the file is an image in one of `image_formats`, or in any
+        format if `image_formats` is None.  The image format is identified once
+        per file and shared between the image sniffers.
+        """
+        format = file_prefix.memoize( 'image_format', lambda file_prefix: image_type( file_prefix.binary_io() ) )
+        if not format:
+            return False
+        return self.image_formats is None or format in self.image_formats
     
 class Jpg( Image ):
-    def sniff(self, filename, image=None):
-        """Determine if the file is in jpg format."""
-        return check_image_type( filename, ['JPEG'], image )
+    image_formats = ['JPEG']
 
 class Png( Image ):
-    def sniff(self, filename, image=None):
-        """Determine if the file is in png format."""
-        return check_image_type( filename, ['PNG'], image )
+    image_formats = ['PNG']
     
 class Tiff( Image ):
-    def sniff(self, filename, image=None):
-        """Determine if the file is in tiff format."""
-        return check_image_type( filename, ['TIFF'], image )
+    image_formats = ['TIFF']
     
 class Bmp( Image ):
-    def sniff(self, filename, image=None):
-        """Determine if the file is in bmp format."""
-        return check_image_type( filename, ['BMP'], image )
+    image_formats = ['BMP']
 
 class Gif( Image ):
-    def sniff(self, filename, image=None):
-        """Determine if the file is in gif format."""
-        return check_image_type( filename, ['GIF'], image )
+    image_formats = ['GIF']
 
 class Im( Image ):
-    def sniff(self, filename, image=None):
-        """Determine if the file is in im format."""
-        return check_image_type( filename, ['IM'], image )
+    image_formats = ['IM']
 
 class Pcd( Image ):
-    def sniff(self, filename, image=None):
-        """Determine if the file is in pcd format."""
-        return check_image_type( filename, ['PCD'], image )        
+    image_formats = ['PCD']
 
 class Pcx( Image ):
-    def sniff(self, filename, image=None):
-        """Determine if the file is in pcx format."""
-        return check_image_type( filename, ['PCX'], image )
+    image_formats = ['PCX']
 
 class Ppm( Image ):
-    def sniff(self, filename, image=None):
-        """Determine if the file is in ppm format."""
-        return check_image_type( filename, ['PPM'], image )        
+    image_formats = ['PPM']
 
 class Psd( Image ):
-    def sniff(self, filename, image=None):
-        """Determine if the file is in psd format."""
-        return check_image_type( filename, ['PSD'], image )        
+    image_formats = ['PSD']
 
 class Xbm( Image ):
-    def sniff(self, filename, image=None):
-        """Determine if the file is in XBM format."""
-        return check_image_type( filename, ['XBM'], image )        
+    image_formats = ['XBM']
 
 class Xpm( Image ):
-    def sniff(self, filename, image=None):
-        """Determine if the file is in XPM format."""
-        return check_image_type( filename, ['XPM'], image )        
+    image_formats = ['XPM']
 
 class Rgb( Image ):
-    def sniff(self, filename, image=None):
-        """Determine if the file is in RGB format."""
-        return check_image_type( filename, ['RGB'], image )
+    image_formats = ['RGB']
 
 class Pbm( Image ):
-    def sniff(self, filename, image=None):
-        """Determine if the file is in PBM format"""
-        return check_image_type( filename, ['PBM'], image )
+    image_formats = ['PBM']
 
 class Pgm( Image ):
-    def sniff(self, filename, image=None):
-        """Determine if the file is in PGM format"""
-        return check_image_type( filename, ['PGM'], image )
+    image_formats = ['PGM']
 
 class Eps( Image ):
-    def sniff(self, filename, image=None):
-        """Determine if the file is in eps format."""
-        return check_image_type( filename, ['EPS'], image )        
+    image_formats = ['EPS']
 
 
 class Rast( Image ):
-    def sniff(self, filename, image=None):
-        """Determine if the file is in rast format"""
-        return check_image_type( filename, ['RAST'], image )
+    image_formats = ['RAST']
 
 class Pdf( Image ):
-    def sniff(self, filename):
+    def sniff_prefix( self, file_prefix ):
         """Determine if the file is in pdf format."""
-        headers = get_headers(filename, None, 1)
+        headers = get_headers(file_prefix, None, 1)
         try:
             if headers[0][0].startswith("%PDF"):
                 return True
@@ -247,7 +211,7 @@ class Html( data.Text ):
     def get_mime(self):
         """Returns the mime type of the datatype"""
         return 'text/html'
-    def sniff( self, filename ):
+    def sniff_prefix( self, file_prefix ):
         """
         Determines whether the file is in html format
 
@@ -258,7 +222,7 @@ class Html( data.Text ):
         >>> Html().sniff( fname )
         True
         """
-        headers = get_headers( filename, None )
+        headers = get_headers( file_prefix, None )
         try:
             for i, hdr in enumerate(headers):
                 if hdr and hdr[0].lower().find( '<html>' ) >=0:
@@ -277,7 +277,7 @@ class Interval( Tabular ):
         """Return options for removing errors along with a description"""
         return [("lines","Remove erroneous lines")]
 
-    def sniff( self, filename ):
+    def sniff_prefix( self, file_prefix ):
         """
         Checks for 'intervalness'
     
@@ -291,7 +291,7 @@ class Interval( Tabular ):
         >>> Interval().sniff( fname )
         True
         """
-        headers = get_headers( filename, '\t' )
+        headers = get_headers( file_prefix, '\t' )
         try:
             """
             If we got here, we already know the file is_column_based and is not bed,
@@ -427,7 +427,7 @@ class Bed( Interval ):
         try: return open(dataset.file_name)
         except: return "This item contains no content"
 
-    def sniff( self, filename ):
+    def sniff_prefix( self, file_prefix ):
         """
         Checks for 'bedness'
         
@@ -450,7 +450,7 @@ class Bed( Interval ):
         >>> Bed().sniff( fname )
         True
         """
-        headers = get_headers( filename, '\t' )
+        headers = get_headers( file_prefix, '\t' )
         try:
             if not headers: return False
             for hdr in headers:
@@ -743,7 +743,7 @@ class Gff( Tabular, _RemoteCallMixin ):
                     link = self._get_remote_call_url( redirect_url, site_name, dataset, type, app, base_url )
                     ret_val.append( ( site_name, link ) )
         return ret_val
-    def sniff( self, filename ):
+    def sniff_prefix( self, file_prefix ):
         """
         Determines whether the file is in gff format
         
@@ -758,7 +758,7 @@ class Gff( Tabular, _RemoteCallMixin ):
         >>> Gff().sniff( fname )
         True
         """
-        headers = get_headers( filename, '\t' )
+        headers = get_headers( file_prefix, '\t' )
         try:
             if len(headers) < 2:
                 return False
@@ -829,7 +829,7 @@ class Gff3( Gff ):
                     if valid_start and valid_end and start < end and strand in self.valid_gff3_strand and phase in self.valid_gff3_phase:
                         break
         Tabular.set_meta( self, dataset, overwrite = overwrite, skip = i )
-    def sniff( self, filename ):
+    def sniff_prefix( self, file_prefix ):
         """
         Determines whether the file is in gff version 3 format
         
@@ -858,7 +858,7 @@ class Gff3( Gff ):
         >>> Gff3().sniff( fname )
         True
         """
-        headers = get_headers( filename, '\t' )
+        headers = get_headers( file_prefix, '\t' )
         try:
             if len(headers) < 2:
                 return False
@@ -903,7 +903,7 @@ class Gtf( Gff ):
     MetadataElement( name="columns", default=9, desc="Number of columns", readonly=True, visible=False )
     MetadataElement( name="column_types", default=['str','str','str','int','int','float','str','int','list'], param=metadata.ColumnTypesParameter, desc="Column types", readonly=True, visible=False )
     
-    def sniff( self, filename ):
+    def sniff_prefix( self, file_prefix ):
         """
         Determines whether the file is in gtf format
         
@@ -927,7 +927,7 @@ class Gtf( Gff ):
         >>> Gtf().sniff( fname )
         True
         """
-        headers = get_headers( filename, '\t' )
+        headers = get_headers( file_prefix, '\t' )
         try:
             if len(headers) < 2:
                 return False
@@ -1084,7 +1084,7 @@ class Wiggle( Tabular, _RemoteCallMixin ):
             #optional metadata values set in Tabular class will be 'None'
             max_data_lines = 100
         Tabular.set_meta( self, dataset, overwrite = overwrite, skip = i, max_data_lines = max_data_lines )
-    def sniff( self, filename ):
+    def sniff_prefix( self, file_prefix ):
         """
         Determines wether the file is in wiggle format
     
@@ -1106,7 +1106,7 @@ class Wiggle( Tabular, _RemoteCallMixin ):
         >>> Wiggle().sniff( fname )
         True
         """
-        headers = get_headers( filename, None )
+        headers = get_headers( file_prefix, None )
         try:
             for hdr in headers:
                 if len(hdr) > 1 and hdr[0] == 'track' and hdr[1].startswith('type=wiggle'):
@@ -1230,7 +1230,7 @@ class CustomTrack ( Tabular ):
                     link = '%s?redirect_url=%s&display_url=%s' % ( internal_url, redirect_url, display_url )
                     ret_val.append( (site_name, link) )
         return ret_val
-    def sniff( self, filename ):
+    def sniff_prefix( self, file_prefix ):
         """
         Determines whether the file is in customtrack format.
         
@@ -1246,7 +1246,7 @@ class CustomTrack ( Tabular ):
         >>> CustomTrack().sniff( fname )
         True
         """
-        headers = get_headers( filename, None )
+        headers = get_headers( file_prefix, None )
         first_line = True
         for hdr in headers:
             if first_line:
@@ -1,4 +1,4 @@
-import sys, logging, copy, shutil, weakref, cPickle, tempfile, os
+import sys, logging, copy, shutil, weakref, tempfile, os
 from os.path import abspath
 
 from galaxy.util import string_as_bool, stringify_dictionary_keys, listify
@@ -104,7 +104,9 @@ class MetadataCollection( object ):
     def from_JSON_dict( self, filename ):
         dataset = self.parent
         log.debug( 'loading metadata from file for: %s %s' % ( dataset.__class__.__name__, dataset.id ) )
-        JSONified_dict = simplejson.load( open( filename ) )
+        self.from_external_dict( simplejson.load( open( filename ) ) )
+    def from_external_dict( self, JSONified_dict ):
+        dataset = self.parent
         for name, spec in self.spec.items():
             if name in JSONified_dict:
                 dataset._metadata[ name ] = spec.param.from_external_value( JSONified_dict[ name ], dataset )
@@ -113,13 +115,15 @@ class MetadataCollection( object ):
                 #metadata associated with our dataset, we'll delete it from our dataset's metadata dict
                 del dataset._metadata[ name ]
     def to_JSON_dict( self, filename ):
+        simplejson.dump( self.to_external_dict(), open( filename, 'wb+' ) )
+    def to_external_dict( self ):
         #galaxy.model.customtypes.json_encoder.encode()
         meta_dict = {}
         dataset_meta_dict = self.parent._metadata
         for name, spec in self.spec.items():
             if name in dataset_meta_dict:
                 meta_dict[ name ] = spec.param.to_external_value( dataset_meta_dict[ name ] )
-        simplejson.dump( meta_dict, open( filename, 'wb+' ) )
+        return meta_dict
     def __getstate__( self ):
         return None #cannot pickle a weakref item (self._parent), when data._metadata_collection is None, it will be recreated on demand
 
@@ -481,7 +485,10 @@ class FileParameter( MetadataParameter ):
         if isinstance( value, galaxy.model.MetadataFile ):
             value = value.id
         elif isinstance( value, MetadataTempFile ):
-            value = MetadataTempFile.to_JSON( value )
+            if value.is_unused_reference():
+                value = value.source_id #the existing file was not used, so it is unchanged
+            else:
+                value = MetadataTempFile.to_JSON( value )
         return value
     
     def new_file( self, dataset = None, **kwds ):
@@ -502,12 +509,29 @@ class MetadataTempFile( object ):
     def __init__( self, **kwds ):
         self.kwds = kwds
         self._filename = None
+        self.source = None
+        self.source_id = None
+    @classmethod
+    def from_reference( cls, source, source_id ):
+        """
+        A temp file starting as a copy of the existing metadata file `source`
+        (with id `source_id`), which is only made if the file name is used.
+        """
+        rval = cls()
+        rval.source = source
+        rval.source_id = source_id
+        return rval
+    def is_unused_reference( self ):
+        return self.source is not None and self._filename is None
     @property
     def file_name( self ):
         if self._filename is None:
             #we need to create a tmp file, accessable across all nodes/heads, save the name, and return it
             self._filename = abspath( tempfile.NamedTemporaryFile( dir = self.tmp_dir, prefix = "metadata_temp_file_" ).name )
-            open( self._filename, 'wb+' ) #create an empty file, so it can't be reused using tempfile
+            if self.source is not None:
+                shutil.copy( self.source, self._filename )
+            else:
+                open( self._filename, 'wb+' ) #create an empty file, so it can't be reused using tempfile
         return self._filename
     def to_JSON( self ):
         return { '__class__':self.__class__.__name__, 'filename':self.file_name, 'kwds':self.kwds }
@@ -523,21 +547,29 @@ class MetadataTempFile( object ):
     @classmethod
     def cleanup_from_JSON_dict_filename( cls, filename ):
         try:
-            for key, value in simplejson.load( open( filename ) ).items():
-                if cls.is_JSONified_value( value ):
-                    value = cls.from_JSON( value )
-                if isinstance( value, cls ) and os.path.exists( value.file_name ):
-                    log.debug( 'Cleaning up abandoned MetadataTempFile file: %s' % value.file_name )
-                    os.unlink( value.file_name )
+            cls.cleanup_from_external_dict( simplejson.load( open( filename ) ) )
         except Exception, e:
             log.debug( 'Failed to cleanup MetadataTempFile temp files from %s: %s' % ( filename, e ) )
+    @classmethod
+    def cleanup_from_external_dict( cls, external_dict ):
+        for key, value in external_dict.items():
+            if cls.is_JSONified_value( value ):
+                value = cls.from_JSON( value )
+            if isinstance( value, cls ) and os.path.exists( value.file_name ):
+                log.debug( 'Cleaning up abandoned MetadataTempFile file: %s' % value.file_name )
+                os.unlink( value.file_name )
 
 #Class with methods allowing set_meta() to be called externally to the Galaxy head
 class JobExternalOutputMetadataWrapper( object ):
     #this class allows access to external metadata filenames for all outputs associated with a job
-    #We will use JSON as the medium of exchange of information, except for the DatasetInstance object which will use pickle (in the future this could be JSONified as well)
+    #We use JSON as the medium of exchange of information: a manifest describes each dataset of the job and the keywords
+    #for its set_meta() call, and the results for all the datasets come back in a single file.  The JobExternalOutputMetadata
+    #of each dataset records the manifest as filename_in and the results as filename_out and filename_results_code.
+    #Older versions of Galaxy pickled each DatasetInstance and used four more files per dataset, these are recognized by
+    #their filename_kwds being set
     def __init__( self, job ):
         self.job_id = job.id
+        self._results = {}
     def get_output_filenames_by_dataset( self, dataset, sa_session ):
         if isinstance( dataset, galaxy.model.HistoryDatasetAssociation ):
             return sa_session.query( galaxy.model.JobExternalOutputMetadata ) \
@@ -552,17 +584,55 @@ class JobExternalOutputMetadataWrapper( object ):
         # Set meta can be called on library items and history items, 
         # need to make different keys for them, since ids can overlap
         return "%s_%d" % ( dataset.__class__.__name__, dataset.id )
+    def get_results( self, metadata_files ):
+        #the results for all the datasets of the job are in the same file, only read it once
+        filename = metadata_files.filename_results_code
+        if filename not in self._results:
+            self._results[ filename ] = simplejson.load( open( filename ) )
+        return self._results[ filename ]
+    def get_dataset_results( self, dataset, metadata_files ):
+        #( set_meta() succeeded, message, metadata ) for dataset
+        return self.get_results( metadata_files ).get( self.get_dataset_metadata_key( dataset ), ( False, 'External set_meta() not called', None ) )
+    def __is_legacy( self, metadata_files ):
+        return metadata_files.filename_kwds is not None
+    def __to_manifest_record( self, dataset, kwds, filename_override ):
+        #everything set_meta() needs to know about dataset, from which the external process recreates it
+        metadata_files = {}
+        for meta_key, spec_value in dataset.metadata.spec.iteritems():
+            if isinstance( spec_value.param, FileParameter ) and dataset.metadata.get( meta_key, None ) is not None:
+                #Metadata FileParameter types may not be writable on a cluster node, the external process substitutes
+                #MetadataTempFiles for them, copying the existing files only if set_meta() uses them
+                metadata_file = dataset.metadata.get( meta_key )
+                metadata_files[ meta_key ] = dict( id = metadata_file.id, file_name = metadata_file.file_name )
+        file_size = dataset.dataset.file_size
+        if file_size is not None:
+            file_size = int( file_size )
+        return dict( key = self.get_dataset_metadata_key( dataset ),
+                     model_class = dataset.__class__.__name__,
+                     id = dataset.id,
+                     name = dataset.name,
+                     info = dataset.info,
+                     extension = dataset.extension,
+                     metadata = dataset._metadata or {},
+                     metadata_files = metadata_files,
+                     dataset = dict( id = dataset.dataset.id,
+                                     state = dataset.dataset.state,
+                                     external_filename = dataset.dataset.external_filename,
+                                     extra_files_path = dataset.dataset._extra_files_path,
+                                     file_size = file_size,
+                                     object_store_id = dataset.dataset.object_store_id ),
+                     filename_override = filename_override,
+                     kwds = kwds )
     def setup_external_metadata( self, datasets, sa_session, exec_dir=None, tmp_dir=None, dataset_files_path=None, 
-                                 output_fnames=None, config_root=None, config_file=None, datatypes_config=None, job_metadata=None, kwds={} ):
-        #fill in metadata_files_dict and return the command with args required to set metadata
-        def __metadata_files_list_to_cmd_line( metadata_files ):
-            def __get_filename_override():
-                if output_fnames:
-                    for dataset_path in output_fnames:
-                        if dataset_path.false_path and dataset_path.real_path == metadata_files.dataset.file_name:
-                            return dataset_path.false_path
-                return ""
-            return "%s,%s,%s,%s,%s,%s" % ( metadata_files.filename_in, metadata_files.filename_kwds, metadata_files.filename_out, metadata_files.filename_results_code, __get_filename_override(), metadata_files.filename_override_metadata )
+                                 output_fnames=None, config_root=None, config_file=None, datatypes_config=None, job_metadata=None, kwds={},
+                                 worker_socket=None ):
+        #write the manifest and return the command with args required to set metadata
+        def __get_filename_override( dataset ):
+            if output_fnames:
+                for dataset_path in output_fnames:
+                    if dataset_path.false_path and dataset_path.real_path == dataset.file_name:
+                        return dataset_path.false_path
+            return ""
         if not isinstance( datasets, list ):
             datasets = [ datasets ]
         if exec_dir is None:
@@ -576,81 +646,107 @@ class JobExternalOutputMetadataWrapper( object ):
         if datatypes_config is None:
             raise Exception( 'In setup_external_metadata, the received datatypes_config is None.' )
             datatypes_config = 'datatypes_conf.xml'
+        manifest_filename = results_filename = None
         metadata_files_list = []
+        new_metadata_files = False
         for dataset in datasets:
-            key = self.get_dataset_metadata_key( dataset )
             #future note:
             #wonkiness in job execution causes build command line to be called more than once
             #when setting metadata externally, via 'auto-detect' button in edit attributes, etc., 
             #we don't want to overwrite (losing the ability to cleanup) our existing dataset keys and files, 
-            #so we will only populate the dictionary once
+            #so we will only write the manifest once
             metadata_files = self.get_output_filenames_by_dataset( dataset, sa_session )
             if not metadata_files:
-                metadata_files = galaxy.model.JobExternalOutputMetadata( dataset = dataset)
+                metadata_files = galaxy.model.JobExternalOutputMetadata( dataset = dataset )
                 metadata_files.job_id = self.job_id
-                #we are using tempfile to create unique filenames, tempfile always returns an absolute path
-                #we will use pathnames relative to the galaxy root, to accommodate instances where the galaxy root
-                #is located differently, i.e. on a cluster node with a different filesystem structure
-                
-                #file to store existing dataset
-                metadata_files.filename_in = abspath( tempfile.NamedTemporaryFile( dir = tmp_dir, prefix = "metadata_in_%s_" % key ).name )
-                
+                new_metadata_files = True
+            elif self.__is_legacy( metadata_files ):
+                #set up by an older version of Galaxy, replace its files by the manifest
+                self.__remove_files( metadata_files )
+                new_metadata_files = True
+            else:
+                manifest_filename = metadata_files.filename_in
+                results_filename = metadata_files.filename_results_code
+            metadata_files_list.append( metadata_files )
+        if manifest_filename is None:
+            #we are using tempfile to create unique filenames, tempfile always returns an absolute path
+            #we will use pathnames relative to the galaxy root, to accommodate instances where the galaxy root
+            #is located differently, i.e. on a cluster node with a different filesystem structure
+            key = "job_%s" % self.job_id
+            manifest_filename = abspath( tempfile.NamedTemporaryFile( dir = tmp_dir, prefix = "metadata_manifest_%s_" % key ).name )
+            #results are like { dataset key: ( True/False - if setting metadata was successful/failed, exception or string of reason of success/failure, metadata ) }
+            results_filename = abspath( tempfile.NamedTemporaryFile( dir = tmp_dir, prefix = "metadata_results_%s_" % key ).name )
+            simplejson.dump( {}, open( results_filename, 'wb+' ) ) # create the file on disk, so it cannot be reused by tempfile (unlikely, but possible)
+        if new_metadata_files:
+            records = []
+            for dataset, metadata_files in zip( datasets, metadata_files_list ):
                 #FIXME: HACK
                 #sqlalchemy introduced 'expire_on_commit' flag for sessionmaker at version 0.5x
-                #This may be causing the dataset attribute of the dataset_association object to no-longer be loaded into memory when needed for pickling.
+                #This may be causing the dataset attribute of the dataset_association object to no-longer be loaded into memory when needed.
                 #For now, we'll simply 'touch' dataset_association.dataset to force it back into memory.
-                dataset.dataset #force dataset_association.dataset to be loaded before pickling
-                #A better fix could be setting 'expire_on_commit=False' on the session, or modifying where commits occur, or ?
-                
-                cPickle.dump( dataset, open( metadata_files.filename_in, 'wb+' ) )
-                #file to store metadata results of set_meta()
-                metadata_files.filename_out = abspath( tempfile.NamedTemporaryFile( dir = tmp_dir, prefix = "metadata_out_%s_" % key ).name )
-                open( metadata_files.filename_out, 'wb+' ) # create the file on disk, so it cannot be reused by tempfile (unlikely, but possible)
-                #file to store a 'return code' indicating the results of the set_meta() call
-                #results code is like (True/False - if setting metadata was successful/failed , exception or string of reason of success/failure )
-                metadata_files.filename_results_code = abspath( tempfile.NamedTemporaryFile( dir = tmp_dir, prefix = "metadata_results_%s_" % key ).name )
-                simplejson.dump( ( False, 'External set_meta() not called' ), open( metadata_files.filename_results_code, 'wb+' ) ) # create the file on disk, so it cannot be reused by tempfile (unlikely, but possible)
-                #file to store kwds passed to set_meta()
-                metadata_files.filename_kwds = abspath( tempfile.NamedTemporaryFile( dir = tmp_dir, prefix = "metadata_kwds_%s_" % key ).name )
-                simplejson.dump( kwds, open( metadata_files.filename_kwds, 'wb+' ), ensure_ascii=True )
-                #existing metadata file parameters need to be overridden with cluster-writable file locations
-                metadata_files.filename_override_metadata = abspath( tempfile.NamedTemporaryFile( dir = tmp_dir, prefix = "metadata_override_%s_" % key ).name )
-                open( metadata_files.filename_override_metadata, 'wb+' ) # create the file on disk, so it cannot be reused by tempfile (unlikely, but possible)
-                override_metadata = []
-                for meta_key, spec_value in dataset.metadata.spec.iteritems():
-                    if isinstance( spec_value.param, FileParameter ) and dataset.metadata.get( meta_key, None ) is not None:
-                        metadata_temp = MetadataTempFile()
-                        shutil.copy( dataset.metadata.get( meta_key, None ).file_name, metadata_temp.file_name )
-                        override_metadata.append( ( meta_key, metadata_temp.to_JSON() ) )
-                simplejson.dump( override_metadata, open( metadata_files.filename_override_metadata, 'wb+' ) )
-                #add to session and flush
+                dataset.dataset #force dataset_association.dataset to be loaded
+                records.append( self.__to_manifest_record( dataset, kwds, __get_filename_override( dataset ) ) )
+                metadata_files.filename_in = manifest_filename
+                metadata_files.filename_out = results_filename
+                metadata_files.filename_results_code = results_filename
+                metadata_files.filename_kwds = None
+                metadata_files.filename_override_metadata = None
                 sa_session.add( metadata_files )
-                sa_session.flush()
-            metadata_files_list.append( metadata_files )
+            simplejson.dump( dict( results = results_filename, datasets = records ), open( manifest_filename, 'wb+' ), ensure_ascii=True )
+            sa_session.flush()
         #return command required to build
-        return "%s %s %s %s %s %s %s %s" % ( os.path.join( exec_dir, 'set_metadata.sh' ), dataset_files_path, tmp_dir, config_root, config_file, datatypes_config, job_metadata, " ".join( map( __metadata_files_list_to_cmd_line, metadata_files_list ) ) )
+        args = "%s %s %s %s %s %s %s" % ( dataset_files_path, tmp_dir, config_root, config_file, datatypes_config, job_metadata, manifest_filename )
+        if worker_socket:
+            #have the metadata worker pool set metadata, the client falls back to set_metadata.sh if it cannot reach the pool
+            return "python %s %s %s" % ( os.path.join( exec_dir, 'scripts', 'set_metadata_client.py' ), os.path.abspath( worker_socket ), args )
+        return "%s %s" % ( os.path.join( exec_dir, 'set_metadata.sh' ), args )
     
     def external_metadata_set_successfully( self, dataset, sa_session ):
         metadata_files = self.get_output_filenames_by_dataset( dataset, sa_session )
         if not metadata_files:
             return False # this file doesn't exist
-        rval, rstring = simplejson.load( open( metadata_files.filename_results_code ) )
+        if self.__is_legacy( metadata_files ):
+            rval, rstring = simplejson.load( open( metadata_files.filename_results_code ) )
+        else:
+            rval, rstring = self.get_dataset_results( dataset, metadata_files )[:2]
         if not rval:
             log.debug( 'setting metadata externally failed for %s %s: %s' % ( dataset.__class__.__name__, dataset.id, rstring ) )
         return rval
     
+    def load_external_metadata( self, dataset, sa_session ):
+        #replace the metadata of dataset by the metadata set externally
+        metadata_files = self.get_output_filenames_by_dataset( dataset, sa_session )
+        if self.__is_legacy( metadata_files ):
+            dataset.metadata.from_JSON_dict( metadata_files.filename_out )
+        else:
+            log.debug( 'loading metadata from results for: %s %s' % ( dataset.__class__.__name__, dataset.id ) )
+            dataset.metadata.from_external_dict( self.get_dataset_results( dataset, metadata_files )[2] )
+    
+    def __remove_files( self, metadata_files ):
+        dataset_key = self.get_dataset_metadata_key( metadata_files.dataset )
+        for key, fname in [ ( 'filename_in', metadata_files.filename_in ), ( 'filename_out', metadata_files.filename_out ), ( 'filename_results_code', metadata_files.filename_results_code ), ( 'filename_kwds', metadata_files.filename_kwds ), ( 'filename_override_metadata', metadata_files.filename_override_metadata ) ]:
+            if fname is None or ( not self.__is_legacy( metadata_files ) and not os.path.exists( fname ) ):
+                continue #the manifest and results are shared by the datasets of the job, and removed with the first
+            try:
+                os.remove( fname )
+            except Exception, e:
+                log.debug( 'Failed to cleanup external metadata file (%s) for %s: %s' % ( key, dataset_key, e ) )
+    
     def cleanup_external_metadata( self, sa_session ):
         log.debug( 'Cleaning up external metadata files' )
         for metadata_files in sa_session.query( galaxy.model.Job ).get( self.job_id ).external_output_metadata:
             #we need to confirm that any MetadataTempFile files were removed, if not we need to remove them
             #can occur if the job was stopped before completion, but a MetadataTempFile is used in the set_meta
-            MetadataTempFile.cleanup_from_JSON_dict_filename( metadata_files.filename_out )
-            dataset_key = self.get_dataset_metadata_key( metadata_files.dataset )
-            for key, fname in [ ( 'filename_in', metadata_files.filename_in ), ( 'filename_out', metadata_files.filename_out ), ( 'filename_results_code', metadata_files.filename_results_code ), ( 'filename_kwds', metadata_files.filename_kwds ), ( 'filename_override_metadata', metadata_files.filename_override_metadata ) ]:
+            if self.__is_legacy( metadata_files ):
+                MetadataTempFile.cleanup_from_JSON_dict_filename( metadata_files.filename_out )
+            else:
                 try:
-                    os.remove( fname )
+                    metadata = self.get_dataset_results( metadata_files.dataset, metadata_files )[2]
+                    if metadata:
+                        MetadataTempFile.cleanup_from_external_dict( metadata )
                 except Exception, e:
-                    log.debug( 'Failed to cleanup external metadata file (%s) for %s: %s' % ( key, dataset_key, e ) )
+                    log.debug( 'Failed to cleanup MetadataTempFile temp files from %s: %s' % ( metadata_files.filename_results_code, e ) )
+            self.__remove_files( metadata_files )
     def set_job_runner_external_pid( self, pid, sa_session ):
         for metadata_files in sa_session.query( galaxy.model.Job ).get( self.job_id ).external_output_metadata:
             metadata_files.job_runner_external_pid = pid
@@ -0,0 +1,349 @@
+"""
+Long-lived processes setting metadata for jobs, instead of a new
+scripts/set_metadata.py process (which imports Galaxy, builds the object
+store and loads the datatypes registry before doing any work) per job.
+
+A `MetadataWorkerPool` imports Galaxy's model, listens on a Unix socket and
+forks worker processes that accept requests on it.  Each worker keeps the object stores and
+datatypes registries it loads, keyed by the configuration they were loaded
+from, so only its first request for a configuration pays for loading them.
+A request is the command line arguments of scripts/set_metadata.py, and is
+sent by scripts/set_metadata_client.py, which runs set_metadata.py itself if
+the pool cannot be reached.  The results are written to the same files as
+by set_metadata.py, the reply only says whether the request was handled:
+
+>>> decode_request( encode_request( [ 'database/files', '/tmp', 'in,kwds,out,code,,override' ] ) )
+['database/files', '/tmp', 'in,kwds,out,code,,override']
+>>> decode_reply( 'error No such file\\n' )
+(False, 'No such file')
+"""
+
+import os
+import errno
+import signal
+import socket
+import logging
+import cPickle
+import ConfigParser
+
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+
+log = logging.getLogger( __name__ )
+
+# Separates the arguments of a request, they are paths and cannot contain it
+REQUEST_SEPARATOR = '\0'
+
+def encode_request( args ):
+    return REQUEST_SEPARATOR.join( args )
+
+def decode_request( data ):
+    return data.split( REQUEST_SEPARATOR )
+
+def decode_reply( reply ):
+    """ Return ( handled, error message ) for a reply from a worker """
+    reply = reply.strip()
+    if reply == 'ok':
+        return True, None
+    return False, reply[ len( 'error ' ): ]
+
+class MetadataTimeout( Exception ):
+    pass
+
+def _timeout( signum, frame ):
+    raise MetadataTimeout( 'Setting metadata took too long' )
+
+class MetadataEnvironment( object ):
+    """
+    The object stores and datatypes registries set_meta() needs, loaded on
+    first use and kept for later requests with the same configuration.
+    """
+    def __init__( self ):
+        import galaxy.model.mapping # need to load this before recreating or unpickling datasets, in order to setup properties assigned by the mappers
+        import galaxy.datatypes.metadata
+        galaxy.model.Job() # instantiating any mapped class makes SA add the mapped properties to the classes
+        galaxy.datatypes.metadata.DATABASE_CONNECTION_AVAILABLE = False # assume object ids are valid, there is no database connection
+        self.object_stores = {}
+        self.registries = {}
+
+    def get_object_store( self, config_file_name ):
+        if config_file_name not in self.object_stores:
+            from galaxy import config
+            from galaxy.objectstore import build_object_store_from_config
+            # The object store configuration is in the main config file
+            conf = ConfigParser.ConfigParser()
+            conf.read( config_file_name )
+            conf_dict = {}
+            for section in conf.sections():
+                for option in conf.options( section ):
+                    try:
+                        conf_dict[ option ] = conf.get( section, option )
+                    except ConfigParser.InterpolationMissingOptionError:
+                        # Because this is not called from Paste Script, %(here)s variable
+                        # is not initialized in the config file so skip those fields -
+                        # just need not to use any such fields for the object store conf...
+                        log.debug( "Did not load option %s from %s" % ( option, config_file_name ) )
+            self.object_stores[ config_file_name ] = build_object_store_from_config( config.Configuration( **conf_dict ) )
+        return self.object_stores[ config_file_name ]
+
+    def get_datatypes_registry( self, config_root, datatypes_config ):
+        # Galaxy writes its datatypes config to a new temporary file each time
+        # it starts, so registries are kept by the contents of the file
+        key = ( config_root, md5( open( os.path.join( config_root, datatypes_config ) ).read() ).hexdigest() )
+        if key not in self.registries:
+            import galaxy.datatypes.registry
+            registry = galaxy.datatypes.registry.Registry()
+            registry.load_datatypes( root_dir=config_root, config=datatypes_config )
+            self.registries[ key ] = registry
+        return self.registries[ key ]
+
+    def set_metadata( self, args, allow_pickles=True ):
+        """
+        Set metadata as scripts/set_metadata.py would with command line
+        arguments `args`: the dataset files path, temporary directory, config
+        root, config file, datatypes config, job metadata file, then the
+        job's metadata manifest (or, as written by older versions of Galaxy,
+        one comma separated list of file names per dataset, which includes a
+        pickled dataset and is refused unless `allow_pickles`).
+        """
+        import galaxy.model
+        import galaxy.datatypes.metadata
+        from galaxy.util import stringify_dictionary_keys
+        from galaxy.util.json import from_json_string
+        file_path, tmp_dir, config_root, config_file_name, datatypes_config, job_metadata = args[:6]
+        galaxy.model.Dataset.file_path = file_path
+        galaxy.datatypes.metadata.MetadataTempFile.tmp_dir = tmp_dir
+        if not os.path.isabs( config_file_name ):
+            config_file_name = os.path.join( config_root, config_file_name )
+        galaxy.model.Dataset.object_store = self.get_object_store( config_file_name )
+        galaxy.model.set_datatypes_registry( self.get_datatypes_registry( config_root, datatypes_config ) )
+        ext_override = dict()
+        if job_metadata != "None" and os.path.exists( job_metadata ):
+            for line in open( job_metadata, 'r' ):
+                try:
+                    line = stringify_dictionary_keys( from_json_string( line ) )
+                    assert line['type'] == 'dataset'
+                    ext_override[line['dataset_id']] = line['ext']
+                except:
+                    continue
+        if len( args ) == 7 and ',' not in args[6]:
+            self.set_metadata_from_manifest( args[6], ext_override )
+        elif allow_pickles:
+            self.set_metadata_from_pickles( args[6:], ext_override )
+        else:
+            raise Exception( 'Requests with pickled datasets are only handled by set_metadata.py' )
+
+    def load_dataset( self, record ):
+        """ Recreate the DatasetInstance described by a manifest record """
+        import galaxy.model
+        import galaxy.datatypes.metadata
+        if record[ 'model_class' ] not in ( 'HistoryDatasetAssociation', 'LibraryDatasetDatasetAssociation' ):
+            raise Exception( 'Cannot set metadata of a %s' % record[ 'model_class' ] )
+        fields = record[ 'dataset' ]
+        dataset = galaxy.model.Dataset( id=fields[ 'id' ],
+                                        state=fields[ 'state' ],
+                                        external_filename=fields[ 'external_filename' ],
+                                        extra_files_path=fields[ 'extra_files_path' ],
+                                        file_size=fields[ 'file_size' ] )
+        dataset.object_store_id = fields[ 'object_store_id' ]
+        instance = getattr( galaxy.model, record[ 'model_class' ] )( id=record[ 'id' ],
+                                                                     name=record[ 'name' ],
+                                                                     info=record[ 'info' ],
+                                                                     extension=record[ 'extension' ],
+                                                                     dataset=dataset )
+        instance._metadata = record[ 'metadata' ]
+        for name, reference in record[ 'metadata_files' ].items():
+            setattr( instance.metadata, name, galaxy.datatypes.metadata.MetadataTempFile.from_reference( reference[ 'file_name' ], reference[ 'id' ] ) )
+        return instance
+
+    def set_metadata_from_manifest( self, manifest_filename, ext_override ):
+        from galaxy.util import stringify_dictionary_keys
+        from galaxy.util.json import from_json_string, to_json_string
+        manifest = from_json_string( open( manifest_filename ).read() )
+        results = {}
+        for record in manifest[ 'datasets' ]:
+            try:
+                dataset = self.load_dataset( record )
+                if record[ 'filename_override' ]:
+                    dataset.dataset.external_filename = record[ 'filename_override' ]
+                if ext_override.get( dataset.dataset.id, None ):
+                    dataset.extension = ext_override[ dataset.dataset.id ]
+                kwds = stringify_dictionary_keys( record[ 'kwds' ] ) #need to ensure our keywords are not unicode
+                dataset.datatype.set_meta( dataset, **kwds )
+                results[ record[ 'key' ] ] = ( True, 'Metadata has been set successfully', dataset.metadata.to_external_dict() )
+            except MetadataTimeout:
+                raise
+            except Exception, e:
+                results[ record[ 'key' ] ] = ( False, str( e ), None )
+        # Replace the results file at once, so Galaxy never reads a partial one
+        open( manifest[ 'results' ] + '.tmp', 'wb' ).write( to_json_string( results ) )
+        os.rename( manifest[ 'results' ] + '.tmp', manifest[ 'results' ] )
+
+    def set_metadata_from_pickles( self, args, ext_override ):
+        import galaxy.datatypes.metadata
+        from galaxy.util import stringify_dictionary_keys
+        from galaxy.util.json import from_json_string, to_json_string
+        for filenames in args:
+            fields = filenames.split( ',' )
+            filename_in = fields.pop( 0 )
+            filename_kwds = fields.pop( 0 )
+            filename_out = fields.pop( 0 )
+            filename_results_code = fields.pop( 0 )
+            dataset_filename_override = fields.pop( 0 )
+            #Need to be careful with the way that these parameters are populated from the filename splitting,
+            #because if a job is running when the server is updated, any existing external metadata command-lines
+            #will not have info about the newly added override_metadata file
+            if fields:
+                override_metadata = fields.pop( 0 )
+            else:
+                override_metadata = None
+            try:
+                dataset = cPickle.load( open( filename_in ) ) #load DatasetInstance
+                if dataset_filename_override:
+                    dataset.dataset.external_filename = dataset_filename_override
+                if ext_override.get( dataset.dataset.id, None ):
+                    dataset.extension = ext_override[ dataset.dataset.id ]
+                #Metadata FileParameter types may not be writable on a cluster node, and are therefore temporarily substituted with MetadataTempFiles
+                if override_metadata:
+                    override_metadata = from_json_string( open( override_metadata ).read() )
+                    for metadata_name, metadata_file_override in override_metadata:
+                        if galaxy.datatypes.metadata.MetadataTempFile.is_JSONified_value( metadata_file_override ):
+                            metadata_file_override = galaxy.datatypes.metadata.MetadataTempFile.from_JSON( metadata_file_override )
+                        setattr( dataset.metadata, metadata_name, metadata_file_override )
+                kwds = stringify_dictionary_keys( from_json_string( open( filename_kwds ).read() ) )#load kwds; need to ensure our keywords are not unicode
+                dataset.datatype.set_meta( dataset, **kwds )
+                dataset.metadata.to_JSON_dict( filename_out ) # write out results of set_meta
+                open( filename_results_code, 'wb+' ).write( to_json_string( ( True, 'Metadata has been set successfully' ) ) ) #setting metadata has succeeded
+            except MetadataTimeout:
+                raise
+            except Exception, e:
+                open( filename_results_code, 'wb+' ).write( to_json_string( ( False, str( e ) ) ) ) #setting metadata has failed somehow
+
+    def shutdown( self ):
+        # Shut down any additional threads that might have been created via the ObjectStore
+        for object_store in self.object_stores.values():
+            object_store.shutdown()
+
+class MetadataWorkerPool( object ):
+    """
+    Forks `workers` processes accepting metadata requests on the Unix
+    socket `socket_path`, replacing each after `max_requests` requests (or
+    if it dies).  A request taking more than `timeout` seconds (if given)
+    is abandoned and the client told it failed.
+    """
+    def __init__( self, socket_path, workers=4, max_requests=1000, timeout=None ):
+        self.socket_path = socket_path
+        self.workers = workers
+        self.max_requests = max_requests
+        self.timeout = timeout
+        self.children = set()
+        self.running = False
+        self.sock = None
+        self.environment = None
+
+    def start( self ):
+        if os.path.exists( self.socket_path ):
+            # Left behind by a pool that did not shut down cleanly
+            os.remove( self.socket_path )
+        self.sock = socket.socket( socket.AF_UNIX, socket.SOCK_STREAM )
+        # Only Galaxy's user may connect, the workers read and write files as
+        # that user on request
+        umask = os.umask( 0177 )
+        try:
+            self.sock.bind( self.socket_path )
+        finally:
+            os.umask( umask )
+        self.sock.listen( 128 )
+        # Set up the model before forking so the workers do not each have to,
+        # the object stores are loaded in the workers as they may start threads
+        self.environment = MetadataEnvironment()
+        self.running = True
+        for i in range( self.workers ):
+            self.__spawn()
+        log.info( "Started %i metadata workers listening on %s" % ( self.workers, self.socket_path ) )
+
+    def serve_forever( self ):
+        """ Start the workers and replace them as they exit, until `stop` is called """
+        self.start()
+        while self.running:
+            try:
+                pid, status = os.wait()
+            except OSError, e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+            self.children.discard( pid )
+            if self.running:
+                self.__spawn()
+
+    def stop( self ):
+        self.running = False
+        for pid in self.children:
+            try:
+                os.kill( pid, signal.SIGTERM )
+            except OSError:
+                pass
+        if self.sock is not None:
+            self.sock.close()
+            os.remove( self.socket_path )
+
+    def __spawn( self ):
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                try:
+                    self.__work()
+                except:
+                    log.exception( "Metadata worker %i failed" % os.getpid() )
+                    status = 1
+            finally:
+                os._exit( status )
+        self.children.add( pid )
+
+    def __work( self ):
+        signal.signal( signal.SIGTERM, signal.SIG_DFL )
+        signal.signal( signal.SIGINT, signal.SIG_DFL )
+        signal.signal( signal.SIGALRM, _timeout )
+        try:
+            for i in range( self.max_requests ):
+                try:
+                    conn, address = self.sock.accept()
+                except socket.error, e:
+                    if e.args[0] == errno.EINTR:
+                        continue
+                    raise
+                try:
+                    self.handle( self.environment, conn )
+                finally:
+                    conn.close()
+        finally:
+            self.environment.shutdown()
+
+    def handle( self, environment, conn ):
+        chunks = []
+        while True:
+            chunk = conn.recv( 65536 )
+            if not chunk:
+                break
+            chunks.append( chunk )
+        args = decode_request( ''.join( chunks ) )
+        cwd = os.getcwd()
+        try:
+            try:
+                # The paths in the request are relative to the config root,
+                # set_metadata.sh is run from there
+                os.chdir( args[2] )
+                if self.timeout:
+                    signal.alarm( self.timeout )
+                environment.set_metadata( args, allow_pickles=False )
+                reply = 'ok\n'
+            except Exception, e:
+                log.exception( "Metadata request failed" )
+                reply = 'error %s\n' % str( e ).replace( '\n', ' ' )
+        finally:
+            signal.alarm( 0 )
+            os.chdir( cwd )
+        conn.sendall( reply )
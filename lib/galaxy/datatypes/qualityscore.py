@@ -21,7 +21,7 @@ class QualityScoreSOLiD ( QualityScore ):
     """
     file_ext = "qualsolid"
 
-    def sniff( self, filename ):
+    def sniff_prefix( self, file_prefix ):
         """
         >>> fname = get_test_fname( 'sequence.fasta' )
         >>> QualityScoreSOLiD().sniff( fname )
@@ -31,7 +31,7 @@ class QualityScoreSOLiD ( QualityScore ):
         True
         """
         try:
-            fh = open( filename )
+            fh = file_prefix.string_io()
             readlen = None
             goodblock = 0
             while True:
@@ -78,7 +78,7 @@ class QualityScore454 ( QualityScore ):
     """
     file_ext = "qual454"
 
-    def sniff( self, filename ):
+    def sniff_prefix( self, file_prefix ):
         """
         >>> fname = get_test_fname( 'sequence.fasta' )
         >>> QualityScore454().sniff( fname )
@@ -88,7 +88,7 @@ class QualityScore454 ( QualityScore ):
         True
         """
         try:
-            fh = open( filename )
+            fh = file_prefix.string_io()
             while True:
                 line = fh.readline()
                 if not line:
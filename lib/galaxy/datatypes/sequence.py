@@ -4,6 +4,7 @@ Sequence classes
 
 import gzip
 import data
+from data import Text
 import logging
 import re
 import string
@@ -198,6 +199,13 @@ class Sequence( data.Text ):
             return None
         raise NotImplementedError("Can't split generic sequence files")
 
+    def split_ranges( cls, input_datasets, split_params):
+        """Only subclasses that know where their records start can be split into byte ranges."""
+        if cls.find_record_start.im_func is data.Text.find_record_start.im_func:
+            return None
+        return data.Text.split_ranges.im_func(cls, input_datasets, split_params)
+    split_ranges = classmethod(split_ranges)
+
 
 class Alignment( data.Text ):
     """Class describing an alignment"""
@@ -211,12 +219,19 @@ class Alignment( data.Text ):
             return None
         raise NotImplementedError("Can't split generic alignment files")
 
+    def split_ranges( cls, input_datasets, split_params):
+        """Only subclasses that know where their records start can be split into byte ranges."""
+        if cls.find_record_start.im_func is data.Text.find_record_start.im_func:
+            return None
+        return data.Text.split_ranges.im_func(cls, input_datasets, split_params)
+    split_ranges = classmethod(split_ranges)
+
                                 
 class Fasta( Sequence ):
     """Class representing a FASTA sequence"""
     file_ext = "fasta"
 
-    def sniff( self, filename ):
+    def sniff_prefix( self, file_prefix ):
         """
         Determines whether the file is in fasta format
         
@@ -251,7 +266,7 @@ class Fasta( Sequence ):
         """
         
         try:
-            fh = open( filename )
+            fh = file_prefix.string_io()
             while True:
                 line = fh.readline()
                 if not line:
@@ -397,11 +412,31 @@ class Fasta( Sequence ):
         f.close()
     _count_split = classmethod(_count_split)
 
+    def iter_record_offsets(cls, f):
+        """Yield the offset of each FASTA record's header line."""
+        offset = 0
+        for line in f:
+            if line[0] == ">":
+                yield offset
+            offset += len(line)
+    iter_record_offsets = classmethod(iter_record_offsets)
+
+    def find_record_start(cls, f, offset):
+        """Return the offset of the first header line at or after offset."""
+        offset = data.Text.find_record_start.im_func(cls, f, offset)
+        f.seek(offset)
+        while True:
+            line = f.readline()
+            if not line or line[0] == ">":
+                return offset
+            offset += len(line)
+    find_record_start = classmethod(find_record_start)
+
 class csFasta( Sequence ):
     """ Class representing the SOLID Color-Space sequence ( csfasta ) """
     file_ext = "csfasta"
 
-    def sniff( self, filename ):
+    def sniff_prefix( self, file_prefix ):
         """
         Color-space sequence: 
             >2_15_85_F3
@@ -415,7 +450,7 @@ class csFasta( Sequence ):
         True
         """
         try:
-            fh = open( filename )
+            fh = file_prefix.string_io()
             while True:
                 line = fh.readline()
                 if not line:
@@ -484,7 +519,7 @@ class Fastq ( Sequence ):
             sequences += 1
         dataset.metadata.data_lines = data_lines
         dataset.metadata.sequences = sequences
-    def sniff ( self, filename ):
+    def sniff_prefix( self, file_prefix ):
         """
         Determines whether the file is in generic fastq format
         For details, see http://maq.sourceforge.net/fastq.shtml
@@ -499,7 +534,7 @@ class Fastq ( Sequence ):
         >>> Fastq().sniff( fname )
         True
         """
-        headers = get_headers( filename, None )
+        headers = get_headers( file_prefix, None )
         bases_regexp = re.compile( "^[NGTAC]*" )
         # check that first block looks like a fastq block
         try:
@@ -537,6 +572,35 @@ class Fastq ( Sequence ):
         return cls.do_slow_split(input_datasets, subdir_generator_function, split_params)
     split = classmethod(split)
 
+    def iter_record_offsets(cls, f):
+        """Yield the offset of each FASTQ record, assuming four line records."""
+        offset = 0
+        for i, line in enumerate(f):
+            if i % 4 == 0:
+                yield offset
+            offset += len(line)
+    iter_record_offsets = classmethod(iter_record_offsets)
+
+    def find_record_start(cls, f, offset):
+        """
+        Return the offset of the first record at or after offset. Quality
+        lines may also start with '@', so a record start is an '@' line
+        followed two lines later by a '+' line.
+        """
+        offset = data.Text.find_record_start.im_func(cls, f, offset)
+        f.seek(offset)
+        lines = []
+        while True:
+            while len(lines) < 3:
+                line = f.readline()
+                if not line:
+                    return offset + sum([len(l) for l in lines])
+                lines.append(line)
+            if lines[0][0] == "@" and lines[2][0] == "+":
+                return offset
+            offset += len(lines.pop(0))
+    find_record_start = classmethod(find_record_start)
+
     def process_split_file(data):
         """
         This is called in the context of an external process launched by a Task (possibly not on the Galaxy machine)
@@ -544,6 +608,9 @@ class Fastq ( Sequence ):
         data - a dict containing the contents of the split file
         """
         args = data['args']
+        if 'start_offset' in args:
+            # Written by Text.write_range_split_info
+            return Text.process_split_file(data)
         input_name = data['input_name']
         output_name = data['output_name']
         start_sequence = long(args['start_sequence'])
@@ -735,7 +802,7 @@ class Maf( Alignment ):
         except Exception, exc:
             out = "Can't create peek %s" % exc
         return out
-    def sniff( self, filename ):
+    def sniff_prefix( self, file_prefix ):
         """
         Determines wether the file is in maf format
         
@@ -757,7 +824,7 @@ class Maf( Alignment ):
         >>> Maf().sniff( fname )
         False
         """
-        headers = get_headers( filename, None )
+        headers = get_headers( file_prefix, None )
         try:
             if len(headers) > 1 and headers[0][0] and headers[0][0] == "##maf":
                 return True
@@ -812,7 +879,7 @@ class Axt( data.Text ):
 
     file_ext = "axt"
 
-    def sniff( self, filename ):
+    def sniff_prefix( self, file_prefix ):
         """
         Determines whether the file is in axt format
         
@@ -837,7 +904,7 @@ class Axt( data.Text ):
         >>> Axt().sniff( fname )
         False
         """
-        headers = get_headers( filename, None )
+        headers = get_headers( file_prefix, None )
         if len(headers) < 4:
             return False
         for hdr in headers:
@@ -864,7 +931,7 @@ class Lav( data.Text ):
     # here simply for backward compatibility ( although it is still in the datatypes registry ).  Subclassing
     # from data.Text eliminates managing metadata elements inherited from the Alignemnt class.
 
-    def sniff( self, filename ):
+    def sniff_prefix( self, file_prefix ):
         """
         Determines whether the file is in lav format
         
@@ -880,7 +947,7 @@ class Lav( data.Text ):
         >>> Lav().sniff( fname )
         False
         """
-        headers = get_headers( filename, None )
+        headers = get_headers( file_prefix, None )
         try:
             if len(headers) > 1 and headers[0][0] and headers[0][0].startswith('#:lav'):
                 return True
@@ -1,14 +1,24 @@
 """
 File format detector
 """
-import logging, sys, os, csv, tempfile, shutil, re, zipfile, gzip
+import logging, sys, os, csv, tempfile, shutil, re, zipfile, gzip, time
 import registry
+import data
 from galaxy import util
 from galaxy.datatypes.checkers import *
+from galaxy.datatypes.util.file_prefix import FilePrefix
+from galaxy.util.counters import Counters
 from encodings import search_function as encodings_search_function
 
 log = logging.getLogger(__name__)
 
+# Number of calls to, and total seconds spent in, each sniffer in this process
+SNIFFER_CALLS = Counters()
+SNIFFER_SECONDS = Counters()
+
+# Registry used when guess_ext is not given a sniff order
+default_registry = None
+
 def get_test_fname(fname):
     """Returns test data filename"""
     path, name = os.path.split(__file__)
@@ -169,14 +179,21 @@ def convert_newlines_sep2tabs( fname, in_place=True, patt="\\s+" ):
 
 def get_headers( fname, sep, count=60, is_multi_byte=False ):
     """
-    Returns a list with the first 'count' lines split by 'sep'
+    Returns a list with the first 'count' lines split by 'sep'.  `fname` may
+    be a file name or a FilePrefix.
 
     >>> fname = get_test_fname('complete.bed')
     >>> get_headers(fname,'\\t')
     [['chr7', '127475281', '127491632', 'NM_000230', '0', '+', '127486022', '127488767', '0', '3', '29,172,3225,', '0,10713,13126,'], ['chr7', '127486011', '127488900', 'D49487', '0', '+', '127486022', '127488767', '0', '2', '155,490,', '0,2399']]
+    >>> get_headers(FilePrefix(fname),'\\t') == get_headers(fname,'\\t')
+    True
     """
     headers = []
-    for idx, line in enumerate(file(fname)):
+    if isinstance( fname, FilePrefix ):
+        lines = fname.line_iterator()
+    else:
+        lines = file( fname )
+    for idx, line in enumerate( lines ):
         line = line.rstrip('\n\r')
         if is_multi_byte:
             # TODO: fix this - sep is never found in line
@@ -190,7 +207,7 @@ def get_headers( fname, sep, count=60, is_multi_byte=False ):
 def is_column_based( fname, sep='\t', skip=0, is_multi_byte=False ):
     """
     Checks whether the file is column based with respect to a separator
-    (defaults to tab separator).
+    (defaults to tab separator).  `fname` may be a file name or a FilePrefix.
 
     >>> fname = get_test_fname('test.gff')
     >>> is_column_based(fname)
@@ -291,10 +308,85 @@ def guess_ext( fname, sniff_order=None, is_multi_byte=False ):
     >>> guess_ext(fname)
     'bam'
     """
-    if sniff_order is None:
+    file_prefix = FilePrefix( fname )
+    start = time.time()
+    ext, sniffers_run = guess_ext_from_prefix( file_prefix, sniff_order=sniff_order, is_multi_byte=is_multi_byte )
+    log.debug( "Sniffed %s as '%s' in %.3f seconds using %d sniffers" % ( fname, ext, time.time() - start, sniffers_run ) )
+    return ext
+
+def get_default_registry():
+    """Return a registry of the default datatypes, loading it on first use."""
+    global default_registry
+    if default_registry is None:
         datatypes_registry = registry.Registry()
         datatypes_registry.load_datatypes()
-        sniff_order = datatypes_registry.sniff_order
+        default_registry = datatypes_registry
+    return default_registry
+
+def run_sniffer( datatype, file_prefix ):
+    """
+    Return whether `datatype` recognises the file, recording the time its
+    sniffer took.  Datatypes implementing `sniff_prefix` are given the shared
+    `file_prefix`, those that still override `sniff` are given the file name.
+    """
+    name = datatype.__class__.__name__
+    start = time.time()
+    try:
+        try:
+            if datatype.__class__.sniff.im_func is data.Data.sniff.im_func:
+                return datatype.sniff_prefix( file_prefix )
+            return datatype.sniff( file_prefix.filename )
+        except:
+            # Some classes may not have a sniff function, which is ok
+            return False
+    finally:
+        SNIFFER_CALLS.incr( name )
+        SNIFFER_SECONDS.incr( name, time.time() - start )
+
+def sniffer_timings():
+    """
+    Return ( sniffer name, number of calls, total seconds ) for every sniffer
+    run in this process, slowest first.
+    """
+    calls = SNIFFER_CALLS.snapshot()
+    seconds = SNIFFER_SECONDS.snapshot()
+    timings = [ ( name, calls[ name ], seconds.get( name, 0.0 ) ) for name in calls ]
+    timings.sort( key=lambda t: t[2], reverse=True )
+    return timings
+
+def is_binary_prefix( file_prefix, is_multi_byte=False ):
+    """Returns True if the start of the file contains binary data."""
+    if is_multi_byte:
+        return False
+    for hdr in get_headers( file_prefix, None ):
+        for char in hdr:
+            #old behavior had 'char' possibly having length > 1,
+            #need to determine when/if this occurs 
+            if util.is_binary( char ):
+                return True
+    return False
+
+def guess_ext_from_prefix( file_prefix, sniff_order=None, is_multi_byte=False ):
+    """
+    Does the work of guess_ext on an already read FilePrefix, returning the
+    extension and the number of sniffers run.
+
+    Datatypes whose magic number the file starts with are sniffed first.
+    Otherwise datatypes are sniffed in `sniff_order`, except that text
+    datatypes are not sniffed if the file is binary.
+    """
+    if sniff_order is None:
+        sniff_order = get_default_registry().sniff_order
+    sniffers_run = 0
+    tried = []
+    for ext in file_prefix.magic_extensions():
+        for datatype in sniff_order:
+            if getattr( datatype, 'file_ext', None ) == ext:
+                tried.append( datatype )
+                sniffers_run += 1
+                if run_sniffer( datatype, file_prefix ):
+                    return datatype.file_ext, sniffers_run
+    is_binary = is_binary_prefix( file_prefix, is_multi_byte=is_multi_byte )
     for datatype in sniff_order:
         """
         Some classes may not have a sniff function, which is ok.  In fact, the
@@ -304,30 +396,19 @@ def guess_ext( fname, sniff_order=None, is_multi_byte=False ):
         from this function after all other datatypes in sniff_order have not been
         successfully discovered.
         """
-        try:
-            if datatype.sniff( fname ):
-                return datatype.file_ext
-        except:
-            pass
-    headers = get_headers( fname, None )
-    is_binary = False
-    if is_multi_byte:
-        is_binary = False
-    else:
-        for hdr in headers:
-            for char in hdr:
-                #old behavior had 'char' possibly having length > 1,
-                #need to determine when/if this occurs 
-                is_binary = util.is_binary( char )
-                if is_binary:
-                    break
-            if is_binary:
-                break
+        if datatype in tried or ( is_binary and isinstance( datatype, data.Text ) ):
+            continue
+        if getattr( datatype, 'file_ext', None ) is None:
+            # A match could not be reported (e.g. Pdf, BigBed)
+            continue
+        sniffers_run += 1
+        if run_sniffer( datatype, file_prefix ):
+            return datatype.file_ext, sniffers_run
     if is_binary:
-        return 'data'        #default binary data type file extension
-    if is_column_based( fname, '\t', 1, is_multi_byte=is_multi_byte ):
-        return 'tabular'    #default tabular data type file extension
-    return 'txt'            #default text data type file extension
+        return 'data', sniffers_run        #default binary data type file extension
+    if is_column_based( file_prefix, '\t', 1, is_multi_byte=is_multi_byte ):
+        return 'tabular', sniffers_run    #default tabular data type file extension
+    return 'txt', sniffers_run            #default text data type file extension
 
 def handle_compressed_file( filename, datatypes_registry, ext = 'auto' ):
     CHUNK_SIZE = 2**20 # 1Mb
@@ -383,13 +464,14 @@ def handle_uploaded_dataset_file( filename, datatypes_registry, ext = 'auto', is
     if not is_valid:
         raise InappropriateDatasetContentError, 'The compressed uploaded file contains inappropriate content.'
 
+    file_prefix = FilePrefix( filename )
     if ext in AUTO_DETECT_EXTENSIONS:
-        ext = guess_ext( filename, sniff_order = datatypes_registry.sniff_order, is_multi_byte=is_multi_byte )
+        ext, sniffers_run = guess_ext_from_prefix( file_prefix, sniff_order = datatypes_registry.sniff_order, is_multi_byte=is_multi_byte )
 
-    if check_binary( filename ):
-        if not Binary.is_ext_unsniffable(ext) and not datatypes_registry.get_datatype_by_extension( ext ).sniff( filename ):
+    if check_binary( file_prefix.contents_header, file_path=False ):
+        if not Binary.is_ext_unsniffable(ext) and not run_sniffer( datatypes_registry.get_datatype_by_extension( ext ), file_prefix ):
             raise InappropriateDatasetContentError, 'The binary uploaded file contains inappropriate content.'
-    elif check_html( filename ):
+    elif check_html( filename, chunk=file_prefix.string_io() ):
         raise InappropriateDatasetContentError, 'The uploaded file contains inappropriate HTML content.'
     return ext
 
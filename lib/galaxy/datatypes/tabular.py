@@ -7,6 +7,9 @@ pkg_resources.require( "bx-python" )
 import gzip
 import logging
 import os
+import re
+import sys
+import bisect
 from cgi import escape
 from galaxy import util
 from galaxy.datatypes import data
@@ -15,9 +18,244 @@ from galaxy.datatypes.checkers import is_gzip
 from galaxy.datatypes.metadata import MetadataElement
 from galaxy.datatypes.sniff import get_headers, get_test_fname
 from galaxy.util.json import to_json_string
+from sqlalchemy.orm import object_session
 
 log = logging.getLogger(__name__)
 
+# The types guessed for the values in tabular columns, in the order they are
+# tried in.  A column's type is the last in this list of its values' types.
+COLUMN_TYPES = [ 'int', 'float', 'list', 'str' ]
+COLUMN_TYPE_RANKS = dict( [ ( column_type, rank ) for rank, column_type in enumerate( COLUMN_TYPES ) ] )
+
+# Bytes of a dataset read at a time when setting metadata
+SET_META_BLOCK_SIZE = 1048576
+
+# Blank lines (with any carriage returns), each after the newline ending the previous line
+BLANK_LINE_RE = re.compile( '\n\r*(?=\n)' )
+
+# Bytes between the lines recorded in a LineOffsetIndex
+LINE_INDEX_INTERVAL = 65536
+
+# Datasets smaller than this are read from the start instead of being indexed
+LINE_INDEX_MIN_SIZE = 1048576
+
+def is_int( column_text ):
+    try:
+        int( column_text )
+        return True
+    except:
+        return False
+
+def is_float( column_text ):
+    try:
+        float( column_text )
+        return True
+    except:
+        if column_text.strip().lower() == 'na':
+            return True #na is special cased to be a float
+        return False
+
+def guess_column_type( column_text ):
+    """
+    Return the first type in COLUMN_TYPES that `column_text` is a value of,
+    or None for an empty string.
+
+    >>> [ guess_column_type( value ) for value in [ '1', '-2.5', 'NA', '1,2', 'chr1', '' ] ]
+    ['int', 'float', 'float', 'list', 'str', None]
+    """
+    if is_int( column_text ):
+        return 'int'
+    if is_float( column_text ):
+        return 'float'
+    if "," in column_text:
+        return 'list'
+    if column_text == "":
+        #anything, except an empty string, is a str
+        return None
+    return 'str'
+
+def merge_column_type( column_type, values ):
+    """
+    Return the type of a column of type `column_type` (None if it has no
+    values yet) once `values` are added to it, only guessing the types of
+    the values that could change it.
+
+    >>> merge_column_type( None, [ '1', '' ] ), merge_column_type( 'int', [ '2', '0.5' ] )
+    ('int', 'float')
+    >>> merge_column_type( 'float', [ '1,2' ] ), merge_column_type( 'list', [ '3', '4,5' ] ), merge_column_type( 'list', [ 'x' ] )
+    ('list', 'list', 'str')
+    """
+    rank = COLUMN_TYPE_RANKS.get( column_type, -1 )
+    float_rank, list_rank, str_rank = COLUMN_TYPE_RANKS[ 'float' ], COLUMN_TYPE_RANKS[ 'list' ], COLUMN_TYPE_RANKS[ 'str' ]
+    for value in values:
+        if rank == str_rank:
+            break
+        if not value or ( rank == list_rank and ',' in value ) or ( rank == float_rank and is_float( value ) ):
+            continue
+        rank = max( rank, COLUMN_TYPE_RANKS[ guess_column_type( value ) ] )
+    if rank < 0:
+        return None
+    return COLUMN_TYPES[ rank ]
+
+def merge_column_types( column_types, lines ):
+    """
+    Update the list of column types `column_types` with the tab separated
+    `lines`, appending the types of columns it does not have yet (None for
+    columns with only empty values).  Each distinct value of a column is only
+    looked at once, and columns that are already 'str' not at all.
+
+    >>> column_types = [ 'int', 'str' ]
+    >>> merge_column_types( column_types, [ '1\\ta\\t', '2.5\\tb\\t', '3\\tc\\t1,2\\tx' ] )
+    >>> column_types
+    ['float', 'str', 'list', 'str']
+    """
+    if column_types and column_types.count( 'str' ) == len( column_types ):
+        # Only lines with more columns can change anything
+        lines = [ line for line in lines if line.count( '\t' ) >= len( column_types ) ]
+    if not lines:
+        return
+    rows = [ line.split( '\t' ) for line in lines ]
+    widths = [ len( row ) for row in rows ]
+    if min( widths ) == max( widths ):
+        columns = zip( *rows )
+    else:
+        # Pad the shorter rows with None
+        columns = map( None, *rows )
+    column_types.extend( [ None ] * ( max( widths ) - len( column_types ) ) )
+    for i, column in enumerate( columns ):
+        if column_types[i] != 'str':
+            values = set( column )
+            values.discard( None )
+            column_types[i] = merge_column_type( column_types[i], values )
+
+def iter_line_blocks( fh, block_size=SET_META_BLOCK_SIZE ):
+    """
+    Read the file `fh` a block at a time, yielding ( lines, text ) for the
+    complete lines in each block, where `text` is the lines as read and
+    `lines` the list of them without their newlines.  A last line without a
+    newline is yielded on its own.
+    """
+    rest = ''
+    while True:
+        block = fh.read( block_size )
+        if not block:
+            break
+        block = rest + block
+        end = block.rfind( '\n' ) + 1
+        text, rest = block[ :end ], block[ end: ]
+        if text:
+            yield text[ :-1 ].split( '\n' ), text
+    if rest:
+        yield [ rest ], rest
+
+class LineOffsetIndex( object ):
+    """
+    A sparse index of the lines of a file: the number and byte offset of the
+    first line starting after every `interval` bytes, so that getting to any
+    line takes a seek and reading less than about `interval` bytes.  The file
+    is indexed by passing it to `add_block` in order, in blocks of any size.
+
+    >>> from cStringIO import StringIO
+    >>> text = 'a\\nbb\\nccc\\n' * 4
+    >>> index = LineOffsetIndex( interval=10 )
+    >>> for i in range( 0, len( text ), 7 ):
+    ...     index.add_block( text[ i:i + 7 ] )
+    >>> index.entries
+    [(0, 0), (4, 11), (8, 23), (12, 36)]
+    >>> fh = StringIO( text )
+    >>> index.seek( fh, 10 ); fh.readline()
+    'bb\\n'
+    >>> index.seek( fh, 12 ); fh.readline()
+    ''
+    """
+    def __init__( self, interval=LINE_INDEX_INTERVAL, entries=None ):
+        self.interval = interval
+        # ( line number, byte offset ) of the indexed lines, in order
+        self.entries = entries or [ ( 0, 0 ) ]
+        self.size = 0 # bytes added
+        self.lines = 0 # newlines in the bytes added
+    def add_block( self, block ):
+        start = 0 # of the part of block whose newlines have not been counted yet
+        while True:
+            end = block.find( '\n', max( self.entries[-1][1] + self.interval - 1 - self.size, start ) )
+            if end < 0:
+                break
+            self.lines += block.count( '\n', start, end + 1 )
+            start = end + 1
+            self.entries.append( ( self.lines, self.size + start ) )
+        self.lines += block.count( '\n', start )
+        self.size += len( block )
+    def seek( self, fh, line_number ):
+        """
+        Move the file `fh` to the start of line `line_number` (counting from
+        0), or to its end if it has fewer lines.
+        """
+        line, offset = self.entries[ bisect.bisect_right( self.entries, ( line_number, sys.maxint ) ) - 1 ]
+        fh.seek( offset )
+        for i in range( line_number - line ):
+            if not fh.readline():
+                break
+    def write( self, filename ):
+        out = open( filename, 'wb' )
+        out.write( '%d\n' % self.interval )
+        for line, offset in self.entries:
+            out.write( '%d\t%d\n' % ( line, offset ) )
+        out.close()
+    @classmethod
+    def read( cls, filename ):
+        lines = open( filename ).read().split( '\n' )
+        entries = [ tuple( map( int, line.split( '\t' ) ) ) for line in lines[ 1: ] if line ]
+        return cls( interval=int( lines[0] ), entries=entries )
+
+def find_line_start( fh, offset ):
+    """
+    Return the offset of the first line of the file `fh` starting at or
+    after `offset`, or of the end of the file if there is none.
+    """
+    if offset <= 0:
+        return 0
+    fh.seek( offset - 1 )
+    while True:
+        block = fh.read( SET_META_BLOCK_SIZE )
+        if not block:
+            return fh.tell()
+        end = block.find( '\n' )
+        if end >= 0:
+            return fh.tell() - len( block ) + end + 1
+
+def read_lines_starting_in( fh, start, size ):
+    """
+    Return the lines of the file `fh` that start in the `size` bytes from
+    `start`, and the offset of the range after them, so that consecutive
+    ranges give consecutive lines.  A range inside a long line is moved on to
+    the range the next line starts in, so only ranges at the end of the file
+    give no lines.
+
+    >>> from cStringIO import StringIO
+    >>> fh = StringIO( 'aaaa\\nbb\\ncc\\nd' )
+    >>> [ read_lines_starting_in( fh, start, 5 ) for start in range( 0, 20, 5 ) ]
+    [('aaaa\\n', 5), ('bb\\ncc\\n', 10), ('d', 15), ('', 20)]
+
+    A line spanning several ranges:
+
+    >>> fh = StringIO( 'a' * 12 + '\\nbb\\ncc\\n' )
+    >>> [ read_lines_starting_in( fh, start, 5 ) for start in range( 0, 25, 5 ) ]
+    [('aaaaaaaaaaaa\\n', 5), ('bb\\n', 15), ('bb\\n', 15), ('cc\\n', 20), ('', 25)]
+    >>> read_lines_starting_in( StringIO( 'a' * 12 ), 5, 5 )
+    ('', 15)
+    """
+    begin = find_line_start( fh, start )
+    if begin >= start + size:
+        start += ( begin - start ) // size * size
+    fh.seek( begin )
+    data = fh.read( start + size - begin )
+    if data and not data.endswith( '\n' ):
+        # Complete the last line
+        end = find_line_start( fh, fh.tell() )
+        fh.seek( start + size )
+        data += fh.read( end - start - size )
+    return data, start + size
+
 class Tabular( data.Text ):
     """Tab delimited data"""
     CHUNK_SIZE = 50000
@@ -27,6 +265,7 @@ class Tabular( data.Text ):
     MetadataElement( name="columns", default=0, desc="Number of columns", readonly=True, visible=False, no_value=0 )
     MetadataElement( name="column_types", default=[], desc="Column types", param=metadata.ColumnTypesParameter, readonly=True, visible=False, no_value=[] )
     MetadataElement( name="column_names", default=[], desc="Column names", readonly=True, visible=False, optional=True, no_value=[] )
+    MetadataElement( name="line_offsets", desc="Line Offset Index File", param=metadata.FileParameter, readonly=True, no_value=None, visible=False, optional=True, downloadable=False )
 
     def init_meta( self, dataset, copy_from=None ):
         data.Text.init_meta( self, dataset, copy_from=copy_from )
@@ -54,56 +293,18 @@ class Tabular( data.Text ):
            set_peek() method read the entire file to determine the number of lines in the file.
            Since metadata can now be processed on cluster nodes, we've merged the line count portion
            of the set_peek() processing here, and we now check the entire contents of the file.
+        4. Datasets of LINE_INDEX_MIN_SIZE or more that are read to the end get a line offset index
+           (see get_line_offset_index).
+        5. The file is read a block at a time.  Lines are looked at one by one only around the
+           skipped lines, the header line and where max_data_lines is reached; elsewhere the data
+           lines of a block have their column types guessed together (see merge_column_types), and
+           once no more column types are to be guessed the lines are counted without splitting them.
         """
         # Store original skip value to check with later
         requested_skip = skip
         if skip is None:
             skip = 0
-        column_type_set_order = [ 'int', 'float', 'list', 'str'  ] #Order to set column types in
-        default_column_type = column_type_set_order[-1] # Default column type is lowest in list
-        column_type_compare_order = list( column_type_set_order ) #Order to compare column types
-        column_type_compare_order.reverse()
-        def type_overrules_type( column_type1, column_type2 ):
-            if column_type1 is None or column_type1 == column_type2:
-                return False
-            if column_type2 is None:
-                return True
-            for column_type in column_type_compare_order:
-                if column_type1 == column_type:
-                    return True
-                if column_type2 == column_type:
-                    return False
-            #neither column type was found in our ordered list, this cannot happen
-            raise "Tried to compare unknown column types"
-        def is_int( column_text ):
-            try:
-                int( column_text )
-                return True
-            except:
-                return False
-        def is_float( column_text ):
-            try:
-                float( column_text )
-                return True
-            except:
-                if column_text.strip().lower() == 'na':
-                    return True #na is special cased to be a float
-                return False
-        def is_list( column_text ):
-            return "," in column_text
-        def is_str( column_text ):
-            #anything, except an empty string, is True
-            if column_text == "":
-                return False
-            return True
-        is_column_type = {} #Dict to store column type string to checking function
-        for column_type in column_type_set_order:
-            is_column_type[column_type] = locals()[ "is_%s" % ( column_type ) ]
-        def guess_column_type( column_text ):
-            for column_type in column_type_set_order:
-                if is_column_type[column_type]( column_text ):
-                    return column_type
-            return None
+        default_column_type = COLUMN_TYPES[-1] # Default column type is lowest in list
         data_lines = 0
         comment_lines = 0
         column_types = []
@@ -112,46 +313,85 @@ class Tabular( data.Text ):
             #NOTE: if skip > num_check_lines, we won't detect any metadata, and will use default
             dataset_fh = open( dataset.file_name )
             i = 0
-            while True:
-                line = dataset_fh.readline()
-                if not line: break
-                line = line.rstrip( '\r\n' )
-                if i < skip or not line or line.startswith( '#' ):
-                    # We'll call blank lines comments
-                    comment_lines += 1
+            position = 0 # bytes read up to the current line
+            guess_lines = [] # data lines whose column types have not been merged into column_types yet
+            done = False
+            # Index the lines of large datasets, if the whole dataset is read
+            index = None
+            if dataset.get_size() >= LINE_INDEX_MIN_SIZE:
+                index = LineOffsetIndex()
+            for lines, text in iter_line_blocks( dataset_fh ):
+                if index is not None:
+                    index.add_block( text )
+                if i >= skip and ( i > 0 or requested_skip is not None ) and \
+                   ( max_data_lines is None or data_lines + len( lines ) < max_data_lines ):
+                    # None of these lines are skipped or the header, and max_data_lines cannot be reached within them
+                    position += len( text )
+                    if max_guess_type_data_lines is None or data_lines < max_guess_type_data_lines:
+                        if '\r' in text:
+                            lines = [ line.rstrip( '\r' ) for line in lines ]
+                        # We'll call blank lines comments
+                        block_data_lines = [ line for line in lines if line and line[0] != '#' ]
+                        if max_guess_type_data_lines is None:
+                            guess_lines.extend( block_data_lines )
+                        else:
+                            guess_lines.extend( block_data_lines[ :max_guess_type_data_lines - data_lines ] )
+                        block_data_line_count = len( block_data_lines )
+                    else:
+                        # Only the lines are left to count: every line starts after a newline
+                        # here, so comments start with '\n#' and blank lines are newlines only
+                        # followed by carriage returns and another newline
+                        text = '\n' + text
+                        if not text.endswith( '\n' ):
+                            text += '\n'
+                        block_data_line_count = len( lines ) - text.count( '\n#' ) - len( BLANK_LINE_RE.findall( text ) )
+                    data_lines += block_data_line_count
+                    comment_lines += len( lines ) - block_data_line_count
+                    i += len( lines )
                 else:
-                    data_lines += 1
-                    if max_guess_type_data_lines is None or data_lines <= max_guess_type_data_lines:
-                        fields = line.split( '\t' )
-                        for field_count, field in enumerate( fields ):
-                            if field_count >= len( column_types ): #found a previously unknown column, we append None
-                                column_types.append( None )
-                            column_type = guess_column_type( field )
-                            if type_overrules_type( column_type, column_types[field_count] ):
-                                column_types[field_count] = column_type
-                    if i == 0 and requested_skip is None:
-                        # This is our first line, people seem to like to upload files that have a header line, but do not
-                        # start with '#' (i.e. all column types would then most likely be detected as str).  We will assume
-                        # that the first line is always a header (this was previous behavior - it was always skipped).  When
-                        # the requested skip is None, we only use the data from the first line if we have no other data for
-                        # a column.  This is far from perfect, as
-                        # 1,2,3	1.1	2.2	qwerty
-                        # 0	0		1,2,3
-                        # will be detected as
-                        # "column_types": ["int", "int", "float", "list"]
-                        # instead of
-                        # "column_types": ["list", "float", "float", "str"]  *** would seem to be the 'Truth' by manual
-                        # observation that the first line should be included as data.  The old method would have detected as
-                        # "column_types": ["int", "int", "str", "list"]
-                        first_line_column_types = column_types
-                        column_types = [ None for col in first_line_column_types ]
-                if max_data_lines is not None and data_lines >= max_data_lines:
-                    if dataset_fh.tell() != dataset.get_size():
-                        data_lines = None #Clear optional data_lines metadata value
-                        comment_lines = None #Clear optional comment_lines metadata value; additional comment lines could appear below this point
+                    newline = int( text.endswith( '\n' ) ) # the last line of the file may not end with one
+                    for line in lines:
+                        position += len( line ) + newline
+                        line = line.rstrip( '\r' )
+                        if i < skip or not line or line.startswith( '#' ):
+                            # We'll call blank lines comments
+                            comment_lines += 1
+                        else:
+                            data_lines += 1
+                            if max_guess_type_data_lines is None or data_lines <= max_guess_type_data_lines:
+                                guess_lines.append( line )
+                            if i == 0 and requested_skip is None:
+                                # This is our first line, people seem to like to upload files that have a header line, but do not
+                                # start with '#' (i.e. all column types would then most likely be detected as str).  We will assume
+                                # that the first line is always a header (this was previous behavior - it was always skipped).  When
+                                # the requested skip is None, we only use the data from the first line if we have no other data for
+                                # a column.  This is far from perfect, as
+                                # 1,2,3	1.1	2.2	qwerty
+                                # 0	0		1,2,3
+                                # will be detected as
+                                # "column_types": ["int", "int", "float", "list"]
+                                # instead of
+                                # "column_types": ["list", "float", "float", "str"]  *** would seem to be the 'Truth' by manual
+                                # observation that the first line should be included as data.  The old method would have detected as
+                                # "column_types": ["int", "int", "str", "list"]
+                                merge_column_types( column_types, guess_lines )
+                                guess_lines = []
+                                first_line_column_types = column_types
+                                column_types = [ None for col in first_line_column_types ]
+                        if max_data_lines is not None and data_lines >= max_data_lines:
+                            if position != dataset.get_size():
+                                data_lines = None #Clear optional data_lines metadata value
+                                comment_lines = None #Clear optional comment_lines metadata value; additional comment lines could appear below this point
+                            done = True
+                            break
+                        i += 1
+                merge_column_types( column_types, guess_lines )
+                guess_lines = []
+                if done:
                     break
-                i += 1
             dataset_fh.close()
+            if index is not None and not done:
+                self.set_line_offsets( dataset, index )
 
         #we error on the larger number of columns
         #first we pad our column_types by using data from first line
@@ -251,18 +491,50 @@ class Tabular( data.Text ):
     def get_chunk(self, trans, dataset, chunk):
         ck_index = int(chunk)
         f = open(dataset.file_name)
-        f.seek(ck_index * self.CHUNK_SIZE)
-        # If we aren't at the start of the file, seek to next newline.  Do this better eventually.
-        if f.tell() != 0:
-            cursor = f.read(1)
-            while cursor and cursor != '\n':
-                cursor = f.read(1)
-        ck_data = f.read(self.CHUNK_SIZE)
-        cursor = f.read(1)
-        while cursor and ck_data[-1] != '\n':
-            ck_data += cursor
-            cursor = f.read(1)
-        return to_json_string({'ck_data': ck_data, 'ck_index': ck_index+1})
+        ck_data, next_start = read_lines_starting_in(f, ck_index * self.CHUNK_SIZE, self.CHUNK_SIZE)
+        f.close()
+        # Chunks inside a long line are skipped, so give the index of the next
+        # chunk to fetch rather than leaving the client to count
+        return to_json_string({'ck_data': ck_data, 'ck_index': next_start // self.CHUNK_SIZE})
+
+    def get_line_offset_index( self, dataset ):
+        """
+        Return the LineOffsetIndex of dataset, building it and storing it as
+        the dataset's line_offsets metadata file if there is none yet.
+        Datasets smaller than LINE_INDEX_MIN_SIZE get an empty index.
+        """
+        index_file = dataset.metadata.line_offsets
+        if index_file:
+            try:
+                return LineOffsetIndex.read( index_file.file_name )
+            except Exception, e:
+                log.debug( 'Rebuilding the line offsets of dataset %s: %s' % ( dataset.id, e ) )
+        index = LineOffsetIndex()
+        if dataset.get_size() < LINE_INDEX_MIN_SIZE:
+            return index
+        dataset_fh = open( dataset.file_name )
+        while True:
+            block = dataset_fh.read( SET_META_BLOCK_SIZE )
+            if not block:
+                break
+            index.add_block( block )
+        dataset_fh.close()
+        try:
+            self.set_line_offsets( dataset, index )
+            object_session( dataset ).flush()
+        except Exception, e:
+            log.warning( 'Could not store the line offsets of dataset %s: %s' % ( dataset.id, e ) )
+        return index
+
+    def set_line_offsets( self, dataset, index ):
+        index_file = dataset.metadata.line_offsets
+        if not index_file:
+            index_file = dataset.metadata.spec['line_offsets'].param.new_file( dataset = dataset )
+        index.write( index_file.file_name )
+        dataset.metadata.line_offsets = index_file
+
+    def seek_line( self, dataset, fh, line_number ):
+        self.get_line_offset_index( dataset ).seek( fh, line_number )
 
     def display_data(self, trans, dataset, preview=False, filename=None, to_ext=None, chunk=None):
         if chunk:
@@ -364,7 +636,7 @@ class Sam( Tabular ):
         """Returns formated html of peek"""
         return Tabular.make_html_table( self, dataset, column_names=self.column_names )
 
-    def sniff( self, filename ):
+    def sniff_prefix( self, file_prefix ):
         """
         Determines whether the file is in SAM format
 
@@ -393,7 +665,7 @@ class Sam( Tabular ):
         True
         """
         try:
-            fh = open( filename )
+            fh = file_prefix.string_io()
             count = 0
             while True:
                 line = fh.readline()
@@ -487,7 +759,7 @@ class Pileup( Tabular ):
         """Return options for removing errors along with a description"""
         return [ ("lines", "Remove erroneous lines") ]
 
-    def sniff( self, filename ):
+    def sniff_prefix( self, file_prefix ):
         """
         Checks for 'pileup-ness'
 
@@ -505,7 +777,7 @@ class Pileup( Tabular ):
         >>> Pileup().sniff( fname )
         True
         """
-        headers = get_headers( filename, '\t' )
+        headers = get_headers( file_prefix, '\t' )
         try:
             for hdr in headers:
                 if hdr and not hdr[0].startswith( '#' ):
@@ -539,8 +811,8 @@ class Vcf( Tabular ):
     MetadataElement( name="column_types", default=['str','int','str','str','str','int','str','list','str','str'], param=metadata.ColumnTypesParameter, desc="Column types", readonly=True, visible=False )
     MetadataElement( name="viz_filter_cols", desc="Score column for visualization", default=[5], param=metadata.ColumnParameter, multiple=True )
 
-    def sniff( self, filename ):
-        headers = get_headers( filename, '\n', count=1 )
+    def sniff_prefix( self, file_prefix ):
+        headers = get_headers( file_prefix, '\n', count=1 )
         return headers[0][0].startswith("##fileformat=VCF")
     def display_peek( self, dataset ):
         """Returns formated html of peek"""
@@ -0,0 +1,148 @@
+"""
+Provides the start of a file, read once, for sniffing its datatype.
+
+Sniffing used to hand every sniffer a file name, so detecting the datatype of
+a single upload opened and read the file dozens of times.  A FilePrefix reads
+the first SNIFF_PREFIX_BYTES of the file once and is shared by every sniffer.
+
+>>> import tempfile, os
+>>> fd, fname = tempfile.mkstemp()
+>>> os.write( fd, 'chr1\\t10\\t20\\nchr1\\t30\\t40\\n' )
+22
+>>> os.close( fd )
+>>> file_prefix = FilePrefix( fname )
+>>> file_prefix.truncated
+False
+>>> [ line for line in file_prefix.line_iterator() ]
+['chr1\\t10\\t20\\n', 'chr1\\t30\\t40\\n']
+>>> file_prefix.string_io().readline()
+'chr1\\t10\\t20\\n'
+>>> file_prefix.magic_extensions()
+[]
+
+Only complete lines are returned when the file is longer than the prefix:
+
+>>> file_prefix = FilePrefix( fname, size=15 )
+>>> file_prefix.truncated
+True
+>>> [ line for line in file_prefix.line_iterator() ]
+['chr1\\t10\\t20\\n']
+>>> len( file_prefix.contents_header )
+15
+
+Binary formats are recognised by their magic number:
+
+>>> open( fname, 'wb' ).write( '.sff\\x00\\x00\\x00\\x01' )
+>>> FilePrefix( fname ).magic_extensions()
+['sff']
+>>> import gzip
+>>> gz = gzip.open( fname, 'wb' )
+>>> ignored = gz.write( 'BAM\\x01' )
+>>> gz.close()
+>>> file_prefix = FilePrefix( fname )
+>>> file_prefix.magic_extensions(), file_prefix.compressed
+(['bam'], True)
+>>> file_prefix.gzip_header( 4 )
+'BAM\\x01'
+>>> os.remove( fname )
+"""
+
+import gzip
+from cStringIO import StringIO
+
+# Number of bytes read from the start of a file for sniffing
+SNIFF_PREFIX_BYTES = 2 ** 20
+
+# Magic numbers of binary formats, as ( magic, datatype extension ).  A file
+# starting with a magic number is offered to the sniffer of the corresponding
+# datatype before any other sniffers are run.  The sniffer still has the final
+# say, e.g. only gzipped files containing BAM data are BAM files.  Formats with
+# an extension of None have no datatype of their own.
+MAGIC_NUMBERS = [ ( '\x1f\x8b', 'bam' ),
+                  ( '.sff', 'sff' ),
+                  ( '\x26\xfc\x8f\x88', 'bigwig' ),
+                  ( '\x88\x8f\xfc\x26', 'bigwig' ),
+                  ( '\xeb\xf2\x89\x87', 'bigbed' ),
+                  ( '\x87\x89\xf2\xeb', 'bigbed' ),
+                  ( '\x1a\x41\x27\x43', 'twobit' ),
+                  ( '\x43\x27\x41\x1a', 'twobit' ),
+                  ( '%PDF', 'pdf' ),
+                  ( '\x89PNG\r\n\x1a\n', 'png' ),
+                  ( '\xff\xd8\xff', 'jpg' ),
+                  ( 'GIF87a', 'gif' ),
+                  ( 'GIF89a', 'gif' ),
+                  ( 'II*\x00', 'tiff' ),
+                  ( 'MM\x00*', 'tiff' ),
+                  ( '\x89HDF\r\n\x1a\n', 'h5' ),
+                  ( 'BZh', None ),
+                  ( 'PK\x03\x04', None ) ]
+# Magic numbers of compressed formats
+COMPRESSED_MAGIC_NUMBERS = [ '\x1f\x8b', 'BZh', 'PK\x03\x04' ]
+
+# MAGIC_NUMBERS indexed by their first byte
+MAGIC_INDEX = {}
+for magic, ext in MAGIC_NUMBERS:
+    MAGIC_INDEX.setdefault( magic[0], [] ).append( ( magic, ext ) )
+
+class FilePrefix( object ):
+    """
+    The first `size` bytes of a file.  `contents_header` is the raw prefix,
+    the line based accessors only return complete lines.
+    """
+    def __init__( self, filename, size=SNIFF_PREFIX_BYTES ):
+        self.filename = filename
+        f = open( filename, 'rb' )
+        try:
+            self.contents_header = f.read( size )
+            self.truncated = f.read( 1 ) != ''
+        finally:
+            f.close()
+        self.text = self.contents_header
+        if self.truncated:
+            end = self.text.rfind( '\n' )
+            if end >= 0:
+                self.text = self.text[ :end + 1 ]
+        self.compressed = False
+        for magic in COMPRESSED_MAGIC_NUMBERS:
+            if self.contents_header.startswith( magic ):
+                self.compressed = True
+                break
+        # Values derived from the prefix, shared between sniffers
+        self.memo = {}
+
+    def startswith( self, magic ):
+        return self.contents_header.startswith( magic )
+
+    def string_io( self ):
+        """Return a file-like object over the complete lines of the prefix."""
+        return StringIO( self.text )
+
+    def binary_io( self ):
+        """Return a file-like object over the raw prefix."""
+        return StringIO( self.contents_header )
+
+    def line_iterator( self ):
+        return iter( self.string_io() )
+
+    def magic_extensions( self ):
+        """Return the extensions of the datatypes whose magic number the file starts with."""
+        if not self.contents_header:
+            return []
+        return [ ext for magic, ext in MAGIC_INDEX.get( self.contents_header[0], [] )
+                 if ext is not None and self.contents_header.startswith( magic ) ]
+
+    def gzip_header( self, size ):
+        """Return the first `size` uncompressed bytes of a gzipped file, or ''."""
+        try:
+            return gzip.GzipFile( fileobj=self.binary_io() ).read( size )
+        except:
+            return ''
+
+    def memoize( self, key, compute ):
+        """
+        Return `compute( self )`, computing it only once per prefix.  This lets
+        e.g. the image sniffers identify an image once between them.
+        """
+        if key not in self.memo:
+            self.memo[ key ] = compute( self )
+        return self.memo[ key ]
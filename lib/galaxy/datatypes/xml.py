@@ -20,7 +20,7 @@ class GenericXml( data.Text ):
             dataset.peek = 'file does not exist'
             dataset.blurb = 'file purged from disk'
 
-    def sniff( self, filename ):
+    def sniff_prefix( self, file_prefix ):
         """
         Determines whether the file is XML or not
         
@@ -31,11 +31,8 @@ class GenericXml( data.Text ):
         >>> GenericXml().sniff( fname )
         False
         """
-        #TODO - Use a context manager on Python 2.5+ to close handle
-        handle = open(filename)
-        line = handle.readline()
-        handle.close()
-        
+        line = file_prefix.string_io().readline()
+
         #TODO - Is there a more robust way to do this?
         return line.startswith('<?xml ')
 
@@ -89,12 +86,11 @@ class Phyloxml( GenericXml ):
             dataset.peek = 'file does not exist'
             dataset.blurb = 'file purged from disk'
 
-    def sniff( self, filename ):
+    def sniff_prefix( self, file_prefix ):
         """"Checking for keyword - 'phyloxml' always in lowercase in the first few lines"""
 
-        f = open( filename, "r" )
-        firstlines = "".join( f.readlines(5) )
-        f.close()
+        # file.readlines(5) used to return the lines in the first read buffer
+        firstlines = "".join( file_prefix.string_io().readlines( 8192 ) )
 
         if "phyloxml" in firstlines:
             return True
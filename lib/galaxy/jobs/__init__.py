@@ -161,6 +161,11 @@ class JobWrapper( object ):
             special = self.sa_session.query( model.GenomeIndexToolData ).filter_by( job=job ).first()
         if special:
             out_data[ "output_file" ] = FakeDatasetAssociation( dataset=special.dataset )
+
+        # Give object stores with a slow backend a head start on fetching the inputs
+        for input_dataset in inp_data.values():
+            if input_dataset:
+                self.app.object_store.prefetch( input_dataset.dataset )
             
         # These can be passed on the command line if wanted as $__user_*__
         if job.history and job.history.user:
@@ -257,6 +262,7 @@ class JobWrapper( object ):
                     self.pause( dep_job_assoc.job, "Execution of this dataset's job is paused because its input datasets are in an error state." )
                 self.sa_session.add( dataset )
                 self.sa_session.flush()
+            self.__notify_dataset_state_changed( job )
             job.state = job.states.ERROR
             job.command_line = self.command_line
             job.info = message
@@ -276,6 +282,7 @@ class JobWrapper( object ):
 
             self.sa_session.add( job )
             self.sa_session.flush()
+            self.__notify_job_state_changed( job )
         #Perform email action even on failure.
         for pja in [pjaa.post_job_action for pjaa in job.post_job_actions if pjaa.post_job_action.action_type == "EmailAction"]:
             ActionBox.execute(self.app, self.sa_session, pja, job)
@@ -314,6 +321,7 @@ class JobWrapper( object ):
         job.state = state
         self.sa_session.add( job )
         self.sa_session.flush()
+        self.__notify_job_state_changed( job )
 
     def get_state( self ):
         job = self.get_job()
@@ -327,6 +335,25 @@ class JobWrapper( object ):
         job.job_runner_external_id = external_id
         self.sa_session.add( job )
         self.sa_session.flush()
+        self.__notify_job_state_changed( job )
+
+    def __notify_dataset_state_changed( self, job ):
+        """
+        Tell the handler queue that the states of this job's output datasets
+        have changed, so that jobs waiting on them are checked right away.
+        """
+        dataset_state_changed = getattr( self.queue, 'dataset_state_changed', None )
+        if dataset_state_changed is not None:
+            dataset_state_changed( [ da.dataset.dataset.id for da in job.output_datasets + job.output_library_datasets ] )
+
+    def __notify_job_state_changed( self, job ):
+        """
+        Tell the handler queue that this job's state or runner has changed, so
+        that its concurrency limit counts stay current.
+        """
+        job_state_changed = getattr( self.queue, 'job_state_changed', None )
+        if job_state_changed is not None:
+            job_state_changed( job )
 
     def finish( self, stdout, stderr, tool_exit_code=None ):
         """
@@ -431,7 +458,7 @@ class JobWrapper( object ):
                         #since if it is edited, the metadata changed on the running output will no longer match
                         #the metadata that was stored to disk for use via the external process,
                         #and the changes made by the user will be lost, without warning or notice
-                        dataset.metadata.from_JSON_dict( self.external_output_metadata.get_output_filenames_by_dataset( dataset, self.sa_session ).filename_out )
+                        self.external_output_metadata.load_external_metadata( dataset, self.sa_session )
                     try:
                         assert context.get( 'line_count', None ) is not None
                         if ( not dataset.datatype.composite_type and dataset.dataset.is_multi_byte() ) or self.tool.is_multi_byte:
@@ -478,6 +505,8 @@ class JobWrapper( object ):
         # Flush all the dataset and job changes above.  Dataset state changes
         # will now be seen by the user.
         self.sa_session.flush()
+        self.__notify_dataset_state_changed( job )
+        self.__notify_job_state_changed( job )
         # Save stdout and stderr
         if len( job.stdout ) > 32768:
             log.info( "stdout for job %d is greater than 32K, only first part will be logged to database" % job.id )
@@ -521,7 +550,7 @@ class JobWrapper( object ):
             bytes += dataset_assoc.dataset.dataset.get_total_size()
 
         if job.user:
-            job.user.total_disk_usage += bytes
+            job.user.adjust_total_disk_usage( bytes )
 
         # fix permissions
         for path in [ dp.real_path for dp in self.get_mutable_output_fnames() ]:
@@ -864,6 +893,7 @@ class JobWrapper( object ):
                                                                       config_file = config_file,
                                                                       datatypes_config = datatypes_config,
                                                                       job_metadata = os.path.join( self.working_directory, TOOL_PROVIDED_JOB_METADATA_FILE ),
+                                                                      worker_socket = self.app.config.metadata_worker_socket,
                                                                       **kwds )
 
     @property
@@ -0,0 +1,162 @@
+"""
+In-memory accounting of active (queued or running) jobs, used by the job
+handler to enforce concurrency limits.
+
+The handler used to recount the active jobs of every user with a grouped
+query on each tick.  Instead, it now loads the active jobs once, updates this
+structure as jobs change state, and reloads it from the database every so
+often to pick up changes made by other processes.
+
+Updates are idempotent: a job is either active (with a user, session and
+runner URL) or not, so reporting the same state twice does not change the
+counts.
+
+>>> counts = JobConcurrencyCounts()
+>>> counts.reset( [ ( 1, 10, 100, 'pbs:///' ), ( 2, 10, 100, 'drmaa://-q short/' ) ] )
+>>> counts.user_count( 10 ), counts.session_count( 100 )
+(2, 2)
+>>> counts.update( 3, True, 10, 101, 'drmaa://-q long/' )
+>>> counts.update( 3, True, 10, 101, 'drmaa://-q long/' )
+>>> counts.user_count( 10 )
+3
+>>> counts.user_runner_count( 10, 'pbs:///' )
+1
+>>> counts.user_runner_count( 10, 'drmaa://%/' )
+2
+>>> counts.user_runner_count( 10, 'drmaa://-q _ong/' )
+1
+>>> counts.update( 1, False )
+>>> counts.update( 1, False )
+>>> counts.user_count( 10 ), counts.session_count( 100 ), counts.user_runner_count( 10, 'pbs:///' )
+(2, 1, 0)
+>>> counts.update( 3, True, 10, 101, 'pbs:///' )
+>>> counts.user_runner_count( 10, 'drmaa://%/' ), counts.user_runner_count( 10, 'pbs:///' )
+(1, 1)
+>>> sorted( counts.snapshot()['users'].items() )
+[(10, 2)]
+"""
+
+import re
+import threading
+
+def like_to_regex( pattern ):
+    """
+    Compile an SQL LIKE `pattern` (with % and _ wildcards) to a regular
+    expression.
+
+    >>> like_to_regex( 'pbs://%/' ).match( 'pbs://server/' ) is not None
+    True
+    >>> like_to_regex( 'a_c' ).match( 'abbc' ) is not None
+    False
+    """
+    regex = ''
+    for c in pattern:
+        if c == '%':
+            regex += '.*'
+        elif c == '_':
+            regex += '.'
+        else:
+            regex += re.escape( c )
+    return re.compile( regex + '$', re.DOTALL )
+
+class JobConcurrencyCounts( object ):
+    """
+    Counts of active jobs by user id, by session id, and by user id and job
+    runner URL.  May be updated from any thread.
+    """
+    def __init__( self ):
+        self.lock = threading.Lock()
+        # Compiled LIKE patterns, keyed by pattern
+        self.patterns = {}
+        self.reset()
+
+    def reset( self, jobs=() ):
+        """
+        Replace the counts with those of `jobs`, an iterable of ( job id,
+        user id, session id, job runner URL ) for every active job.
+        """
+        self.lock.acquire()
+        try:
+            self.jobs = {}
+            self.users = {}
+            self.sessions = {}
+            self.user_runners = {}
+            for job_id, user_id, session_id, runner_name in jobs:
+                self.__add( job_id, ( user_id, session_id, runner_name ) )
+        finally:
+            self.lock.release()
+
+    def __incr( self, counts, key, amount ):
+        value = counts.get( key, 0 ) + amount
+        if value > 0:
+            counts[ key ] = value
+        else:
+            counts.pop( key, None )
+
+    def __add( self, job_id, info, amount=1 ):
+        user_id, session_id, runner_name = info
+        if amount > 0:
+            self.jobs[ job_id ] = info
+        else:
+            del self.jobs[ job_id ]
+        if user_id is not None:
+            self.__incr( self.users, user_id, amount )
+            runners = self.user_runners.setdefault( user_id, {} )
+            self.__incr( runners, runner_name, amount )
+            if not runners:
+                del self.user_runners[ user_id ]
+        if session_id is not None:
+            self.__incr( self.sessions, session_id, amount )
+
+    def update( self, job_id, active, user_id=None, session_id=None, runner_name=None ):
+        """
+        Record that job `job_id` is now `active` (queued or running) or not.
+        """
+        info = ( user_id, session_id, runner_name )
+        self.lock.acquire()
+        try:
+            old = self.jobs.get( job_id )
+            if old is not None and ( not active or old != info ):
+                self.__add( job_id, old, -1 )
+                old = None
+            if active and old is None:
+                self.__add( job_id, info )
+        finally:
+            self.lock.release()
+
+    def user_count( self, user_id ):
+        return self.users.get( user_id, 0 )
+
+    def session_count( self, session_id ):
+        return self.sessions.get( session_id, 0 )
+
+    def user_runner_count( self, user_id, runner_pattern ):
+        """
+        Return the number of active jobs of `user_id` whose runner URL matches
+        `runner_pattern`, which may contain SQL LIKE wildcards.
+        """
+        self.lock.acquire()
+        try:
+            runners = self.user_runners.get( user_id )
+            if not runners:
+                return 0
+            if '%' not in runner_pattern and '_' not in runner_pattern:
+                return runners.get( runner_pattern, 0 )
+            regex = self.patterns.get( runner_pattern )
+            if regex is None:
+                regex = self.patterns[ runner_pattern ] = like_to_regex( runner_pattern )
+            return sum( [ count for runner_name, count in runners.items()
+                          if runner_name is not None and regex.match( runner_name ) ] )
+        finally:
+            self.lock.release()
+
+    def snapshot( self ):
+        """Return a copy of the counts, e.g. for display to administrators."""
+        self.lock.acquire()
+        try:
+            return dict( jobs=len( self.jobs ),
+                         users=dict( self.users ),
+                         sessions=dict( self.sessions ),
+                         user_runners=dict( [ ( user_id, dict( runners ) ) for user_id, runners in self.user_runners.items() ] ) )
+        finally:
+            self.lock.release()
@@ -5,19 +5,28 @@ Galaxy job handler, prepares, runs, tracks, and finishes Galaxy jobs
 import os
 import time
 import logging
+import datetime
 import threading
 from Queue import Queue, Empty
 
-from sqlalchemy.sql.expression import and_, or_, select, func
+from sqlalchemy.sql.expression import and_, or_, select
 
 from galaxy import util, model
 from galaxy.jobs import Sleeper, JobWrapper, TaskWrapper
+from galaxy.jobs.readiness import JobReadinessGraph
+from galaxy.jobs.concurrency import JobConcurrencyCounts
+from galaxy.util.counters import Counters
 
 log = logging.getLogger( __name__ )
 
 # States for running a job. These are NOT the same as data states
 JOB_WAIT, JOB_ERROR, JOB_INPUT_ERROR, JOB_INPUT_DELETED, JOB_READY, JOB_DELETED, JOB_ADMIN_DELETED, JOB_USER_OVER_QUOTA = 'wait', 'error', 'input_error', 'input_deleted', 'ready', 'deleted', 'admin_deleted', 'user_over_quota'
 DEFAULT_JOB_PUT_FAILURE_MESSAGE = 'Unable to run job due to a misconfiguration of the Galaxy job running system.  Please contact a site administrator.'
+# Maximum number of ids to put in a single SQL IN clause
+IN_CLAUSE_CHUNK_SIZE = 1000
+# Datasets updated this many seconds before the previous poll are polled again,
+# to allow for clock skew between processes and for slow transaction commits
+DATASET_POLL_OVERLAP = 10
 
 class JobHandler( object ):
     """
@@ -29,7 +38,7 @@ class JobHandler( object ):
         self.dispatcher = DefaultJobDispatcher( app )
         # Queues for starting and stopping jobs
         self.job_queue = JobHandlerQueue( app, self.dispatcher )
-        self.job_stop_queue = JobHandlerStopQueue( app, self.dispatcher )
+        self.job_stop_queue = JobHandlerStopQueue( app, self.dispatcher, self.job_queue )
     def start( self ):
         self.job_queue.start()
     def shutdown( self ):
@@ -58,6 +67,21 @@ class JobHandlerQueue( object ):
         self.queue = Queue()
         # Contains jobs that are waiting (only use from monitor thread)
         self.waiting_jobs = []
+        # Tracks which new jobs are waiting on which input datasets. Note this
+        # is only used if track_jobs_in_database is True
+        self.readiness = JobReadinessGraph()
+        self.last_reconcile = 0
+        self.last_dataset_poll = None
+        self.tick_queries = 0
+        self.counters = Counters( 'ticks', 'queries', 'last_tick_queries', 'reconciliations', 'jobs_woken',
+                                  'quota_checks', 'quota_decision_hits', 'last_tick_quota_lookups' )
+        # Over quota decisions for the current tick, keyed by user id (or
+        # history id for anonymous users)
+        self.quota_decisions = {}
+        # Active job counts for enforcing concurrency limits, kept up to date
+        # by job_state_changed and periodically reloaded from the database
+        self.concurrency = JobConcurrencyCounts()
+        self.last_concurrency_reconcile = 0
         # Helper for interruptable sleep
         self.sleeper = Sleeper()
         self.running = True
@@ -128,36 +152,22 @@ class JobHandlerQueue( object ):
         """
         # Pull all new jobs from the queue at once
         jobs_to_check = []
+        # Usage may have changed since the last tick, and quotas may have been
+        # changed by another process
+        self.quota_decisions = {}
+        if self.app.config.enable_quotas:
+            self.app.quota_agent.check_for_changes()
         if self.track_jobs_in_database:
             # Clear the session so we get fresh states for job and all datasets
             self.sa_session.expunge_all()
-            # Fetch all new jobs
-            hda_not_ready = self.sa_session.query(model.Job.id).enable_eagerloads(False) \
-                    .join(model.JobToInputDatasetAssociation) \
-                    .join(model.HistoryDatasetAssociation) \
-                    .join(model.Dataset) \
-                    .filter(and_((model.Job.state == model.Job.states.NEW),
-                                 or_((model.HistoryDatasetAssociation._state == model.HistoryDatasetAssociation.states.FAILED_METADATA),
-                                     (model.HistoryDatasetAssociation.deleted == True ),
-                                     (model.Dataset.state != model.Dataset.states.OK ),
-                                     (model.Dataset.deleted == True)))).subquery()
-            ldda_not_ready = self.sa_session.query(model.Job.id).enable_eagerloads(False) \
-                    .join(model.JobToInputLibraryDatasetAssociation) \
-                    .join(model.LibraryDatasetDatasetAssociation) \
-                    .join(model.Dataset) \
-                    .filter(and_((model.Job.state == model.Job.states.NEW),
-                                 or_((model.LibraryDatasetDatasetAssociation._state != None),
-                                     (model.LibraryDatasetDatasetAssociation.deleted == True),
-                                     (model.Dataset.state != model.Dataset.states.OK),
-                                     (model.Dataset.deleted == True)))).subquery()
-            jobs_to_check = self.sa_session.query(model.Job).enable_eagerloads(False) \
-                    .filter(and_((model.Job.state == model.Job.states.NEW),
-                                 (model.Job.handler == self.app.config.server_name),
-                                 ~model.Job.table.c.id.in_(hda_not_ready),
-                                 ~model.Job.table.c.id.in_(ldda_not_ready))) \
-                    .order_by(model.Job.id).all()
-            # Ensure that we get new job counts on each iteration
-            self.__clear_user_job_count()
+            self.tick_queries = 0
+            # Incrementally work out which new jobs have all of their inputs
+            # ready, with a periodic full pass as a safety net
+            if time.time() - self.last_reconcile >= self.app.config.job_readiness_reconcile_interval:
+                self.__reconcile_readiness()
+            else:
+                self.__update_readiness()
+            jobs_to_check = self.__get_jobs( self.readiness.ready_jobs() )
         else:
             # Get job objects and append to watch queue for any which were
             # previously waiting
@@ -174,6 +184,9 @@ class JobHandlerQueue( object ):
                     jobs_to_check.append( self.sa_session.query( model.Job ).get( job_id ) )
             except Empty:
                 pass
+        # Periodically pick up jobs started and finished by other processes
+        if self.__job_limits_enabled() and time.time() - self.last_concurrency_reconcile >= self.app.config.job_concurrency_reconcile_interval:
+            self.__reconcile_job_counts()
         # Iterate over new and waiting jobs and look for any that are
         # ready to run
         new_waiting_jobs = []
@@ -191,6 +204,7 @@ class JobHandlerQueue( object ):
                     log.info( "(%d) Job unable to run: one or more inputs deleted" % job.id )
                 elif job_state == JOB_READY:
                     self.dispatcher.put( JobWrapper( job, self ) )
+                    self.readiness.discard( job.id )
                     log.info( "(%d) Job dispatched" % job.id )
                 elif job_state == JOB_DELETED:
                     log.info( "(%d) Job deleted by user while still queued" % job.id )
@@ -198,6 +212,7 @@ class JobHandlerQueue( object ):
                     log.info( "(%d) Job deleted by admin while still queued" % job.id )
                 elif job_state == JOB_USER_OVER_QUOTA:
                     log.info( "(%d) User (%s) is over quota: job paused" % ( job.id, job.user_id ) )
+                    self.readiness.discard( job.id )
                     job.state = model.Job.states.PAUSED
                     for dataset_assoc in job.output_datasets + job.output_library_datasets:
                         dataset_assoc.dataset.dataset.state = model.Dataset.states.PAUSED
@@ -216,6 +231,138 @@ class JobHandlerQueue( object ):
         self.sa_session.flush()
         # Done with the session
         self.sa_session.remove()
+        if self.track_jobs_in_database:
+            self.counters.incr( 'ticks' )
+            self.counters.incr( 'queries', self.tick_queries )
+            self.counters.set( 'last_tick_queries', self.tick_queries )
+        self.counters.set( 'last_tick_quota_lookups', len( self.quota_decisions ) )
+
+    def __execute( self, statement ):
+        self.tick_queries += 1
+        return self.sa_session.execute( statement )
+
+    def __get_new_job_ids( self ):
+        """
+        Return the ids of all jobs assigned to this handler in the NEW state.
+        """
+        job_table = model.Job.table
+        return [ row[0] for row in self.__execute( select( [ job_table.c.id ] ) \
+                         .where( and_( job_table.c.state == model.Job.states.NEW,
+                                       job_table.c.handler == self.app.config.server_name ) ) ) ]
+
+    def __get_waiting_inputs( self, job_ids=None ):
+        """
+        Return a dictionary mapping job id to the set of ids of its input
+        Datasets that are not ready, for the given jobs or, if `job_ids` is
+        None, for all of this handler's NEW jobs.  Jobs whose inputs are all
+        ready are not included.
+        """
+        if job_ids is None:
+            chunks = [ None ]
+        else:
+            job_ids = sorted( job_ids )
+            chunks = [ job_ids[ i:i + IN_CLAUSE_CHUNK_SIZE ] for i in range( 0, len( job_ids ), IN_CLAUSE_CHUNK_SIZE ) ]
+        job_table = model.Job.table
+        dataset_table = model.Dataset.table
+        hda_table = model.HistoryDatasetAssociation.table
+        ldda_table = model.LibraryDatasetDatasetAssociation.table
+        jtid_table = model.JobToInputDatasetAssociation.table
+        jtild_table = model.JobToInputLibraryDatasetAssociation.table
+        dataset_not_ready = or_( dataset_table.c.state != model.Dataset.states.OK,
+                                 dataset_table.c.deleted == True )
+        waiting = {}
+        for chunk in chunks:
+            if chunk is None:
+                hda_jobs = and_( jtid_table.c.job_id == job_table.c.id,
+                                 job_table.c.state == model.Job.states.NEW,
+                                 job_table.c.handler == self.app.config.server_name )
+                ldda_jobs = and_( jtild_table.c.job_id == job_table.c.id,
+                                  job_table.c.state == model.Job.states.NEW,
+                                  job_table.c.handler == self.app.config.server_name )
+            else:
+                hda_jobs = jtid_table.c.job_id.in_( chunk )
+                ldda_jobs = jtild_table.c.job_id.in_( chunk )
+            hda_not_ready = select( [ jtid_table.c.job_id, dataset_table.c.id ] ) \
+                    .where( and_( hda_jobs,
+                                  jtid_table.c.dataset_id == hda_table.c.id,
+                                  hda_table.c.dataset_id == dataset_table.c.id,
+                                  or_( hda_table.c._state == model.HistoryDatasetAssociation.states.FAILED_METADATA,
+                                       hda_table.c.deleted == True,
+                                       dataset_not_ready ) ) )
+            ldda_not_ready = select( [ jtild_table.c.job_id, dataset_table.c.id ] ) \
+                    .where( and_( ldda_jobs,
+                                  jtild_table.c.ldda_id == ldda_table.c.id,
+                                  ldda_table.c.dataset_id == dataset_table.c.id,
+                                  or_( ldda_table.c._state != None,
+                                       ldda_table.c.deleted == True,
+                                       dataset_not_ready ) ) )
+            for query in ( hda_not_ready, ldda_not_ready ):
+                for job_id, dataset_id in self.__execute( query ):
+                    waiting.setdefault( job_id, set() ).add( dataset_id )
+        return waiting
+
+    def __evaluate_readiness( self, job_ids, waiting ):
+        for job_id in job_ids:
+            if job_id in waiting:
+                self.readiness.add_waiting( job_id, waiting[ job_id ] )
+            else:
+                self.readiness.add_ready( job_id )
+
+    def __reconcile_readiness( self ):
+        """
+        Rebuild the readiness graph from scratch by checking the inputs of
+        every NEW job assigned to this handler.  This catches any dataset
+        state changes that were missed by `__update_readiness`.
+        """
+        self.last_reconcile = time.time()
+        self.last_dataset_poll = datetime.datetime.utcnow()
+        self.readiness.reset()
+        new_job_ids = self.__get_new_job_ids()
+        self.__evaluate_readiness( new_job_ids, self.__get_waiting_inputs() )
+        self.counters.incr( 'reconciliations' )
+        log.debug( "Reconciled readiness of %d new jobs, handler queue counters: %s, quota cache: %s" % ( len( new_job_ids ), self.counters.snapshot(), self.app.quota_agent.cache_stats() ) )
+
+    def __update_readiness( self ):
+        """
+        Check the inputs of jobs that are new since the last tick, and of
+        waiting jobs whose input datasets have changed since the last tick.
+        """
+        new_job_ids = self.__get_new_job_ids()
+        unknown_job_ids = self.readiness.retain( new_job_ids )
+        # Datasets updated by other processes (e.g. another handler finishing
+        # a job) are found via the indexed update_time column, changes made by
+        # this handler's own job wrappers are reported to
+        # dataset_state_changed() directly
+        poll_time = datetime.datetime.utcnow()
+        since = self.last_dataset_poll - datetime.timedelta( seconds=DATASET_POLL_OVERLAP )
+        self.last_dataset_poll = poll_time
+        changed = [ row[0] for row in self.__execute( select( [ model.Dataset.table.c.id ] ) \
+                            .where( model.Dataset.table.c.update_time >= since ) ) ]
+        self.counters.incr( 'jobs_woken', self.readiness.dataset_changed( changed ) )
+        job_ids = unknown_job_ids | self.readiness.pop_woken()
+        if job_ids:
+            self.__evaluate_readiness( job_ids, self.__get_waiting_inputs( job_ids ) )
+
+    def __get_jobs( self, job_ids ):
+        jobs = []
+        for i in range( 0, len( job_ids ), IN_CLAUSE_CHUNK_SIZE ):
+            self.tick_queries += 1
+            jobs.extend( self.sa_session.query( model.Job ).enable_eagerloads( False ) \
+                                        .filter( and_( model.Job.id.in_( job_ids[ i:i + IN_CLAUSE_CHUNK_SIZE ] ),
+                                                       model.Job.state == model.Job.states.NEW ) ) \
+                                        .order_by( model.Job.id ).all() )
+        return jobs
+
+    def dataset_state_changed( self, dataset_ids ):
+        """
+        Called (from any thread) when the state of the given Datasets has
+        changed, so that jobs waiting on them are re-checked on the next tick.
+        """
+        if self.track_jobs_in_database:
+            woken = self.readiness.dataset_changed( dataset_ids )
+            if woken:
+                self.counters.incr( 'jobs_woken', woken )
+                self.sleeper.wake()
 
     def __check_if_ready_to_run( self, job ):
         """
@@ -252,60 +399,84 @@ class JobHandlerQueue( object ):
                     # need to requeue
                     return JOB_WAIT
         state = self.__check_user_jobs( job )
-        if state == JOB_READY and self.app.config.enable_quotas:
-            quota = self.app.quota_agent.get_quota( job.user )
-            if quota is not None:
-                try:
-                    usage = self.app.quota_agent.get_usage( user=job.user, history=job.history )
-                    if usage > quota:
-                        return JOB_USER_OVER_QUOTA
-                except AssertionError, e:
-                    pass # No history, should not happen with an anon user
+        if state == JOB_READY and self.app.config.enable_quotas and self.__is_over_quota( job ):
+            return JOB_USER_OVER_QUOTA
         return state
 
-    def __clear_user_job_count( self ):
-        self.user_job_count = {}
-        self.user_job_count_per_runner = {}
+    def __is_over_quota( self, job ):
+        """
+        Check whether the owner of `job` is over quota.  The decision is made
+        once per user (or per history for anonymous users) per tick, so a
+        batch of ready jobs from one user costs a single quota and usage
+        lookup.
+        """
+        self.counters.incr( 'quota_checks' )
+        if job.user_id:
+            key = ( 'user', job.user_id )
+        else:
+            key = ( 'history', job.history_id )
+        if key in self.quota_decisions:
+            self.counters.incr( 'quota_decision_hits' )
+            return self.quota_decisions[ key ]
+        over_quota = False
+        quota = self.app.quota_agent.get_quota( job.user )
+        if quota is not None:
+            try:
+                usage = self.app.quota_agent.get_usage( user=job.user, history=job.history )
+                over_quota = usage > quota
+            except AssertionError, e:
+                pass # No history, should not happen with an anon user
+        self.quota_decisions[ key ] = over_quota
+        return over_quota
+
+    def __job_limits_enabled( self ):
+        return bool( self.app.config.registered_user_job_limit or
+                     self.app.config.anonymous_user_job_limit or
+                     self.app.config.job_limits )
+
+    def __reconcile_job_counts( self ):
+        """
+        Reload the active (queued and running) job counts from the database.
+        """
+        self.last_concurrency_reconcile = time.time()
+        query = self.__execute( select( [ model.Job.table.c.id,
+                                          model.Job.table.c.user_id,
+                                          model.Job.table.c.session_id,
+                                          model.Job.table.c.job_runner_name ] )
+                                .where( model.Job.table.c.state.in_( ( model.Job.states.QUEUED, model.Job.states.RUNNING ) ) ) )
+        self.concurrency.reset( query )
+        log.debug( "Reloaded active job counts for concurrency limits: %d active jobs" % len( self.concurrency.jobs ) )
+
+    def job_state_changed( self, job ):
+        """
+        Update the active job counts after `job` has changed state or runner.
+        Called by JobWrapper, possibly from job runner threads.
+        """
+        self.concurrency.update( job.id,
+                                 job.state in ( model.Job.states.QUEUED, model.Job.states.RUNNING ),
+                                 job.user_id,
+                                 job.session_id,
+                                 job.job_runner_name )
+
+    def concurrency_counts( self ):
+        """Return the current active job counts, for administrators."""
+        return self.concurrency.snapshot()
 
     def __check_user_jobs( self, job ):
         if job.user:
             # Check the hard limit first
             if self.app.config.registered_user_job_limit:
-                # Cache the job count if necessary
-                if not self.user_job_count:
-                    query = self.sa_session.execute(select([model.Job.table.c.user_id, func.count(model.Job.table.c.user_id)]) \
-                            .where(and_(model.Job.table.c.state.in_((model.Job.states.QUEUED, model.Job.states.RUNNING)), (model.Job.table.c.user_id is not None))) \
-                            .group_by(model.Job.table.c.user_id))
-                    for row in query:
-                        self.user_job_count[row[0]] = row[1]
-                if self.user_job_count.get(job.user_id, 0) >= self.app.config.registered_user_job_limit:
+                if self.concurrency.user_count( job.user_id ) >= self.app.config.registered_user_job_limit:
                     return JOB_WAIT
             # If we pass the hard limit, also check the per-runner count
             if job.job_runner_name in self.app.config.job_limits:
-                # Cache the job count if necessary
-                if job.job_runner_name not in self.user_job_count_per_runner:
-                    self.user_job_count_per_runner[job.job_runner_name] = {}
-                    query_url, limit = self.app.config.job_limits[job.job_runner_name]
-                    base_query = select([model.Job.table.c.user_id, model.Job.table.c.job_runner_name, func.count(model.Job.table.c.user_id).label('job_count')]) \
-                                .where(model.Job.table.c.state.in_((model.Job.states.QUEUED, model.Job.states.RUNNING))) \
-                                .group_by(model.Job.table.c.user_id, model.Job.table.c.job_runner_name)
-                    if '%' in query_url or '_' in query_url:
-                        subq = base_query.having(model.Job.table.c.job_runner_name.like(query_url)).alias('subq')
-                        query = self.sa_session.execute(select([subq.c.user_id, func.sum(subq.c.job_count).label('job_count')]).group_by(subq.c.user_id))
-                    else:
-                        query = self.sa_session.execute(base_query.having(model.Job.table.c.job_runner_name == query_url))
-                    for row in query:
-                        self.user_job_count_per_runner[job.job_runner_name][row['user_id']] = row['job_count']
-                if self.user_job_count_per_runner[job.job_runner_name].get(job.user_id, 0) >= self.app.config.job_limits[job.job_runner_name][1]:
+                query_url, limit = self.app.config.job_limits[job.job_runner_name]
+                if self.concurrency.user_runner_count( job.user_id, query_url ) >= limit:
                     return JOB_WAIT
         elif job.galaxy_session:
             # Anonymous users only get the hard limit
             if self.app.config.anonymous_user_job_limit:
-                count = self.sa_session.query( model.Job ).enable_eagerloads( False ) \
-                            .filter( and_( model.Job.session_id == job.galaxy_session.id,
-                                           or_( model.Job.state == model.Job.states.RUNNING,
-                                                model.Job.state == model.Job.states.QUEUED ) ) ).count()
-                if count >= self.app.config.anonymous_user_job_limit:
+                if self.concurrency.session_count( job.galaxy_session.id ) >= self.app.config.anonymous_user_job_limit:
                     return JOB_WAIT
         else:
             log.warning( 'Job %s is not associated with a user or session so job concurrency limit cannot be checked.' % job.id )
@@ -336,9 +507,11 @@ class JobHandlerStopQueue( object ):
     A queue for jobs which need to be terminated prematurely.
     """
     STOP_SIGNAL = object()
-    def __init__( self, app, dispatcher ):
+    def __init__( self, app, dispatcher, job_queue=None ):
         self.app = app
         self.dispatcher = dispatcher
+        # The handler's job queue, told about jobs that are stopped
+        self.job_queue = job_queue
 
         self.sa_session = app.model.context
 
@@ -408,6 +581,8 @@ class JobHandlerStopQueue( object ):
                 job.state = job.states.DELETED
             self.sa_session.add( job )
             self.sa_session.flush()
+            if self.job_queue is not None:
+                self.job_queue.job_state_changed( job )
             if job.job_runner_name is not None:
                 # tell the dispatcher to stop the job
                 self.dispatcher.stop( job )
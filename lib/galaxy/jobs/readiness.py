@@ -0,0 +1,165 @@
+"""
+In-memory dependency graph used by the job handler to decide which new jobs
+need their inputs re-checked.
+
+Rather than asking the database on every tick which NEW jobs have all of
+their inputs in the OK state, the handler registers each waiting job against
+the ids of the input Datasets that are not yet ready.  When one of those
+datasets changes state, only the jobs waiting on it are woken and re-checked.
+
+>>> graph = JobReadinessGraph()
+>>> graph.add_waiting( 1, [ 10, 11 ] )
+>>> graph.add_waiting( 2, [ 11 ] )
+>>> graph.add_ready( 3 )
+>>> graph.ready_jobs()
+[3]
+>>> graph.dataset_changed( [ 12 ] )
+0
+>>> graph.dataset_changed( [ 11 ] )
+2
+>>> sorted( graph.pop_woken() )
+[1, 2]
+>>> graph.pop_woken()
+set([])
+>>> sorted( graph.retain( [ 1, 3, 4 ] ) )
+[4]
+>>> graph.is_waiting( 2 )
+False
+>>> graph.discard( 3 )
+>>> graph.ready_jobs()
+[]
+>>> sorted( graph.watched_dataset_ids() )
+[10, 11]
+"""
+
+import threading
+
+class JobReadinessGraph( object ):
+    """
+    Maps input Dataset ids to the ids of NEW jobs that are waiting on them.
+
+    Jobs are in one of two sets: `waiting` jobs have at least one input that
+    is not ready, `ready` jobs have all of their inputs ready but have not yet
+    been dispatched (e.g. because of a concurrency limit) and so are checked
+    on every tick.  `dataset_changed` may be called from any thread.
+    """
+    def __init__( self ):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset( self ):
+        self.lock.acquire()
+        try:
+            # job id -> set of input dataset ids not yet ready
+            self.waiting = {}
+            # dataset id -> set of job ids waiting on it
+            self.watchers = {}
+            # job ids whose inputs are all ready
+            self.ready = set()
+            # job ids that must be re-evaluated on the next tick
+            self.woken = set()
+        finally:
+            self.lock.release()
+
+    def __len__( self ):
+        return len( self.waiting ) + len( self.ready )
+
+    def __unwatch( self, job_id ):
+        for dataset_id in self.waiting.pop( job_id, () ):
+            watchers = self.watchers.get( dataset_id )
+            if watchers is not None:
+                watchers.discard( job_id )
+                if not watchers:
+                    del self.watchers[ dataset_id ]
+
+    def add_waiting( self, job_id, dataset_ids ):
+        """Register `job_id` as waiting on each of `dataset_ids`."""
+        self.lock.acquire()
+        try:
+            self.__unwatch( job_id )
+            self.ready.discard( job_id )
+            self.woken.discard( job_id )
+            self.waiting[ job_id ] = set( dataset_ids )
+            for dataset_id in dataset_ids:
+                self.watchers.setdefault( dataset_id, set() ).add( job_id )
+        finally:
+            self.lock.release()
+
+    def add_ready( self, job_id ):
+        """Register `job_id` as having all of its inputs ready."""
+        self.lock.acquire()
+        try:
+            self.__unwatch( job_id )
+            self.woken.discard( job_id )
+            self.ready.add( job_id )
+        finally:
+            self.lock.release()
+
+    def discard( self, job_id ):
+        """Forget about `job_id` (it was dispatched or is no longer NEW)."""
+        self.lock.acquire()
+        try:
+            self.__unwatch( job_id )
+            self.ready.discard( job_id )
+            self.woken.discard( job_id )
+        finally:
+            self.lock.release()
+
+    def retain( self, job_ids ):
+        """
+        Forget any job not in `job_ids` and return the subset of `job_ids`
+        that the graph does not yet know about.
+        """
+        job_ids = set( job_ids )
+        self.lock.acquire()
+        try:
+            for job_id in [ j for j in self.waiting if j not in job_ids ]:
+                self.__unwatch( job_id )
+            self.ready &= job_ids
+            self.woken &= job_ids
+            return job_ids - self.ready - set( self.waiting )
+        finally:
+            self.lock.release()
+
+    def dataset_changed( self, dataset_ids ):
+        """
+        Wake every job waiting on any of `dataset_ids`, returning the number
+        of jobs woken.
+        """
+        woken = 0
+        self.lock.acquire()
+        try:
+            for dataset_id in dataset_ids:
+                for job_id in self.watchers.get( dataset_id, () ):
+                    if job_id not in self.woken:
+                        self.woken.add( job_id )
+                        woken += 1
+        finally:
+            self.lock.release()
+        return woken
+
+    def pop_woken( self ):
+        self.lock.acquire()
+        try:
+            woken = self.woken
+            self.woken = set()
+            return woken
+        finally:
+            self.lock.release()
+
+    def is_waiting( self, job_id ):
+        return job_id in self.waiting
+
+    def ready_jobs( self ):
+        self.lock.acquire()
+        try:
+            return sorted( self.ready )
+        finally:
+            self.lock.release()
+
+    def watched_dataset_ids( self ):
+        self.lock.acquire()
+        try:
+            return self.watchers.keys()
+        finally:
+            self.lock.release()
@@ -118,6 +118,65 @@ class ClusterJobState( object ):
         self.old_state = None
         self.running = False
         self.runner_url = None
+        # Used by StatusCheckPolicy to decide when to next check the job
+        self.last_state_change = None
+        self.next_check = 0
+
+class StatusCheckPolicy( object ):
+    """
+    Decides how often a runner's monitor thread polls the DRM, so that
+    large queues do not overwhelm the scheduler.  Jobs whose state changed
+    recently are checked every `min_interval` seconds, jobs that have sat in
+    the same state for a while are checked less often (up to every
+    `max_interval` seconds), and the monitor sleeps longer between passes as
+    the number of watched jobs grows.
+
+    The job state objects passed in must have `last_state_change` and
+    `next_check` attributes.
+    """
+    # A job that has not changed state for N seconds is checked every
+    # N / AGE_DIVISOR seconds
+    AGE_DIVISOR = 10.0
+    # The monitor sleeps one second per this many watched jobs
+    JOBS_PER_SECOND = 1000.0
+
+    def __init__( self, min_interval=1, max_interval=30 ):
+        self.min_interval = min_interval
+        self.max_interval = max( min_interval, max_interval )
+
+    def __clamp( self, interval ):
+        return max( self.min_interval, min( self.max_interval, interval ) )
+
+    def partition( self, watched, now=None ):
+        """
+        Split `watched` into the job states due for a check and those that
+        can be skipped on this pass.
+        """
+        if now is None:
+            now = time.time()
+        due = []
+        skipped = []
+        for job_state in watched:
+            if job_state.next_check <= now:
+                due.append( job_state )
+            else:
+                skipped.append( job_state )
+        return due, skipped
+
+    def record( self, job_state, changed, now=None ):
+        """
+        Record that a job has been checked (and whether its state `changed`)
+        and schedule its next check.
+        """
+        if now is None:
+            now = time.time()
+        if changed or job_state.last_state_change is None:
+            job_state.last_state_change = now
+        job_state.next_check = now + self.__clamp( ( now - job_state.last_state_change ) / self.AGE_DIVISOR )
+
+    def sleep_interval( self, watched_count ):
+        """Seconds the monitor thread should sleep between passes."""
+        return self.__clamp( watched_count / self.JOBS_PER_SECOND )
 
 STOP_SIGNAL = object()
 
@@ -141,6 +200,8 @@ class ClusterJobRunner( BaseJobRunner ):
         # to 'watched' and then manage the watched jobs.
         self.watched = []
         self.monitor_queue = Queue()
+        self.status_check_policy = StatusCheckPolicy( app.config.cluster_job_status_min_interval,
+                                                      app.config.cluster_job_status_max_interval )
 
     def _init_monitor_thread(self):
         self.monitor_thread = threading.Thread( name="%s.monitor_thread" % self.runner_name, target=self.monitor )
@@ -181,7 +242,7 @@ class ClusterJobRunner( BaseJobRunner ):
             # Iterate over the list of watched jobs and check state
             self.check_watched_items()
             # Sleep a bit before the next state check
-            time.sleep( 1 )
+            time.sleep( self.status_check_policy.sleep_interval( len( self.watched ) ) )
 
     def run_next( self ):
         """
@@ -231,14 +292,39 @@ class ClusterJobRunner( BaseJobRunner ):
         states. Subclasses can opt to override this directly (as older job runners will
         initially) or just override check_watched_item and allow the list processing to
         reuse the logic here.
+
+        Only jobs that are due according to the runner's StatusCheckPolicy are
+        checked.  Before they are, get_job_states is called once with all of
+        them so that runners able to query the DRM in bulk can do so;
+        check_watched_item can find the result in the job state's
+        batch_state attribute (None if the job was missing from the bulk
+        result, in which case it should be checked individually).
         """
-        new_watched = []
-        for cluster_job_state in self.watched:
+        now = time.time()
+        due, new_watched = self.status_check_policy.partition( self.watched, now )
+        batch_states = {}
+        if due:
+            try:
+                batch_states = self.get_job_states( due )
+            except:
+                log.exception( "Bulk job state check failed, falling back to checking jobs individually" )
+        for cluster_job_state in due:
+            cluster_job_state.batch_state = batch_states.get( cluster_job_state.job_id, None )
+            old_state = cluster_job_state.old_state
             new_cluster_job_state = self.check_watched_item(cluster_job_state)
             if new_cluster_job_state:
+                self.status_check_policy.record( new_cluster_job_state, new_cluster_job_state.old_state != old_state, now )
                 new_watched.append(new_cluster_job_state)
         self.watched = new_watched
 
+    def get_job_states( self, job_states ):
+        """
+        Return a dictionary of external job id to DRM state for as many of
+        `job_states` as can be determined with a single bulk query.  Runners
+        that cannot query in bulk should return an empty dictionary.
+        """
+        return {}
+
     # Subclasses should implement this unless they override check_watched_items all together.
     def check_watched_item(self):
         raise NotImplementedError()
@@ -12,7 +12,7 @@ import subprocess
 from Queue import Queue, Empty
 
 from galaxy import model
-from galaxy.jobs.runners import BaseJobRunner
+from galaxy.jobs.runners import BaseJobRunner, StatusCheckPolicy
 
 log = logging.getLogger( __name__ )
 
@@ -50,6 +50,9 @@ class ShellJobRunner( BaseJobRunner ):
         # to 'watched' and then manage the watched jobs.
         self.watched = []
         self.monitor_queue = Queue()
+        # Statuses are checked in bulk, but back off as the queue grows
+        self.status_check_policy = StatusCheckPolicy( app.config.cluster_job_status_min_interval,
+                                                      app.config.cluster_job_status_max_interval )
         self.monitor_thread = threading.Thread( target=self.monitor )
         self.monitor_thread.start()
         self.work_queue = Queue()
@@ -227,7 +230,7 @@ class ShellJobRunner( BaseJobRunner ):
             except:
                 log.exception('Uncaught exception checking job state:')
             # Sleep a bit before the next state check
-            time.sleep( 15 )
+            time.sleep( max( 15, self.status_check_policy.sleep_interval( len( self.watched ) ) ) )
             
     def check_watched_items( self ):
         """
@@ -8,7 +8,8 @@ import simplejson as json
 from Queue import Queue, Empty
 
 from galaxy import model
-from galaxy.jobs.runners import BaseJobRunner
+from galaxy.jobs.runners import BaseJobRunner, StatusCheckPolicy
+from galaxy.util.counters import Counters
 
 import pkg_resources
 
@@ -37,6 +38,30 @@ drmaa_state = {
     drmaa.JobState.FAILED: 'job finished, but failed',
 }
 
+# State codes as printed by the status commands of common DRMs (SGE/UGE
+# `qstat`, Torque/PBS `qstat`, SLURM `squeue -h -o '%i %t'`, LSF `bjobs`),
+# used to interpret the output of drmaa_bulk_status_command.  Codes not listed
+# here are ignored, and those jobs are checked individually through DRMAA.
+drm_status_codes = {
+    'qw': drmaa.JobState.QUEUED_ACTIVE,
+    'Q': drmaa.JobState.QUEUED_ACTIVE,
+    'W': drmaa.JobState.QUEUED_ACTIVE,
+    'PD': drmaa.JobState.QUEUED_ACTIVE,
+    'PEND': drmaa.JobState.QUEUED_ACTIVE,
+    'hqw': drmaa.JobState.USER_ON_HOLD,
+    'H': drmaa.JobState.USER_ON_HOLD,
+    'PSUSP': drmaa.JobState.USER_ON_HOLD,
+    'r': drmaa.JobState.RUNNING,
+    't': drmaa.JobState.RUNNING,
+    'R': drmaa.JobState.RUNNING,
+    'CG': drmaa.JobState.RUNNING,
+    'RUN': drmaa.JobState.RUNNING,
+    's': drmaa.JobState.USER_SUSPENDED,
+    'S': drmaa.JobState.SYSTEM_SUSPENDED,
+    'SSUSP': drmaa.JobState.SYSTEM_SUSPENDED,
+    'USUSP': drmaa.JobState.USER_SUSPENDED,
+}
+
 # The last four lines (following the last fi) will:
 #  - setup the env
 #  - move to the job wrapper's working directory
@@ -83,6 +108,9 @@ class DRMAAJobState( object ):
         self.efile = None
         self.ecfile = None
         self.runner_url = None
+        # Used by StatusCheckPolicy to decide when to next check the job
+        self.last_state_change = None
+        self.next_check = 0
 
 class DRMAAJobRunner( BaseJobRunner ):
     """
@@ -118,6 +146,12 @@ class DRMAAJobRunner( BaseJobRunner ):
         self.external_runJob_script = app.config.drmaa_external_runjob_script
         self.external_killJob_script = app.config.drmaa_external_killjob_script
         self.userid = None
+        # Poll the DRM less often for large queues and for jobs that have not
+        # changed state in a while
+        self.status_check_policy = StatusCheckPolicy( app.config.cluster_job_status_min_interval,
+                                                      app.config.cluster_job_status_max_interval )
+        self.bulk_status_command = app.config.drmaa_bulk_status_command
+        self.counters = Counters( 'bulk_status_checks', 'single_status_checks', 'bulk_status_failures' )
 
     def get_native_spec( self, url ):
         """Get any native DRM arguments specified by the site configuration"""
@@ -279,21 +313,67 @@ class DRMAAJobRunner( BaseJobRunner ):
             # Iterate over the list of watched jobs and check state
             self.check_watched_items()
             # Sleep a bit before the next state check
-            time.sleep( 1 )
-            
+            time.sleep( self.status_check_policy.sleep_interval( len( self.watched ) ) )
+
+    def get_job_states( self, drm_job_states ):
+        """
+        Run drmaa_bulk_status_command (if configured) and return a dictionary
+        of DRM job id to DRMAA job state for every job it lists.  The command
+        must print one job per line, with the job id in the first column and
+        the DRM's state code in the second.  Jobs not listed (e.g. because
+        they have left the queue) must be checked individually.
+        """
+        if not self.bulk_status_command:
+            return {}
+        self.counters.incr( 'bulk_status_checks' )
+        try:
+            p = subprocess.Popen( self.bulk_status_command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE )
+            stdout, stderr = p.communicate()
+            assert p.returncode == 0, stderr
+        except Exception, e:
+            self.counters.incr( 'bulk_status_failures' )
+            log.warning( "Bulk DRM status check failed, checking jobs individually: %s" % e )
+            return {}
+        return self.parse_job_states( stdout )
+
+    def parse_job_states( self, output ):
+        states = {}
+        for line in output.splitlines():
+            fields = line.split()
+            if len( fields ) < 2:
+                continue
+            # Torque prints ids as <id>.<server> while runJob may return
+            # either form, so index both
+            job_id = fields[0]
+            state = drm_status_codes.get( fields[1], None )
+            if state is not None:
+                states[ job_id ] = state
+                states[ job_id.split( '.' )[0] ] = state
+        return states
+
     def check_watched_items( self ):
         """
         Called by the monitor thread to look at each watched job and deal
-        with state changes.
+        with state changes.  Only jobs that are due to be checked according
+        to the StatusCheckPolicy are checked; their states are fetched with
+        a single bulk query where possible, falling back to one DRMAA call
+        per job for jobs missing from the bulk result.
         """
-        new_watched = []
-        for drm_job_state in self.watched:
+        now = time.time()
+        due, new_watched = self.status_check_policy.partition( self.watched, now )
+        bulk_states = {}
+        if due:
+            bulk_states = self.get_job_states( due )
+        for drm_job_state in due:
             job_id = drm_job_state.job_id
             galaxy_job_id = drm_job_state.job_wrapper.job_id
             old_state = drm_job_state.old_state
             try:
                 assert job_id not in ( None, 'None' ), 'Invalid job id: %s' % job_id
-                state = self.ds.jobStatus( job_id )
+                state = bulk_states.get( job_id, None )
+                if state is None:
+                    self.counters.incr( 'single_status_checks' )
+                    state = self.ds.jobStatus( job_id )
             # InternalException was reported to be necessary on some DRMs, but
             # this could cause failures to be detected as completion!  Please
             # report if you experience problems with this.
@@ -304,6 +384,7 @@ class DRMAAJobRunner( BaseJobRunner ):
                 continue
             except drmaa.DrmCommunicationException, e:
                 log.warning("(%s/%s) unable to communicate with DRM: %s" % ( galaxy_job_id, job_id, e ))
+                self.status_check_policy.record( drm_job_state, False, now )
                 new_watched.append( drm_job_state )
                 continue
             except Exception, e:
@@ -321,6 +402,7 @@ class DRMAAJobRunner( BaseJobRunner ):
             if state in ( drmaa.JobState.DONE, drmaa.JobState.FAILED ):
                 self.work_queue.put( ( 'finish', drm_job_state ) )
                 continue
+            self.status_check_policy.record( drm_job_state, state != old_state, now )
             drm_job_state.old_state = state
             new_watched.append( drm_job_state )
         # Replace the watch list with the updated version
@@ -5,7 +5,7 @@ from Queue import Queue, Empty
 from galaxy import model
 from galaxy.datatypes.data import nice_size
 from galaxy.util.bunch import Bunch
-from galaxy.jobs.runners import BaseJobRunner
+from galaxy.jobs.runners import BaseJobRunner, StatusCheckPolicy
 
 import pkg_resources
 
@@ -123,6 +123,9 @@ class PBSJobRunner( BaseJobRunner ):
         # to 'watched' and then manage the watched jobs.
         self.watched = []
         self.monitor_queue = Queue()
+        # Statuses are checked in bulk, but back off as the queue grows
+        self.status_check_policy = StatusCheckPolicy( app.config.cluster_job_status_min_interval,
+                                                      app.config.cluster_job_status_max_interval )
         # set the default server during startup
         self.default_pbs_server = None
         self.determine_pbs_server( 'pbs:///' )
@@ -365,7 +368,7 @@ class PBSJobRunner( BaseJobRunner ):
             except:
                 log.exception( "Uncaught exception checking jobs" )
             # Sleep a bit before the next state check
-            time.sleep( 1 )
+            time.sleep( self.status_check_policy.sleep_interval( len( self.watched ) ) )
             
     def check_watched_items( self ):
         """
@@ -69,6 +69,7 @@ class TaskedJobRunner( object ):
 
         # If we were able to get a command line, run the job.  ( must be passed to tasks )
         if command_line:
+            task_wrappers = []
             try:
                 job_wrapper.change_state( model.Job.states.RUNNING )
                 self.sa_session.flush()
@@ -80,20 +81,20 @@ class TaskedJobRunner( object ):
                     job_wrapper.change_state( model.Job.states.ERROR )
                     job_wrapper.fail("Job Splitting Failed, no match for '%s'" % parallelism)
                     return
-                tasks = splitter.do_split(job_wrapper)
                 # Not an option for now.  Task objects don't *do* anything 
                 # useful yet, but we'll want them tracked outside this thread 
                 # to do anything.
                 # if track_tasks_in_database:
-                task_wrappers = []
-                for task in tasks:
+                def queue_task(task):
+                    # Tasks are queued as the splitter creates them, so the
+                    # first tasks run while the rest of the input is split.
                     self.sa_session.add(task)
-                self.sa_session.flush()
-                # Must flush prior to the creation and queueing of task wrappers.
-                for task in tasks:
+                    # Must flush prior to the creation and queueing of task wrappers.
+                    self.sa_session.flush()
                     tw = TaskWrapper(task, job_wrapper.queue)
                     task_wrappers.append(tw)
                     self.app.job_manager.job_handler.dispatcher.put(tw)
+                splitter.do_split(job_wrapper, queue_task)
                 tasks_complete = False
                 count_complete = 0
                 sleep_time = 1
@@ -139,8 +140,15 @@ class TaskedJobRunner( object ):
                 log.debug('execution finished - beginning merge: %s' % command_line)
                 stdout,  stderr = splitter.do_merge(job_wrapper,  task_wrappers)
             except Exception:
-                job_wrapper.fail( "failure running job", exception=True )
                 log.exception("failure running job %d" % job_wrapper.job_id)
+                # Tasks are dispatched while the input is split, stop any
+                # that were before failing the job
+                if task_wrappers:
+                    try:
+                        self.cancel_job( job_wrapper, task_wrappers )
+                    except Exception:
+                        log.exception( "failure cancelling the tasks of job %d" % job_wrapper.job_id )
+                job_wrapper.fail( "failure running job", exception=True )
                 return
 
         #run the metadata setting script here
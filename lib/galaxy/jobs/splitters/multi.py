@@ -1,11 +1,46 @@
 import os, logging,  shutil
 import inspect
+import threading
+import time
 from galaxy import model, util
+from galaxy.util.counters import Counters
 
 
 log = logging.getLogger( __name__ )
 
-def do_split (job_wrapper):
+# Bytes split or merged and seconds spent doing it, per datatype extension
+SPLIT_BYTES = Counters()
+SPLIT_SECONDS = Counters()
+MERGE_BYTES = Counters()
+MERGE_SECONDS = Counters()
+
+def split_merge_stats():
+    """
+    Return { ext : { 'split_bytes', 'split_seconds', 'merge_bytes', 'merge_seconds' } }
+    for the datatypes split or merged since startup.
+    """
+    stats = {}
+    for prefix, counters in ( ( 'split_', SPLIT_BYTES ), ( 'merge_', MERGE_BYTES ) ):
+        for ext, value in counters.snapshot().items():
+            stats.setdefault( ext, {} )[ prefix + 'bytes' ] = value
+    for prefix, counters in ( ( 'split_', SPLIT_SECONDS ), ( 'merge_', MERGE_SECONDS ) ):
+        for ext, value in counters.snapshot().items():
+            stats.setdefault( ext, {} )[ prefix + 'seconds' ] = value
+    return stats
+
+def _record_throughput( action, byte_counters, second_counters, ext, nbytes, seconds ):
+    byte_counters.incr( ext, nbytes )
+    second_counters.incr( ext, seconds )
+    log.debug( '%s %i bytes of %s in %0.3f seconds (%0.1f MB/s)'
+               % ( action, nbytes, ext, seconds, nbytes / ( 1048576.0 * max( seconds, 0.001 ) ) ) )
+
+def do_split (job_wrapper, task_callback=None):
+    """
+    Split the inputs of job_wrapper's job into task directories and return
+    the list of tasks.  If task_callback is given it is called with each task
+    as soon as its inputs are known, so tasks can start while later parts of
+    the input are still being split.
+    """
     parent_job = job_wrapper.get_job()
     working_directory = os.path.abspath(job_wrapper.working_directory)
 
@@ -27,6 +62,12 @@ def do_split (job_wrapper):
     if len(illegal_inputs) > 0:
         raise Exception("Inputs have conflicting parallelism attributes: %s" % str( illegal_inputs ))
 
+    # shared inputs are soft linked into each task directory as it is created
+    shared_files = []
+    for input in parent_job.input_datasets:
+        if input and input.name in shared_inputs:
+            shared_files.extend(job_wrapper.get_input_dataset_fnames(input.dataset))
+
     subdir_index = [0] # use a list to get around Python 2.x lame closure support
     task_dirs = []
     def get_new_working_directory_name():
@@ -34,6 +75,8 @@ def do_split (job_wrapper):
         subdir_index[0] = subdir_index[0] + 1
         if not os.path.exists(dir):
             os.makedirs(dir)
+        for file in shared_files:
+            os.symlink(file, os.path.join(dir,  os.path.basename(file)))
         task_dirs.append(dir)
         return dir
 
@@ -67,30 +110,56 @@ def do_split (job_wrapper):
             input_datasets.append(input.dataset)
 
     input_type = type_to_input_map.keys()[0]
-    # DBTODO execute an external task to do the splitting, this should happen at refactor.
-    # If the number of tasks is sufficiently high, we can use it to calculate job completion % and give a running status.
-    try:
-        input_type.split(input_datasets, get_new_working_directory_name, parallel_settings)
-    except AttributeError:
-        log_error = "The type '%s' does not define a method for splitting files" % str(input_type)
-        log.error(log_error)
-        raise
-    log.debug('do_split created %d parts' % len(task_dirs))
-    # next, after we know how many divisions there are, add the shared inputs via soft links
-    for input in parent_job.input_datasets:
-        if input and input.name in shared_inputs:
-            names = job_wrapper.get_input_dataset_fnames(input.dataset)
-            for dir in task_dirs:
-                for file in names:
-                    os.symlink(file, os.path.join(dir,  os.path.basename(file)))
     tasks = []
     prepare_files = os.path.join(util.galaxy_directory(), 'extract_dataset_parts.sh') + ' %s'
-    for dir in task_dirs:
+    def add_task(dir):
         task = model.Task(parent_job, dir, prepare_files % dir)
         tasks.append(task)
+        if task_callback is not None:
+            task_callback(task)
+
+    ext = getattr(input_type, 'file_ext', input_type.__class__.__name__)
+    split_size = sum([os.path.getsize(dataset.file_name) for dataset in input_datasets])
+    start = time.time()
+    # Datatypes that can find record boundaries in their input are split
+    # into byte ranges, which the tasks copy out of the input themselves.
+    # Splitting only needs to seek to each boundary, so each task is queued
+    # as soon as its range is known.
+    split_ranges = getattr(input_type, 'split_ranges', None)
+    ranges = None
+    if split_ranges is not None:
+        ranges = split_ranges(input_datasets, parallel_settings)
+    if ranges is not None:
+        for range_start, range_end in ranges:
+            dir = get_new_working_directory_name()
+            input_type.write_range_split_info(input_datasets[0].file_name, dir, range_start, range_end)
+            add_task(dir)
+    else:
+        # DBTODO execute an external task to do the splitting, this should happen at refactor.
+        # If the number of tasks is sufficiently high, we can use it to calculate job completion % and give a running status.
+        try:
+            input_type.split(input_datasets, get_new_working_directory_name, parallel_settings)
+        except AttributeError:
+            log_error = "The type '%s' does not define a method for splitting files" % str(input_type)
+            log.error(log_error)
+            raise
+        for dir in task_dirs:
+            add_task(dir)
+    _record_throughput('split', SPLIT_BYTES, SPLIT_SECONDS, ext, split_size, time.time() - start)
+    log.debug('do_split created %d parts' % len(task_dirs))
     return tasks
 
 
+def merge_output(output_type, output_files, output_file_name, extra_merge_args):
+    """Merge output_files into output_file_name, recording the merge throughput."""
+    ext = getattr(output_type, 'file_ext', output_type.__class__.__name__)
+    start = time.time()
+    output_type.merge(output_files, output_file_name, **extra_merge_args)
+    merge_size = 0
+    if os.path.exists(output_file_name):
+        merge_size = os.path.getsize(output_file_name)
+    _record_throughput('merged', MERGE_BYTES, MERGE_SECONDS, ext, merge_size, time.time() - start)
+
 def do_merge( job_wrapper,  task_wrappers):
     parallel_settings = job_wrapper.get_parallelism().attributes
     # Syntax: merge_outputs="export" pickone_outputs="genomesize"
@@ -120,6 +189,7 @@ def do_merge( job_wrapper,  task_wrappers):
         # TODO: Output datasets can be very complex. This doesn't handle metadata files
         outputs = job_wrapper.get_output_hdas_and_fnames()
         pickone_done = []
+        merges = []
         task_dirs = [os.path.join(working_directory, x) for x in os.listdir(working_directory) if x.startswith('task_')]
         task_dirs.sort(key = lambda x: int(x.split('task_')[-1]))
         for output in outputs:
@@ -143,8 +213,7 @@ def do_merge( job_wrapper,  task_wrappers):
                     extra_merge_args = {}
                     if "output_dataset" in extra_merge_arg_names:
                         extra_merge_args["output_dataset"] = output_dataset
-                    output_type.merge(output_files, output_file_name, **extra_merge_args)
-                    log.debug('merge finished: %s' % output_file_name)
+                    merges.append((output_type, output_files, output_file_name, extra_merge_args))
                 else:
                     msg = 'nothing to merge for %s (expected %i files)' \
                           % (output_file_name, len(task_dirs))
@@ -160,6 +229,25 @@ def do_merge( job_wrapper,  task_wrappers):
                 log_error = "The output '%s' does not define a method for implementing parallelism" % output
                 log.exception(log_error)
                 raise Exception(log_error)
+        # Each output is written by its own merge, so run them in parallel
+        merge_errors = []
+        def run_merge(merge):
+            try:
+                merge_output(*merge)
+                log.debug('merge finished: %s' % merge[2])
+            except Exception, e:
+                log.exception('Error merging %s' % merge[2])
+                merge_errors.append(e)
+        if len(merges) == 1:
+            run_merge(merges[0])
+        else:
+            threads = [threading.Thread(target=run_merge, args=(merge,)) for merge in merges]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        if merge_errors:
+            raise merge_errors[0]
     except Exception, e:
         stdout = 'Error merging files';
         log.exception( stdout )
@@ -20,7 +20,7 @@ from galaxy.web.form_builder import (AddressField, CheckboxField, PasswordField,
                                     WorkflowField, WorkflowMappingField, HistoryField)
 from galaxy.model.item_attrs import UsesAnnotations, APIItem
 from sqlalchemy.orm import object_session
-from sqlalchemy.sql.expression import func
+from sqlalchemy.sql.expression import func, select, and_, not_
 
 log = logging.getLogger( __name__ )
 
@@ -87,17 +87,73 @@ class User( object, APIItem ):
     @property
     def nice_total_disk_usage( self ):
         return self.get_disk_usage( nice_size=True )
+    def adjust_total_disk_usage( self, amount ):
+        """
+        Add `amount` (which may be negative) to the user's stored disk usage.
+        This is done with a single UPDATE statement rather than a
+        read-modify-write of the attribute, so that concurrent adjustments
+        (e.g. jobs finishing in several handlers) are not lost.
+        """
+        if not amount:
+            return
+        db_session = object_session( self )
+        if db_session is None or self.id is None:
+            self.total_disk_usage += amount
+            return
+        table = User.table
+        db_session.execute( table.update( table.c.id == self.id,
+                                          values={ table.c.disk_usage: func.coalesce( table.c.disk_usage, 0 ) + amount } ) )
+        # Reload on next access
+        db_session.expire( self, [ 'disk_usage' ] )
+    @staticmethod
+    def disk_usage_query( user_ids ):
+        """
+        Return a statement selecting ( user_id, disk usage ) for each of
+        `user_ids` that has any data: the total size of the distinct,
+        non-purged datasets in the users' non-purged histories, excluding
+        datasets that are also in a data library.  Users without data are
+        not included in the results.
+        """
+        history = History.table
+        hda = HistoryDatasetAssociation.table
+        dataset = Dataset.table
+        ldda = LibraryDatasetDatasetAssociation.table
+        user_datasets = select( [ history.c.user_id, dataset.c.id, dataset.c.total_size ],
+                                and_( history.c.user_id.in_( user_ids ),
+                                      history.c.purged == False,
+                                      hda.c.history_id == history.c.id,
+                                      hda.c.purged == False,
+                                      hda.c.dataset_id == dataset.c.id,
+                                      dataset.c.purged == False,
+                                      not_( dataset.c.id.in_( select( [ ldda.c.dataset_id ], ldda.c.dataset_id != None ) ) ) ),
+                                distinct=True ).alias( 'user_datasets' )
+        return select( [ user_datasets.c.user_id, func.coalesce( func.sum( user_datasets.c.total_size ), 0 ) ] ) \
+                .group_by( user_datasets.c.user_id )
     def calculate_disk_usage( self ):
-        dataset_ids = []
-        total = 0
-        # this can be a huge number and can run out of memory, so we avoid the mappers
+        """
+        Calculate (but do not store) the user's disk usage from scratch with
+        a single aggregate query.
+        """
         db_session = object_session( self )
-        for history in db_session.query( History ).enable_eagerloads( False ).filter_by( user_id=self.id, purged=False ).yield_per( 1000 ):
-            for hda in db_session.query( HistoryDatasetAssociation ).enable_eagerloads( False ).filter_by( history_id=history.id, purged=False ).yield_per( 1000 ):
-                if not hda.dataset.id in dataset_ids and not hda.dataset.purged and not hda.dataset.library_associations:
-                    dataset_ids.append( hda.dataset.id )
-                    total += hda.dataset.get_total_size()
-        return total
+        # Datasets created before total_size existed have it computed and
+        # stored on demand, as in Dataset.get_total_size()
+        history = History.table
+        hda = HistoryDatasetAssociation.table
+        unsized = select( [ hda.c.dataset_id ],
+                          and_( history.c.user_id == self.id,
+                                history.c.purged == False,
+                                hda.c.history_id == history.c.id,
+                                hda.c.purged == False ) )
+        for dataset in db_session.query( Dataset ).enable_eagerloads( False ) \
+                                 .filter( and_( Dataset.table.c.id.in_( unsized ),
+                                                Dataset.table.c.total_size == None,
+                                                Dataset.table.c.file_size != None,
+                                                Dataset.table.c.purged == False ) ):
+            dataset.get_total_size()
+        row = db_session.execute( User.disk_usage_query( [ self.id ] ) ).fetchone()
+        if row is None:
+            return 0
+        return int( row[1] )
 
 class Job( object ):
     """
@@ -621,12 +677,39 @@ class History( object, UsesAnnotations ):
             if set_hid:
                 dataset.hid = self._next_hid()
         if quota and self.user:
-            self.user.total_disk_usage += dataset.quota_amount( self.user )
+            self.user.adjust_total_disk_usage( dataset.quota_amount( self.user ) )
         dataset.history = self
         if genome_build not in [None, '?']:
             self.genome_build = genome_build
         self.datasets.append( dataset )
         return dataset
+    def add_datasets( self, sa_session, datasets, genome_build=None, set_hid=True, quota=True ):
+        """
+        Add many HistoryDatasetAssociations to the history at once.  This is
+        `add_dataset` for each of them, except that the last hid is looked up
+        once, with a query instead of by loading all of the history's
+        datasets, and the user's disk usage is adjusted once.
+        """
+        if set_hid:
+            if self.id is None or 'datasets' in self.__dict__:
+                # New history, or its datasets are already loaded
+                hid = self._next_hid()
+            else:
+                hid = ( sa_session.query( func.max( HistoryDatasetAssociation.hid ) )
+                                  .filter( HistoryDatasetAssociation.history_id == self.id ).scalar() or 0 ) + 1
+        disk_usage = 0
+        for dataset in datasets:
+            if set_hid:
+                dataset.hid = hid
+                hid += 1
+            if quota and self.user:
+                disk_usage += dataset.quota_amount( self.user )
+            dataset.history = self
+        if disk_usage:
+            self.user.adjust_total_disk_usage( disk_usage )
+        if genome_build not in [None, '?']:
+            self.genome_build = genome_build
+        return datasets
     def copy( self, name=None, target_user=None, activatable=False ):
         # Create new history.
         if not name:
@@ -948,12 +1031,57 @@ class Dataset( object ):
             return self.total_size
         return 0
     def set_total_size( self ):
-        if self.file_size is None:
-            self.set_size()
-        self.total_size = self.file_size or 0
-        if self.object_store.exists(self, extra_dir=self._extra_files_path or "dataset_%d_files" % self.id, dir_only=True):
-            for root, dirs, files in os.walk( self.extra_files_path ):
-                self.total_size += sum( [ os.path.getsize( os.path.join( root, file ) ) for file in files ] )
+        Dataset.set_total_sizes( [ self ] )
+    @staticmethod
+    def get_sizes( datasets ):
+        """
+        Return a dictionary mapping the id of each of `datasets` to its size,
+        as `get_size` would, asking the object store for the sizes of all
+        those without a recorded file_size at once.
+        """
+        sizes = {}
+        unsized = []
+        for dataset in datasets:
+            if dataset.file_size:
+                sizes[ dataset.id ] = dataset.file_size
+            elif dataset.external_filename:
+                sizes[ dataset.id ] = dataset._calculate_size()
+            else:
+                unsized.append( dataset )
+        if len( unsized ) == 1:
+            # Batch lookups list whole directories, only worth it for several
+            sizes[ unsized[0].id ] = unsized[0]._calculate_size()
+        elif unsized:
+            sizes.update( Dataset.object_store.size_many( unsized ) )
+        return sizes
+    @staticmethod
+    def set_total_sizes( datasets ):
+        """
+        Set the file_size (if unset) and total_size of each of `datasets`,
+        asking the object store about all of them at once.
+        """
+        unsized = [ dataset for dataset in datasets if dataset.file_size is None ]
+        sizes = Dataset.get_sizes( unsized )
+        for dataset in unsized:
+            dataset.file_size = sizes[ dataset.id ]
+        # Extra files directories are named after their dataset unless set
+        # explicitly, so only datasets sharing one can be checked together
+        by_extra_dir = {}
+        for dataset in datasets:
+            by_extra_dir.setdefault( dataset._extra_files_path or "dataset_%d_files" % dataset.id, [] ).append( dataset )
+        for extra_dir, extra_dir_datasets in by_extra_dir.items():
+            if len( extra_dir_datasets ) == 1:
+                # The usual case of a dataset with its own extra files
+                # directory, stat it rather than listing its parent directory
+                dataset = extra_dir_datasets[0]
+                exists = { dataset.id: Dataset.object_store.exists( dataset, extra_dir=extra_dir, dir_only=True ) }
+            else:
+                exists = Dataset.object_store.exists_many( extra_dir_datasets, extra_dir=extra_dir, dir_only=True )
+            for dataset in extra_dir_datasets:
+                dataset.total_size = dataset.file_size or 0
+                if exists[ dataset.id ]:
+                    for root, dirs, files in os.walk( dataset.extra_files_path ):
+                        dataset.total_size += sum( [ os.path.getsize( os.path.join( root, file ) ) for file in files ] )
     def has_data( self ):
         """Detects whether there is any data"""
         return self.get_size() > 0
@@ -1508,11 +1636,14 @@ class HistoryDatasetAssociation( DatasetInstance ):
         for child in self.children:
             rval += child.get_disk_usage( user )
         return rval
-    def get_api_value( self, view='collection' ):
+    def get_api_value( self, view='collection', file_size=None ):
         # Since this class is a proxy to rather complex attributes we want to
         # display in other objects, we can't use the simpler method used by
         # other model classes.
+        # `file_size` may be given if already known, e.g. from Dataset.get_sizes()
         hda = self
+        if file_size is None:
+            file_size = hda.get_size()
         rval = dict( id = hda.id,
                      model_class = self.__class__.__name__,
                      name = hda.name,
@@ -1520,7 +1651,7 @@ class HistoryDatasetAssociation( DatasetInstance ):
                      purged = hda.purged,
                      visible = hda.visible,
                      state = hda.state,
-                     file_size = int( hda.get_size() ),
+                     file_size = int( file_size ),
                      data_type = hda.ext,
                      genome_build = hda.dbkey,
                      misc_info = hda.info,
@@ -2118,10 +2249,72 @@ class StoredWorkflowMenuEntry( object ):
         self.order_index = None
 
 class WorkflowInvocation( object ):
-    pass
+    """
+    A run of a workflow.  Its steps are recorded when the workflow is run,
+    and their jobs created in the background by the workflow scheduler of the
+    Galaxy process named by `handler` (see galaxy.workflow.scheduler).
+    """
+    states = Bunch( NEW = 'new',
+                    SCHEDULED = 'scheduled',
+                    FAILED = 'failed' )
+    def __init__( self, workflow=None, history=None, user=None, handler=None, params=None ):
+        self.workflow = workflow
+        self.history = history
+        self.user = user
+        self.handler = handler
+        self.params = params
+        self.state = WorkflowInvocation.states.NEW
+        self.message = None
+    @property
+    def scheduled_steps( self ):
+        return [ step for step in self.steps if step.state == WorkflowInvocationStep.states.SCHEDULED ]
+    def get_api_value( self, view='collection', value_mapper = None ):
+        if value_mapper is None:
+            value_mapper = {}
+        rval = dict( id = self.id,
+                     workflow_id = self.workflow_id,
+                     history_id = self.history_id,
+                     state = self.state,
+                     steps_total = len( self.steps ),
+                     steps_scheduled = len( self.scheduled_steps ) )
+        if view == 'element':
+            rval[ 'message' ] = self.message
+            rval[ 'steps' ] = [ step.get_api_value( view=view, value_mapper=value_mapper ) for step in self.steps ]
+        for key in ( 'id', 'workflow_id', 'history_id' ):
+            if key in value_mapper:
+                rval[ key ] = value_mapper[ key ]( rval[ key ] )
+        return rval
 
 class WorkflowInvocationStep( object ):
-    pass
+    """
+    A step of a workflow invocation: the runtime state of a tool step until
+    the scheduler creates its job, then the ids of the datasets it outputs.
+    """
+    states = Bunch( NEW = 'new',
+                    SCHEDULED = 'scheduled' )
+    def __init__( self, workflow_invocation=None, workflow_step=None, tool_state=None ):
+        self.workflow_invocation = workflow_invocation
+        self.workflow_step = workflow_step
+        self.tool_state = tool_state
+        self.job = None
+        self.outputs = None
+        self.state = WorkflowInvocationStep.states.NEW
+    def get_api_value( self, view='collection', value_mapper = None ):
+        if value_mapper is None:
+            value_mapper = {}
+        encode = value_mapper.get( 'id', lambda id: id )
+        outputs = {}
+        for name, hda_id in ( self.outputs or {} ).items():
+            outputs[ name ] = encode( hda_id )
+        rval = dict( id = encode( self.id ),
+                     workflow_step_id = encode( self.workflow_step_id ),
+                     order_index = self.workflow_step.order_index,
+                     state = self.state,
+                     job_id = None,
+                     outputs = outputs )
+        if self.job_id is not None:
+            rval[ 'job_id' ] = encode( self.job_id )
+        return rval
 
 class MetadataFile( object ):
     def __init__( self, dataset = None, name = None ):
@@ -689,7 +689,13 @@ WorkflowInvocation.table = Table( "workflow_invocation", metadata,
     Column( "id", Integer, primary_key=True ),
     Column( "create_time", DateTime, default=now ),
     Column( "update_time", DateTime, default=now, onupdate=now ),
-    Column( "workflow_id", Integer, ForeignKey( "workflow.id" ), index=True, nullable=False )
+    Column( "workflow_id", Integer, ForeignKey( "workflow.id" ), index=True, nullable=False ),
+    Column( "history_id", Integer, ForeignKey( "history.id" ), index=True, nullable=True ),
+    Column( "user_id", Integer, ForeignKey( "galaxy_user.id" ), index=True, nullable=True ),
+    Column( "state", String( 64 ), index=True ),
+    Column( "handler", TrimmedString( 255 ), index=True ),
+    Column( "params", JSONType ),
+    Column( "message", TEXT )
     )
 
 WorkflowInvocationStep.table = Table( "workflow_invocation_step", metadata,
@@ -698,7 +704,10 @@ WorkflowInvocationStep.table = Table( "workflow_invocation_step", metadata,
     Column( "update_time", DateTime, default=now, onupdate=now ),
     Column( "workflow_invocation_id", Integer, ForeignKey( "workflow_invocation.id" ), index=True, nullable=False ),
     Column( "workflow_step_id",  Integer, ForeignKey( "workflow_step.id" ), index=True, nullable=False ),
-    Column( "job_id",  Integer, ForeignKey( "job.id" ), index=True, nullable=True )
+    Column( "job_id",  Integer, ForeignKey( "job.id" ), index=True, nullable=True ),
+    Column( "state", String( 64 ) ),
+    Column( "tool_state", TEXT ),
+    Column( "outputs", JSONType )
     )
 
 StoredWorkflowUserShareAssociation.table = Table( "stored_workflow_user_share_connection", metadata,
@@ -1726,7 +1735,9 @@ assign_mapper( context, StoredWorkflowMenuEntry, StoredWorkflowMenuEntry.table,
 assign_mapper( context, WorkflowInvocation, WorkflowInvocation.table,
     properties=dict(
         steps=relation( WorkflowInvocationStep, backref='workflow_invocation', lazy=False ),
-        workflow=relation( Workflow ) ) )
+        workflow=relation( Workflow ),
+        history=relation( History ),
+        user=relation( User ) ) )
 
 assign_mapper( context, WorkflowInvocationStep, WorkflowInvocationStep.table,
     properties=dict(
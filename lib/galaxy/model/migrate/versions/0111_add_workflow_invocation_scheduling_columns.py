@@ -0,0 +1,79 @@
+"""
+Add the columns the workflow scheduler needs to the workflow_invocation and
+workflow_invocation_step tables.
+"""
+
+from sqlalchemy import *
+from sqlalchemy.orm import *
+from migrate import *
+from migrate.changeset import *
+
+import logging
+log = logging.getLogger( __name__ )
+
+# Need our custom types, but don't import anything else from model
+from galaxy.model.custom_types import *
+
+metadata = MetaData( migrate_engine )
+
+def get_invocation_columns():
+    return [ Column( "history_id", Integer, ForeignKey( "history.id" ), index=True, nullable=True ),
+             Column( "user_id", Integer, ForeignKey( "galaxy_user.id" ), index=True, nullable=True ),
+             Column( "state", String( 64 ), index=True ),
+             Column( "handler", TrimmedString( 255 ), index=True ),
+             Column( "params", JSONType ),
+             Column( "message", TEXT ) ]
+
+def get_invocation_step_columns():
+    return [ Column( "state", String( 64 ) ),
+             Column( "tool_state", TEXT ),
+             Column( "outputs", JSONType ) ]
+
+def display_migration_details():
+    print ""
+    print "This migration script adds the state, handler, history and runtime parameter"
+    print "columns needed to schedule workflow invocations in the background."
+
+def add_columns( table_name, columns ):
+    try:
+        table = Table( table_name, metadata, autoload=True )
+    except NoSuchTableError:
+        log.debug( "Failed loading table %s" % table_name )
+        return
+    for col in columns:
+        try:
+            col.create( table )
+            assert col is getattr( table.c, col.name )
+        except Exception, e:
+            print str(e)
+            log.error( "Adding column '%s' to %s table failed: %s" % ( col.name, table_name, str( e ) ) )
+
+def drop_columns( table_name, columns ):
+    try:
+        table = Table( table_name, metadata, autoload=True )
+    except NoSuchTableError:
+        log.debug( "Failed loading table %s" % table_name )
+        return
+    for col in columns:
+        try:
+            getattr( table.c, col.name ).drop()
+        except Exception, e:
+            log.debug( "Dropping '%s' column from %s table failed: %s" % ( col.name, table_name, str( e ) ) )
+
+def upgrade():
+    print __doc__
+    metadata.reflect()
+    add_columns( "workflow_invocation", get_invocation_columns() )
+    add_columns( "workflow_invocation_step", get_invocation_step_columns() )
+    # Invocations run before this migration had all of their steps run
+    # while they were submitted
+    try:
+        migrate_engine.execute( "UPDATE workflow_invocation SET state = 'scheduled'" )
+        migrate_engine.execute( "UPDATE workflow_invocation_step SET state = 'scheduled'" )
+    except Exception, e:
+        log.error( "Setting the state of existing workflow invocations failed: %s" % str( e ) )
+
+def downgrade():
+    metadata.reflect()
+    drop_columns( "workflow_invocation_step", get_invocation_step_columns() )
+    drop_columns( "workflow_invocation", get_invocation_columns() )
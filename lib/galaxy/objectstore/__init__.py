@@ -6,25 +6,32 @@ tools
 
 import os
 import sys
+import errno
 import time
 import random
 import shutil
 import statvfs
+import tempfile
 import logging
 import threading
-import subprocess
+from Queue import Queue, Empty
 from datetime import datetime
 
 from galaxy import util
 from galaxy.jobs import Sleeper
+from galaxy.util.counters import Counters
+from galaxy.util.lrucache import LRUCache
+from galaxy.util.json import to_json_string, from_json_string
 from galaxy.model import directory_hash_id
 from galaxy.exceptions import ObjectNotFound, ObjectInvalid
+from galaxy.objectstore.cache_index import CacheIndex
+from galaxy.objectstore.placement import BackendState, load_policy
 
 from sqlalchemy.orm import object_session
 
 if sys.version_info >= (2, 6):
-    import multiprocessing
     from galaxy.objectstore.s3_multipart_upload import multipart_upload
+    from galaxy.objectstore.s3_multipart_download import multipart_download, read_range
     import boto
     from boto.s3.key import Key
     from boto.s3.connection import S3Connection
@@ -33,6 +40,73 @@ if sys.version_info >= (2, 6):
 log = logging.getLogger( __name__ )
 logging.getLogger('boto').setLevel(logging.INFO) # Otherwise boto is quite noisy
 
+# Number of resolved object paths remembered by each DiskObjectStore
+PATH_CACHE_SIZE = 100000
+
+# Created in a DiskObjectStore's file_path by scripts/migrate_flat_datasets.py
+# once no objects are left in the legacy flat layout
+HASHED_ONLY_MARKER = '.hashed_only'
+
+# stat() calls made by DiskObjectStores resolving object paths, in total and
+# in the current thread (i.e. during the current web request)
+STAT_COUNTS = Counters('stats', 'directory_scans', 'path_cache_hits', 'path_cache_misses')
+_thread_stats = threading.local()
+
+def reset_request_stat_count():
+    """ Reset the number of stat() calls counted for the current thread """
+    _thread_stats.count = 0
+
+def request_stat_count():
+    """ Return the number of stat() calls made by the current thread since the last reset """
+    return getattr(_thread_stats, 'count', 0)
+
+def _stat_exists(path):
+    STAT_COUNTS.incr('stats')
+    _thread_stats.count = getattr(_thread_stats, 'count', 0) + 1
+    return os.path.exists(path)
+
+def _list_dir(path):
+    """ Return the set of names in the directory `path`, empty if it does not exist """
+    STAT_COUNTS.incr('directory_scans')
+    _thread_stats.count = getattr(_thread_stats, 'count', 0) + 1
+    try:
+        return set(os.listdir(path))
+    except OSError:
+        return set()
+
+# Seconds a cached object that is never explicitly updated (e.g. written in
+# place by a job) must go unmodified before CachingObjectStore writes it back
+WRITE_BACK_DELAY = 300
+
+# Seconds between CachingObjectStore's checks for such objects
+WRITE_BACK_SWEEP_INTERVAL = 60
+
+# Directory in CachingObjectStore's cache with a marker file for each cached
+# object not written back yet, shared by all processes using the cache
+DIRTY_MARKER_DIR = '.dirty'
+
+# Journal of the objects to write back kept by earlier versions, read once to
+# create their markers
+WRITE_BACK_JOURNAL = '.write_back_journal'
+
+# Seconds HierarchicalObjectStore trusts a backend's usage percentage for
+USAGE_CHECK_INTERVAL = 60
+
+# Keyword arguments of create() hinting where a new object should be placed,
+# used by stores choosing between backends and ignored by the others
+PLACEMENT_HINTS = ('size_hint', 'destination')
+
+def _pop_placement_hints(kwargs):
+    """ Remove the placement hints from `kwargs`, returning them in a dictionary """
+    return dict([(name, kwargs.pop(name)) for name in PLACEMENT_HINTS if name in kwargs])
+
+# Seconds between S3ObjectStore's checks of its cache size
+CACHE_CHECK_INTERVAL = 30
+
+# Seconds between S3ObjectStore's walks of its cache directory, to catch
+# files changed without its knowledge
+CACHE_RECONCILE_INTERVAL = 6 * 60 * 60
+
 
 class ObjectStore(object):
     """
@@ -96,6 +170,15 @@ class ObjectStore(object):
         no content. This method will create a proper directory structure for
         the file if the directory does not already exist.
         See `exists` method for the description of other fields.
+
+        Stores that choose where to place new objects also accept the
+        `PLACEMENT_HINTS` keyword arguments, which other stores ignore:
+
+        :type size_hint: int
+        :param size_hint: The expected size of the object in bytes
+
+        :type destination: string
+        :param destination: The job runner URL of the job creating the object
         """
         raise NotImplementedError()
 
@@ -150,6 +233,42 @@ class ObjectStore(object):
         """
         raise NotImplementedError()
 
+    def exists_many(self, objs, **kwargs):
+        """
+        Return a dictionary mapping the id of each object in `objs` to True
+        if the object exists in this store, False otherwise. Stores that can
+        check many objects at once (e.g. by listing a directory rather than
+        stat'ing each file) override this, so callers checking more than a
+        few objects should use it rather than calling `exists` in a loop.
+        `objs` must all be of the same kind (e.g. all Datasets), since they
+        are identified by id.
+        See `exists` method for the description of the fields.
+        """
+        return dict([(obj.id, self.exists(obj, **kwargs)) for obj in objs])
+
+    def size_many(self, objs, **kwargs):
+        """
+        Return a dictionary mapping the id of each object in `objs` to its
+        size, or 0 if the object does not exist.
+        See `exists_many` and `size` methods for the description of the fields.
+        """
+        return dict([(obj.id, self.size(obj, **kwargs)) for obj in objs])
+
+    def get_filenames_many(self, objs, **kwargs):
+        """
+        Return a dictionary mapping the id of each object in `objs` to its
+        filename, as returned by `get_filename`, or None if `get_filename`
+        raises `ObjectNotFound` for the object.
+        See `exists_many` and `get_filename` methods for the description of the fields.
+        """
+        filenames = {}
+        for obj in objs:
+            try:
+                filenames[obj.id] = self.get_filename(obj, **kwargs)
+            except ObjectNotFound:
+                filenames[obj.id] = None
+        return filenames
+
     def update_from_file(self, obj, base_dir=None, extra_dir=None, extra_dir_at_root=False, alt_name=None, file_name=None, create=False):
         """
         Inform the store that the file associated with the object has been
@@ -182,6 +301,29 @@ class ObjectStore(object):
         """
         raise NotImplementedError()
 
+    def get_store_free_bytes(self):
+        """
+        Return the number of bytes that can still be stored, or None if the
+        store cannot tell
+        """
+        return None
+
+    def prefetch(self, obj, **kwargs):
+        """
+        Hint that the object identified by `obj` will be read soon, e.g. by a
+        job that is about to run. Stores with a slow backend may start copying
+        it somewhere faster.
+        See `exists` method for the description of the fields.
+        """
+        pass
+
+    def stats(self):
+        """
+        Return a dictionary of counters describing how the store's caches and
+        backends are used, for logging or reporting.
+        """
+        return {}
+
     ## def get_staging_command( id ):
     ##     """
     ##     Return a shell command that can be prepended to the job script to stage the
@@ -206,6 +348,35 @@ class DiskObjectStore(ObjectStore):
     >>> s.exists(obj)
     True
     >>> assert s.get_filename(obj) == file_path + '/000/dataset_1.dat'
+
+    Objects stored by old releases in the flat layout (e.g.
+    /files/dataset_10.dat rather than /files/000/dataset_10.dat) are still
+    found.  The layout of each object is remembered, so only the first
+    lookup of an object needs to stat both paths:
+
+    >>> obj = Bunch(id=2)
+    >>> open(file_path + '/dataset_2.dat', 'w').close()
+    >>> reset_request_stat_count()
+    >>> assert s.get_filename(obj) == file_path + '/dataset_2.dat'
+    >>> s.exists(obj), s.size(obj), request_stat_count()
+    (True, 0, 2)
+    >>> s.delete(obj)
+    True
+    >>> s.exists(obj)
+    False
+
+    Many objects can be checked with one listing of each directory they may
+    be in:
+
+    >>> objs = [Bunch(id=1), Bunch(id=2), Bunch(id=3)]
+    >>> open(s.get_filename(objs[0]), 'w').write('data')
+    >>> reset_request_stat_count()
+    >>> sorted(s.exists_many(objs).items()), request_stat_count()
+    ([(1, True), (2, False), (3, False)], 2)
+    >>> sorted(s.size_many(objs).items())
+    [(1, 4), (2, 0), (3, 0)]
+    >>> import shutil
+    >>> shutil.rmtree(file_path)
     """
     def __init__(self, config, file_path=None, extra_dirs=None):
         super(DiskObjectStore, self).__init__()
@@ -215,16 +386,75 @@ class DiskObjectStore(ObjectStore):
         self.extra_dirs['temp'] = config.new_file_path
         if extra_dirs is not None:
             self.extra_dirs.update( extra_dirs )
+        # If every object has been moved to the hashed layout there is no
+        # need to look for objects in the flat layout
+        self.hashed_only = os.path.exists(os.path.join(self.file_path, HASHED_ONLY_MARKER))
+        # Maps the flat layout path of an object to True if the object is
+        # stored in the flat layout and False if it is stored in the hashed one
+        self.old_style_cache = LRUCache(PATH_CACHE_SIZE)
 
     def _get_filename(self, obj, base_dir=None, dir_only=False, extra_dir=None, extra_dir_at_root=False, alt_name=None):
         """Class method that returns the absolute path for the file corresponding
         to the `obj`.id regardless of whether the file exists.
         """
-        path = self._construct_path(obj, base_dir=base_dir, dir_only=dir_only, extra_dir=extra_dir, extra_dir_at_root=extra_dir_at_root, alt_name=alt_name, old_style=True)
-        # For backward compatibility, check the old style root path first; otherwise,
-        # construct hashed path
-        if not os.path.exists(path):
-            return self._construct_path(obj, base_dir=base_dir, dir_only=dir_only, extra_dir=extra_dir, extra_dir_at_root=extra_dir_at_root, alt_name=alt_name)
+        return self._resolve_path(obj, base_dir=base_dir, dir_only=dir_only, extra_dir=extra_dir, extra_dir_at_root=extra_dir_at_root, alt_name=alt_name)
+
+    def _resolve_path(self, obj, **kwargs):
+        """ Return the path of the object identified by `obj`.id, in the flat
+        layout if the object is stored there and in the hashed layout otherwise.
+        """
+        if not self._hashed_only(**kwargs):
+            old_path = self._construct_path(obj, old_style=True, **kwargs)
+            old_style = self.old_style_cache.get(old_path)
+            if old_style is None:
+                STAT_COUNTS.incr('path_cache_misses')
+                # For backward compatibility, check the old style root path first
+                old_style = _stat_exists(old_path)
+                self.old_style_cache[old_path] = old_style
+            else:
+                STAT_COUNTS.incr('path_cache_hits')
+            if old_style:
+                return old_path
+        return self._construct_path(obj, **kwargs)
+
+    def _scan_paths(self, objs, **kwargs):
+        """ Return a dictionary mapping the id of each object in `objs` to
+        ( path, exists ), listing each directory the objects may be in once
+        rather than stat'ing the paths of each object.
+        """
+        listings = {}
+        def listed(path):
+            dir, name = os.path.split(path)
+            if dir not in listings:
+                listings[dir] = _list_dir(dir)
+            return name in listings[dir]
+        paths = {}
+        for obj in objs:
+            path = None
+            if not self._hashed_only(**kwargs):
+                old_path = self._construct_path(obj, old_style=True, **kwargs)
+                old_style = self.old_style_cache.get(old_path)
+                if old_style is None:
+                    STAT_COUNTS.incr('path_cache_misses')
+                    old_style = listed(old_path)
+                    self.old_style_cache[old_path] = old_style
+                else:
+                    STAT_COUNTS.incr('path_cache_hits')
+                if old_style:
+                    path = old_path
+            if path is None:
+                path = self._construct_path(obj, **kwargs)
+            paths[obj.id] = (path, listed(path))
+        return paths
+
+    def _hashed_only(self, base_dir=None, **kwargs):
+        # Only objects under file_path are moved out of the flat layout
+        return self.hashed_only and base_dir is None
+
+    def _forget_path(self, obj, **kwargs):
+        """ Forget the layout of a deleted object """
+        if not self._hashed_only(**kwargs):
+            self.old_style_cache.pop(self._construct_path(obj, old_style=True, **kwargs))
 
     def _construct_path(self, obj, old_style=False, base_dir=None, dir_only=False, extra_dir=None, extra_dir_at_root=False, alt_name=None, **kwargs):
         """ Construct the expected absolute path for accessing the object
@@ -276,16 +506,10 @@ class DiskObjectStore(ObjectStore):
         return os.path.abspath(path)
 
     def exists(self, obj, **kwargs):
-        path = self._construct_path(obj, old_style=True, **kwargs)
-        # For backward compatibility, check root path first; otherwise, construct
-        # and check hashed path
-        if os.path.exists(path):
-            return True
-        else:
-            path = self._construct_path(obj, **kwargs)
-            return os.path.exists(path)
+        return _stat_exists(self._resolve_path(obj, **kwargs))
 
     def create(self, obj, **kwargs):
+        _pop_placement_hints(kwargs)
         if not self.exists(obj, **kwargs):
             path = self._construct_path(obj, **kwargs)
             dir_only = kwargs.get('dir_only', False)
@@ -302,12 +526,9 @@ class DiskObjectStore(ObjectStore):
         return os.path.getsize(self.get_filename(obj, **kwargs)) > 0
 
     def size(self, obj, **kwargs):
-        if self.exists(obj, **kwargs):
-            try:
-                return os.path.getsize(self.get_filename(obj, **kwargs))
-            except OSError:
-                return 0
-        else:
+        try:
+            return os.path.getsize(self.get_filename(obj, **kwargs))
+        except OSError:
             return 0
 
     def delete(self, obj, entire_dir=False, **kwargs):
@@ -316,12 +537,14 @@ class DiskObjectStore(ObjectStore):
         try:
             if entire_dir and extra_dir:
                 shutil.rmtree(path)
+                self._forget_path(obj, **kwargs)
                 return True
-            if self.exists(obj, **kwargs):
+            if _stat_exists(path):
                 os.remove(path)
+                self._forget_path(obj, **kwargs)
                 return True
         except OSError, ex:
-            log.critical('%s delete error %s' % (self._get_filename(obj, **kwargs), ex))
+            log.critical('%s delete error %s' % (path, ex))
         return False
 
     def get_data(self, obj, start=0, count=-1, **kwargs):
@@ -332,13 +555,24 @@ class DiskObjectStore(ObjectStore):
         return content
 
     def get_filename(self, obj, **kwargs):
-        path = self._construct_path(obj, old_style=True, **kwargs)
-        # For backward compatibility, check root path first; otherwise, construct
-        # and return hashed path
-        if os.path.exists(path):
-            return path
-        else:
-            return self._construct_path(obj, **kwargs)
+        return self._resolve_path(obj, **kwargs)
+
+    def exists_many(self, objs, **kwargs):
+        return dict([(id, exists) for id, (path, exists) in self._scan_paths(objs, **kwargs).items()])
+
+    def size_many(self, objs, **kwargs):
+        sizes = {}
+        for id, (path, exists) in self._scan_paths(objs, **kwargs).items():
+            sizes[id] = 0
+            if exists:
+                try:
+                    sizes[id] = os.path.getsize(path)
+                except OSError:
+                    pass
+        return sizes
+
+    def get_filenames_many(self, objs, **kwargs):
+        return dict([(id, path) for id, (path, exists) in self._scan_paths(objs, **kwargs).items()])
 
     def update_from_file(self, obj, file_name=None, create=False, **kwargs):
         """ `create` parameter is not used in this implementation """
@@ -364,15 +598,597 @@ class DiskObjectStore(ObjectStore):
         st = os.statvfs(self.file_path)
         return (float(st.f_blocks - st.f_bavail)/st.f_blocks) * 100
 
+    def get_store_free_bytes(self):
+        st = os.statvfs(self.file_path)
+        return st.f_bavail * st.f_frsize
+
+
+class ObjectRef(object):
+    """
+    The identity of a Galaxy object, for handing it to the backends of a store
+    from a thread other than the one that loaded the object.
+    """
+    def __init__(self, id, object_store_id=None):
+        self.id = id
+        self.object_store_id = object_store_id
+
+def _object_ref(obj):
+    return ObjectRef(obj.id, getattr(obj, 'object_store_id', None))
+
 
 class CachingObjectStore(ObjectStore):
     """
     Object store that uses a directory for caching files, but defers and writes
     back to another object store.
+
+    Dataset files are read through the cache: a file not in the cache is copied
+    from the backend when it is first requested (or prefetched), and a file
+    already in the cache is never replaced from the backend. Files created or
+    updated through the store are written to the cache and copied to the
+    backend by a background thread of the process that wrote them; until then
+    they have a marker file in the cache directory, so that other processes
+    sharing the cache know not to evict them and the copy is retried after a
+    restart. The least recently used files that are also in the backend are
+    removed when the cache grows over `cache_size` bytes. Job working
+    directories, extra files and metadata files always stay in the backend.
+
+    The cache directory must be visible wherever jobs run.
+
+    >>> from galaxy.util.bunch import Bunch
+    >>> import tempfile
+    >>> backend_path, cache_path = tempfile.mkdtemp(), tempfile.mkdtemp()
+    >>> config = Bunch(umask=077, job_working_directory=backend_path, new_file_path=backend_path)
+    >>> backend = DiskObjectStore(config, file_path=backend_path)
+    >>> s = CachingObjectStore(config, backend, cache_path=cache_path, cache_size=10)
+    >>> obj = Bunch(id=1)
+    >>> s.create(obj)
+    >>> assert s.get_filename(obj) == cache_path + '/000/dataset_1.dat'
+    >>> open(s.get_filename(obj), 'w').write('12345678')
+    >>> s.update_from_file(obj)
+    >>> s.flush()
+    >>> open(backend.get_filename(obj)).read(), s.is_durable(obj)
+    ('12345678', True)
+
+    Objects only in the backend are copied to the cache when they are read,
+    evicting the least recently used objects to make room:
+
+    >>> obj2 = Bunch(id=2)
+    >>> backend.create(obj2)
+    >>> open(backend.get_filename(obj2), 'w').write('abcdef')
+    >>> s.get_data(obj2)
+    'abcdef'
+    >>> os.path.exists(cache_path + '/000/dataset_2.dat'), os.path.exists(cache_path + '/000/dataset_1.dat')
+    (True, False)
+    >>> s.get_data(obj)
+    '12345678'
+    >>> stats = s.stats()
+    >>> stats['hits'], stats['misses'], stats['evictions'], stats['bytes_fetched_from_backend']
+    (2, 2, 2, 14)
+    >>> s.shutdown()
+    >>> shutil.rmtree(backend_path); shutil.rmtree(cache_path)
     """
+    STOP_SIGNAL = object()
+
+    def __init__(self, config, backend, cache_path=None, cache_size=None, write_back_delay=WRITE_BACK_DELAY):
+        super(CachingObjectStore, self).__init__()
+        self.config = config
+        self.backend = backend
+        self.extra_dirs = backend.extra_dirs
+        self.cache_path = os.path.abspath(cache_path or config.object_store_cache_path)
+        if not os.path.exists(self.cache_path):
+            os.makedirs(self.cache_path)
+        self.cache = DiskObjectStore(config, file_path=self.cache_path)
+        # Nothing was ever stored in the cache in the flat layout
+        self.cache.hashed_only = True
+        if cache_size is None and config.object_store_cache_size != -1:
+            # Convert GBs to bytes
+            cache_size = int(config.object_store_cache_size * 1073741824)
+        self.write_back_delay = write_back_delay
+        self.counters = Counters('hits', 'misses', 'prefetches', 'bytes_served_from_cache', 'bytes_fetched_from_backend',
+                                 'write_backs', 'write_back_failures', 'evictions')
+        self.lock = threading.RLock()
+        self.write_back_lock = threading.Lock()
+        # Cached files that are also in the backend, least recently used
+        # first, mapped to ( ObjectRef, kwargs, mtime when written back )
+        self.clean = LRUCache(max_bytes=cache_size, on_evict=self.__evict)
+        # Cached files this process has not yet written back, mapped to
+        # ( ObjectRef, kwargs ), each with a marker in dirty_path
+        self.dirty = {}
+        self.dirty_path = os.path.join(self.cache_path, DIRTY_MARKER_DIR)
+        # Processes only write back the files they marked dirty
+        self.owner = getattr(config, 'server_name', None) or 'main'
+        # Cached files waiting in write_back_queue
+        self.queued = set()
+        # Files being copied from the backend, mapped to a threading.Event
+        self.fetching = {}
+        self.__load_cache()
+        self.write_back_queue = Queue()
+        self.prefetch_queue = Queue()
+        self.threads = []
+        for name, target in (('write_back', self.__write_back_worker), ('prefetch', self.__prefetch_worker)):
+            thread = threading.Thread(name='CachingObjectStore.%s' % name, target=target)
+            thread.setDaemon(True)
+            thread.start()
+            self.threads.append(thread)
+        for path in self.dirty.keys():
+            self.__queue_write_back(path)
+        log.info("Caching object store started, %s cached in %s, %i files to write back"
+                 % (convert_bytes(self.clean.current_bytes), self.cache_path, len(self.dirty)))
+
+    def __load_cache(self):
+        """
+        Adopt the files already in the cache directory, and restore the list
+        of files this process has to write back from their markers.
+        """
+        if not os.path.exists(self.dirty_path):
+            os.makedirs(self.dirty_path)
+        self.__migrate_journal()
+        entries = {}
+        for dirpath, dirnames, filenames in os.walk(self.dirty_path):
+            for filename in filenames:
+                try:
+                    entry = from_json_string(open(os.path.join(dirpath, filename)).read())
+                except (IOError, ValueError):
+                    # Being written by another process
+                    continue
+                entries[entry['path']] = entry
+        cached = []
+        for dirpath, dirnames, filenames in os.walk(self.cache_path):
+            if dirpath == self.cache_path and DIRTY_MARKER_DIR in dirnames:
+                dirnames.remove(DIRTY_MARKER_DIR)
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                if filename.startswith('.fetch_') and os.path.getmtime(path) < time.time() - 3600:
+                    # Partial copy from the backend, left by a process that
+                    # stopped (newer ones may be copies in progress)
+                    os.remove(path)
+                elif not filename.startswith('.') and path not in entries:
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    cached.append((st.st_atime, path, st.st_size))
+        cached.sort()
+        for atime, path, size in cached:
+            self.clean.set(path, None, size=size)
+        for path, entry in entries.items():
+            if entry['owner'] != self.owner:
+                continue
+            if os.path.exists(path):
+                kwargs = dict([(str(k), v) for k, v in entry['kwargs'].items()])
+                self.__mark_dirty(path, ObjectRef(entry['id'], entry['object_store_id']), kwargs)
+            else:
+                self.__remove_marker(path)
+
+    def __migrate_journal(self):
+        """ Create markers for the files left to write back in an old journal """
+        journal_path = os.path.join(self.cache_path, WRITE_BACK_JOURNAL)
+        if not os.path.exists(journal_path):
+            return
+        entries = {}
+        for line in open(journal_path):
+            try:
+                entry = from_json_string(line)
+            except ValueError:
+                # Partly written when Galaxy stopped
+                continue
+            if entry['dirty']:
+                entries[entry['path']] = entry
+            else:
+                entries.pop(entry['path'], None)
+        for path, entry in entries.items():
+            if os.path.exists(path):
+                kwargs = dict([(str(k), v) for k, v in entry['kwargs'].items()])
+                self.__write_marker(path, ObjectRef(entry['id'], entry['object_store_id']), kwargs)
+        try:
+            os.rename(journal_path, journal_path + '.migrated')
+        except OSError:
+            # Migrated by another process
+            pass
+
+    def __marker_path(self, path):
+        return os.path.join(self.dirty_path, os.path.relpath(path, self.cache_path) + '.json')
+
+    def __has_marker(self, path):
+        return os.path.exists(self.__marker_path(path))
+
+    def __write_marker(self, path, ref, kwargs):
+        marker_path = self.__marker_path(path)
+        dir = os.path.dirname(marker_path)
+        if not os.path.exists(dir):
+            try:
+                os.makedirs(dir)
+            except OSError:
+                # Created by another process
+                pass
+        entry = dict(path=path, owner=self.owner, id=ref.id, object_store_id=ref.object_store_id, kwargs=kwargs)
+        # Write to a temporary name so that other processes never read a
+        # partial marker
+        fd, temp_path = tempfile.mkstemp(dir=dir, prefix='.marker_')
+        os.write(fd, to_json_string(entry))
+        os.close(fd)
+        os.rename(temp_path, marker_path)
+
+    def __remove_marker(self, path):
+        try:
+            os.remove(self.__marker_path(path))
+        except OSError:
+            pass
+
+    def __mark_dirty(self, path, ref, kwargs):
+        self.lock.acquire()
+        try:
+            self.clean.pop(path)
+            if path not in self.dirty:
+                self.dirty[path] = (ref, kwargs)
+                self.__write_marker(path, ref, kwargs)
+        finally:
+            self.lock.release()
+
+    def __forget(self, path):
+        self.lock.acquire()
+        try:
+            self.clean.pop(path)
+            self.dirty.pop(path, None)
+            self.__remove_marker(path)
+        finally:
+            self.lock.release()
+
+    def __queue_write_back(self, path):
+        self.lock.acquire()
+        try:
+            if path in self.queued:
+                return
+            self.queued.add(path)
+        finally:
+            self.lock.release()
+        self.write_back_queue.put(path)
+
+    def __evict(self, path, value):
+        if self.__has_marker(path):
+            # Changed by another process sharing the cache, which writes it
+            # back
+            return
+        if value is not None:
+            ref, kwargs, mtime = value
+            try:
+                if os.path.getmtime(path) != mtime:
+                    # Changed since it was written back, so keep it until the
+                    # change has been written back too
+                    self.__mark_dirty(path, ref, kwargs)
+                    self.__queue_write_back(path)
+                    return
+            except OSError:
+                return
+        self.counters.incr('evictions')
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def __write_back_worker(self):
+        while True:
+            try:
+                path = self.write_back_queue.get(timeout=WRITE_BACK_SWEEP_INTERVAL)
+            except Empty:
+                self.__sweep()
+                continue
+            if path is self.STOP_SIGNAL:
+                return
+            self.__write_back(path)
+
+    def __sweep(self):
+        """ Write back the files that were modified in place and have not changed for a while """
+        now = time.time()
+        for path in self.dirty.keys():
+            try:
+                if now - os.path.getmtime(path) > self.write_back_delay:
+                    self.__queue_write_back(path)
+            except OSError:
+                pass
+        log.debug("Caching object store: %s" % self.stats())
+
+    def __write_back(self, path):
+        # flush() may write back in parallel with the write back thread
+        self.write_back_lock.acquire()
+        try:
+            self.__write_back_file(path)
+        finally:
+            self.write_back_lock.release()
+
+    def __write_back_file(self, path):
+        self.lock.acquire()
+        try:
+            self.queued.discard(path)
+            entry = self.dirty.get(path)
+        finally:
+            self.lock.release()
+        if entry is None:
+            # Deleted since it was queued
+            return
+        ref, kwargs = entry
+        try:
+            mtime = os.path.getmtime(path)
+            size = os.path.getsize(path)
+            self.backend.update_from_file(ref, file_name=path, **kwargs)
+            # Some backends only log failed copies
+            if self.backend.size(ref, **kwargs) != size:
+                raise Exception('the backend has %i bytes, the cache %i' % (self.backend.size(ref, **kwargs), size))
+        except Exception, e:
+            # Still dirty, so the sweep will try again
+            log.error("Error writing back cached file '%s': %s" % (path, e))
+            self.counters.incr('write_back_failures')
+            return
+        self.counters.incr('write_backs')
+        self.lock.acquire()
+        try:
+            # Files changed while being copied stay dirty
+            clean = path in self.dirty and os.path.getmtime(path) == mtime
+            if clean:
+                del self.dirty[path]
+                self.__remove_marker(path)
+        finally:
+            self.lock.release()
+        if clean:
+            self.clean.set(path, (ref, kwargs, mtime), size=size)
+
+    def __prefetch_worker(self):
+        while True:
+            item = self.prefetch_queue.get()
+            if item is self.STOP_SIGNAL:
+                return
+            ref, kwargs = item
+            try:
+                path = self.cache.get_filename(ref, **kwargs)
+                if not self.__is_cached(path) and self.__fetch(ref, path, **kwargs):
+                    self.counters.incr('prefetches')
+            except Exception, e:
+                log.warning("Error prefetching %s into the cache: %s" % (ref.id, e))
+
+    def __is_cached(self, path):
+        if self.clean.get(path, self) is not self or path in self.dirty:
+            return True
+        # Copied from the backend or written by another process sharing the
+        # cache
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return False
+        if not self.__has_marker(path):
+            self.clean.set(path, None, size=size)
+        return True
+
+    def __fetch(self, obj, path, **kwargs):
+        """
+        Copy the object from the backend to `path` in the cache, returning
+        False if the backend does not have it. Only one thread copies an object
+        at a time, others wait for it.
+        """
+        self.lock.acquire()
+        try:
+            event = self.fetching.get(path)
+            fetching = event is None
+            if fetching:
+                event = self.fetching[path] = threading.Event()
+        finally:
+            self.lock.release()
+        if not fetching:
+            event.wait()
+            return self.__is_cached(path)
+        try:
+            if not self.backend.exists(obj, **kwargs):
+                return False
+            source = self.backend.get_filename(obj, **kwargs)
+            dir = os.path.dirname(path)
+            if not os.path.exists(dir):
+                os.makedirs(dir)
+            # Copy to a temporary name so that partial copies are never used
+            fd, temp_path = tempfile.mkstemp(dir=dir, prefix='.fetch_')
+            os.close(fd)
+            try:
+                shutil.copyfile(source, temp_path)
+                util.umask_fix_perms(temp_path, self.config.umask, 0666)
+                # Linking fails if the file appeared in the cache meanwhile,
+                # e.g. written by another process, which must not be replaced
+                os.link(temp_path, path)
+            except OSError, e:
+                os.remove(temp_path)
+                if e.errno != errno.EEXIST:
+                    raise
+                return self.__is_cached(path)
+            except:
+                os.remove(temp_path)
+                raise
+            os.remove(temp_path)
+            size = os.path.getsize(path)
+            self.counters.incr('misses')
+            self.counters.incr('bytes_fetched_from_backend', size)
+            self.clean.set(path, (_object_ref(obj), kwargs, os.path.getmtime(path)), size=size)
+            return True
+        finally:
+            self.lock.acquire()
+            try:
+                del self.fetching[path]
+            finally:
+                self.lock.release()
+            event.set()
 
-    def __init__(self, path, backend):
-        super(CachingObjectStore, self).__init__(self, path, backend)
+    def _cacheable(self, base_dir=None, dir_only=False, extra_dir=None, **kwargs):
+        return base_dir is None and not dir_only and extra_dir is None
+
+    def _cached_filename(self, obj, **kwargs):
+        """
+        Return the path of the object in the cache, copying it from the
+        backend if necessary, or None if the object is not cached and not in
+        the backend.
+        """
+        path = self.cache.get_filename(obj, **kwargs)
+        if self.__is_cached(path):
+            self.counters.incr('hits')
+            try:
+                self.counters.incr('bytes_served_from_cache', os.path.getsize(path))
+            except OSError:
+                pass
+            return path
+        if self.__fetch(obj, path, **kwargs):
+            return path
+        return None
+
+    def exists(self, obj, **kwargs):
+        if self._cacheable(**kwargs) and self.cache.exists(obj, **kwargs):
+            return True
+        return self.backend.exists(obj, **kwargs)
+
+    def file_ready(self, obj, **kwargs):
+        if self._cacheable(**kwargs) and self.__is_cached(self.cache.get_filename(obj, **kwargs)):
+            return True
+        return self.backend.file_ready(obj, **kwargs)
+
+    def create(self, obj, **kwargs):
+        hints = _pop_placement_hints(kwargs)
+        if not self._cacheable(**kwargs):
+            return self.backend.create(obj, **dict(kwargs, **hints))
+        if self.cache.exists(obj, **kwargs):
+            # Created through the cache already, or fetched from the backend
+            return
+        # A distributed store has not chosen a backend for new objects yet,
+        # so there is nothing to look for (and no backend to look in)
+        new = isinstance(self.backend, DistributedObjectStore) and getattr(obj, 'object_store_id', None) is None
+        if not new and self.backend.exists(obj, **kwargs):
+            return self.backend.create(obj, **dict(kwargs, **hints))
+        # Reserve the object in the backend, e.g. choosing the backend of a
+        # distributed store, but write it in the cache
+        self.backend.create(obj, **dict(kwargs, **hints))
+        self.cache.create(obj, **kwargs)
+        self.__mark_dirty(self.cache.get_filename(obj, **kwargs), _object_ref(obj), kwargs)
+
+    def empty(self, obj, **kwargs):
+        if self._cacheable(**kwargs):
+            path = self._cached_filename(obj, **kwargs)
+            if path is not None:
+                return self.cache.empty(obj, **kwargs)
+        return self.backend.empty(obj, **kwargs)
+
+    def size(self, obj, **kwargs):
+        if self._cacheable(**kwargs):
+            path = self.cache.get_filename(obj, **kwargs)
+            if self.__is_cached(path):
+                try:
+                    return os.path.getsize(path)
+                except OSError:
+                    pass
+        return self.backend.size(obj, **kwargs)
+
+    def delete(self, obj, entire_dir=False, **kwargs):
+        if self._cacheable(**kwargs):
+            self.__forget(self.cache.get_filename(obj, **kwargs))
+            self.cache.delete(obj, **kwargs)
+        return self.backend.delete(obj, entire_dir=entire_dir, **kwargs)
+
+    def get_data(self, obj, start=0, count=-1, **kwargs):
+        if self._cacheable(**kwargs) and self._cached_filename(obj, **kwargs) is not None:
+            return self.cache.get_data(obj, start=start, count=count, **kwargs)
+        return self.backend.get_data(obj, start=start, count=count, **kwargs)
+
+    def get_filename(self, obj, **kwargs):
+        if self._cacheable(**kwargs):
+            path = self._cached_filename(obj, **kwargs)
+            if path is not None:
+                return path
+        return self.backend.get_filename(obj, **kwargs)
+
+    def exists_many(self, objs, **kwargs):
+        exists = {}
+        if self._cacheable(**kwargs):
+            exists = self.cache.exists_many(objs, **kwargs)
+            objs = [obj for obj in objs if not exists[obj.id]]
+        exists.update(self.backend.exists_many(objs, **kwargs))
+        return exists
+
+    def size_many(self, objs, **kwargs):
+        sizes = {}
+        if self._cacheable(**kwargs):
+            uncached = []
+            paths = self.cache.get_filenames_many(objs, **kwargs)
+            for obj in objs:
+                if self.__is_cached(paths[obj.id]):
+                    try:
+                        sizes[obj.id] = os.path.getsize(paths[obj.id])
+                        continue
+                    except OSError:
+                        pass
+                uncached.append(obj)
+            objs = uncached
+        sizes.update(self.backend.size_many(objs, **kwargs))
+        return sizes
+
+    def get_filenames_many(self, objs, **kwargs):
+        if not self._cacheable(**kwargs):
+            return self.backend.get_filenames_many(objs, **kwargs)
+        # Uncached objects are fetched one by one, as by get_filename
+        return super(CachingObjectStore, self).get_filenames_many(objs, **kwargs)
+
+    def update_from_file(self, obj, file_name=None, create=False, **kwargs):
+        if create:
+            self.create(obj, **kwargs)
+            create = False
+        if not self._cacheable(**kwargs) or kwargs.get('preserve_symlinks', False):
+            return self.backend.update_from_file(obj, file_name=file_name, create=create, **kwargs)
+        path = self.cache.get_filename(obj, **kwargs)
+        if file_name and os.path.abspath(file_name) != path:
+            if not self.exists(obj, **kwargs):
+                return
+            dir = os.path.dirname(path)
+            if not os.path.exists(dir):
+                os.makedirs(dir)
+            try:
+                shutil.copy(file_name, path)
+            except IOError, ex:
+                log.critical('Error copying %s to %s: %s' % (file_name, path, ex))
+                return
+        elif not os.path.exists(path):
+            return self.backend.update_from_file(obj, file_name=file_name, create=create, **kwargs)
+        self.__mark_dirty(path, _object_ref(obj), kwargs)
+        self.__queue_write_back(path)
+
+    def get_object_url(self, obj, **kwargs):
+        return self.backend.get_object_url(obj, **kwargs)
+
+    def get_store_usage_percent(self):
+        return self.backend.get_store_usage_percent()
+
+    def prefetch(self, obj, **kwargs):
+        if self._cacheable(**kwargs):
+            self.prefetch_queue.put((_object_ref(obj), kwargs))
+
+    def is_durable(self, obj, **kwargs):
+        """ Return True unless the object has changes not yet written back """
+        if not self._cacheable(**kwargs):
+            return True
+        path = self.cache.get_filename(obj, **kwargs)
+        return path not in self.dirty and not self.__has_marker(path)
+
+    def flush(self):
+        """ Write back all changed files now, waiting until they are written """
+        for path in self.dirty.keys():
+            self.__write_back(path)
+
+    def stats(self):
+        stats = self.counters.snapshot()
+        stats['hit_ratio'] = self.counters.ratio('hits', 'misses')
+        stats['cached_bytes'] = self.clean.current_bytes
+        stats['files_to_write_back'] = len(self.dirty)
+        stats['backend'] = self.backend.stats()
+        return stats
+
+    def shutdown(self):
+        super(CachingObjectStore, self).shutdown()
+        # Finish the write backs already queued, the rest have markers
+        self.prefetch_queue.put(self.STOP_SIGNAL)
+        self.write_back_queue.put(self.STOP_SIGNAL)
+        for thread in self.threads:
+            thread.join()
+        self.backend.shutdown()
 
 
 class S3ObjectStore(ObjectStore):
@@ -391,6 +1207,8 @@ class S3ObjectStore(ObjectStore):
         self.use_rr = self.config.os_use_reduced_redundancy
         self.cache_size = self.config.object_store_cache_size
         self.transfer_progress = 0
+        # Sizes and last access times of the files in the cache
+        self.cache_index = CacheIndex(self.staging_path)
         # Clean cache only if value is set in universe_wsgi.ini
         if self.cache_size != -1:
             # Convert GBs to bytes for comparison
@@ -400,31 +1218,30 @@ class S3ObjectStore(ObjectStore):
             self.cache_monitor_thread = threading.Thread(target=self.__cache_monitor)
             self.cache_monitor_thread.start()
             log.info("Cache cleaner manager started")
-        # Test if 'axel' is available for parallel download and pull the key into cache
-        try:
-            subprocess.call('axel')
-            self.use_axel = True
-        except OSError:
-            self.use_axel = False
+        # Objects larger than a part are transferred in parts by several threads
+        self.transfer_part_size = int(self.config.os_transfer_part_size * 1048576)
+        self.transfer_concurrency = self.config.os_transfer_concurrency
+
+    def _connect(self):
+        """ Return a new connection, for use by a transfer thread """
+        return get_OS_connection(self.config)
 
     def __cache_monitor(self):
         time.sleep(2) # Wait for things to load before starting the monitor
+        # The index is kept up to date as files are added to, used in and
+        # removed from the cache; the cache directory is only walked to start
+        # the index and now and then to catch changes made behind its back
+        # (e.g. job outputs written straight into the cache, or files added by
+        # other processes sharing it). Eviction checks each file's access time
+        # on disk, so files other processes are using are kept
+        last_reconcile = 0
+        last_evictions = 0
         while self.running:
-            total_size = 0
-            # Is this going to be too expensive of an operation to be done frequently?
-            file_list = []
-            for dirpath, dirnames, filenames in os.walk(self.staging_path):
-                for f in filenames:
-                    fp = os.path.join(dirpath, f)
-                    file_size = os.path.getsize(fp)
-                    total_size += file_size
-                    # Get the time given file was last accessed
-                    last_access_time = time.localtime(os.stat(fp)[7])
-                    # Compose a tuple of the access time and the file path
-                    file_tuple = last_access_time, fp, file_size
-                    file_list.append(file_tuple)
-            # Sort the file list (based on access time)
-            file_list.sort()
+            if time.time() - last_reconcile > CACHE_RECONCILE_INTERVAL:
+                added, removed = self.cache_index.reconcile()
+                last_reconcile = time.time()
+                log.debug("Reconciled cache index with %s: %i files added, %i removed" % (self.staging_path, added, removed))
+            total_size = self.cache_index.total_bytes
             # Initiate cleaning once within 10% of the defined cache size?
             cache_limit = self.cache_size * 0.9
             if total_size > cache_limit:
@@ -435,41 +1252,18 @@ class S3ObjectStore(ObjectStore):
                 # the limit - maybe delete additional #%?
                 # For now, delete enough to leave at least 10% of the total cache free
                 delete_this_much = total_size - cache_limit
-                self.__clean_cache(file_list, delete_this_much)
-            self.sleeper.sleep(30) # Test cache size every 30 seconds?
-
-    def __clean_cache(self, file_list, delete_this_much):
-        """ Keep deleting files from the file_list until the size of the deleted
-        files is greater than the value in delete_this_much parameter.
-
-        :type file_list: list
-        :param file_list: List of candidate files that can be deleted. This method
-            will start deleting files from the beginning of the list so the list
-            should be sorted accordingly. The list must contains 3-element tuples,
-            positioned as follows: position 0 holds file last accessed timestamp
-            (as time.struct_time), position 1 holds file path, and position 2 has
-            file size (e.g., (<access time>, /mnt/data/dataset_1.dat), 472394)
-
-        :type delete_this_much: int
-        :param delete_this_much: Total size of files, in bytes, that should be deleted.
-        """
-        # Keep deleting datasets from file_list until deleted_amount does not
-        # exceed delete_this_much; start deleting from the front of the file list,
-        # which assumes the oldest files come first on the list.
-        deleted_amount = 0
-        for i, f in enumerate(file_list):
-            if deleted_amount < delete_this_much:
-                deleted_amount += f[2]
-                os.remove(f[1])
-                # Debugging code for printing deleted files' stats
-                # folder, file_name = os.path.split(f[1])
-                # file_date = time.strftime("%m/%d/%y %H:%M:%S", f[0])
-                # log.debug("%s. %-25s %s, size %s (deleted %s/%s)" \
-                #     % (i, file_name, convert_bytes(f[2]), file_date, \
-                #     convert_bytes(deleted_amount), convert_bytes(delete_this_much)))
-            else:
+                deleted_amount = self.cache_index.evict(delete_this_much)
                 log.debug("Cache cleaning done. Total space freed: %s" % convert_bytes(deleted_amount))
-                return
+            stats = self.cache_index.stats()
+            if stats['evictions'] != last_evictions:
+                log.debug("Cache: %s in %i files, %i files evicted in the last %i seconds, hit ratio %.2f"
+                          % (convert_bytes(stats['cache_bytes']), stats['entries'], stats['evictions'] - last_evictions,
+                             CACHE_CHECK_INTERVAL, stats['hit_ratio']))
+                last_evictions = stats['evictions']
+            self.sleeper.sleep(CACHE_CHECK_INTERVAL)
+
+    def stats(self):
+        return self.cache_index.stats()
 
     def _get_bucket(self, bucket_name):
         """ Sometimes a handle to a bucket is not established right away so try
@@ -549,11 +1343,36 @@ class S3ObjectStore(ObjectStore):
             raise
         return exists
 
+    def _list_keys(self, prefix):
+        """ Return a dictionary mapping the names of the keys under `prefix` to their sizes """
+        try:
+            return dict([(key.name, key.size) for key in self.bucket.list(prefix=prefix)])
+        except S3ResponseError, ex:
+            log.error("Trouble listing S3 keys under '%s': %s" % (prefix, ex))
+            return {}
+
+    def _scan_keys(self, objs, **kwargs):
+        """ Return a dictionary mapping the id of each object in `objs` to
+        ( rel_path, in cache, size in S3 or None if not in S3 ), listing the
+        keys under each directory the objects are in once rather than making
+        a request per object.
+        """
+        listings = {}
+        scanned = {}
+        for obj in objs:
+            rel_path = self._construct_path(obj, **kwargs)
+            prefix = '%s/' % os.path.dirname(rel_path)
+            if prefix not in listings:
+                listings[prefix] = self._list_keys(prefix)
+            scanned[obj.id] = (rel_path, self._in_cache(rel_path), listings[prefix].get(rel_path))
+        return scanned
+
     def _in_cache(self, rel_path):
         """ Check if the given dataset is in the local cache and return True if so. """
         # log.debug("------ Checking cache for rel_path %s" % rel_path)
-        cache_path = self._get_cache_path(rel_path)
-        return os.path.exists(cache_path)
+        # Files added by other processes sharing the cache, or written into it
+        # behind the index's back, are indexed as they are found
+        return self.cache_index.touch(self._get_cache_path(rel_path))
         # TODO: Part of checking if a file is in cache should be to ensure the
         # size of the cached file matches that on S3. Once the upload tool explicitly
         # creates, this check sould be implemented- in the mean time, it's not
@@ -600,17 +1419,26 @@ class S3ObjectStore(ObjectStore):
                 log.critical("File %s is larger (%s) than the cache size (%s). Cannot download." \
                     % (rel_path, key.size, self.cache_size))
                 return False
-            if self.use_axel:
+            if self.transfer_concurrency > 1 and key.size > self.transfer_part_size:
                 log.debug("Parallel pulled key '%s' into cache to %s" % (rel_path, self._get_cache_path(rel_path)))
-                ncores = multiprocessing.cpu_count()
-                url = key.generate_url(7200)
-                ret_code = subprocess.call("axel -a -n %s '%s'" % (ncores, url))
-                if ret_code == 0:
-                    return True
+                cache_path = self._get_cache_path(rel_path)
+                # Download to a temporary name so that partial downloads are never used
+                fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(cache_path), prefix='.download_')
+                os.close(fd)
+                try:
+                    multipart_download(self._connect, self.bucket.name, rel_path, key.size, temp_path,
+                                       self.transfer_part_size, self.transfer_concurrency)
+                    os.rename(temp_path, cache_path)
+                except:
+                    os.remove(temp_path)
+                    raise
+                self.cache_index.add(cache_path, size=key.size)
+                return True
             else:
                 log.debug("Pulled key '%s' into cache to %s" % (rel_path, self._get_cache_path(rel_path)))
                 self.transfer_progress = 0 # Reset transfer progress counter
                 key.get_contents_to_filename(self._get_cache_path(rel_path), cb=self._transfer_cb, num_cb=10)
+                self.cache_index.add(self._get_cache_path(rel_path), size=key.size)
                 return True
         except S3ResponseError, ex:
             log.error("Problem downloading key '%s' from S3 bucket '%s': %s" % (rel_path, self.bucket.name, ex))
@@ -626,6 +1454,9 @@ class S3ObjectStore(ObjectStore):
         """
         try:
             source_file = source_file if source_file else self._get_cache_path(rel_path)
+            if os.path.exists(self._get_cache_path(rel_path)):
+                # The cache copy may have been created or changed
+                self.cache_index.add(self._get_cache_path(rel_path))
             if os.path.exists(source_file):
                 key = Key(self.bucket, rel_path)
                 if os.path.getsize(source_file) == 0 and key.exists():
@@ -639,12 +1470,14 @@ class S3ObjectStore(ObjectStore):
                     # print "Pushing cache file '%s' of size %s bytes to key '%s'" % (source_file, os.path.getsize(source_file), rel_path)
                     # print "+ Push started at '%s'" % start_time
                     mb_size = os.path.getsize(source_file) / 1e6
-                    if mb_size < 60 or self.config.object_store == 'swift':
+                    if os.path.getsize(source_file) <= self.transfer_part_size or self.config.object_store == 'swift':
                         self.transfer_progress = 0 # Reset transfer progress counter
                         key.set_contents_from_filename(source_file, reduced_redundancy=self.use_rr,
                             cb=self._transfer_cb, num_cb=10)
                     else:
-                        multipart_upload(self.bucket, key.name, source_file, mb_size, use_rr=self.use_rr)
+                        multipart_upload(self.bucket, key.name, source_file, mb_size, use_rr=self.use_rr,
+                                         part_size=self.transfer_part_size, concurrency=self.transfer_concurrency,
+                                         connect=self._connect)
                     end_time = datetime.now()
                     # print "+ Push ended at   '%s'; %s bytes transfered in %ssec" % (end_time, os.path.getsize(source_file), end_time-start_time)
                     log.debug("Pushed cache file '%s' to key '%s' (%s bytes transfered in %s sec)" % (source_file, rel_path, os.path.getsize(source_file), end_time-start_time))
@@ -696,6 +1529,7 @@ class S3ObjectStore(ObjectStore):
             return False
 
     def create(self, obj, **kwargs):
+        _pop_placement_hints(kwargs)
         if not self.exists(obj, **kwargs):
             #print "S3 OS creating a dataset with ID %s" % kwargs
             # Pull out locally used fields
@@ -756,6 +1590,7 @@ class S3ObjectStore(ObjectStore):
             # but requires iterating through each individual key in S3 and deleing it.
             if entire_dir and extra_dir:
                 shutil.rmtree(self._get_cache_path(rel_path))
+                self.cache_index.remove_tree(self._get_cache_path(rel_path))
                 rs = self.bucket.get_all_keys(prefix=rel_path)
                 for key in rs:
                     log.debug("Deleting key %s" % key.name)
@@ -764,6 +1599,7 @@ class S3ObjectStore(ObjectStore):
             else:
                 # Delete from cache first
                 os.unlink(self._get_cache_path(rel_path))
+                self.cache_index.remove(self._get_cache_path(rel_path))
                 # Delete from S3 as well
                 if self._key_exists(rel_path):
                         key = Key(self.bucket, rel_path)
@@ -778,11 +1614,14 @@ class S3ObjectStore(ObjectStore):
 
     def get_data(self, obj, start=0, count=-1, **kwargs):
         rel_path = self._construct_path(obj, **kwargs)
-        # Check cache first and get file if not there
+        # Check cache first, and only read the requested range from S3 if the
+        # file is not there rather than pulling the whole object into cache
         if not self._in_cache(rel_path):
-            self._pull_into_cache(rel_path)
-        #else:
-        #    print "(cccc) Getting '%s' from cache" % self._get_cache_path(rel_path)
+            try:
+                return read_range(self.bucket, rel_path, start, count)
+            except S3ResponseError, ex:
+                log.error("Could not read %s bytes of key '%s' from S3 starting at %s: %s" % (count, rel_path, start, ex))
+                raise ObjectNotFound()
         # Read the file content from cache
         data_file = open(self._get_cache_path(rel_path), 'r')
         data_file.seek(start)
@@ -820,6 +1659,40 @@ class S3ObjectStore(ObjectStore):
         raise ObjectNotFound()
         # return cache_path # Until the upload tool does not explicitly create the dataset, return expected path
 
+    def exists_many(self, objs, **kwargs):
+        if kwargs.get('dir_only', False):
+            # Directories are only prefixes of keys, check them one by one
+            return super(S3ObjectStore, self).exists_many(objs, **kwargs)
+        exists = {}
+        for id, (rel_path, in_cache, s3_size) in self._scan_keys(objs, **kwargs).items():
+            if in_cache and s3_size is None:
+                # As in exists()
+                self._push_to_os(rel_path, source_file=self._get_cache_path(rel_path))
+            exists[id] = in_cache or s3_size is not None
+        return exists
+
+    def size_many(self, objs, **kwargs):
+        sizes = {}
+        for id, (rel_path, in_cache, s3_size) in self._scan_keys(objs, **kwargs).items():
+            if in_cache:
+                try:
+                    sizes[id] = os.path.getsize(self._get_cache_path(rel_path))
+                    continue
+                except OSError, ex:
+                    log.info("Could not get size of file '%s' in local cache, will try S3. Error: %s" % (rel_path, ex))
+            sizes[id] = s3_size or 0
+        return sizes
+
+    def get_filenames_many(self, objs, **kwargs):
+        if kwargs.get('dir_only', False):
+            return super(S3ObjectStore, self).get_filenames_many(objs, **kwargs)
+        filenames = {}
+        for id, (rel_path, in_cache, s3_size) in self._scan_keys(objs, **kwargs).items():
+            filenames[id] = None
+            if in_cache or (s3_size is not None and self._pull_into_cache(rel_path)):
+                filenames[id] = self._get_cache_path(rel_path)
+        return filenames
+
     def update_from_file(self, obj, file_name=None, create=False, **kwargs):
         if create:
             self.create(obj, **kwargs)
@@ -860,8 +1733,9 @@ class S3ObjectStore(ObjectStore):
 class DistributedObjectStore(ObjectStore):
     """
     ObjectStore that defers to a list of backends, for getting objects the
-    first store where the object exists is used, objects are created in a
-    store selected randomly, but with weighting.
+    store recorded in the object's object_store_id is used, objects are
+    created in a store chosen by a placement policy (see
+    galaxy.objectstore.placement) from those that are not full.
     """
 
     def __init__(self, config):
@@ -871,68 +1745,83 @@ class DistributedObjectStore(ObjectStore):
                                                     "requires a config file, please set one in " \
                                                     "'distributed_object_store_config_file')"
         self.backends = {}
-        self.weighted_backend_ids = []
-        self.original_weighted_backend_ids = []
-        self.max_percent_full = {}
+        # Maps backend id to the BackendState the placement policy uses
+        self.backend_states = {}
         self.global_max_percent_full = 0.0
 
         random.seed()
 
         self.__parse_distributed_config(config)
 
-        if self.global_max_percent_full or filter(lambda x: x is not None, self.max_percent_full.values()):
-            self.sleeper = Sleeper()
-            self.filesystem_monitor_thread = threading.Thread(target=self.__filesystem_monitor)
-            self.filesystem_monitor_thread.start()
-            log.info("Filesystem space monitor started")
+        # Placement policies and maxpctfull both need the backends' usage
+        self.sleeper = Sleeper()
+        self.filesystem_monitor_thread = threading.Thread(target=self.__filesystem_monitor)
+        self.filesystem_monitor_thread.start()
+        log.info("Filesystem space monitor started")
 
     def __parse_distributed_config(self, config):
-        tree = util.parse_xml(self.distributed_config)
-        root = tree.getroot()
         log.debug('Loading backends for distributed object store from %s' % self.distributed_config)
-        self.global_max_percent_full = float(root.get('maxpctfull', 0))
+        self.global_max_percent_full, backends = parse_backends_config(config, self.distributed_config)
+        root = util.parse_xml(self.distributed_config).getroot()
+        self.policy = load_policy(root.get('policy', 'weighted'))
+        log.debug("Using the '%s' placement policy" % root.get('policy', 'weighted'))
+        # Job runner URL prefixes of the compute destinations near each backend
+        destinations = {}
         for elem in [ e for e in root if e.tag == 'backend' ]:
-            id = elem.get('id')
-            weight = int(elem.get('weight', 1))
-            maxpctfull = float(elem.get('maxpctfull', 0))
-            if elem.get('type', 'disk'):
-                path = None
-                extra_dirs = {}
-                for sub in elem:
-                    if sub.tag == 'files_dir':
-                        path = sub.get('path')
-                    elif sub.tag == 'extra_dir':
-                        type = sub.get('type')
-                        extra_dirs[type] = sub.get('path')
-                self.backends[id] = DiskObjectStore(config, file_path=path, extra_dirs=extra_dirs)
-                self.max_percent_full[id] = maxpctfull
-                log.debug("Loaded disk backend '%s' with weight %s and file_path: %s" % (id, weight, path))
-                if extra_dirs:
-                    log.debug("    Extra directories:")
-                    for type, dir in extra_dirs.items():
-                        log.debug("        %s: %s" % (type, dir))
-            for i in range(0, weight):
-                # The simplest way to do weighting: add backend ids to a
-                # sequence the number of times equalling weight, then randomly
-                # choose a backend from that sequence at creation
-                self.weighted_backend_ids.append(id)
-        self.original_weighted_backend_ids = self.weighted_backend_ids
+            destinations[elem.get('id')] = [ d.strip() for d in elem.get('destinations', '').split(',') if d.strip() ]
+        for id, weight, maxpctfull, backend in backends:
+            self.backends[id] = backend
+            self.backend_states[id] = BackendState(id, weight=weight,
+                                                   max_percent_full=maxpctfull or self.global_max_percent_full,
+                                                   destinations=destinations.get(id))
 
     def __filesystem_monitor(self):
         while self.running:
-            new_weighted_backend_ids = self.original_weighted_backend_ids
             for id, backend in self.backends.items():
-                maxpct = self.max_percent_full[id] or self.global_max_percent_full
-                pct = backend.get_store_usage_percent()
-                if pct > maxpct:
-                    new_weighted_backend_ids = filter(lambda x: x != id, new_weighted_backend_ids)
-            self.weighted_backend_ids = new_weighted_backend_ids
-            self.sleeper.sleep(120) # Test free space every 2 minutes
+                state = self.backend_states[id]
+                try:
+                    state.record_usage(backend.get_store_usage_percent(), free_bytes=backend.get_store_free_bytes())
+                except OSError, e:
+                    log.warning("Could not check the usage of object store backend '%s': %s" % (id, e))
+                    continue
+                log.debug("Object store backend '%s' is %.1f%% full, filling at %.2f%% per hour, write latency %s, %i objects placed"
+                          % (id, state.percent_full(), state.fill_rate() * 60 * 60, state.write_latency, state.counters.get('placements')))
+            self.sleeper.sleep(USAGE_CHECK_INTERVAL)
 
     def shutdown(self):
         super(DistributedObjectStore, self).shutdown()
         self.sleeper.wake()
 
+    def __accepts_new_objects(self, id):
+        """ Backends with no weight only hold existing objects """
+        state = self.backend_states.get(id)
+        return state is not None and state.weight > 0 and not state.is_full()
+
+    def choose_backend(self, size_hint=None, destination=None, exclude=None):
+        """
+        Return the id of the backend the placement policy chooses for a new
+        object, from those accepting new objects other than `exclude`.
+        See `create` method for the description of the hints.
+        """
+        available = [ state for state in self.backend_states.values()
+                      if self.__accepts_new_objects(state.id) and state.id not in (exclude or []) ]
+        if not available:
+            raise ObjectInvalid()
+        id = self.policy.choose(available, size_hint=size_hint, destination=destination)
+        self.backend_states[id].counters.incr('placements')
+        return id
+
+    def __timed_write(self, id, method, obj, nbytes, **kwargs):
+        """ Call the write `method` of backend `id`, recording how long it took """
+        start = time.time()
+        try:
+            rval = getattr(self.backends[id], method)(obj, **kwargs)
+        except:
+            self.backend_states[id].record_write(time.time() - start, nbytes, error=True)
+            raise
+        self.backend_states[id].record_write(time.time() - start, nbytes)
+        return rval
+
     def exists(self, obj, **kwargs):
         return self.__call_method('exists', obj, False, False, **kwargs)
 
@@ -943,18 +1832,16 @@ class DistributedObjectStore(ObjectStore):
         """
         create() is the only method in which obj.object_store_id may be None
         """
+        hints = _pop_placement_hints(kwargs)
         if obj.object_store_id is None or not self.exists(obj, **kwargs):
-            if obj.object_store_id is None or obj.object_store_id not in self.weighted_backend_ids:
-                try:
-                    obj.object_store_id = random.choice(self.weighted_backend_ids)
-                except IndexError:
-                    raise ObjectInvalid()
+            if obj.object_store_id is None or not self.__accepts_new_objects(obj.object_store_id):
+                obj.object_store_id = self.choose_backend(**hints)
                 object_session( obj ).add( obj )
                 object_session( obj ).flush()
                 log.debug("Selected backend '%s' for creation of %s %s" % (obj.object_store_id, obj.__class__.__name__, obj.id))
             else:
                 log.debug("Using preferred backend '%s' for creation of %s %s" % (obj.object_store_id, obj.__class__.__name__, obj.id))
-            self.backends[obj.object_store_id].create(obj, **kwargs)
+            self.__timed_write(obj.object_store_id, 'create', obj, 0, **kwargs)
 
     def empty(self, obj, **kwargs):
         return self.__call_method('empty', obj, True, False, **kwargs)
@@ -975,11 +1862,95 @@ class DistributedObjectStore(ObjectStore):
         if kwargs.get('create', False):
             self.create(obj, **kwargs)
             kwargs['create'] = False
-        return self.__call_method('update_from_file', obj, ObjectNotFound, True, **kwargs)
+        object_store_id = self.__get_store_id_for(obj, **kwargs)
+        if object_store_id is None:
+            raise ObjectNotFound()
+        nbytes = 0
+        file_name = kwargs.get('file_name', None)
+        if file_name and os.path.exists(file_name):
+            nbytes = os.path.getsize(file_name)
+        return self.__timed_write(object_store_id, 'update_from_file', obj, nbytes, **kwargs)
 
     def get_object_url(self, obj, **kwargs):
         return self.__call_method('get_object_url', obj, None, False, **kwargs)
 
+    def get_store_free_bytes(self):
+        free = [ state.free_bytes for state in self.backend_states.values() if self.__accepts_new_objects(state.id) ]
+        if None in free:
+            return None
+        return sum(free)
+
+    def migrate(self, obj, object_store_id, extra_dir=None):
+        """
+        Copy the object identified by `obj`, and its extra files directory
+        `extra_dir` if given, to the backend `object_store_id` and record that
+        it is stored there.  The backend it was in keeps its copy for readers
+        that looked up its filename before it was moved, remove that with
+        `delete_from_backend` once they are done.  Returns the id of the
+        backend the object was in.
+        """
+        source_id = self.__get_store_id_for(obj)
+        if source_id is None:
+            raise ObjectNotFound()
+        if source_id == object_store_id:
+            return source_id
+        source, target = self.backends[source_id], self.backends[object_store_id]
+        size = source.size(obj)
+        target.create(obj)
+        self.__timed_write(object_store_id, 'update_from_file', obj, size, file_name=source.get_filename(obj))
+        if target.size(obj) != size:
+            raise Exception("Copy of %s %s in backend '%s' is incomplete" % (obj.__class__.__name__, obj.id, object_store_id))
+        if extra_dir is not None and source.exists(obj, extra_dir=extra_dir, dir_only=True):
+            target_dir = target.get_filename(obj, extra_dir=extra_dir, dir_only=True)
+            if os.path.exists(target_dir):
+                shutil.rmtree(target_dir)
+            shutil.copytree(source.get_filename(obj, extra_dir=extra_dir, dir_only=True), target_dir, symlinks=True)
+        obj.object_store_id = object_store_id
+        object_session( obj ).add( obj )
+        object_session( obj ).flush()
+        self.backend_states[source_id].counters.incr('migrated_out')
+        self.backend_states[object_store_id].counters.incr('migrated_in')
+        log.debug("Migrated %s %s from backend '%s' to '%s'" % (obj.__class__.__name__, obj.id, source_id, object_store_id))
+        return source_id
+
+    def delete_from_backend(self, obj, object_store_id, extra_dir=None):
+        """ Remove the copy left in the backend `object_store_id` by `migrate` """
+        assert object_store_id != obj.object_store_id, "%s %s is stored in backend '%s'" % (obj.__class__.__name__, obj.id, object_store_id)
+        backend = self.backends[object_store_id]
+        backend.delete(obj)
+        if extra_dir is not None:
+            backend.delete(obj, entire_dir=True, extra_dir=extra_dir, dir_only=True)
+
+    def stats(self):
+        stats = {}
+        for id, state in self.backend_states.items():
+            stats[id] = state.stats()
+            stats[id].update(self.backends[id].stats())
+        return stats
+
+    def exists_many(self, objs, **kwargs):
+        return self.__call_method_many('exists_many', objs, False, **kwargs)
+
+    def size_many(self, objs, **kwargs):
+        return self.__call_method_many('size_many', objs, 0, **kwargs)
+
+    def get_filenames_many(self, objs, **kwargs):
+        return self.__call_method_many('get_filenames_many', objs, None, **kwargs)
+
+    def __call_method_many(self, method, objs, default, **kwargs):
+        """ Call `method` of each backend once, with the objects in it """
+        by_backend = {}
+        results = {}
+        for obj in objs:
+            object_store_id = self.__get_store_id_for(obj, **kwargs)
+            if object_store_id is None:
+                results[obj.id] = default
+            else:
+                by_backend.setdefault(object_store_id, []).append(obj)
+        for object_store_id, backend_objs in by_backend.items():
+            results.update(getattr(self.backends[object_store_id], method)(backend_objs, **kwargs))
+        return results
+
     def __call_method(self, method, obj, default, default_is_exception, **kwargs):
         object_store_id = self.__get_store_id_for(obj, **kwargs)
         if object_store_id is not None:
@@ -1010,26 +1981,258 @@ class HierarchicalObjectStore(ObjectStore):
     """
     ObjectStore that defers to a list of backends, for getting objects the
     first store where the object exists is used, objects are always created
-    in the first store.
+    in the first store that is not full.
+
+    >>> from galaxy.util.bunch import Bunch
+    >>> import tempfile
+    >>> path1, path2 = tempfile.mkdtemp(), tempfile.mkdtemp()
+    >>> config = Bunch(umask=077, job_working_directory=path1, new_file_path=path1)
+    >>> fast, slow = DiskObjectStore(config, file_path=path1), DiskObjectStore(config, file_path=path2)
+    >>> s = HierarchicalObjectStore(config, backends=[('fast', 0, fast), ('slow', 0, slow)])
+    >>> slow.create(Bunch(id=1))
+    >>> s.create(Bunch(id=2))
+    >>> assert s.get_filename(Bunch(id=1)) == path2 + '/000/dataset_1.dat'
+    >>> assert s.get_filename(Bunch(id=2)) == path1 + '/000/dataset_2.dat'
+    >>> s.stats()['slow']['reads'], s.stats()['fast']['reads']
+    (1, 1)
+    >>> sorted(s.exists_many([Bunch(id=1), Bunch(id=2), Bunch(id=3)]).items())
+    [(1, True), (2, True), (3, False)]
+    >>> shutil.rmtree(path1); shutil.rmtree(path2)
     """
 
-    def __init__(self, backends=[]):
+    def __init__(self, config, backends=None):
+        """
+        `backends` is a list of ( id, maxpctfull, store ), in the order they
+        are searched, and is read from the hierarchical_object_store_config_file
+        if not given.
+        """
         super(HierarchicalObjectStore, self).__init__()
+        self.global_max_percent_full = 0.0
+        if backends is None:
+            config_file = config.hierarchical_object_store_config_file
+            assert config_file is not None, "hierarchical object store ('object_store = hierarchical') " \
+                                            "requires a config file, please set one in " \
+                                            "'hierarchical_object_store_config_file')"
+            log.debug('Loading backends for hierarchical object store from %s' % config_file)
+            self.global_max_percent_full, parsed = parse_backends_config(config, config_file)
+            backends = [(id, maxpctfull, backend) for id, weight, maxpctfull, backend in parsed]
+        self.backends = backends
+        # Maps an object to the id of the backend it was last found in
+        self.locations = LRUCache(PATH_CACHE_SIZE)
+        # Maps backend id to ( time checked, percent full )
+        self.usage = {}
+        self.counters = dict([(id, Counters('reads', 'bytes_read', 'creates')) for id, maxpctfull, backend in backends])
+
+    def shutdown(self):
+        super(HierarchicalObjectStore, self).shutdown()
+        for id, maxpctfull, backend in self.backends:
+            backend.shutdown()
+
+    def __key(self, obj, kwargs):
+        return (obj.__class__.__name__, obj.id, repr(sorted(kwargs.items())))
+
+    def __find(self, obj, **kwargs):
+        """ Return ( id, store ) of the first backend containing the object, or ( None, None ) """
+        key = self.__key(obj, kwargs)
+        id = self.locations.get(key)
+        for backend_id, maxpctfull, backend in self.backends:
+            if backend_id == id:
+                if backend.exists(obj, **kwargs):
+                    return id, backend
+                self.locations.pop(key)
+                break
+        for id, maxpctfull, backend in self.backends:
+            if backend.exists(obj, **kwargs):
+                self.locations[key] = id
+                return id, backend
+        return None, None
+
+    def __has_capacity(self, id, maxpctfull, backend):
+        maxpctfull = maxpctfull or self.global_max_percent_full
+        if not maxpctfull:
+            return True
+        checked, pct = self.usage.get(id, (0, 0.0))
+        if time.time() - checked > USAGE_CHECK_INTERVAL:
+            pct = backend.get_store_usage_percent()
+            self.usage[id] = (time.time(), pct)
+        return pct < maxpctfull
+
+    def __first_with_capacity(self):
+        for id, maxpctfull, backend in self.backends:
+            if self.__has_capacity(id, maxpctfull, backend):
+                return id, backend
+        raise ObjectInvalid()
+
+    def __call_method(self, method, obj, default, default_is_exception, **kwargs):
+        id, backend = self.__find(obj, **kwargs)
+        if backend is not None:
+            return getattr(backend, method)(obj, **kwargs)
+        if default_is_exception:
+            raise default()
+        else:
+            return default
+
+    def __find_many(self, objs, **kwargs):
+        """
+        Return a list of ( id, store, objects ) for the backends containing
+        any of `objs`, and a list of the objects not in any backend, asking
+        each backend about all the objects not found in the ones before it.
+        """
+        found = []
+        for id, maxpctfull, backend in self.backends:
+            if not objs:
+                break
+            exists = backend.exists_many(objs, **kwargs)
+            backend_objs = [obj for obj in objs if exists[obj.id]]
+            if backend_objs:
+                for obj in backend_objs:
+                    self.locations[self.__key(obj, kwargs)] = id
+                found.append((id, backend, backend_objs))
+            objs = [obj for obj in objs if not exists[obj.id]]
+        return found, objs
+
+    def exists(self, obj, **kwargs):
+        return self.__find(obj, **kwargs)[1] is not None
+
+    def exists_many(self, objs, **kwargs):
+        found, missing = self.__find_many(objs, **kwargs)
+        exists = dict([(obj.id, False) for obj in missing])
+        for id, backend, backend_objs in found:
+            exists.update(dict([(obj.id, True) for obj in backend_objs]))
+        return exists
+
+    def size_many(self, objs, **kwargs):
+        found, missing = self.__find_many(objs, **kwargs)
+        sizes = dict([(obj.id, 0) for obj in missing])
+        for id, backend, backend_objs in found:
+            sizes.update(backend.size_many(backend_objs, **kwargs))
+        return sizes
+
+    def get_filenames_many(self, objs, **kwargs):
+        found, missing = self.__find_many(objs, **kwargs)
+        filenames = {}
+        for id, backend, backend_objs in found:
+            self.counters[id].incr('reads', len(backend_objs))
+            filenames.update(backend.get_filenames_many(backend_objs, **kwargs))
+        if missing:
+            # Where the objects would be created
+            id, backend = self.__first_with_capacity()
+            filenames.update(backend.get_filenames_many(missing, **kwargs))
+        return filenames
+
+    def file_ready(self, obj, **kwargs):
+        return self.__call_method('file_ready', obj, False, False, **kwargs)
+
+    def create(self, obj, **kwargs):
+        hints = _pop_placement_hints(kwargs)
+        if not self.exists(obj, **kwargs):
+            id, backend = self.__first_with_capacity()
+            backend.create(obj, **dict(kwargs, **hints))
+            self.locations[self.__key(obj, kwargs)] = id
+            self.counters[id].incr('creates')
+
+    def empty(self, obj, **kwargs):
+        return self.__call_method('empty', obj, True, False, **kwargs)
+
+    def size(self, obj, **kwargs):
+        return self.__call_method('size', obj, 0, False, **kwargs)
+
+    def delete(self, obj, **kwargs):
+        deleted = self.__call_method('delete', obj, False, False, **kwargs)
+        self.locations.pop(self.__key(obj, kwargs))
+        return deleted
+
+    def get_data(self, obj, **kwargs):
+        id, backend = self.__find(obj, **kwargs)
+        if backend is None:
+            raise ObjectNotFound()
+        data = backend.get_data(obj, **kwargs)
+        self.counters[id].incr('reads')
+        self.counters[id].incr('bytes_read', len(data))
+        return data
+
+    def get_filename(self, obj, **kwargs):
+        id, backend = self.__find(obj, **kwargs)
+        if backend is None:
+            # Where the object would be created
+            id, backend = self.__first_with_capacity()
+        else:
+            self.counters[id].incr('reads')
+        return backend.get_filename(obj, **kwargs)
+
+    def update_from_file(self, obj, **kwargs):
+        if kwargs.get('create', False):
+            self.create(obj, **kwargs)
+            kwargs['create'] = False
+        return self.__call_method('update_from_file', obj, ObjectNotFound, True, **kwargs)
+
+    def get_object_url(self, obj, **kwargs):
+        return self.__call_method('get_object_url', obj, None, False, **kwargs)
+
+    def get_store_usage_percent(self):
+        return self.backends[0][2].get_store_usage_percent()
+
+    def prefetch(self, obj, **kwargs):
+        id, backend = self.__find(obj, **kwargs)
+        if backend is not None:
+            backend.prefetch(obj, **kwargs)
+
+    def stats(self):
+        stats = {}
+        for id, maxpctfull, backend in self.backends:
+            stats[id] = self.counters[id].snapshot()
+            stats[id].update(backend.stats())
+        return stats
+
+def parse_backends_config(config, config_file):
+    """
+    Parse the XML config file of a distributed or hierarchical object store,
+    returning its global maxpctfull and a list of ( id, weight, maxpctfull,
+    store ) for its backends, in the order they are listed.
+    """
+    tree = util.parse_xml(config_file)
+    root = tree.getroot()
+    global_max_percent_full = float(root.get('maxpctfull', 0))
+    backends = []
+    for elem in [ e for e in root if e.tag == 'backend' ]:
+        id = elem.get('id')
+        weight = int(elem.get('weight', 1))
+        maxpctfull = float(elem.get('maxpctfull', 0))
+        if elem.get('type', 'disk'):
+            path = None
+            extra_dirs = {}
+            for sub in elem:
+                if sub.tag == 'files_dir':
+                    path = sub.get('path')
+                elif sub.tag == 'extra_dir':
+                    type = sub.get('type')
+                    extra_dirs[type] = sub.get('path')
+            backends.append((id, weight, maxpctfull, DiskObjectStore(config, file_path=path, extra_dirs=extra_dirs)))
+            log.debug("Loaded disk backend '%s' with weight %s and file_path: %s" % (id, weight, path))
+            if extra_dirs:
+                log.debug("    Extra directories:")
+                for type, dir in extra_dirs.items():
+                    log.debug("        %s: %s" % (type, dir))
+    return global_max_percent_full, backends
 
 def build_object_store_from_config(config):
     """ Depending on the configuration setting, invoke the appropriate object store
     """
     store = config.object_store
     if store == 'disk':
-        return DiskObjectStore(config=config)
+        object_store = DiskObjectStore(config=config)
     elif store == 's3' or store == 'swift':
-        return S3ObjectStore(config=config)
+        object_store = S3ObjectStore(config=config)
     elif store == 'distributed':
-        return DistributedObjectStore(config=config)
+        object_store = DistributedObjectStore(config=config)
     elif store == 'hierarchical':
-        return HierarchicalObjectStore()
+        object_store = HierarchicalObjectStore(config=config)
     else:
         log.error("Unrecognized object store definition: {0}".format(store))
+        return None
+    if config.object_store_cache_path:
+        object_store = CachingObjectStore(config, object_store)
+    return object_store
 
 def convert_bytes(bytes):
     """ A helper function used for pretty printing disk usage """
@@ -1061,7 +2264,7 @@ def get_OS_connection(config):
     log.debug("Getting a connection object for '{0}' object store".format(config.object_store))
     a_key = config.os_access_key
     s_key = config.os_secret_key
-    if config.object_store == 's3':
+    if config.object_store == 's3' and not config.os_host:
         return S3Connection(a_key, s_key)
     else:
         # Establish the connection now
@@ -1070,7 +2273,7 @@ def get_OS_connection(config):
                             aws_secret_access_key=s_key,
                             is_secure=config.os_is_secure,
                             host=config.os_host,
-                            port=int(config.os_port),
+                            port=config.os_port and int(config.os_port) or None,
                             calling_format=calling_format,
                             path=config.os_conn_path)
         return s3_conn
@@ -0,0 +1,253 @@
+"""
+In-process index of the files in an object store's local cache directory.
+
+Object stores that keep copies of remote objects in a local directory need
+to know how big the cache is and which files were used least recently.
+Walking and stat'ing the whole directory to find out is far too expensive
+for caches with many files, so the store tells the index about every file it
+adds, uses or removes instead.  Files that change behind the store's back
+(e.g. outputs written into the cache by jobs) are caught by `reconcile`,
+which walks the directory and should be called rarely.
+
+Several processes (web and job handler processes) may share the cache
+directory, each with its own index.  So that one process does not evict
+files another is using, uses are recorded in the access times of the files
+themselves, and a file is only evicted if it has not been used (by any
+process) since the time the index has for it.
+
+>>> import tempfile, os, shutil
+>>> root = tempfile.mkdtemp()
+>>> def write( name, size ):
+...     open( os.path.join( root, name ), 'w' ).write( 'x' * size )
+...     return os.path.join( root, name )
+>>> index = CacheIndex( root )
+>>> a, b, c = write( 'a', 10 ), write( 'b', 20 ), write( 'c', 30 )
+>>> index.add( a, now=1 ); index.add( b, now=2 ); index.add( c, now=3 )
+>>> index.total_bytes
+60
+>>> index.touch( a, now=4 )
+True
+>>> index.evict( 15 )
+20
+>>> sorted( os.listdir( root ) ), index.total_bytes
+(['a', 'c'], 40)
+>>> os.remove( c ); index.remove( c )
+>>> index.total_bytes, index.touch( c )
+(10, False)
+
+Files used more recently by another process sharing the cache are kept:
+
+>>> other = CacheIndex( root )
+>>> e = write( 'e', 5 )
+>>> index.add( e, now=5 ); other.touch( a, now=10 )
+True
+>>> index.evict( 5 ), sorted( os.listdir( root ) )
+(5, ['a'])
+>>> index.entries[ a ]
+[10, 10.0]
+
+Reconciliation picks up files the index was not told about:
+
+>>> d = write( 'd', 5 )
+>>> index.reconcile()
+(1, 0)
+>>> index.total_bytes
+15
+>>> stats = index.stats()
+>>> stats[ 'entries' ], stats[ 'evictions' ], stats[ 'hits' ], stats[ 'misses' ]
+(2, 2, 1, 1)
+>>> shutil.rmtree( root )
+"""
+
+import os
+import stat
+import time
+import heapq
+import logging
+import threading
+
+from galaxy.util.counters import Counters
+
+log = logging.getLogger( __name__ )
+
+# Index entries
+SIZE, LAST_ACCESS = 0, 1
+
+class CacheIndex( object ):
+    """
+    Sizes and last access times of the files under `root`, with a heap of
+    ( last access, path ) for finding the least recently used files.  Heap
+    entries are not removed when a file is used again or removed, they are
+    skipped when popped if they no longer match the index.
+    """
+    # Access times within this many seconds of the index's are taken to be
+    # the same use, allowing for the precision of file system timestamps
+    access_time_slack = 1
+
+    def __init__( self, root ):
+        self.root = root
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.heap = []
+        self.total_bytes = 0
+        self.counters = Counters( 'hits', 'misses', 'evictions', 'evicted_bytes', 'reconciliations' )
+
+    def __set( self, path, size, last_access ):
+        entry = self.entries.get( path )
+        if entry is not None:
+            self.total_bytes -= entry[SIZE]
+        self.entries[ path ] = [ size, last_access ]
+        self.total_bytes += size
+        heapq.heappush( self.heap, ( last_access, path ) )
+        # Drop the stale heap entries once they outnumber the live ones
+        if len( self.heap ) > 2 * len( self.entries ) + 1000:
+            self.heap = [ ( entry[LAST_ACCESS], p ) for p, entry in self.entries.iteritems() ]
+            heapq.heapify( self.heap )
+
+    def __set_access_time( self, path, now ):
+        """ Record a use of `path` in its access time, for other processes. """
+        try:
+            st = os.stat( path )
+            os.utime( path, ( now, st.st_mtime ) )
+            return st
+        except OSError:
+            return None
+
+    def add( self, path, size=None, now=None ):
+        """ Record that `path` was added to (or changed in) the cache. """
+        now = now or time.time()
+        st = self.__set_access_time( path, now )
+        if size is None:
+            if st is None:
+                return
+            size = st.st_size
+        self.lock.acquire()
+        try:
+            self.__set( path, size, now )
+        finally:
+            self.lock.release()
+
+    def touch( self, path, now=None ):
+        """
+        Record a use of `path`, returning True if it is in the cache.  Files
+        added by other processes sharing the cache are indexed as they are
+        used, and count as hits.  Directories are in the cache if they exist,
+        but are not indexed.
+        """
+        now = now or time.time()
+        st = self.__set_access_time( path, now )
+        if st is None:
+            self.remove( path )
+            self.counters.incr( 'misses' )
+            return False
+        if stat.S_ISDIR( st.st_mode ):
+            return True
+        self.lock.acquire()
+        try:
+            self.counters.incr( 'hits' )
+            self.__set( path, st.st_size, now )
+            return True
+        finally:
+            self.lock.release()
+
+    def remove( self, path ):
+        """ Record that `path` was removed from the cache. """
+        self.lock.acquire()
+        try:
+            entry = self.entries.pop( path, None )
+            if entry is not None:
+                self.total_bytes -= entry[SIZE]
+        finally:
+            self.lock.release()
+
+    def remove_tree( self, path ):
+        """ Record that the directory `path` was removed from the cache. """
+        prefix = os.path.join( path, '' )
+        self.lock.acquire()
+        try:
+            for p in [ p for p in self.entries if p.startswith( prefix ) ]:
+                self.total_bytes -= self.entries.pop( p )[SIZE]
+        finally:
+            self.lock.release()
+
+    def evict( self, nbytes ):
+        """
+        Remove the least recently used files until at least `nbytes` bytes
+        have been freed or the cache is empty, returning the bytes freed.
+        Files used by another process since they were last used by this one
+        are kept, and moved up the index to the time of that use.
+        """
+        freed = 0
+        while freed < nbytes:
+            self.lock.acquire()
+            try:
+                if not self.heap:
+                    break
+                last_access, path = heapq.heappop( self.heap )
+                entry = self.entries.get( path )
+                if entry is None or entry[LAST_ACCESS] != last_access:
+                    # Stale heap entry
+                    continue
+                try:
+                    last_shared_access = os.stat( path ).st_atime
+                except OSError:
+                    # Evicted or removed by another process
+                    del self.entries[ path ]
+                    self.total_bytes -= entry[SIZE]
+                    continue
+                if last_shared_access > last_access + self.access_time_slack:
+                    self.__set( path, entry[SIZE], last_shared_access )
+                    continue
+                del self.entries[ path ]
+                self.total_bytes -= entry[SIZE]
+            finally:
+                self.lock.release()
+            try:
+                os.remove( path )
+            except OSError, e:
+                log.warning( "Could not remove %s from the cache: %s" % ( path, e ) )
+                continue
+            freed += entry[SIZE]
+            self.counters.incr( 'evictions' )
+            self.counters.incr( 'evicted_bytes', entry[SIZE] )
+        return freed
+
+    def reconcile( self ):
+        """
+        Walk the cache directory to pick up changes made outside of the
+        index, returning the numbers of files added and removed.  Files
+        already in the index keep their last access time.
+        """
+        found = {}
+        for dirpath, dirnames, filenames in os.walk( self.root ):
+            for filename in filenames:
+                path = os.path.join( dirpath, filename )
+                try:
+                    st = os.stat( path )
+                except OSError:
+                    continue
+                found[ path ] = st
+        added = removed = 0
+        self.lock.acquire()
+        try:
+            for path in [ p for p in self.entries if p not in found ]:
+                self.total_bytes -= self.entries.pop( path )[SIZE]
+                removed += 1
+            for path, st in found.iteritems():
+                entry = self.entries.get( path )
+                if entry is None:
+                    self.__set( path, st.st_size, st.st_atime )
+                    added += 1
+                elif entry[SIZE] != st.st_size:
+                    self.__set( path, st.st_size, entry[LAST_ACCESS] )
+        finally:
+            self.lock.release()
+        self.counters.incr( 'reconciliations' )
+        return added, removed
+
+    def stats( self ):
+        stats = self.counters.snapshot()
+        stats[ 'hit_ratio' ] = self.counters.ratio( 'hits', 'misses' )
+        stats[ 'cache_bytes' ] = self.total_bytes
+        stats[ 'entries' ] = len( self.entries )
+        return stats
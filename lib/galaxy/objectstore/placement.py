@@ -0,0 +1,229 @@
+"""
+Placement policies, choosing which backend of a DistributedObjectStore a new
+object is created in.
+
+The store keeps a `BackendState` for each backend, recording how full the
+backend has been over the last few hours and how long writes to it take, and
+asks its policy to choose between the backends that are not full:
+
+>>> fast = BackendState( 'fast', max_percent_full=90, destinations=[ 'pbs://cluster1/' ] )
+>>> slow = BackendState( 'slow', max_percent_full=90 )
+>>> fast.record_usage( 50.0, now=0 ); fast.record_usage( 51.0, now=3600 )
+>>> slow.record_usage( 80.0, now=0 ); slow.record_usage( 85.0, now=3600 )
+>>> fast.seconds_until_full()
+140400.0
+>>> slow.seconds_until_full()
+3600.0
+>>> fast.record_write( 0.01 ); slow.record_write( 2.0 )
+>>> policy = load_policy( 'adaptive' )
+>>> policy.suitable( slow ), policy.score( fast ) > 10 * policy.score( slow )
+(False, True)
+>>> policy.choose( [ fast, slow ], destination='pbs://cluster1/-q long' )
+'fast'
+
+Backends without room for the expected size of the object are avoided, but
+used if no backend has room:
+
+>>> fast.record_usage( 51.0, free_bytes=1024, now=3600 )
+>>> policy.suitable( fast, size_hint=4096 )
+False
+>>> policy.choose( [ fast ], size_hint=4096 )
+'fast'
+>>> sorted( fast.stats().keys() )
+['bytes_written', 'fill_rate_per_hour', 'free_bytes', 'percent_full', 'placements', 'write_errors', 'write_latency', 'write_seconds', 'writes']
+"""
+
+import sys
+import time
+import random
+import logging
+import threading
+
+from galaxy.util.counters import Counters
+
+log = logging.getLogger( __name__ )
+
+# Seconds of usage samples kept for estimating how fast a backend fills up
+USAGE_HISTORY = 6 * 60 * 60
+
+# Backends projected to be full within this many seconds are avoided
+FILL_HORIZON = 24 * 60 * 60
+
+# Weight of each new write time in a backend's moving average write latency
+LATENCY_SMOOTHING = 0.2
+
+class BackendState( object ):
+    """
+    What a DistributedObjectStore knows about one of its backends: its
+    configuration, samples of how full it is and its recent write latency.
+    """
+    def __init__( self, id, weight=1, max_percent_full=0.0, destinations=None ):
+        self.id = id
+        self.weight = weight
+        self.max_percent_full = max_percent_full
+        # Prefixes of the job runner URLs of compute destinations close to the backend
+        self.destinations = destinations or []
+        self.lock = threading.Lock()
+        # ( time, percent full ) samples, oldest first
+        self.usage = []
+        self.free_bytes = None
+        # Moving average of the seconds writes without data (i.e. creating
+        # empty objects) take, tracking the backend's responsiveness
+        # independently of the sizes of the objects written to it
+        self.write_latency = None
+        self.counters = Counters( 'placements', 'writes', 'write_errors', 'write_seconds', 'bytes_written' )
+
+    def record_usage( self, percent_full, free_bytes=None, now=None ):
+        if now is None:
+            now = time.time()
+        self.lock.acquire()
+        try:
+            self.usage = [ sample for sample in self.usage if now - sample[0] <= USAGE_HISTORY ]
+            self.usage.append( ( now, percent_full ) )
+            self.free_bytes = free_bytes
+        finally:
+            self.lock.release()
+
+    def record_write( self, seconds, nbytes=0, error=False ):
+        self.counters.incr( 'writes' )
+        self.counters.incr( 'write_seconds', seconds )
+        self.counters.incr( 'bytes_written', nbytes )
+        if error:
+            self.counters.incr( 'write_errors' )
+        if nbytes:
+            return
+        self.lock.acquire()
+        try:
+            if self.write_latency is None:
+                self.write_latency = seconds
+            else:
+                self.write_latency += LATENCY_SMOOTHING * ( seconds - self.write_latency )
+        finally:
+            self.lock.release()
+
+    def percent_full( self ):
+        """ The last sampled usage of the backend, or None if it has not been sampled """
+        if not self.usage:
+            return None
+        return self.usage[-1][1]
+
+    def fill_rate( self ):
+        """ Percentage points per second the backend filled at over the sampled period """
+        usage = self.usage
+        if len( usage ) < 2 or usage[-1][0] <= usage[0][0]:
+            return 0.0
+        return ( usage[-1][1] - usage[0][1] ) / ( usage[-1][0] - usage[0][0] )
+
+    def seconds_until_full( self ):
+        """
+        The seconds from the last sample until the backend reaches its
+        maximum usage at its fill rate, or None if it is not filling up.
+        """
+        percent_full, rate = self.percent_full(), self.fill_rate()
+        if percent_full is None or rate <= 0:
+            return None
+        return max( ( ( self.max_percent_full or 100.0 ) - percent_full ) / rate, 0.0 )
+
+    def is_full( self ):
+        percent_full = self.percent_full()
+        return bool( self.max_percent_full ) and percent_full is not None and percent_full > self.max_percent_full
+
+    def is_near( self, destination ):
+        """ Whether the backend is close to the job runner URL `destination` """
+        for prefix in self.destinations:
+            if destination.startswith( prefix ):
+                return True
+        return False
+
+    def stats( self ):
+        stats = self.counters.snapshot()
+        stats[ 'percent_full' ] = self.percent_full()
+        stats[ 'fill_rate_per_hour' ] = self.fill_rate() * 60 * 60
+        stats[ 'free_bytes' ] = self.free_bytes
+        stats[ 'write_latency' ] = self.write_latency
+        return stats
+
+def weighted_choice( weighted ):
+    """
+    Choose at random from a list of ( weight, item ) in proportion to the
+    weights, or uniformly if no weight is positive.
+    """
+    total = sum( [ max( weight, 0 ) for weight, item in weighted ] )
+    if total <= 0:
+        return random.choice( weighted )[1]
+    r = random.uniform( 0, total )
+    for weight, item in weighted:
+        r -= max( weight, 0 )
+        if r <= 0:
+            break
+    return item
+
+class PlacementPolicy( object ):
+    """
+    Chooses the backend new objects are created in.
+    """
+    def choose( self, backends, size_hint=None, destination=None ):
+        """
+        Return the id of the backend to create an object in, from a non-empty
+        list of the `BackendState`s of the backends that are not full.
+        `size_hint` is the expected size of the object in bytes and
+        `destination` the job runner URL of the job creating it, either may
+        be None if not known.
+        """
+        raise NotImplementedError()
+
+class WeightedRandomPolicy( PlacementPolicy ):
+    """
+    Choose backends at random, in proportion to their configured weights.
+    """
+    def choose( self, backends, size_hint=None, destination=None ):
+        return weighted_choice( [ ( backend.weight, backend ) for backend in backends ] ).id
+
+class AdaptivePolicy( PlacementPolicy ):
+    """
+    Choose backends at random, in proportion to their configured weights
+    scaled down as they fill up and as their writes slow down, and up if
+    they are near the job's compute destination.  Backends without room for
+    the object or projected to be full within FILL_HORIZON at their current
+    fill rate are only used if all the backends are like that.
+    """
+    def __init__( self, latency_target=0.05, locality_bonus=4.0 ):
+        # Writes taking up to `latency_target` seconds are not penalized
+        self.latency_target = latency_target
+        self.locality_bonus = locality_bonus
+
+    def suitable( self, backend, size_hint=None ):
+        if size_hint and backend.free_bytes is not None and backend.free_bytes < size_hint:
+            return False
+        seconds_until_full = backend.seconds_until_full()
+        return seconds_until_full is None or seconds_until_full > FILL_HORIZON
+
+    def score( self, backend, destination=None ):
+        score = float( backend.weight )
+        percent_full = backend.percent_full()
+        if percent_full is not None:
+            limit = backend.max_percent_full or 100.0
+            score *= max( limit - percent_full, 0.0 ) / limit
+        if backend.write_latency is not None:
+            score *= self.latency_target / max( backend.write_latency, self.latency_target )
+        if destination and backend.is_near( destination ):
+            score *= self.locality_bonus
+        return score
+
+    def choose( self, backends, size_hint=None, destination=None ):
+        candidates = [ backend for backend in backends if self.suitable( backend, size_hint ) ] or backends
+        return weighted_choice( [ ( self.score( backend, destination ), backend ) for backend in candidates ] ).id
+
+POLICIES = dict( weighted=WeightedRandomPolicy, adaptive=AdaptivePolicy )
+
+def load_policy( name ):
+    """
+    Return an instance of the policy registered in POLICIES as `name`, or
+    of the PlacementPolicy subclass at the dotted path `name`
+    (e.g. 'mymodule.MyPolicy').
+    """
+    if name in POLICIES:
+        return POLICIES[ name ]()
+    module_name, class_name = name.rsplit( '.', 1 )
+    __import__( module_name )
+    return getattr( sys.modules[ module_name ], class_name )()
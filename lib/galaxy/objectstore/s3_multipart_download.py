@@ -0,0 +1,120 @@
+"""
+Download S3 objects, or parts of them, using concurrent ranged GETs.
+
+Each worker thread opens its own connection with the `connect` function it
+is given, since boto connections should not be shared between threads.  The
+functions only use the parts of the boto API that S3-compatible services
+implement, and can be tried out against any object with a `get_contents_as_string`
+method that honours the Range header:
+
+>>> class FakeKey(object):
+...     def __init__(self, data):
+...         self.data = data
+...         self.size = len(data)
+...     def get_contents_as_string(self, headers={}):
+...         start, end = headers['Range'][len('bytes='):].split('-')
+...         if int(start) >= self.size:
+...             raise Exception('416 Requested Range Not Satisfiable')
+...         return self.data[int(start):end and int(end) + 1 or None]
+>>> class FakeBucket(object):
+...     def get_key(self, name):
+...         return FakeKey('0123456789' * 10)
+>>> class FakeConnection(object):
+...     def get_bucket(self, name, validate=True):
+...         return FakeBucket()
+>>> read_range(FakeBucket(), 'key', 95)
+'56789'
+>>> read_range(FakeBucket(), 'key', 10, 5)
+'01234'
+
+Ranges starting at or past the end of the key (e.g. any range of an empty
+key) are empty rather than a request S3 would refuse:
+
+>>> read_range(FakeBucket(), 'key', 100), read_range(FakeBucket(), 'key', 120, 5)
+('', '')
+>>> part_ranges(10, 4)
+[(0, 3), (4, 7), (8, 9)]
+>>> import tempfile, os
+>>> fd, filename = tempfile.mkstemp()
+>>> os.close(fd)
+>>> multipart_download(FakeConnection, 'bucket', 'key', 100, filename, part_size=7, concurrency=3)
+>>> open(filename).read() == '0123456789' * 10
+True
+>>> os.remove(filename)
+"""
+
+import threading
+from Queue import Queue, Empty
+
+def part_ranges(size, part_size):
+    """ Return inclusive ( start, end ) byte ranges of at most `part_size` bytes covering `size` bytes """
+    return [(start, min(start + part_size, size) - 1) for start in range(0, size, part_size)]
+
+def transfer_parts(parts, transfer, concurrency):
+    """
+    Call `transfer( part )` for each of `parts` from `concurrency` threads,
+    raising the first exception any of them raised once all have finished.
+    """
+    queue = Queue()
+    for part in parts:
+        queue.put(part)
+    errors = []
+    def worker():
+        while not errors:
+            try:
+                part = queue.get_nowait()
+            except Empty:
+                return
+            try:
+                transfer(part)
+            except Exception, e:
+                errors.append(e)
+    threads = [threading.Thread(target=worker) for i in range(max(min(concurrency, len(parts)), 1))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+
+def read_range(bucket, key_name, start, count=-1):
+    """ Return `count` bytes (or all of them, if -1) of a key starting at `start` """
+    if count == 0:
+        return ''
+    key = bucket.get_key(key_name)
+    if start >= key.size:
+        # S3 refuses ranges with no bytes in the key
+        return ''
+    if count < 0:
+        byte_range = 'bytes=%i-' % start
+    else:
+        byte_range = 'bytes=%i-%i' % (start, start + count - 1)
+    return key.get_contents_as_string(headers={'Range': byte_range})
+
+def multipart_download(connect, bucket_name, key_name, size, filename, part_size, concurrency):
+    """
+    Download the `size` byte key to `filename`, fetching parts of `part_size`
+    bytes with `concurrency` threads, each using a connection from `connect()`.
+    """
+    f = open(filename, 'wb')
+    f.truncate(size)
+    f.close()
+    local = threading.local()
+    files = []
+    def download_part(part):
+        if not hasattr(local, 'bucket'):
+            local.bucket = connect().get_bucket(bucket_name, validate=False)
+            local.file = open(filename, 'r+b')
+            files.append(local.file)
+        start, end = part
+        data = read_range(local.bucket, key_name, start, end - start + 1)
+        if len(data) != end - start + 1:
+            raise Exception("Got %i bytes of '%s' starting at %i, expected %i" % (len(data), key_name, start, end - start + 1))
+        local.file.seek(start)
+        local.file.write(data)
+        local.file.flush()
+    try:
+        transfer_parts(part_ranges(size, part_size), download_part, concurrency)
+    finally:
+        for f in files:
+            f.close()
@@ -1,94 +1,76 @@
 #!/usr/bin/env python
 """
 Split large file into multiple pieces for upload to S3.
-This parallelizes the task over available cores using multiprocessing.
-Code mostly taken form CloudBioLinux.
+This parallelizes the task over a configurable number of threads, each
+uploading parts read straight from the file.
+Code originally taken form CloudBioLinux.
 """
 from __future__ import with_statement
 
 import os
 import sys
-import glob
-import subprocess
-import contextlib
-import functools
+import threading
+from cStringIO import StringIO
 
 if sys.version_info >= (2, 6):
     # this is just to prevent unit tests from failing
     import multiprocessing
-    from multiprocessing.pool import IMapIterator
 
 from galaxy import eggs
 eggs.require('boto')
 
 import boto
 
-def map_wrap(f):
-    @functools.wraps(f)
-    def wrapper(*args, **kwargs):
-        return apply(f, *args, **kwargs)
-    return wrapper
+from galaxy.objectstore.s3_multipart_download import part_ranges, transfer_parts
 
-def mp_from_ids(mp_id, mp_keyname, mp_bucketname):
+# S3 rejects parts (other than the last) smaller than 5MB
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+def mp_from_ids(mp_id, mp_keyname, mp_bucketname, connect=None):
     """Get the multipart upload from the bucket and multipart IDs.
 
     This allows us to reconstitute a connection to the upload
-    from within multiprocessing functions.
+    from within other threads, using a connection from `connect()` if given.
     """
-    conn = boto.connect_s3()
+    if connect is None:
+        conn = boto.connect_s3()
+    else:
+        conn = connect()
     bucket = conn.lookup(mp_bucketname)
     mp = boto.s3.multipart.MultiPartUpload(bucket)
     mp.key_name = mp_keyname
     mp.id = mp_id
     return mp
 
-@map_wrap
-def transfer_part(mp_id, mp_keyname, mp_bucketname, i, part):
-    """Transfer a part of a multipart upload. Designed to be run in parallel.
-    """
-    mp = mp_from_ids(mp_id, mp_keyname, mp_bucketname)
-    #print " Transferring", i, part
-    with open(part) as t_handle:
-        mp.upload_part_from_file(t_handle, i+1)
-    os.remove(part)
-
-def multipart_upload(bucket, s3_key_name, tarball, mb_size, use_rr=True):
+def multipart_upload(bucket, s3_key_name, tarball, mb_size, use_rr=True, part_size=None, concurrency=None, connect=None):
     """Upload large files using Amazon's multipart upload functionality.
-    """
-    cores = multiprocessing.cpu_count()
-    #print "Initiating multipart upload using %s cores" % cores
-    def split_file(in_file, mb_size, split_num=5):
-        prefix = os.path.join(os.path.dirname(in_file),
-                              "%sS3PART" % (os.path.basename(s3_key_name)))
-        # Split chunks so they are 5MB < chunk < 250MB
-        split_size = int(max(min(mb_size / (split_num * 2.0), 250), 5))
-        if not os.path.exists("%saa" % prefix):
-            cl = ["split", "-b%sm" % split_size, in_file, prefix]
-            subprocess.check_call(cl)
-        return sorted(glob.glob("%s*" % prefix))
 
+    The file is uploaded in parts of `part_size` bytes by `concurrency`
+    threads (by default one per core, with parts of a tenth of the file per
+    thread, between 5MB and 250MB), each using a connection from `connect()`.
+    """
+    if concurrency is None:
+        concurrency = multiprocessing.cpu_count()
+    if part_size is None:
+        part_size = int(max(min(mb_size / (concurrency * 2.0), 250), 5)) * 1024 * 1024
+    part_size = max(part_size, MIN_PART_SIZE)
+    parts = list(enumerate(part_ranges(os.path.getsize(tarball), part_size)))
+    #print "Initiating multipart upload of %i parts using %s threads" % (len(parts), concurrency)
     mp = bucket.initiate_multipart_upload(s3_key_name, reduced_redundancy=use_rr)
-    with multimap(cores) as pmap:
-        for _ in pmap(transfer_part, ((mp.id, mp.key_name, mp.bucket_name, i, part)
-                                      for (i, part) in
-                                      enumerate(split_file(tarball, mb_size, cores)))):
-            pass
+    local = threading.local()
+    def transfer_part(part):
+        """Transfer a part of a multipart upload. Run in parallel.
+        """
+        i, (start, end) = part
+        if not hasattr(local, 'mp'):
+            local.mp = mp_from_ids(mp.id, mp.key_name, mp.bucket_name, connect)
+        with open(tarball, 'rb') as t_handle:
+            t_handle.seek(start)
+            data = t_handle.read(end - start + 1)
+        local.mp.upload_part_from_file(StringIO(data), i+1)
+    try:
+        transfer_parts(parts, transfer_part, concurrency)
+    except:
+        mp.cancel_upload()
+        raise
     mp.complete_upload()
-
-@contextlib.contextmanager
-def multimap(cores=None):
-    """Provide multiprocessing imap like function.
-    
-    The context manager handles setting up the pool, worked around interrupt issues
-    and terminating the pool on completion.
-    """
-    if cores is None:
-        cores = max(multiprocessing.cpu_count() - 1, 1)
-    def wrapper(func):
-        def wrap(self, timeout=None):
-            return func(self, timeout=timeout if timeout is not None else 1e100)
-        return wrap
-    IMapIterator.next = wrapper(IMapIterator.next)
-    pool = multiprocessing.Pool(cores)
-    yield pool.imap
-    pool.terminate()
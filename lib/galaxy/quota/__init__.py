@@ -2,14 +2,19 @@
 Galaxy Quotas
 
 """
-import logging, socket, operator
+import logging, socket, operator, time
 from datetime import datetime, timedelta
 from galaxy import util
 from galaxy.util.bunch import Bunch
+from galaxy.util.counters import Counters
+from galaxy.util.lrucache import LRUCache
 from galaxy.model.orm import *
 
 log = logging.getLogger(__name__)
 
+# Maximum number of users whose quota is cached
+QUOTA_CACHE_SIZE = 10000
+
 class NoQuotaAgent( object ):
     """Base quota agent, always returns no quota"""
     def __init__( self, model ):
@@ -35,10 +40,90 @@ class NoQuotaAgent( object ):
         return None
     def get_user_quotas( self, user ):
         return []
+    def check_for_changes( self, max_age=0 ):
+        return False
+    def invalidate( self ):
+        pass
+    def cache_stats( self ):
+        return {}
 
 class QuotaAgent( NoQuotaAgent ):
-    """Class that handles galaxy quotas"""
+    """
+    Class that handles galaxy quotas
+
+    Calculated quotas are cached by user id.  Since quotas and group
+    membership may be changed by other Galaxy processes, the cache is cleared
+    whenever a single aggregate query over the quota and group membership
+    tables (the "signature") returns a different result.  The signature is
+    checked at most every `check_interval` seconds by `get_quota`, and can be
+    checked explicitly with `check_for_changes`.  Usage is never cached.
+    """
+    def __init__( self, model, check_interval=10 ):
+        super( QuotaAgent, self ).__init__( model )
+        self.check_interval = check_interval
+        self.quota_cache = LRUCache( QUOTA_CACHE_SIZE )
+        self.signature = None
+        self.last_signature_check = 0
+        self.counters = Counters( 'quota_queries', 'signature_checks', 'invalidations' )
+    def __signature_query( self ):
+        columns = []
+        for table in ( self.model.Quota.table,
+                       self.model.DefaultQuotaAssociation.table,
+                       self.model.UserQuotaAssociation.table,
+                       self.model.GroupQuotaAssociation.table,
+                       self.model.UserGroupAssociation.table ):
+            columns.append( select( [ func.count( table.c.id ) ] ).as_scalar() )
+            columns.append( select( [ func.max( table.c.update_time ) ] ).as_scalar() )
+        return select( columns )
+    def check_for_changes( self, max_age=0 ):
+        """
+        Clear the quota cache if quotas or group membership have changed since
+        the last check, unless the last check was less than `max_age` seconds
+        ago.  Returns True if the cache was cleared.
+        """
+        now = time.time()
+        if max_age and now - self.last_signature_check < max_age:
+            return False
+        self.last_signature_check = now
+        self.counters.incr( 'signature_checks' )
+        signature = tuple( self.sa_session.execute( self.__signature_query() ).fetchone() )
+        if signature == self.signature:
+            return False
+        if self.signature is not None:
+            log.debug( "Quotas or group membership changed, clearing quota cache" )
+        self.signature = signature
+        self.invalidate()
+        return True
+    def invalidate( self ):
+        """Forget all cached quotas."""
+        self.quota_cache.clear()
+        self.counters.incr( 'invalidations' )
     def get_quota( self, user, nice_size=False ):
+        """
+        Return the quota for `user` in bytes (or None for unlimited), from the
+        cache if possible.
+        """
+        self.check_for_changes( max_age=self.check_interval )
+        key = None
+        if user:
+            key = user.id
+        rval = self.quota_cache.get( key, default=False )
+        if rval is False:
+            self.counters.incr( 'quota_queries' )
+            rval = self.calculate_quota( user )
+            self.quota_cache.set( key, rval )
+        if nice_size:
+            if rval is not None:
+                rval = util.nice_size( rval )
+            else:
+                rval = 'unlimited'
+        return rval
+    def cache_stats( self ):
+        """Return quota cache and query counters."""
+        stats = self.counters.snapshot()
+        stats.update( self.quota_cache.stats() )
+        return stats
+    def calculate_quota( self, user ):
         """
         Calculated like so:
 
@@ -86,11 +171,6 @@ class QuotaAgent( NoQuotaAgent ):
             rval = max + adjustment
             if rval <= 0:
                 rval = 0
-        if nice_size:
-            if rval is not None:
-                rval = util.nice_size( rval )
-            else:
-                rval = 'unlimited'
         return rval
     @property
     def default_unregistered_quota( self ):
@@ -123,6 +203,7 @@ class QuotaAgent( NoQuotaAgent ):
             dqa = self.model.DefaultQuotaAssociation( default_type, quota )
         self.sa_session.add( dqa )
         self.sa_session.flush()
+        self.invalidate()
         
     def get_percent( self, trans=None, user=False, history=False, usage=False, quota=False ):
         """
@@ -159,6 +240,7 @@ class QuotaAgent( NoQuotaAgent ):
                 gqa = self.model.GroupQuotaAssociation( group, quota )
                 self.sa_session.add( gqa )
             self.sa_session.flush()
+        self.invalidate()
     def get_user_quotas( self, user ):
         rval = []
         if not user:
@@ -66,7 +66,7 @@ class RBACAgent:
         raise "Unimplemented Method"
     def history_set_default_permissions( self, history, permissions=None, dataset=False, bypass_manage_permission=False ):
         raise "Unimplemented Method"
-    def set_all_dataset_permissions( self, dataset, permissions ):
+    def set_all_dataset_permissions( self, dataset, permissions, flush=True ):
         raise "Unimplemented Method"
     def set_dataset_permission( self, dataset, permission ):
         raise "Unimplemented Method"
@@ -689,10 +689,12 @@ class GalaxyRBACAgent( RBACAgent ):
             else:
                 permissions[ action ] = [ dhp.role ]
         return permissions
-    def set_all_dataset_permissions( self, dataset, permissions={} ):
+    def set_all_dataset_permissions( self, dataset, permissions={}, flush=True ):
         """
         Set new permissions on a dataset, eliminating all current permissions
         permissions looks like: { Action : [ Role, Role ] }
+        If flush is False the changes are left for the caller to flush, e.g.
+        along with many new datasets.
         """
         # Make sure that DATASET_MANAGE_PERMISSIONS is associated with at least 1 role
         has_dataset_manage_permissions = False
@@ -718,7 +720,7 @@ class GalaxyRBACAgent( RBACAgent ):
             for dp in [ self.model.DatasetPermissions( action, dataset, role ) for role in roles ]:
                 self.sa_session.add( dp )
                 flush_needed = True
-        if flush_needed:
+        if flush_needed and flush:
             self.sa_session.flush()
         return ""
     def set_dataset_permission( self, dataset, permission={} ):
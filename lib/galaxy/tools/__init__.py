@@ -14,6 +14,7 @@ from mako.template import Template
 from UserDict import DictMixin
 from galaxy.util.odict import odict
 from galaxy.util.bunch import Bunch
+from galaxy.util.lrucache import LRUCache
 from galaxy.util.template import fill_template
 from galaxy import util, jobs, model
 from galaxy.jobs import ParallelismInfo
@@ -716,6 +717,9 @@ class ToolSectionLabel( object ):
         """ Return a dict that includes label's attributes. """
         return { 'type': 'label', 'id': self.id, 'name': self.text, 'version': self.version }
 
+# Parsed tool states, keyed by their encoded form (see DefaultToolState.decode)
+TOOL_STATE_CACHE = LRUCache( 1000, max_bytes=32 * 1024 * 1024 )
+
 class DefaultToolState( object ):
     """
     Keeps track of the state of a users interaction with a tool between 
@@ -745,14 +749,19 @@ class DefaultToolState( object ):
         """
         Restore the state from a string
         """
-        if secure:
-            # Extract and verify hash
-            a, b = value.split( ":" )
-            value = binascii.unhexlify( b )
-            test = hmac_new( app.config.tool_secret, value )
-            assert a == test
-        # Restore from string
-        values = json_fix( simplejson.loads( value ) )
+        def parse():
+            state = value
+            if secure:
+                # Extract and verify hash
+                a, b = state.split( ":" )
+                state = binascii.unhexlify( b )
+                test = hmac_new( app.config.tool_secret, state )
+                assert a == test
+            # Restore from string
+            return json_fix( simplejson.loads( state ) )
+        # The same encoded state is posted back on every refresh of a tool
+        # form, so cache the verified and parsed dictionary
+        values = dict( TOOL_STATE_CACHE.get_or_compute( ( secure, value ), parse, size=len( value ) ) )
         self.page = values.pop( "__page__" )
         self.inputs = params_from_strings( tool.inputs, values, app, ignore_errors=True )
 
@@ -2127,6 +2136,16 @@ class Tool( object ):
         when run will build the tool's outputs, e.g. `DefaultToolAction`.
         """
         return self.tool_action.execute( self, trans, incoming=incoming, set_output_hid=set_output_hid, history=history, **kwargs )
+    def execute_many( self, trans, incomings, set_output_hid=True, history=None, **kwargs ):
+        """
+        Execute the tool once for each of the parameter dictionaries in
+        `incomings`, returning a list of ( job, outputs ) pairs.  Tool actions
+        that support it (e.g. `DefaultToolAction`) create all of the jobs
+        together rather than one at a time.
+        """
+        if hasattr( self.tool_action, 'execute_many' ):
+            return self.tool_action.execute_many( self, trans, incomings, set_output_hid=set_output_hid, history=history, **kwargs )
+        return [ self.execute( trans, incoming=incoming, set_output_hid=set_output_hid, history=history, **kwargs ) for incoming in incomings ]
     def params_to_strings( self, params, app ):
         return params_to_strings( self.inputs, params, app )
     def params_from_strings( self, params, app, ignore_errors=False ):
@@ -2929,7 +2948,7 @@ class SetMetadataTool( Tool ):
         for name, dataset in inp_data.iteritems():
             external_metadata = galaxy.datatypes.metadata.JobExternalOutputMetadataWrapper( job )
             if external_metadata.external_metadata_set_successfully( dataset, app.model.context ):
-                dataset.metadata.from_JSON_dict( external_metadata.get_output_filenames_by_dataset( dataset, app.model.context ).filename_out )    
+                external_metadata.load_external_metadata( dataset, app.model.context )
             else:
                 dataset._state = model.Dataset.states.FAILED_METADATA
                 self.sa_session.add( dataset )
@@ -21,6 +21,12 @@ class ToolAction( object ):
     """
     def execute( self, tool, trans, incoming={}, set_output_hid=True ):
         raise TypeError("Abstract method")
+    def execute_many( self, tool, trans, incomings, **kwargs ):
+        """
+        Execute the tool once for each of the parameter dictionaries in
+        `incomings`, returning a list of the results of `execute`.
+        """
+        return [ self.execute( tool, trans, incoming=incoming, **kwargs ) for incoming in incomings ]
     
 class DefaultToolAction( object ):
     """Default tool action is to run an external command"""
@@ -111,6 +117,135 @@ class DefaultToolAction( object ):
         submitting the job to the job queue. If history is not specified, use
         trans.history as destination for tool's output datasets.
         """
+        job, out_data = self._create_jobs( tool, trans, [ incoming ], set_output_hid, set_output_history, history, job_params )[0]
+        # Some tools are not really executable, but jobs are still created for them ( for record keeping ).
+        # Examples include tools that redirect to other applications ( epigraph ).  These special tools must
+        # include something that can be retrieved from the params ( e.g., REDIRECT_URL ) to keep the job
+        # from being queued.
+        if 'REDIRECT_URL' in incoming:
+            # Get the dataset - there should only be 1
+            for assoc in job.input_datasets:
+                dataset = assoc.dataset
+            redirect_url = tool.parse_redirect_url( dataset, incoming )
+            # GALAXY_URL should be include in the tool params to enable the external application 
+            # to send back to the current Galaxy instance
+            GALAXY_URL = incoming.get( 'GALAXY_URL', None )
+            assert GALAXY_URL is not None, "GALAXY_URL parameter missing in tool config."
+            redirect_url += "&GALAXY_URL=%s" % GALAXY_URL
+            # Job should not be queued, so set state to ok
+            job.state = trans.app.model.Job.states.OK
+            job.info = "Redirected to: %s" % redirect_url
+            trans.sa_session.add( job )
+            trans.sa_session.flush()
+            trans.response.send_redirect( url_for( controller='tool_runner', action='redirect', redirect_url=redirect_url ) )
+        else:
+            # Queue the job for execution
+            trans.app.job_queue.put( job.id, tool )
+            trans.log_event( "Added job to the job queue, id: %s" % str(job.id), tool_id=job.tool_id )
+            return job, out_data
+
+    def execute_many( self, tool, trans, incomings, set_output_hid=True, set_output_history=True, history=None, job_params=None ):
+        """
+        Executes a tool once for each of the parameter dictionaries in
+        `incomings`, returning a list of ( job, outputs ) pairs.  All of the
+        jobs and their outputs are written to the database together, and
+        then queued.  Tools that redirect to other applications cannot be
+        executed this way.
+        """
+        for incoming in incomings:
+            if 'REDIRECT_URL' in incoming:
+                raise Exception( "Tool %s redirects to another application, it can only be executed once at a time" % tool.id )
+        rval = self._create_jobs( tool, trans, incomings, set_output_hid, set_output_history, history, job_params )
+        for job, out_data in rval:
+            trans.app.job_queue.put( job.id, tool )
+        trans.log_event( "Added jobs to the job queue, ids: %s" % ", ".join( [ str( job.id ) for job, out_data in rval ] ), tool_id=tool.id )
+        return rval
+
+    def _create_jobs( self, tool, trans, incomings, set_output_hid, set_output_history, history, job_params ):
+        """
+        Create and return a ( job, outputs ) pair for running `tool` with each
+        of the parameter dictionaries in `incomings`, with two flushes in all:
+        one for the output datasets, which need ids before their files can be
+        created, and one for the jobs and their parameters and associations.
+        The jobs are not queued.
+        """
+        # Set history.
+        if not history:
+            history = trans.history
+        runs = [ self._prepare_outputs( tool, trans, incoming, history, job_params ) for incoming in incomings ]
+        # Add all the children to their parents
+        for run in runs:
+            for parent_name, child_name in run.parent_to_child_pairs:
+                parent_dataset = run.out_data[ parent_name ]
+                child_dataset = run.out_data[ child_name ]
+                parent_dataset.children.append( child_dataset )
+        # Store data after custom code runs 
+        trans.sa_session.flush()
+        new_top_level = []
+        for run in runs:
+            # Create an empty file immediately.  The first dataset will be
+            # created in the "default" store, all others will be created in
+            # the same store as the first.
+            object_store_id = None
+            for data in run.out_data.values():
+                data.dataset.object_store_id = object_store_id
+                try:
+                    trans.app.object_store.create( data.dataset, **run.placement_hints )
+                except ObjectInvalid:
+                    raise Exception('Unable to create output dataset: object store is full')
+                object_store_id = data.dataset.object_store_id      # these will be the same thing after the first output
+            run.object_store_id = object_store_id
+            for name, data in run.out_data.items():
+                if name not in run.child_dataset_names and name not in run.incoming: #don't add children; or already existing datasets, i.e. async created
+                    new_top_level.append( data )
+        # Add all the top-level (non-child) datasets to the history unless otherwise specified
+        if set_output_history:
+            history.add_datasets( trans.sa_session, new_top_level, set_hid = set_output_hid )
+        galaxy_session = trans.get_galaxy_session()
+        current_user_roles = trans.get_current_user_roles()
+        rval = []
+        for run in runs:
+            # Create the job object
+            job = trans.app.model.Job()
+            # If we're submitting from the API, there won't be a session.
+            if type( galaxy_session ) == trans.model.GalaxySession:
+                job.session_id = galaxy_session.id
+            if trans.user is not None:
+                job.user_id = trans.user.id
+            job.history = history
+            job.tool_id = tool.id
+            try:
+                # For backward compatibility, some tools may not have versions yet.
+                job.tool_version = tool.version
+            except:
+                job.tool_version = "1.0.0"
+            # FIXME: Don't need all of incoming here, just the defined parameters
+            #        from the tool. We need to deal with tools that pass all post
+            #        parameters to the command as a special case.
+            for name, value in tool.params_to_strings( run.incoming, trans.app ).iteritems():
+                job.add_parameter( name, value )
+            for name, dataset in run.inp_data.iteritems():
+                if dataset:
+                    if not trans.app.security_agent.can_access_dataset( current_user_roles, dataset.dataset ):
+                        raise "User does not have permission to use a dataset (%s) provided for input." % dataset.id
+                    job.add_input_dataset( name, dataset )
+                else:
+                    job.add_input_dataset( name, None )
+            for name, dataset in run.out_data.iteritems():
+                job.add_output_dataset( name, dataset )
+            job.object_store_id = run.object_store_id
+            if job_params:
+                job.params = to_json_string( job_params )
+            trans.sa_session.add( job )
+            rval.append( ( job, run.out_data ) )
+        trans.sa_session.flush()
+        return rval
+
+    def _prepare_outputs( self, tool, trans, incoming, history, job_params ):
+        """
+        Collect the input datasets for running `tool` with `incoming`, and
+        build (but do not flush) its output datasets.
+        """
         def make_dict_copy( from_dict ):
             """
             Makes a copy of input dictionary from_dict such that all values that are dictionaries
@@ -165,11 +300,7 @@ class DefaultToolAction( object ):
                     input_values[ input.name ] = galaxy.tools.SelectToolParameterWrapper( input, input_values[ input.name ], tool.app, other_values = incoming )
                 else:
                     input_values[ input.name ] = galaxy.tools.InputValueWrapper( input, input_values[ input.name ], incoming )
-        
-        # Set history.
-        if not history:
-            history = trans.history
-        
+
         out_data = odict()
         # Collect any input datasets from the incoming parameters
         inp_data = self.collect_input_datasets( tool, incoming, trans )
@@ -243,7 +374,13 @@ class DefaultToolAction( object ):
         # datasets first, then create the associations
         parent_to_child_pairs = []
         child_dataset_names = set()
-        object_store_id = None
+        # Tell object stores choosing where to create the outputs how big they
+        # may be (as big as the inputs) and where the job is likely to run.
+        placement_hints = dict( size_hint=sum( [ inp.dataset.file_size or 0 for inp in inp_data.values() if inp ] ) )
+        try:
+            placement_hints[ 'destination' ] = tool.get_job_runner_url( job_params )
+        except Exception, e:
+            log.debug( 'Could not determine the job runner of tool %s: %s' % ( tool.id, e ) )
         for name, output in tool.outputs.items():
             for filter in output.filters:
                 try:
@@ -299,22 +436,13 @@ class DefaultToolAction( object ):
                                         if check is not None:
                                             if str( getattr( check, when_elem.get( 'attribute' ) ) ) == when_elem.get( 'value', None ):
                                                 ext = when_elem.get( 'format', ext )
-                    data = trans.app.model.HistoryDatasetAssociation( extension=ext, create_dataset=True, sa_session=trans.sa_session )
+                    # The dataset gets its id, and permissions, when the
+                    # outputs of all the jobs being created are flushed
+                    data = trans.app.model.HistoryDatasetAssociation( extension=ext, dataset=trans.app.model.Dataset( state=trans.app.model.Dataset.states.NEW ) )
                     if output.hidden:
                         data.visible = False
-                    # Commit the dataset immediately so it gets database assigned unique id
                     trans.sa_session.add( data )
-                    trans.sa_session.flush()
-                    trans.app.security_agent.set_all_dataset_permissions( data.dataset, output_permissions )
-                # Create an empty file immediately.  The first dataset will be
-                # created in the "default" store, all others will be created in
-                # the same store as the first.
-                data.dataset.object_store_id = object_store_id
-                try:
-                    trans.app.object_store.create( data.dataset )
-                except ObjectInvalid:
-                    raise Exception('Unable to create output dataset: object store is full')
-                object_store_id = data.dataset.object_store_id      # these will be the same thing after the first output
+                    trans.app.security_agent.set_all_dataset_permissions( data.dataset, output_permissions, flush=False )
                 # This may not be neccesary with the new parent/child associations
                 data.designation = name
                 # Copy metadata from one of the inputs if requested. 
@@ -352,80 +480,9 @@ class DefaultToolAction( object ):
                     output_action_params = dict( out_data )
                     output_action_params.update( incoming )
                     output.actions.apply_action( data, output_action_params )
-                # Store all changes to database
-                trans.sa_session.flush()
-        # Add all the top-level (non-child) datasets to the history unless otherwise specified
-        for name in out_data.keys():
-            if name not in child_dataset_names and name not in incoming: #don't add children; or already existing datasets, i.e. async created
-                data = out_data[ name ]
-                if set_output_history:
-                    history.add_dataset( data, set_hid = set_output_hid )
-                trans.sa_session.add( data )
-                trans.sa_session.flush()
-        # Add all the children to their parents
-        for parent_name, child_name in parent_to_child_pairs:
-            parent_dataset = out_data[ parent_name ]
-            child_dataset = out_data[ child_name ]
-            parent_dataset.children.append( child_dataset )
-        # Store data after custom code runs 
-        trans.sa_session.flush()
-        # Create the job object
-        job = trans.app.model.Job()
-        galaxy_session = trans.get_galaxy_session()
-        # If we're submitting from the API, there won't be a session.
-        if type( galaxy_session ) == trans.model.GalaxySession:
-            job.session_id = galaxy_session.id
-        if trans.user is not None:
-            job.user_id = trans.user.id
-        job.history_id = history.id
-        job.tool_id = tool.id
-        try:
-            # For backward compatibility, some tools may not have versions yet.
-            job.tool_version = tool.version
-        except:
-            job.tool_version = "1.0.0"
-        # FIXME: Don't need all of incoming here, just the defined parameters
-        #        from the tool. We need to deal with tools that pass all post
-        #        parameters to the command as a special case.
-        for name, value in tool.params_to_strings( incoming, trans.app ).iteritems():
-            job.add_parameter( name, value )
-        current_user_roles = trans.get_current_user_roles()
-        for name, dataset in inp_data.iteritems():
-            if dataset:
-                if not trans.app.security_agent.can_access_dataset( current_user_roles, dataset.dataset ):
-                    raise "User does not have permission to use a dataset (%s) provided for input." % data.id
-                job.add_input_dataset( name, dataset )
-            else:
-                job.add_input_dataset( name, None )
-        for name, dataset in out_data.iteritems():
-            job.add_output_dataset( name, dataset )
-        job.object_store_id = object_store_id
-        if job_params:
-            job.params = to_json_string( job_params )
-        trans.sa_session.add( job )
-        trans.sa_session.flush()
-        # Some tools are not really executable, but jobs are still created for them ( for record keeping ).
-        # Examples include tools that redirect to other applications ( epigraph ).  These special tools must
-        # include something that can be retrieved from the params ( e.g., REDIRECT_URL ) to keep the job
-        # from being queued.
-        if 'REDIRECT_URL' in incoming:
-            # Get the dataset - there should only be 1
-            for name in inp_data.keys():
-                dataset = inp_data[ name ]
-            redirect_url = tool.parse_redirect_url( dataset, incoming )
-            # GALAXY_URL should be include in the tool params to enable the external application 
-            # to send back to the current Galaxy instance
-            GALAXY_URL = incoming.get( 'GALAXY_URL', None )
-            assert GALAXY_URL is not None, "GALAXY_URL parameter missing in tool config."
-            redirect_url += "&GALAXY_URL=%s" % GALAXY_URL
-            # Job should not be queued, so set state to ok
-            job.state = trans.app.model.Job.states.OK
-            job.info = "Redirected to: %s" % redirect_url
-            trans.sa_session.add( job )
-            trans.sa_session.flush()
-            trans.response.send_redirect( url_for( controller='tool_runner', action='redirect', redirect_url=redirect_url ) )
-        else:
-            # Queue the job for execution
-            trans.app.job_queue.put( job.id, tool )
-            trans.log_event( "Added job to the job queue, id: %s" % str(job.id), tool_id=job.tool_id )
-            return job, out_data
+        return Bunch( incoming = incoming,
+                      inp_data = inp_data,
+                      out_data = out_data,
+                      child_dataset_names = child_dataset_names,
+                      parent_to_child_pairs = parent_to_child_pairs,
+                      placement_hints = placement_hints )
@@ -75,7 +75,8 @@ class SetMetadataToolAction( ToolAction ):
                                                                       config_file = app.config.config_file,
                                                                       datatypes_config = app.datatypes_registry.integrated_datatypes_configs,
                                                                       job_metadata = None,
-                                                                      kwds = { 'overwrite' : overwrite } )
+                                                                      kwds = { 'overwrite' : overwrite },
+                                                                      worker_socket = app.config.metadata_worker_socket )
         incoming[ '__SET_EXTERNAL_METADATA_COMMAND_LINE__' ] = cmd_line
         for name, value in tool.params_to_strings( incoming, app ).iteritems():
             job.add_parameter( name, value )
@@ -167,7 +167,7 @@ class TabularToolDataTable( ToolDataTable ):
         # Configure columns
         self.parse_column_spec( config_element )
         # Read every file
-        all_rows = []
+        self.filenames = []
         for file_element in config_element.findall( 'file' ):
             found = False
             if tool_data_path:
@@ -180,7 +180,7 @@ class TabularToolDataTable( ToolDataTable ):
                filename = file_element.get( 'path' )
             if os.path.exists( filename ):
                 found = True
-                all_rows.extend( self.parse_file_fields( open( filename ) ) )
+                self.filenames.append( filename )
             else:
                 # Since the path attribute can include a hard-coded path to a specific directory
                 # (e.g., <file path="tool-data/cg_crr_files.loc" />) which may not be the same value
@@ -191,16 +191,65 @@ class TabularToolDataTable( ToolDataTable ):
                     corrected_filename = os.path.join( self.tool_data_path, file_name )
                     if os.path.exists( corrected_filename ):
                         found = True
-                        all_rows.extend( self.parse_file_fields( open( corrected_filename ) ) )
+                        self.filenames.append( corrected_filename )
             if not found:
                 self.missing_index_file = filename
                 log.warn( "Cannot find index file '%s' for tool data table '%s'" % ( filename, self.name ) )
-        self.data = all_rows
+        self.load_files()
     def handle_found_index_file( self, filename ):
         self.missing_index_file = None
-        self.data.extend( self.parse_file_fields( open( filename ) ) )
+        self.filenames.append( filename )
+        self.load_files()
+    def load_files( self ):
+        """
+        (Re)read the rows of the table from its files, noting when each file
+        was last modified so changes to them on disk can be picked up.
+        """
+        all_rows = []
+        mtimes = {}
+        for filename in self.filenames:
+            mtimes[ filename ] = self.get_mtime( filename )
+            try:
+                all_rows.extend( self.parse_file_fields( open( filename ) ) )
+            except IOError, e:
+                log.warn( "Cannot read index file '%s' for tool data table '%s': %s" % ( filename, self.name, e ) )
+        self.data = all_rows
+        # Maps of column values to rows, built as lookups ask for them
+        self.column_indexes = {}
+        self.mtimes = mtimes
+    def get_mtime( self, filename ):
+        try:
+            return os.path.getmtime( filename )
+        except OSError:
+            return None
+    def reload_if_changed( self ):
+        """
+        Reread the table if any of its files has changed on disk since it was
+        loaded.
+        """
+        for filename in self.filenames:
+            if self.get_mtime( filename ) != self.mtimes.get( filename ):
+                log.debug( "Reloading tool data table '%s' since '%s' changed" % ( self.name, filename ) )
+                self.load_files()
+                break
     def get_fields( self ):
+        self.reload_if_changed()
         return self.data
+    def get_fields_by_column_value( self, column, value ):
+        """
+        Return the rows whose field `column` (an index) is `value`, using a
+        hash index of the column instead of scanning the table.
+        """
+        self.reload_if_changed()
+        column_indexes = self.column_indexes
+        index = column_indexes.get( column, None )
+        if index is None:
+            index = {}
+            for fields in self.data:
+                if column < len( fields ):
+                    index.setdefault( fields[ column ], [] ).append( fields )
+            column_indexes[ column ] = index
+        return index.get( value, [] )
     def parse_column_spec( self, config_element ):
         """
         Parse column definitions, which can either be a set of 'column' elements
@@ -211,6 +260,7 @@ class TabularToolDataTable( ToolDataTable ):
         A column named 'value' is required. 
         """
         self.columns = {}
+        self.largest_index = 0
         if config_element.find( 'columns' ) is not None:
             column_names = util.xml_text( config_element.find( 'columns' ) )
             column_names = [ n.strip() for n in column_names.split( ',' ) ]
@@ -252,19 +302,16 @@ class TabularToolDataTable( ToolDataTable ):
         Returns table entry associated with a col/val pair.
         """
         query_col = self.columns.get( query_attr, None )
-        if not query_col:
+        if query_col is None:
             return None
         return_col = self.columns.get( return_attr, None )
-        if not return_col:
+        if return_col is None:
             return None
 
         # Look for table entry.
-        for fields in self.data:
-            if fields[ query_col ] == query_val:
-                rval = fields[ return_col ]
-                break
-
-        return rval
+        for fields in self.get_fields_by_column_value( query_col, query_val ):
+            return fields[ return_col ]
+        return None
 
 # Registry of tool data types by type_key
 tool_data_table_types = dict( [ ( cls.type_key, cls ) for cls in [ TabularToolDataTable ] ] )
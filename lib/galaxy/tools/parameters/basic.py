@@ -7,6 +7,7 @@ from elementtree.ElementTree import XML, Element
 from galaxy import config, datatypes, util
 from galaxy.web import form_builder
 from galaxy.util.bunch import Bunch
+from galaxy.util.odict import odict
 from galaxy.util import string_as_bool, sanitize_param
 from sanitize import ToolParameterSanitizer
 import validation, dynamic_options
@@ -1358,6 +1359,108 @@ class DrillDownSelectToolParameter( SelectToolParameter ):
 class DummyDataset( object ):
     pass
 
+class HistoryDatasetIndex( object ):
+    """
+    The datasets of a history that DataToolParameters choose from, collected
+    once per request and shared by all of the data parameters of a form (see
+    `get_history_dataset_index`).
+
+    The active datasets of the history and their children are grouped by
+    extension, so the datatype and conversion target of each extension are
+    only worked out once for each set of accepted formats, and whether the
+    current user can access the datasets is looked up with a bulk query
+    instead of a permissions query per dataset.
+    """
+    # Number of datasets to look up permissions for per query, keeping below
+    # the limit on query parameters of some databases (e.g. sqlite)
+    access_batch_size = 500
+
+    def __init__( self, trans, history ):
+        self.trans = trans
+        self.history = history
+        self.user_roles = trans.get_current_user_roles()
+        # ( hid, hda ) pairs in history order, children numbered after their parent
+        self.entries = []
+        self.__collect( history.active_datasets, None )
+        # The datasets checked so far, and maps of their ids to whether the
+        # user can access them and whether they are public
+        self.datasets = odict()
+        self.access = {}
+        self.public = {}
+        # get_matches() for each set of formats asked for
+        self.matches = {}
+        self.__check_access( [ hda for hid, hda in self.entries ] )
+
+    def __collect( self, hdas, parent_hid ):
+        for i, hda in enumerate( hdas ):
+            if parent_hid is not None:
+                hid = "%s.%d" % ( parent_hid, i + 1 )
+            else:
+                hid = str( hda.hid )
+            self.entries.append( ( hid, hda ) )
+            self.__collect( hda.children, hid )
+
+    def __batches( self, datasets ):
+        for i in range( 0, len( datasets ), self.access_batch_size ):
+            yield datasets[ i:i + self.access_batch_size ]
+
+    def __check_access( self, hdas ):
+        datasets = odict()
+        for hda in hdas:
+            if hda.dataset.id not in self.datasets:
+                datasets[ hda.dataset.id ] = hda.dataset
+        self.datasets.update( datasets )
+        for batch in self.__batches( datasets.values() ):
+            self.access.update( self.trans.app.security_agent.dataset_access_mapping( self.trans, self.user_roles, batch ) )
+
+    def can_access( self, data ):
+        return self.access[ data.dataset.id ]
+
+    def is_public( self, data ):
+        if data.dataset.id not in self.public:
+            unchecked = [ dataset for dataset_id, dataset in self.datasets.items() if dataset_id not in self.public ]
+            for batch in self.__batches( unchecked ):
+                self.public.update( self.trans.app.security_agent.datasets_are_public( self.trans, batch ) )
+        return self.public[ data.dataset.id ]
+
+    def get_matches( self, formats ):
+        """
+        The ( hid, hda, target extension, converted dataset ) of each dataset
+        of the history that either is one of `formats` (target extension is
+        None) or can be converted to one of them (converted dataset is None
+        while the conversion has not been run), in history order.
+        """
+        if formats not in self.matches:
+            # Whether each extension is one of the formats, or else the
+            # extension it can be converted to
+            targets = {}
+            matches = []
+            for hid, hda in self.entries:
+                if hda.extension not in targets:
+                    if isinstance( hda.datatype, formats ):
+                        targets[ hda.extension ] = ( True, None )
+                    else:
+                        targets[ hda.extension ] = ( False, hda.find_conversion_destination( formats )[0] )
+                is_format, target_ext = targets[ hda.extension ]
+                if is_format:
+                    matches.append( ( hid, hda, None, None ) )
+                elif target_ext:
+                    matches.append( ( hid, hda, target_ext, hda.get_converted_files_by_type( target_ext ) ) )
+            self.__check_access( [ converted_dataset for hid, hda, target_ext, converted_dataset in matches if converted_dataset ] )
+            self.matches[ formats ] = matches
+        return self.matches[ formats ]
+
+def get_history_dataset_index( trans, history ):
+    """
+    Return the HistoryDatasetIndex of `history` for this request, building it
+    the first time a data parameter asks for it.
+    """
+    index = getattr( trans, '_history_dataset_index', None )
+    if index is None or index.history is not history:
+        index = HistoryDatasetIndex( trans, history )
+        trans._history_dataset_index = index
+    return index
+
 class DataToolParameter( ToolParameter ):
     # TODO, Nate: Make sure the following unit tests appropriately test the dataset security
     # components.  Add as many additional tests as necessary.
@@ -1435,46 +1538,35 @@ class DataToolParameter( ToolParameter ):
             if type( value ) != list:
                 value = [ value ]
         field = form_builder.SelectField( self.name, self.multiple, None, self.refresh_on_change, refresh_on_change_values = self.refresh_on_change_values )
-        # CRUCIAL: the dataset_collector function needs to be local to DataToolParameter.get_html_field()
-        def dataset_collector( hdas, parent_hid ):
-            current_user_roles = trans.get_current_user_roles()
-            for i, hda in enumerate( hdas ):
-                if len( hda.name ) > 30:
-                    hda_name = '%s..%s' % ( hda.name[:17], hda.name[-11:] )
-                else:
-                    hda_name = hda.name
-                if parent_hid is not None:
-                    hid = "%s.%d" % ( parent_hid, i + 1 )
+        index = get_history_dataset_index( trans, history )
+        for hid, hda, target_ext, converted_dataset in index.get_matches( self.formats ):
+            if len( hda.name ) > 30:
+                hda_name = '%s..%s' % ( hda.name[:17], hda.name[-11:] )
+            else:
+                hda_name = hda.name
+            if not hda.dataset.state in [galaxy.model.Dataset.states.ERROR, galaxy.model.Dataset.states.DISCARDED] and \
+                ( hda.visible or ( value and hda in value and not hda.implicitly_converted_parent_datasets ) ) and \
+                index.can_access( hda ):
+                # If we are sending data to an external application, then we need to make sure there are no roles
+                # associated with the dataset that restrict it's access from "public".
+                if self.tool and self.tool.tool_type == 'data_destination' and not index.is_public( hda ):
+                    continue
+                if self.options and self._options_filter_attribute( hda ) != filter_value:
+                    continue
+                if target_ext is None:
+                    selected = ( value and ( hda in value ) )
+                    if hda.visible:
+                        hidden_text = ""
+                    else:
+                        hidden_text = " (hidden)"
+                    field.add_option( "%s:%s %s" % ( hid, hidden_text, hda_name ), hda.id, selected )
                 else:
-                    hid = str( hda.hid )
-                if not hda.dataset.state in [galaxy.model.Dataset.states.ERROR, galaxy.model.Dataset.states.DISCARDED] and \
-                    ( hda.visible or ( value and hda in value and not hda.implicitly_converted_parent_datasets ) ) and \
-                    trans.app.security_agent.can_access_dataset( current_user_roles, hda.dataset ):
-                    # If we are sending data to an external application, then we need to make sure there are no roles
-                    # associated with the dataset that restrict it's access from "public".
-                    if self.tool and self.tool.tool_type == 'data_destination' and not trans.app.security_agent.dataset_is_public( hda.dataset ):
-                        continue
-                    if self.options and self._options_filter_attribute( hda ) != filter_value:
+                    if converted_dataset:
+                        hda = converted_dataset
+                    if not index.can_access( hda ):
                         continue
-                    if isinstance( hda.datatype, self.formats):
-                        selected = ( value and ( hda in value ) )
-                        if hda.visible:
-                            hidden_text = ""
-                        else:
-                            hidden_text = " (hidden)"
-                        field.add_option( "%s:%s %s" % ( hid, hidden_text, hda_name ), hda.id, selected )
-                    else:
-                        target_ext, converted_dataset = hda.find_conversion_destination( self.formats )
-                        if target_ext:
-                            if converted_dataset:
-                                hda = converted_dataset
-                            if not trans.app.security_agent.can_access_dataset( current_user_roles, hda.dataset ):
-                                continue
-                            selected = ( value and ( hda in value ) )
-                            field.add_option( "%s: (as %s) %s" % ( hid, target_ext, hda_name ), hda.id, selected )
-                # Also collect children via association object
-                dataset_collector( hda.children, hid )
-        dataset_collector( history.active_datasets, None )
+                    selected = ( value and ( hda in value ) )
+                    field.add_option( "%s: (as %s) %s" % ( hid, target_ext, hda_name ), hda.id, selected )
         some_data = bool( field.options )
         if some_data:
             if value is None or len( field.options ) == 1:
@@ -1496,8 +1588,9 @@ class DataToolParameter( ToolParameter ):
 
     def get_initial_value_from_history_prevent_repeats( self, trans, context, already_used ):
         """
-        NOTE: This is wasteful since dynamic options and dataset collection
-              happens twice (here and when generating HTML). 
+        The most recent dataset of the history that this parameter accepts and
+        that is not in `already_used`.  The datasets are looked up in the
+        same per request index of the history as get_html_field() uses.
         """
         # Can't look at history in workflow mode
         if trans is None or trans.workflow_building_mode:
@@ -1514,29 +1607,14 @@ class DataToolParameter( ToolParameter ):
                 filter_value = self.options.get_options( trans, context )[0][0]
             except IndexError:
                 pass #no valid options
-        def dataset_collector( datasets ):
-            def is_convertable( dataset ):
-                target_ext, converted_dataset = dataset.find_conversion_destination( self.formats )
-                if target_ext is not None:
-                    return True
-                return False
-            for i, data in enumerate( datasets ):
-                if data.visible and not data.deleted and data.state not in [data.states.ERROR, data.states.DISCARDED]:
-                    is_valid = False
-                    if isinstance( data.datatype, self.formats ):
-                        is_valid = True
-                    else:
-                        target_ext, converted_dataset = data.find_conversion_destination( self.formats )
-                        if target_ext:
-                            is_valid = True
-                        if converted_dataset:
-                            data = converted_dataset
-                    if not is_valid or ( self.options and self._options_filter_attribute( data ) != filter_value ):
-                        continue
-                    most_recent_dataset.append(data)
-                # Also collect children via association object
-                dataset_collector( data.children )
-        dataset_collector( history.datasets )
+        index = get_history_dataset_index( trans, history )
+        for hid, data, target_ext, converted_dataset in index.get_matches( self.formats ):
+            if data.visible and not data.deleted and data.state not in [data.states.ERROR, data.states.DISCARDED]:
+                if converted_dataset:
+                    data = converted_dataset
+                if not index.can_access( data ) or ( self.options and self._options_filter_attribute( data ) != filter_value ):
+                    continue
+                most_recent_dataset.append(data)
         most_recent_dataset.reverse()
         if already_used is not None:
             for val in most_recent_dataset:
@@ -368,15 +368,8 @@ class SortByColumnFilter( Filter ):
         assert column is not None, "Required 'column' attribute missing from filter"
         self.column = d_option.column_spec_to_index( column )
     def filter_options( self, options, trans, other_values ):
-        rval = []
-        for i, fields in enumerate( options ):
-            for j in range( 0, len( rval ) ):
-                if fields[self.column] < rval[j][self.column]:
-                    rval.insert( j, fields )
-                    break
-            else:
-                rval.append( fields )
-        return rval
+        # sorted() is stable, so options with equal values keep their order
+        return sorted( options, key=lambda fields: fields[self.column] )
 
 
 filter_types = dict( data_meta = DataMetaFilter,
@@ -391,6 +384,8 @@ filter_types = dict( data_meta = DataMetaFilter,
 
 class DynamicOptions( object ):
     """Handles dynamically generated SelectToolParameter options"""
+    # Number of datasets to keep the parsed options of (see get_dataset_fields)
+    dataset_fields_cache_size = 16
     def __init__( self, elem, tool_param  ):
         def load_from_parameter( from_parameter, transform_lines = None ):
             obj = self.tool_param
@@ -416,6 +411,12 @@ class DynamicOptions( object ):
         self.line_startswith = elem.get( 'startswith', None )
         data_file = elem.get( 'from_file', None )
         self.index_file = None
+        # Path and modification time of the file the options were read from,
+        # to reread it when it changes
+        self.index_file_path = None
+        self.index_file_mtime = None
+        # Options parsed from datasets, keyed by dataset and file modification time
+        self.dataset_fields = {}
         self.missing_index_file = None
         dataset_file = elem.get( 'from_dataset', None )
         from_parameter = elem.get( 'from_parameter', None )
@@ -449,7 +450,8 @@ class DynamicOptions( object ):
                     full_path = os.path.join( self.tool_param.tool.app.config.tool_data_path, data_file )
                     if os.path.exists( full_path ):
                         self.index_file = data_file
-                        self.file_fields = self.parse_file_fields( open( full_path ) )
+                        self.index_file_path = full_path
+                        self.load_index_file()
                     else:
                         self.missing_index_file = data_file
             elif dataset_file is not None:
@@ -508,6 +510,44 @@ class DynamicOptions( object ):
                     rval.append( fields )
         return rval
     
+    def load_index_file( self ):
+        self.index_file_mtime = os.path.getmtime( self.index_file_path )
+        self.file_fields = self.parse_file_fields( open( self.index_file_path ) )
+
+    def reload_index_file_if_changed( self ):
+        try:
+            mtime = os.path.getmtime( self.index_file_path )
+        except OSError:
+            # Keep the options we have if the file went away
+            return
+        if mtime != self.index_file_mtime:
+            log.debug( "Reloading options from '%s' since it changed" % self.index_file_path )
+            self.load_index_file()
+
+    def get_dataset_fields( self, dataset ):
+        """
+        Return the options parsed from `dataset`, parsing it only the first
+        time it is used or when its file has changed since.
+        """
+        path = dataset.file_name
+        file_size = os.path.getsize( path )
+        key = ( getattr( dataset, 'id', None ), path, os.path.getmtime( path ), file_size )
+        fields = self.dataset_fields.get( key, None )
+        if fields is None:
+            # Ensure parsing dynamic options does not consume more than a megabyte worth memory.
+            if file_size < 1048576:
+                fields = self.parse_file_fields( open( path ) )
+            else:
+                # Pass just the first megabyte to parse_file_fields. 
+                import StringIO
+                log.warn( "Attempting to load options from large file, reading just first megabyte" )
+                contents = open( path, 'r' ).read( 1048576 )
+                fields = self.parse_file_fields( StringIO.StringIO( contents ) )
+            if len( self.dataset_fields ) >= self.dataset_fields_cache_size:
+                self.dataset_fields.clear()
+            self.dataset_fields[ key ] = fields
+        return fields
+
     def get_dependency_names( self ):
         """
         Return the names of parameters these options depend on -- both data
@@ -527,20 +567,12 @@ class DynamicOptions( object ):
             dataset = other_values.get( self.dataset_ref_name, None )
             assert dataset is not None, "Required dataset '%s' missing from input" % self.dataset_ref_name
             if not dataset: return [] #no valid dataset in history
-            # Ensure parsing dynamic options does not consume more than a megabyte worth memory.
-            path = dataset.file_name
-            file_size = os.path.getsize( path )
-            if os.path.getsize( path ) < 1048576:
-                options = self.parse_file_fields( open( path ) )
-            else:
-                # Pass just the first megabyte to parse_file_fields. 
-                import StringIO
-                log.warn( "Attempting to load options from large file, reading just first megabyte" )
-                contents = open( path, 'r' ).read( 1048576 )
-                options = self.parse_file_fields( StringIO.StringIO( contents ) )
+            options = list( self.get_dataset_fields( dataset ) )
         elif self.tool_data_table:
-            options = self.tool_data_table.get_fields()
+            options = list( self.tool_data_table.get_fields() )
         else:
+            if self.index_file_path is not None:
+                self.reload_index_file_if_changed()
             options = list( self.file_fields )
         for filter in self.filters:
             options = filter.filter_options( options, trans, other_values )
@@ -550,8 +582,11 @@ class DynamicOptions( object ):
         """
         Return a list of fields with column 'value' matching provided value.
         """
-        rval = []
         val_index = self.columns[ 'value' ]
+        if self.tool_data_table and not self.filters:
+            # Look the value up in the table's index of the column
+            return list( self.tool_data_table.get_fields_by_column_value( val_index, value ) )
+        rval = []
         for fields in self.get_fields( trans, other_values ):
             if fields[ val_index ] == value:
                 rval.append( fields )
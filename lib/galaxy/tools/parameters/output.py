@@ -208,7 +208,7 @@ class FromDataTableOutputActionOption( ToolOutputActionOption ):
         assert self.name is not None, "Required 'name' attribute missing from FromDataTableOutputActionOption"
         self.missing_tool_data_table_name = None
         if self.name in self.tool.app.tool_data_tables:
-            self.options = self.tool.app.tool_data_tables[ self.name ].get_fields()
+            self.tool_data_table = self.tool.app.tool_data_tables[ self.name ]
             self.column = elem.get( 'column', None )
             assert self.column is not None, "Required 'column' attribute missing from FromDataTableOutputActionOption"
             self.column = int( self.column )
@@ -217,7 +217,8 @@ class FromDataTableOutputActionOption( ToolOutputActionOption ):
         else:
             self.missing_tool_data_table_name = self.name
     def get_value( self, other_values ):
-        options = self.options
+        # Get the rows on each use, so changes to the table's files are seen
+        options = self.tool_data_table.get_fields()
         for filter in self.filters:
             options = filter.filter_options( options, other_values )
         try:
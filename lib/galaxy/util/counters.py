@@ -0,0 +1,84 @@
+"""
+Thread-safe named counters for instrumenting Galaxy's background workers.
+
+Components keep a `Counters` instance and bump it from whatever thread does
+the work; `snapshot()` returns a plain dictionary suitable for logging or
+returning from the API.
+
+>>> c = Counters( 'queries', 'hits' )
+>>> c.incr( 'queries' )
+1
+>>> c.incr( 'queries', 2 )
+3
+>>> c.incr( 'misses' )
+1
+>>> sorted( c.snapshot().items() )
+[('hits', 0), ('misses', 1), ('queries', 3)]
+>>> c.ratio( 'hits', 'misses' )
+0.0
+>>> c.set( 'hits', 3 )
+>>> c.ratio( 'hits', 'misses' )
+0.75
+>>> c.reset()
+>>> sorted( c.snapshot().items() )
+[('hits', 0), ('misses', 0), ('queries', 0)]
+"""
+
+import threading
+
+class Counters( object ):
+    """
+    A collection of named integer counters protected by a single lock.
+    """
+    def __init__( self, *names ):
+        self.lock = threading.Lock()
+        self.values = dict( [ ( name, 0 ) for name in names ] )
+
+    def incr( self, name, amount=1 ):
+        self.lock.acquire()
+        try:
+            value = self.values.get( name, 0 ) + amount
+            self.values[ name ] = value
+            return value
+        finally:
+            self.lock.release()
+
+    def set( self, name, value ):
+        self.lock.acquire()
+        try:
+            self.values[ name ] = value
+        finally:
+            self.lock.release()
+
+    def get( self, name, default=0 ):
+        return self.values.get( name, default )
+
+    def ratio( self, name, other ):
+        """
+        Return `name / ( name + other )`, e.g. a hit ratio from hit and miss
+        counts, or 0.0 if both are zero.
+        """
+        self.lock.acquire()
+        try:
+            a = self.values.get( name, 0 )
+            total = a + self.values.get( other, 0 )
+        finally:
+            self.lock.release()
+        if not total:
+            return 0.0
+        return float( a ) / total
+
+    def snapshot( self ):
+        self.lock.acquire()
+        try:
+            return dict( self.values )
+        finally:
+            self.lock.release()
+
+    def reset( self ):
+        self.lock.acquire()
+        try:
+            for name in self.values:
+                self.values[ name ] = 0
+        finally:
+            self.lock.release()
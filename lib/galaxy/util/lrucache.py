@@ -1,72 +1,299 @@
 """
 Kanwei Li, 03/2010
 
-Simple LRU cache that uses a dictionary to store a specified number of objects
-at a time.
+Thread-safe LRU cache backed by a dictionary and a doubly-linked list, so
+that lookups, insertions and evictions are all O(1).
+
+The cache can be bounded by number of entries, by total size in bytes, or
+both, and entries can optionally expire after a time-to-live.  For backwards
+compatibility, looking up a missing key with [] returns None rather than
+raising KeyError.
+
+>>> lru = LRUCache( 2 )
+>>> for i in range( 0, 4 ):
+...     lru[i] = i
+>>> lru[0], lru[1], lru[2], lru[3]
+(None, None, 2, 3)
+>>> lru.__setitem__( "hello", "world" )
+'world'
+>>> lru[2]
+>>> lru.clear()
+>>> lru["hello"], lru[3]
+(None, None)
+
+Recently used items are kept:
+
+>>> lru[0] = 0
+>>> lru[1] = 1
+>>> ping = lru[0]
+>>> lru[2] = 2
+>>> lru[0], lru[1], lru[2]
+(0, None, 2)
+
+Hits, misses and evictions are counted:
+
+>>> lru = LRUCache( 1 )
+>>> lru['a'] = 1
+>>> lru['b'] = 2
+>>> lru['a'], lru['b']
+(None, 2)
+>>> sorted( lru.stats().items() )
+[('bytes', 0), ('entries', 1), ('evictions', 1), ('expirations', 0), ('hits', 1), ('misses', 1)]
+
+Size-aware eviction:
+
+>>> lru = LRUCache( max_bytes=10 )
+>>> lru.set( 'a', 'aaaa' )
+>>> lru.set( 'b', 'bbbb' )
+>>> lru.set( 'c', 'cccc' )
+>>> 'a' in lru, 'b' in lru, 'c' in lru
+(False, True, True)
+>>> lru.current_bytes
+8
+>>> lru.set( 'big', 'x', size=100 )
+>>> 'big' in lru
+False
+
+An `on_evict` callback is told about entries evicted to make room (and
+values too big to be cached), e.g. to remove the files they describe:
+
+>>> evicted = []
+>>> lru = LRUCache( max_bytes=10, on_evict=lambda key, value: evicted.append( key ) )
+>>> lru.set( 'a', 'aaaa' )
+>>> lru.set( 'b', 'bbbbbbbb' )
+>>> lru.set( 'big', 'x', size=100 )
+>>> evicted
+['a', 'big']
+
+Time-to-live:
+
+>>> lru = LRUCache( 10, ttl=60 )
+>>> lru.set( 'a', 1, now=0 )
+>>> lru.get( 'a', now=59 )
+1
+>>> lru.get( 'a', now=61 )
+>>> lru.stats()['expirations']
+1
+
+Computing missing values:
+
+>>> calls = []
+>>> def compute():
+...     calls.append( 1 )
+...     return 'value'
+>>> lru.get_or_compute( 'k', compute )
+'value'
+>>> lru.get_or_compute( 'k', compute )
+'value'
+>>> len( calls )
+1
 """
 
-class LRUCache:
-    def clear(self):
-        ''' Clears/initiates storage variables'''
-        self.key_ary = []
-        self.obj_cache = {}
-        
-    def __init__(self, num_elements):
+import sys
+import time
+import threading
+
+# Indexes into the linked list nodes
+PREV, NEXT, KEY, VALUE, SIZE, EXPIRES = 0, 1, 2, 3, 4, 5
+
+def default_sizeof( value ):
+    """Estimate the size in bytes of a cached value."""
+    if isinstance( value, basestring ):
+        return len( value )
+    return sys.getsizeof( value )
+
+class LRUCache( object ):
+    def __init__( self, num_elements=None, max_bytes=None, ttl=None, sizeof=default_sizeof, on_evict=None ):
+        """
+        `num_elements` and `max_bytes` bound the number of entries and their
+        total size; either may be None for no limit.  `ttl` is the default
+        number of seconds an entry stays valid.  `sizeof` is used to size
+        values when `max_bytes` is set and no explicit size is given.
+        `on_evict( key, value )` is called, outside of the cache's lock, for
+        each entry evicted by `set`.
+        """
         self.num_elements = num_elements
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sizeof = sizeof
+        self.on_evict = on_evict
+        self.lock = threading.RLock()
+        # Keys currently being computed by get_or_compute, mapped to an Event
+        self.pending = {}
+        self.hits = self.misses = self.evictions = self.expirations = 0
         self.clear()
 
-    def __getitem__(self, key):
-        ''' Return value of key, or None if key is not in cache '''
+    def clear( self ):
+        ''' Clears/initiates storage variables'''
+        self.lock.acquire()
         try:
-            index = self.key_ary.index(key)
-        except ValueError:
-            return None
-        # Move this key to the end
-        self.key_ary.remove(key)
-        self.key_ary.append(key)
-        return self.obj_cache[key]
-    
-    def __setitem__(self, key, value):
+            self.map = {}
+            # Circular doubly-linked list, root[NEXT] is least recently used
+            self.root = []
+            self.root[:] = [ self.root, self.root, None, None, 0, None ]
+            self.current_bytes = 0
+        finally:
+            self.lock.release()
+
+    def __len__( self ):
+        return len( self.map )
+
+    def __contains__( self, key ):
+        self.lock.acquire()
+        try:
+            node = self.map.get( key )
+            return node is not None and not self.__expired( node, time.time() )
+        finally:
+            self.lock.release()
+
+    def __getitem__( self, key ):
+        ''' Return value of key, or None if key is not in cache '''
+        return self.get( key )
+
+    def __setitem__( self, key, value ):
         ''' Sets a new value to a key '''
-        if key not in self.obj_cache:
-            if len(self.key_ary) >= self.num_elements:
-                deleted_key = self.key_ary.pop(0) # Remove first element
-                del self.obj_cache[deleted_key]
-            self.key_ary.append(key)
-        self.obj_cache[key] = value
+        self.set( key, value )
         return value
 
-if __name__ == "__main__":
-    import unittest
-    
-    class TestLRUCache(unittest.TestCase):
-        def test_lru(self):
-            lru = LRUCache(2)
-            for i in range(0, 4): # Insert 4 numbers
-                lru[i] = i
-            self.assertEqual( lru[0], None )
-            self.assertEqual( lru[1], None )
-            self.assertEqual( lru[2], 2 )
-            self.assertEqual( lru[3], 3 )
-            
-            self.assertEqual( lru.__setitem__("hello", "world"), "world")
-            self.assertEqual( lru[2], None )
-            
-            lru.clear()
-            self.assertEqual( lru["hello"], None )
-            self.assertEqual( lru[3], None )
-            
-            # Test if recently used item is kept
-            lru[0] = 0
-            lru[1] = 1
-            # Now saturated
-            ping = lru[0]
-            lru[2] = 2
-            # Should keep 0, delete 1
-            self.assertEqual( lru[0], 0 )
-            self.assertEqual( lru[1], None )
-            self.assertEqual( lru[2], 2 )
-            
-    unittest.main()
-            
-            
\ No newline at end of file
+    def __delitem__( self, key ):
+        self.pop( key )
+
+    def __expired( self, node, now ):
+        return node[EXPIRES] is not None and node[EXPIRES] <= now
+
+    def __unlink( self, node ):
+        node[PREV][NEXT] = node[NEXT]
+        node[NEXT][PREV] = node[PREV]
+        del self.map[ node[KEY] ]
+        self.current_bytes -= node[SIZE]
+
+    def __append( self, node ):
+        # Insert just before root, i.e. as the most recently used entry
+        last = self.root[PREV]
+        node[PREV] = last
+        node[NEXT] = self.root
+        last[NEXT] = self.root[PREV] = node
+        self.map[ node[KEY] ] = node
+        self.current_bytes += node[SIZE]
+
+    def get( self, key, default=None, now=None ):
+        """Return the value for `key` (marking it recently used) or `default`."""
+        if now is None:
+            now = time.time()
+        self.lock.acquire()
+        try:
+            node = self.map.get( key )
+            if node is None:
+                self.misses += 1
+                return default
+            if self.__expired( node, now ):
+                self.__unlink( node )
+                self.expirations += 1
+                self.misses += 1
+                return default
+            # Move to the most recently used position
+            node[PREV][NEXT] = node[NEXT]
+            node[NEXT][PREV] = node[PREV]
+            last = self.root[PREV]
+            node[PREV] = last
+            node[NEXT] = self.root
+            last[NEXT] = self.root[PREV] = node
+            self.hits += 1
+            return node[VALUE]
+        finally:
+            self.lock.release()
+
+    def set( self, key, value, size=None, ttl=None, now=None ):
+        """
+        Store `value` under `key`, evicting least recently used entries as
+        needed.  Values larger than `max_bytes` are not cached at all.
+        """
+        if now is None:
+            now = time.time()
+        if size is None:
+            if self.max_bytes is not None:
+                size = self.sizeof( value )
+            else:
+                size = 0
+        if ttl is None:
+            ttl = self.ttl
+        expires = None
+        if ttl is not None:
+            expires = now + ttl
+        evicted = []
+        self.lock.acquire()
+        try:
+            node = self.map.get( key )
+            if node is not None:
+                self.__unlink( node )
+            if self.max_bytes is not None and size > self.max_bytes:
+                evicted.append( ( key, value ) )
+            else:
+                self.__append( [ None, None, key, value, size, expires ] )
+                while ( self.num_elements is not None and len( self.map ) > self.num_elements ) or \
+                      ( self.max_bytes is not None and self.current_bytes > self.max_bytes ):
+                    node = self.root[NEXT]
+                    self.__unlink( node )
+                    self.evictions += 1
+                    evicted.append( ( node[KEY], node[VALUE] ) )
+        finally:
+            self.lock.release()
+        if self.on_evict is not None:
+            for evicted_key, evicted_value in evicted:
+                self.on_evict( evicted_key, evicted_value )
+
+    def pop( self, key, default=None ):
+        self.lock.acquire()
+        try:
+            node = self.map.get( key )
+            if node is None:
+                return default
+            self.__unlink( node )
+            return node[VALUE]
+        finally:
+            self.lock.release()
+
+    def get_or_compute( self, key, compute, size=None, ttl=None ):
+        """
+        Return the cached value for `key`, calling `compute()` to produce (and
+        cache) it if necessary.  Concurrent callers asking for the same
+        missing key wait for the first caller's result instead of computing
+        it again.
+        """
+        while True:
+            self.lock.acquire()
+            try:
+                node = self.map.get( key )
+                if node is not None and not self.__expired( node, time.time() ):
+                    return self.get( key )
+                event = self.pending.get( key )
+                if event is None:
+                    self.misses += 1
+                    event = self.pending[ key ] = threading.Event()
+                    break
+            finally:
+                self.lock.release()
+            # Another thread is computing this key, wait and look again.  If
+            # its compute failed, the key is still missing and we try ourselves.
+            event.wait()
+        try:
+            value = compute()
+            self.set( key, value, size=size, ttl=ttl )
+            return value
+        finally:
+            self.lock.acquire()
+            try:
+                del self.pending[ key ]
+            finally:
+                self.lock.release()
+            event.set()
+
+    def stats( self ):
+        """Return a dictionary of counters describing cache effectiveness."""
+        self.lock.acquire()
+        try:
+            return dict( hits=self.hits, misses=self.misses, evictions=self.evictions,
+                         expirations=self.expirations, entries=len( self.map ),
+                         bytes=self.current_bytes )
+        finally:
+            self.lock.release()
@@ -1,44 +1,260 @@
 """
-A simple wrapper for writing tarballs as a stream.
+Simple wrappers for writing tarballs and zip archives as a stream.
+
+Member files are read in chunks and the archive is written to the response as
+it is produced, so no temporary copy of the archive is made and memory use
+does not grow with the size of the download.
 """
-import os
+import os, time, struct, zlib
 import logging, tarfile
+try:
+    import bz2
+except ImportError:
+    bz2 = None
 
 log = logging.getLogger( __name__ )
 
+# Size of the chunks member files are read in
+CHUNK_SIZE = 65536
+
+# Members with these extensions are already compressed, so ZipBall stores them
+# as they are rather than deflating them again
+COMPRESSED_EXTENSIONS = [ '.bam', '.bz2', '.gif', '.gz', '.jpeg', '.jpg', '.png', '.sff', '.tbz', '.tbz2', '.tgz', '.zip' ]
+
+class ResponseWriter( object ):
+    """
+    File like wrapper of a WSGI write callable that keeps count of the bytes
+    written, for the offsets of zip records and for logging throughput.
+    """
+    def __init__( self, response_write ):
+        self.response_write = response_write
+        self.bytes = 0
+        self.start = time.time()
+    def write( self, data ):
+        if data:
+            self.bytes += len( data )
+            self.response_write( data )
+    def log_throughput( self, description ):
+        elapsed = time.time() - self.start
+        if elapsed > 0:
+            rate = self.bytes / elapsed / 1048576
+        else:
+            rate = 0.0
+        log.info( "Streamed %s archive of %d bytes in %.2f seconds (%.2f MB/s)" % ( description, self.bytes, elapsed, rate ) )
+
+class CompressedWriter( object ):
+    """
+    File like object that compresses what is written to it in the gzip or
+    bzip2 format and passes the result on to `fileobj`.
+    """
+    def __init__( self, fileobj, comptype, compresslevel ):
+        self.fileobj = fileobj
+        self.comptype = comptype
+        if comptype == 'gz':
+            self.compressor = zlib.compressobj( compresslevel, zlib.DEFLATED, -zlib.MAX_WBITS, zlib.DEF_MEM_LEVEL, 0 )
+            self.crc = zlib.crc32( '' ) & 0xffffffffL
+            self.size = 0
+            if compresslevel == 9:
+                xfl = '\002'
+            elif compresslevel == 1:
+                xfl = '\004'
+            else:
+                xfl = '\000'
+            fileobj.write( '\037\213\010\000' + struct.pack( '<L', long( time.time() ) ) + xfl + '\377' )
+        elif comptype == 'bz2':
+            if bz2 is None:
+                raise tarfile.CompressionError( "bz2 module is not available" )
+            self.compressor = bz2.BZ2Compressor( max( compresslevel, 1 ) )
+        else:
+            raise tarfile.CompressionError( "unknown compression type %r" % comptype )
+    def write( self, data ):
+        if self.comptype == 'gz':
+            self.crc = zlib.crc32( data, self.crc ) & 0xffffffffL
+            self.size += len( data )
+        self.fileobj.write( self.compressor.compress( data ) )
+    def close( self ):
+        self.fileobj.write( self.compressor.flush() )
+        if self.comptype == 'gz':
+            self.fileobj.write( struct.pack( '<LL', self.crc, self.size & 0xffffffffL ) )
+
 class StreamBall( object ):
-    def __init__( self, mode, members=None ):
+    def __init__( self, mode, members=None, compresslevel=9 ):
         self.members = members
         if members is None:
             self.members = {}
         self.mode = mode
+        self.compresslevel = compresslevel
         self.wsgi_status = None
         self.wsgi_headeritems = None
     def add( self, file, relpath ):
         self.members[file] = relpath
     def stream( self, environ, start_response ):
-        response_write = start_response( self.wsgi_status, self.wsgi_headeritems )
-        class tarfileobj:
-            def write( self, *args, **kwargs ):
-                response_write( *args, **kwargs )
-        tf = tarfile.open( mode=self.mode, fileobj=tarfileobj() )
+        writer = ResponseWriter( start_response( self.wsgi_status, self.wsgi_headeritems ) )
+        # Compress the uncompressed tar stream ourselves, so the compression
+        # level can be chosen
+        comptype = self.mode.split( '|' )[-1]
+        if comptype:
+            fileobj = CompressedWriter( writer, comptype, self.compresslevel )
+        else:
+            fileobj = writer
+        tf = tarfile.open( mode='w|', fileobj=fileobj )
         for file, rel in self.members.items():
             tf.add( file, arcname=rel )
         tf.close()
+        if comptype:
+            fileobj.close()
+        writer.log_throughput( self.mode )
         return []
 
-class ZipBall(object):
-    def __init__(self, tmpf, tmpd):
-        self._tmpf = tmpf
-        self._tmpd = tmpd
-    def stream(self, environ, start_response):
-        response_write = start_response( self.wsgi_status, self.wsgi_headeritems )
-        tmpfh = open( self._tmpf )
-        response_write(tmpfh.read())
-        tmpfh.close()
-        try:
-            os.unlink( self._tmpf )
-            os.rmdir( self._tmpd )
-        except OSError:
-            log.exception( "Unable to remove temporary library download archive and directory" )
+class ZipBall( object ):
+    """
+    Writes a zip archive straight to the response.  Each member is read and
+    deflated in chunks after writing its local header, and its checksum and
+    sizes follow the data in a data descriptor, so nothing has to be known in
+    advance.  ZIP64 records are used for members, offsets and archives beyond
+    the 4 GB and 65535 member limits of the original format if `allow_zip64`.
+
+    Members are deflated at `compresslevel`, unless it is 0 or a member is
+    added with `compress` False.
+    """
+    zip64_limit = ( 1 << 32 ) - 1
+    zip_max_members = ( 1 << 16 ) - 1
+
+    def __init__( self, compresslevel=6, allow_zip64=True ):
+        self.members = []
+        self.compresslevel = compresslevel
+        self.allow_zip64 = allow_zip64
+        self.total_size = 0
+        self.wsgi_status = None
+        self.wsgi_headeritems = None
+    def add( self, file, relpath, compress=None ):
+        """
+        Add `file` to the archive as `relpath`.  If `compress` is None, files
+        that look compressed already (by extension) are stored rather than
+        deflated.  Raises IOError if the file cannot be read, or would not
+        fit in an archive without ZIP64 records.
+        """
+        # Fail now rather than after the response has started
+        open( file, 'rb' ).close()
+        if compress is None:
+            compress = True
+            for path in ( file, relpath ):
+                if os.path.splitext( path )[1].lower() in COMPRESSED_EXTENSIONS:
+                    compress = False
+        self.total_size += os.path.getsize( file )
+        if not self.allow_zip64 and ( len( self.members ) >= self.zip_max_members or self.needs_zip64( self.total_size ) ):
+            raise IOError( "Adding '%s' would make the zip archive too large without ZIP64 support" % relpath )
+        self.members.append( ( file, relpath, compress ) )
+    def needs_zip64( self, size ):
+        # Leave room for deflate expanding incompressible data
+        return size + ( size >> 8 ) + 1024 >= self.zip64_limit
+    def stream( self, environ, start_response ):
+        writer = ResponseWriter( start_response( self.wsgi_status, self.wsgi_headeritems ) )
+        records = []
+        for file, relpath, compress in self.members:
+            records.append( self.__write_member( writer, file, relpath, compress ) )
+        self.__write_central_directory( writer, records )
+        writer.log_throughput( 'zip' )
         return []
+    def __encode_name( self, name ):
+        """
+        Return the name of a member as stored, along with the flag bits
+        marking names that are not plain ASCII as UTF-8.
+        """
+        if isinstance( name, unicode ):
+            name = name.encode( 'utf-8' )
+        try:
+            name.decode( 'ascii' )
+            return name, 0
+        except UnicodeError:
+            return name, 0x800
+    def __dos_date_time( self, timestamp ):
+        t = time.localtime( timestamp )
+        if t[0] < 1980:
+            t = ( 1980, 1, 1, 0, 0, 0 )
+        return ( ( t[0] - 1980 ) << 9 | t[1] << 5 | t[2] ), ( t[3] << 11 | t[4] << 5 | ( t[5] // 2 ) )
+    def __write_member( self, writer, file, relpath, compress ):
+        offset = writer.bytes
+        st = os.stat( file )
+        name, flags = self.__encode_name( relpath )
+        # Bit 3: checksum and sizes are in the data descriptor
+        flags |= 0x08
+        dosdate, dostime = self.__dos_date_time( st.st_mtime )
+        if compress and self.compresslevel:
+            method = 8
+            compressor = zlib.compressobj( self.compresslevel, zlib.DEFLATED, -zlib.MAX_WBITS )
+        else:
+            method = 0
+            compressor = None
+        zip64 = self.allow_zip64 and self.needs_zip64( st.st_size )
+        if zip64:
+            version = 45
+            extra = struct.pack( '<HHQQ', 0x0001, 16, 0, 0 )
+            header_size = 0xffffffffL
+        else:
+            version = 20
+            extra = ''
+            header_size = 0
+        writer.write( struct.pack( '<4s5H3L2H', 'PK\003\004', version, flags, method, dostime, dosdate,
+                                   0, header_size, header_size, len( name ), len( extra ) ) + name + extra )
+        crc = 0
+        usize = 0
+        csize = 0
+        fh = open( file, 'rb' )
+        try:
+            while True:
+                chunk = fh.read( CHUNK_SIZE )
+                if not chunk:
+                    break
+                usize += len( chunk )
+                crc = zlib.crc32( chunk, crc )
+                if compressor:
+                    chunk = compressor.compress( chunk )
+                csize += len( chunk )
+                writer.write( chunk )
+            if compressor:
+                chunk = compressor.flush()
+                csize += len( chunk )
+                writer.write( chunk )
+        finally:
+            fh.close()
+        crc &= 0xffffffffL
+        if zip64:
+            writer.write( struct.pack( '<4sLQQ', 'PK\007\010', crc, csize, usize ) )
+        elif usize >= self.zip64_limit or csize >= self.zip64_limit:
+            raise IOError( "'%s' grew too large for a zip archive without ZIP64 support while it was being written" % relpath )
+        else:
+            writer.write( struct.pack( '<4s3L', 'PK\007\010', crc, csize, usize ) )
+        return ( name, flags, method, dostime, dosdate, crc, csize, usize, offset, zip64, st.st_mode )
+    def __write_central_directory( self, writer, records ):
+        cd_offset = writer.bytes
+        for name, flags, method, dostime, dosdate, crc, csize, usize, offset, zip64, mode in records:
+            # Values too large for the record go in a ZIP64 extra field, in
+            # this order
+            extra_values = []
+            if zip64 or usize >= self.zip64_limit or csize >= self.zip64_limit:
+                extra_values.extend( [ usize, csize ] )
+                usize = csize = 0xffffffffL
+            if offset >= self.zip64_limit:
+                extra_values.append( offset )
+                offset = 0xffffffffL
+            if extra_values:
+                version = 45
+                extra = struct.pack( '<HH%dQ' % len( extra_values ), 0x0001, 8 * len( extra_values ), *extra_values )
+            else:
+                version = 20
+                extra = ''
+            # Made by: unix (3), so the file mode in the external attributes is used
+            writer.write( struct.pack( '<4s6H3L5H2L', 'PK\001\002', 3 << 8 | version, version, flags, method, dostime, dosdate,
+                                       crc, csize, usize, len( name ), len( extra ), 0, 0, 0,
+                                       ( mode & 0xffff ) << 16L, offset ) + name + extra )
+        cd_size = writer.bytes - cd_offset
+        count = len( records )
+        if count >= self.zip_max_members or cd_size >= self.zip64_limit or cd_offset >= self.zip64_limit:
+            zip64_end_offset = writer.bytes
+            writer.write( struct.pack( '<4sQ2H2L4Q', 'PK\006\006', 44, 45, 45, 0, 0, count, count, cd_size, cd_offset ) )
+            writer.write( struct.pack( '<4sLQL', 'PK\006\007', 0, zip64_end_offset, 1 ) )
+            count = min( count, self.zip_max_members )
+            cd_size = min( cd_size, 0xffffffffL )
+            cd_offset = min( cd_offset, 0xffffffffL )
+        writer.write( struct.pack( '<4s4H2LH', 'PK\005\006', 0, 0, count, count, cd_size, cd_offset, 0 ) )
@@ -18,6 +18,7 @@ from bx.bbi.bigwig_file import BigWigFile
 from galaxy.util.lrucache import LRUCache
 from galaxy.visualization.tracks.summary import *
 from galaxy.visualization.data_providers.basic import BaseDataProvider
+from galaxy.visualization.data_providers.region_index import get_region_index, bed_region, vcf_region
 import galaxy_utils.sequence.vcf
 from galaxy.datatypes.tabular import Tabular, Vcf
 from galaxy.datatypes.interval import Interval, Bed, Gff, Gtf, ENCODEPeak, ChromatinInteractions
@@ -253,6 +254,31 @@ class GenomeDataProvider( BaseDataProvider ):
 # -- Base mixins and providers --
 #
 
+class RegionIndexMixin:
+    """
+    Region queries for plain text datasets through a RegionIndex of the
+    original dataset, built on first access and kept next to the dataset.
+    Subclasses set `parse_region` to a function returning ( chrom, start, end )
+    for a line of the dataset.
+    """
+
+    # Store up to 20 recently used indices
+    REGION_INDEX_CACHE = LRUCache( 20 )
+
+    parse_region = None
+
+    def get_region_lines( self, chrom, start, end ):
+        """
+        Returns an iterator over the lines of the original dataset that may
+        overlap chrom:start-end, converting between UCSC and Ensembl
+        chromosome naming if needed.
+        """
+        file_name = self.original_dataset.file_name
+        index = get_region_index( file_name, self.parse_region, cache=self.REGION_INDEX_CACHE )
+        if chrom not in index.blocks:
+            chrom = _convert_between_ucsc_and_ensemble_naming( chrom )
+        return chrom, index.iter_lines( file_name, chrom, start, end )
+
 class FilterableMixin:
     def get_filters( self ):
         """ Returns a dataset's filters. """
@@ -560,25 +586,25 @@ class BedTabixDataProvider( TabixDataProvider, BedDataProvider ):
     """
     pass
     
-class RawBedDataProvider( BedDataProvider ):
+class RawBedDataProvider( RegionIndexMixin, BedDataProvider ):
     """
     Provide data from BED file.
 
-    NOTE: this data provider does not use indices, and hence will be very slow
-    for large datasets.
+    Region queries use a RegionIndex of the file, which is built on first
+    access, so no converted dataset is needed.
     """
 
+    parse_region = staticmethod( bed_region )
+
     def get_iterator( self, chrom=None, start=None, end=None, **kwargs ):
-        # Read first line in order to match chrom naming format.
-        line = source.readline()
-        dataset_chrom = line.split()[0]
-        if not _chrom_naming_matches( chrom, dataset_chrom ):
-            chrom = _convert_between_ucsc_and_ensemble_naming( chrom )
-        # Undo read.
-        source.seek( 0 )
+        if chrom is None:
+            # Whole file requested.
+            source = open( self.original_dataset.file_name )
+        else:
+            chrom, source = self.get_region_lines( chrom, start, end )
 
         def line_filter_iter():
-            for line in open( self.original_dataset.file_name ):
+            for line in source:
                 if line.startswith( "track" ) or line.startswith( "browser" ):
                     continue
                 feature = line.split()
@@ -709,25 +735,21 @@ class VcfTabixDataProvider( TabixDataProvider, VcfDataProvider ):
     """
     pass
 
-class RawVcfDataProvider( VcfDataProvider ):
+class RawVcfDataProvider( RegionIndexMixin, VcfDataProvider ):
     """
     Provide data from VCF file.
 
-    NOTE: this data provider does not use indices, and hence will be very slow
-    for large datasets.
+    Region queries use a RegionIndex of the file, which is built on first
+    access, so no converted dataset is needed.
     """
 
+    parse_region = staticmethod( vcf_region )
+
     def get_iterator( self, chrom, start, end, **kwargs ):
-        # Read first line in order to match chrom naming format.
-        line = source.readline()
-        dataset_chrom = line.split()[0]
-        if not _chrom_naming_matches( chrom, dataset_chrom ):
-            chrom = _convert_between_ucsc_and_ensemble_naming( chrom )
-        # Undo read.
-        source.seek( 0 )
+        chrom, source = self.get_region_lines( chrom, start, end )
 
         def line_filter_iter():
-            for line in open( self.original_dataset.file_name ):
+            for line in source:
                 if line.startswith("#"):
                     continue
                 variant = line.split()
@@ -751,26 +773,31 @@ class SummaryTreeDataProvider( GenomeDataProvider ):
 
     dataset_type = 'summary_tree'
     
-    CACHE = LRUCache( 20 ) # Store 20 recently accessed indices for performance
+    # Store up to 20 recently accessed indices (and at most 512MB worth of
+    # them, sized by their file size) for performance. Trees in the compact
+    # format are memory-mapped rather than loaded, so use much less memory.
+    CACHE = LRUCache( 20, max_bytes=512 * 1024 * 1024 )
     
+    def get_summary_tree( self ):
+        filename = self.converted_dataset.file_name
+        # Concurrent requests for the same tree only load it once
+        return self.CACHE.get_or_compute( filename, lambda: summary_tree_from_file( filename ),
+                                          size=os.path.getsize( filename ) )
+
     def valid_chroms( self ):
-        st = summary_tree_from_file( self.converted_dataset.file_name )
-        return st.chrom_blocks.keys()
+        st = self.get_summary_tree()
+        return st.chrom_stats.keys()
     
     def get_data( self, chrom, start, end, level=None, resolution=None, detail_cutoff=None, draw_cutoff=None, **kwargs ):
         """
         Returns summary tree data for a given genomic region.
         """
-        filename = self.converted_dataset.file_name
-        st = self.CACHE[filename]
-        if st is None:
-            st = summary_tree_from_file( self.converted_dataset.file_name )
-            self.CACHE[filename] = st
+        st = self.get_summary_tree()
 
         # Look for chrom in tree using both naming conventions.
-        if chrom not in st.chrom_blocks:
+        if chrom not in st.chrom_stats:
             chrom = _convert_between_ucsc_and_ensemble_naming( chrom )
-            if chrom not in st.chrom_blocks:
+            if chrom not in st.chrom_stats:
                 return None
 
         # Get or compute level.
@@ -808,14 +835,10 @@ class SummaryTreeDataProvider( GenomeDataProvider ):
         """
         
         # Get summary tree.
-        filename = self.converted_dataset.file_name
-        st = self.CACHE[filename]
-        if st is None:
-            st = summary_tree_from_file( self.converted_dataset.file_name )
-            self.CACHE[filename] = st
+        st = self.get_summary_tree()
             
         # Check for data.
-        return st.chrom_blocks.get(chrom, None) or st.chrom_blocks.get(_convert_between_ucsc_and_ensemble_naming(chrom), None)
+        return chrom in st.chrom_stats or _convert_between_ucsc_and_ensemble_naming( chrom ) in st.chrom_stats
 
 class BamDataProvider( GenomeDataProvider, FilterableMixin ):
     """
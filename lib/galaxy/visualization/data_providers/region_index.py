@@ -0,0 +1,215 @@
+"""
+Lightweight index of the regions in a plain text, line based genome file
+(BED, VCF) so that region queries can seek straight to the relevant parts of
+the file instead of scanning all of it.
+
+The file is divided into blocks of consecutive lines on the same chromosome
+of at most BLOCK_SIZE bytes.  For each block the index stores its byte offset
+and length and the lowest start and highest end of its features, so files do
+not need to be sorted.  The index is built the first time a region of a file
+is requested and written next to the file; it records the size and
+modification time of the file and is rebuilt if the file changes.
+
+>>> import tempfile, os
+>>> fd, fname = tempfile.mkstemp()
+>>> lines = [ 'track name=test\\n' ] + [ 'chr1\\t%i\\t%i\\tf%i\\n' % ( i * 100, i * 100 + 50, i ) for i in range( 10 ) ] + \\
+...         [ 'chr2\\t%i\\t%i\\tg%i\\n' % ( i * 100, i * 100 + 50, i ) for i in range( 10 ) ]
+>>> os.write( fd, ''.join( lines ) )
+330
+>>> os.close( fd )
+>>> index = RegionIndex.build( fname, bed_region, block_size=64 )
+>>> index.chroms()
+['chr1', 'chr2']
+>>> len( index.blocks[ 'chr1' ] ), index.blocks[ 'chr1' ][0]
+(3, (16, 61, 0, 350))
+>>> [ line.split()[3] for line in index.iter_lines( fname, 'chr2', 420, 520 ) ]
+['g4', 'g5', 'g6', 'g7']
+>>> list( index.iter_lines( fname, 'chr3', 0, 100 ) )
+[]
+>>> index.write( fname + '.regions' )
+>>> index = RegionIndex.read( fname + '.regions' )
+>>> index.is_current( fname ), index.blocks[ 'chr1' ][0]
+(True, (16, 61, 0, 350))
+>>> open( fname, 'a' ).write( 'chr3\\t0\\t10\\th0\\n' )
+>>> index.is_current( fname )
+False
+>>> os.remove( fname + '.regions' )
+>>> os.remove( fname )
+"""
+
+import os
+import tempfile
+
+# Maximum number of bytes in an index block
+BLOCK_SIZE = 2 ** 16
+
+# Version of the on-disk index format
+INDEX_VERSION = 1
+
+# Suffix of the index file written next to the indexed file
+INDEX_SUFFIX = '.regions'
+
+def bed_region( line ):
+    """
+    Return ( chrom, start, end ) of a BED line, or None if it is not a feature.
+
+    >>> bed_region( 'chr1\\t10\\t20\\tname\\n' )
+    ('chr1', 10, 20)
+    >>> bed_region( 'browser position chr1:1-100\\n' )
+    """
+    if line.startswith( 'track' ) or line.startswith( 'browser' ) or line.startswith( '#' ):
+        return None
+    fields = line.split()
+    try:
+        return fields[0], int( fields[1] ), int( fields[2] )
+    except ( IndexError, ValueError ):
+        return None
+
+def vcf_region( line ):
+    """
+    Return ( chrom, start, end ) of a VCF line, or None if it is not a variant.
+    The end is an upper bound, covering the reference and all alternate alleles.
+
+    >>> vcf_region( '20\\t14370\\trs6054257\\tG\\tA,TTT\\t29\\tPASS\\n' )
+    ('20', 14370, 14375)
+    >>> vcf_region( '#CHROM\\tPOS\\n' )
+    """
+    if line.startswith( '#' ):
+        return None
+    fields = line.split()
+    try:
+        start = int( fields[1] )
+        return fields[0], start, start + max( len( fields[3] ), len( fields[4] ) )
+    except ( IndexError, ValueError ):
+        return None
+
+class RegionIndex( object ):
+    """
+    Maps chromosome to a list of ( offset, length, lowest start, highest end )
+    blocks, in file order.
+    """
+    def __init__( self, blocks, file_size, file_mtime ):
+        self.blocks = blocks
+        self.file_size = file_size
+        self.file_mtime = file_mtime
+
+    def build( cls, filename, parse_line, block_size=BLOCK_SIZE ):
+        """
+        Index `filename`; `parse_line` returns ( chrom, start, end ) for lines
+        with a feature and None for any other line.
+        """
+        stat = os.stat( filename )
+        blocks = {}
+        # The block being built, as [ chrom, offset, length, start, end ]
+        block = None
+        offset = 0
+        for line in open( filename, 'rb' ):
+            region = parse_line( line )
+            if region is not None:
+                chrom, start, end = region
+                if block is None or block[0] != chrom or offset + len( line ) - block[1] > block_size:
+                    if block is not None:
+                        blocks.setdefault( block[0], [] ).append( tuple( block[1:] ) )
+                    block = [ chrom, offset, 0, start, end ]
+                block[2] = offset + len( line ) - block[1]
+                block[3] = min( block[3], start )
+                block[4] = max( block[4], end )
+            offset += len( line )
+        if block is not None:
+            blocks.setdefault( block[0], [] ).append( tuple( block[1:] ) )
+        return cls( blocks, stat.st_size, int( stat.st_mtime ) )
+    build = classmethod( build )
+
+    def read( cls, index_filename ):
+        """Read an index written by `write`, returning None if it is not usable."""
+        try:
+            index_file = open( index_filename )
+        except IOError:
+            return None
+        try:
+            try:
+                version, file_size, file_mtime = [ int( f ) for f in index_file.readline().split() ]
+                if version != INDEX_VERSION:
+                    return None
+                blocks = {}
+                for line in index_file:
+                    fields = line.rstrip( '\n' ).split( '\t' )
+                    blocks.setdefault( fields[0], [] ).append( tuple( [ int( f ) for f in fields[1:] ] ) )
+                return cls( blocks, file_size, file_mtime )
+            except ValueError:
+                return None
+        finally:
+            index_file.close()
+    read = classmethod( read )
+
+    def write( self, index_filename ):
+        """
+        Write the index to `index_filename`.  The index is written to a
+        temporary file first so that readers never see a partial index.
+        """
+        fd, temp_name = tempfile.mkstemp( dir=os.path.dirname( index_filename ) or '.', prefix='.regions_' )
+        try:
+            index_file = os.fdopen( fd, 'w' )
+            index_file.write( '%i %i %i\n' % ( INDEX_VERSION, self.file_size, self.file_mtime ) )
+            for chrom in self.chroms():
+                for block in self.blocks[ chrom ]:
+                    index_file.write( '%s\t%i\t%i\t%i\t%i\n' % ( ( chrom, ) + block ) )
+            index_file.close()
+            os.rename( temp_name, index_filename )
+        except:
+            if os.path.exists( temp_name ):
+                os.remove( temp_name )
+            raise
+
+    def is_current( self, filename ):
+        """Return True if `filename` has not changed since it was indexed."""
+        try:
+            stat = os.stat( filename )
+        except OSError:
+            return False
+        return stat.st_size == self.file_size and int( stat.st_mtime ) == self.file_mtime
+
+    def chroms( self ):
+        return sorted( self.blocks.keys() )
+
+    def iter_lines( self, filename, chrom, start, end ):
+        """
+        Yield the lines of the blocks of `chrom` that may overlap start-end.
+        Lines outside of the region may also be returned, so callers still
+        need to filter them.
+        """
+        blocks = [ block for block in self.blocks.get( chrom, () ) if block[2] <= end and block[3] >= start ]
+        if not blocks:
+            return
+        data_file = open( filename, 'rb' )
+        try:
+            for offset, length, block_start, block_end in blocks:
+                data_file.seek( offset )
+                for line in data_file.read( length ).splitlines( True ):
+                    yield line
+        finally:
+            data_file.close()
+
+def get_region_index( filename, parse_line, cache=None ):
+    """
+    Return an up to date RegionIndex of `filename`, reading it from `cache`
+    (a dictionary-like object, e.g. an LRUCache) or from the index file next to
+    `filename` if possible, and building it otherwise.  If the index file cannot
+    be written, e.g. because the file is in a read-only directory, the index is
+    only kept in `cache`.
+    """
+    if cache is not None:
+        index = cache.get( filename )
+        if index is not None and index.is_current( filename ):
+            return index
+    index_filename = filename + INDEX_SUFFIX
+    index = RegionIndex.read( index_filename )
+    if index is None or not index.is_current( filename ):
+        index = RegionIndex.build( filename, parse_line )
+        try:
+            index.write( index_filename )
+        except ( IOError, OSError ):
+            pass
+    if cache is not None:
+        cache[ filename ] = index
+    return index
@@ -1,16 +1,132 @@
 '''
 This module cannot be moved due to the use of pickling.
+
+Summary trees used to be written with cPickle, so reading one meant loading
+every block of every level into memory.  They are now written in a compact
+binary format: for each chromosome and level, the sorted ids of the non-empty
+blocks and their counts are stored as arrays of unsigned 32 bit integers, and
+a small header gives the statistics and location of each array.  Reading a
+tree only parses the header and memory-maps the arrays, which are then binary
+searched by queries.  summary_tree_from_file() reads both formats.
+
+Format (all integers little-endian):
+
+    header:  magic, version, block size, levels, min level, draw cutoff,
+             detail cutoff, number of chroms
+    chroms:  name length, name, then for each level from min level to levels:
+             level, number of blocks, max, avg, offset of the block ids
+    arrays:  block ids followed by counts, for each chrom and level
+
+>>> import tempfile, os
+>>> st = SummaryTree( block_size=10, levels=3 )
+>>> st.insert_range( 'chr1', 0, 150 )
+>>> st.insert_range( 'chr1', 120, 130 )
+>>> st.insert_range( 'chr1', 950, 960 )
+>>> st.insert_range( 'chr2', 5, 10 )
+>>> st.finish()
+>>> st.query( 'chr1', 0, 999, 2, draw_cutoff=0, detail_cutoff=0 )
+[(0, 1), (100, 2), (200, 0), (300, 0), (400, 0), (500, 0), (600, 0), (700, 0), (800, 0), (900, 1)]
+>>> fd, fname = tempfile.mkstemp()
+>>> os.close( fd )
+>>> st.write( fname )
+>>> is_compact_summary_tree( fname ), convert_summary_tree_file( fname )
+(True, False)
+>>> cst = summary_tree_from_file( fname )
+>>> cst.block_size, cst.levels, sorted( cst.chrom_stats.keys() )
+(10, 3, ['chr1', 'chr2'])
+>>> cst.query( 'chr1', 0, 999, 2, draw_cutoff=0, detail_cutoff=0 ) == st.query( 'chr1', 0, 999, 2, draw_cutoff=0, detail_cutoff=0 )
+True
+>>> cst.query( 'chr1', 450, 1250, 2, draw_cutoff=0, detail_cutoff=0 )
+[(400, 0), (500, 0), (600, 0), (700, 0), (800, 0), (900, 1), (1000, 0), (1100, 0), (1200, 0)]
+>>> cst.query( 'chr1', 0, 999, 2 )
+'detail'
+>>> cst.query( 'chr3', 0, 999, 2 )
+>>> cst.chrom_stats[ 'chr1' ][ 3 ] == st.chrom_stats[ 'chr1' ][ 3 ]
+True
+>>> cst.close()
+>>> os.remove( fname )
 '''
 
 import sys, os
 import cPickle
+import mmap
+import struct
+import tempfile
+from array import array
 
 # TODO: What are the performance implications of setting min level to 1? Data
 # structure size and/or query speed? It would be nice to have level 1 data
 # so that client does not have to compute it.
 MIN_LEVEL = 2
 
-class SummaryTree:
+# Compact file format.
+COMPACT_MAGIC = 'GXSUMTRE'
+COMPACT_VERSION = 1
+HEADER_FORMAT = '<8sIIIIIII'
+NAME_LENGTH_FORMAT = '<I'
+LEVEL_FORMAT = '<IIIdQ'
+ITEM_FORMAT = '<I'
+ITEM_SIZE = struct.calcsize( ITEM_FORMAT )
+
+def uint32_array( values ):
+    """ Returns an array of unsigned 32 bit integers. """
+    for typecode in ( 'I', 'L' ):
+        if array( typecode ).itemsize == ITEM_SIZE:
+            return array( typecode, values )
+    raise Exception( "No 32 bit array type available" )
+
+class BaseSummaryTree:
+    '''
+    Queries common to the in-memory and compact summary trees. Subclasses
+    provide chrom_stats and get_block_counts().
+    '''
+    def find_block( self, num, level ):
+        """ Returns block that num is in for level. """
+        return ( num / self.block_size ** level )
+
+    def get_block_counts( self, chrom, level, starting_block, ending_block ):
+        """ Returns a dict of the non-zero counts of blocks in a range. """
+        raise Exception( "Unimplemented Function" )
+
+    def query( self, chrom, start, end, level, draw_cutoff=None, detail_cutoff=None ):
+        """ Queries tree for data. """
+
+        # Set cutoffs to self's attributes if not defined.
+        if draw_cutoff != 0:
+            draw_cutoff = self.draw_cutoff
+        if detail_cutoff != 0:
+            detail_cutoff = self.detail_cutoff
+
+        # Get data.
+        if chrom in self.chrom_stats:
+            stats = self.chrom_stats[ chrom ]
+
+            # For backwards compatibility:
+            if "detail_level" in stats and level <= stats[ "detail_level" ]:
+                return "detail"
+            elif "draw_level" in stats and level <= stats[ "draw_level" ]:
+                return "draw"
+
+            # If below draw, detail level, return string to denote this.
+            max = stats[ level ][ "max" ]
+            if max < detail_cutoff:
+                return "detail"
+            if max < draw_cutoff:
+                return "draw"
+
+            # Return block data.
+            results = []
+            multiplier = self.block_size ** level
+            starting_block = self.find_block( start, level )
+            ending_block = self.find_block( end, level )
+            counts = self.get_block_counts( chrom, level, starting_block, ending_block )
+            for block in range( starting_block, ending_block + 1 ):
+                results.append(  ( block * multiplier, counts.get( block, 0 ) )  )
+            return results
+
+        return None
+
+class SummaryTree( BaseSummaryTree ):
     '''
     Summary tree data structure for feature aggregation across large genomic regions.
     '''
@@ -21,14 +137,10 @@ class SummaryTree:
         self.detail_cutoff = detail_cutoff
         self.block_size = block_size
         self.chrom_stats = {}
-    
-    def find_block( self, num, level ):
-        """ Returns block that num is in for level. """
-        return ( num / self.block_size ** level )
-        
+
     def insert_range( self, chrom, start, end ):
         """ Inserts a feature at chrom:start-end into the tree. """
-        
+
         # Get or set up chrom blocks.
         if chrom in self.chrom_blocks:
             blocks = self.chrom_blocks[ chrom ]
@@ -37,7 +149,7 @@ class SummaryTree:
             self.chrom_stats[ chrom ] = {}
             for level in range( MIN_LEVEL, self.levels + 1 ):
                 blocks[ level ] = {}
-            
+
         # Insert feature into all matching blocks at all levels.
         for level in range( MIN_LEVEL, self.levels + 1 ):
             block_level = blocks[ level ]
@@ -48,10 +160,10 @@ class SummaryTree:
                     block_level[ block ] += 1
                 else:
                     block_level[ block ] = 1
-        
+
     def finish( self ):
         """ Compute stats for levels. """
-        
+
         for chrom, blocks in self.chrom_blocks.iteritems():
             for level in range( self.levels, MIN_LEVEL - 1, -1 ):
                 # Set level's stats.
@@ -60,58 +172,141 @@ class SummaryTree:
                 self.chrom_stats[ chrom ][ level ][ "delta" ] = self.block_size ** level
                 self.chrom_stats[ chrom ][ level ][ "max" ] = max_val
                 self.chrom_stats[ chrom ][ level ][ "avg" ] = float( max_val ) / len( blocks[ level ] )
-            
-            self.chrom_blocks[ chrom ] = dict( [ ( key, value ) for key, value in blocks.iteritems() ] )
-        
-    def query( self, chrom, start, end, level, draw_cutoff=None, detail_cutoff=None ):
-        """ Queries tree for data. """
-
-        # Set cutoffs to self's attributes if not defined.
-        if draw_cutoff != 0:
-            draw_cutoff = self.draw_cutoff
-        if detail_cutoff != 0:
-            detail_cutoff = self.detail_cutoff
 
-        # Get data.
-        if chrom in self.chrom_blocks:
-            stats = self.chrom_stats[ chrom ]
+            self.chrom_blocks[ chrom ] = dict( [ ( key, value ) for key, value in blocks.iteritems() ] )
 
-            # For backwards compatibility:
-            if "detail_level" in stats and level <= stats[ "detail_level" ]:
-                return "detail"
-            elif "draw_level" in stats and level <= stats[ "draw_level" ]:
-                return "draw"
+    def get_block_counts( self, chrom, level, starting_block, ending_block ):
+        return self.chrom_blocks[ chrom ][ level ]
 
-            # If below draw, detail level, return string to denote this.
-            max = stats[ level ][ "max" ]
-            if max < detail_cutoff:
-                return "detail"
-            if max < draw_cutoff:
-                return "draw"
-            
-            # Return block data.
-            blocks = self.chrom_blocks[ chrom ]
-            results = []
-            multiplier = self.block_size ** level
-            starting_block = self.find_block( start, level )
-            ending_block = self.find_block( end, level )
-            for block in range( starting_block, ending_block + 1 ):
-                val = 0
-                if block in blocks[ level ]:
-                    val = blocks[ level ][ block ]
-                results.append(  ( block * multiplier, val )  )
-            return results
-            
-        return None
-        
     def write( self, filename ):
-        """ Writes tree to file. """
+        """ Writes tree to file in the compact format. """
         self.finish()
-        cPickle.dump( self, open( filename, 'wb' ), 2 )
-        
+        write_compact_summary_tree( self, filename )
+
+class CompactSummaryTree( BaseSummaryTree ):
+    '''
+    Read-only summary tree backed by a memory-mapped file in the compact
+    format. Only the header is read into memory.
+    '''
+    def __init__( self, filename ):
+        self.filename = filename
+        st_file = open( filename, "rb" )
+        try:
+            size = os.fstat( st_file.fileno() ).st_size
+            self.data = mmap.mmap( st_file.fileno(), size, access=mmap.ACCESS_READ )
+        finally:
+            st_file.close()
+        magic, version, self.block_size, self.levels, min_level, self.draw_cutoff, \
+            self.detail_cutoff, num_chroms = struct.unpack_from( HEADER_FORMAT, self.data, 0 )
+        if magic != COMPACT_MAGIC or version != COMPACT_VERSION:
+            raise Exception( "%s is not a version %i summary tree" % ( filename, COMPACT_VERSION ) )
+        self.chrom_stats = {}
+        # chrom -> level -> ( number of blocks, offset of block ids )
+        self.chrom_arrays = {}
+        pos = struct.calcsize( HEADER_FORMAT )
+        for i in range( num_chroms ):
+            name_length, = struct.unpack_from( NAME_LENGTH_FORMAT, self.data, pos )
+            pos += struct.calcsize( NAME_LENGTH_FORMAT )
+            chrom = self.data[ pos:pos + name_length ]
+            pos += name_length
+            stats = self.chrom_stats[ chrom ] = {}
+            arrays = self.chrom_arrays[ chrom ] = {}
+            for level in range( min_level, self.levels + 1 ):
+                level, count, max_val, avg, offset = struct.unpack_from( LEVEL_FORMAT, self.data, pos )
+                pos += struct.calcsize( LEVEL_FORMAT )
+                stats[ level ] = { "delta": self.block_size ** level, "max": max_val, "avg": avg }
+                arrays[ level ] = ( count, offset )
+
+    def __item( self, offset, index ):
+        return struct.unpack_from( ITEM_FORMAT, self.data, offset + index * ITEM_SIZE )[0]
+
+    def get_block_counts( self, chrom, level, starting_block, ending_block ):
+        count, offset = self.chrom_arrays[ chrom ][ level ]
+        # Binary search for the first block id >= starting_block.
+        low, high = 0, count
+        while low < high:
+            mid = ( low + high ) // 2
+            if self.__item( offset, mid ) < starting_block:
+                low = mid + 1
+            else:
+                high = mid
+        counts = {}
+        counts_offset = offset + count * ITEM_SIZE
+        for index in xrange( low, count ):
+            block = self.__item( offset, index )
+            if block > ending_block:
+                break
+            counts[ block ] = self.__item( counts_offset, index )
+        return counts
+
+    def close( self ):
+        self.data.close()
+
+def write_compact_summary_tree( st, filename ):
+    """
+    Writes a finished SummaryTree to filename in the compact format. The tree
+    is written to a temporary file that then replaces filename, so readers
+    never see a partial tree.
+    """
+    chroms = sorted( st.chrom_blocks.keys() )
+    levels = range( MIN_LEVEL, st.levels + 1 )
+    # Lay out the arrays after the header.
+    header_size = struct.calcsize( HEADER_FORMAT )
+    for chrom in chroms:
+        header_size += struct.calcsize( NAME_LENGTH_FORMAT ) + len( chrom ) + len( levels ) * struct.calcsize( LEVEL_FORMAT )
+    header = [ struct.pack( HEADER_FORMAT, COMPACT_MAGIC, COMPACT_VERSION, st.block_size, st.levels, MIN_LEVEL,
+                            st.draw_cutoff, st.detail_cutoff, len( chroms ) ) ]
+    offset = header_size
+    for chrom in chroms:
+        header.append( struct.pack( NAME_LENGTH_FORMAT, len( chrom ) ) + chrom )
+        for level in levels:
+            stats = st.chrom_stats[ chrom ][ level ]
+            count = len( st.chrom_blocks[ chrom ][ level ] )
+            header.append( struct.pack( LEVEL_FORMAT, level, count, stats[ "max" ], stats[ "avg" ], offset ) )
+            offset += 2 * count * ITEM_SIZE
+    fd, temp_name = tempfile.mkstemp( dir=os.path.dirname( os.path.abspath( filename ) ), prefix='.summary_tree_' )
+    try:
+        st_file = os.fdopen( fd, 'wb' )
+        st_file.write( ''.join( header ) )
+        for chrom in chroms:
+            for level in levels:
+                items = sorted( st.chrom_blocks[ chrom ][ level ].items() )
+                block_ids = uint32_array( [ block for block, val in items ] )
+                counts = uint32_array( [ val for block, val in items ] )
+                if sys.byteorder == 'big':
+                    block_ids.byteswap()
+                    counts.byteswap()
+                block_ids.tofile( st_file )
+                counts.tofile( st_file )
+        st_file.close()
+        os.chmod( temp_name, 0644 )
+        os.rename( temp_name, filename )
+    except:
+        if os.path.exists( temp_name ):
+            os.remove( temp_name )
+        raise
+
+def is_compact_summary_tree( filename ):
+    st_file = open( filename, "rb" )
+    magic = st_file.read( len( COMPACT_MAGIC ) )
+    st_file.close()
+    return magic == COMPACT_MAGIC
+
 def summary_tree_from_file( filename ):
+    if is_compact_summary_tree( filename ):
+        return CompactSummaryTree( filename )
     st_file = open( filename, "rb" )
     st = cPickle.load( st_file )
     st_file.close()
     return st
-    
+
+def convert_summary_tree_file( filename ):
+    """
+    Rewrites a pickled summary tree in the compact format. Returns True if the
+    file was converted, False if it was already compact.
+    """
+    if is_compact_summary_tree( filename ):
+        return False
+    st = summary_tree_from_file( filename )
+    write_compact_summary_tree( st, filename )
+    return True
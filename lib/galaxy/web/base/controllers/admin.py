@@ -1063,6 +1063,19 @@ class Admin( object ):
                                     status = status,
                                     job_lock = trans.app.job_manager.job_queue.job_lock )
 
+    @web.json
+    @web.require_admin
+    def job_concurrency_counts( self, trans, **kwd ):
+        """
+        Return the active job counts used by this instance's job handler to
+        enforce job concurrency limits.
+        """
+        # Instances that do not handle jobs have a NoopQueue
+        job_queue = getattr( trans.app.job_manager.job_handler, 'job_queue', None )
+        if not hasattr( job_queue, 'concurrency_counts' ):
+            return dict( error='This Galaxy instance (%s) is not a job handler.' % self.app.config.server_name )
+        return job_queue.concurrency_counts()
+
 ## ---- Utility methods -------------------------------------------------------
 
 def get_ids_of_tool_shed_repositories_being_installed( trans, as_string=False ):
@@ -249,6 +249,17 @@ class WebApplication( base.WebApplication ):
             collection_size = 500,
             output_encoding = 'utf-8' )
 
+    def handle_request( self, environ, start_response ):
+        # Count the stat() calls made resolving dataset paths for the request.
+        # Imported here to avoid an import cycle, galaxy.objectstore imports
+        # galaxy.jobs
+        from galaxy.objectstore import reset_request_stat_count, request_stat_count
+        reset_request_stat_count()
+        try:
+            return base.WebApplication.handle_request( self, environ, start_response )
+        finally:
+            self.trace( object_store_stats=request_stat_count() )
+
     def handle_controller_exception( self, e, trans, **kwargs ):
         if isinstance( e, MessageException ):
             #In the case of a controller exception, sanitize to make sure unsafe html input isn't reflected back to the user
@@ -667,7 +678,7 @@ class GalaxyWebTransaction( base.DefaultWebTransaction ):
                     if prev_galaxy_session.user is None:
                         # Increase the user's disk usage by the amount of the previous history's datasets if they didn't already own it.
                         for hda in history.datasets:
-                            user.total_disk_usage += hda.quota_amount( user )
+                            user.adjust_total_disk_usage( hda.quota_amount( user ) )
             elif self.galaxy_session.current_history:
                 history = self.galaxy_session.current_history
             if not history and \
@@ -45,6 +45,8 @@ class DatasetsController( BaseAPIController, UsesVisualizationMixin ):
                 rval = self._search_features( trans, dataset, kwd.get( 'query' ) )
             elif data_type == 'raw_data':
                 rval = self._raw_data( trans, dataset, **kwd )
+            elif data_type == 'lines':
+                rval = self._lines( trans, dataset, **kwd )
             elif data_type == 'track_config':
                 rval = self.get_new_track_config( trans, dataset )
             elif data_type == 'genome_data':
@@ -191,3 +193,19 @@ class DatasetsController( BaseAPIController, UsesVisualizationMixin ):
         data = data_provider.get_data( **kwargs )
 
         return data
+
+    def _lines( self, trans, dataset, offset=0, limit=1000, **kwargs ):
+        """
+        Returns up to `limit` lines of a text dataset starting at line number
+        `offset` (counting from 0).  Tabular datasets keep an index of line
+        offsets, so fetching any range of them is fast.
+        """
+        # Dataset check.
+        msg = self.check_dataset_state( trans, dataset )
+        if msg:
+            return msg
+        if not hasattr( dataset.datatype, 'get_lines' ):
+            raise Exception( "Datatype %s does not support fetching lines" % dataset.extension )
+        offset = max( int( offset ), 0 )
+        limit = max( int( limit ), 0 )
+        return { 'offset': offset, 'limit': limit, 'lines': dataset.datatype.get_lines( dataset, offset, limit ) }
@@ -59,21 +59,28 @@ class HistoryContentsController( BaseAPIController, UsesHistoryDatasetAssociatio
                 #NOTE: this might not be the best form (passing all info),
                 #   but we(I?) need an hda collection with full data somewhere
                 ids = ids.split( ',' )
-                for hda in history.datasets:
-                    #TODO: curr. ordered by history, change to order from ids list
+                #TODO: curr. ordered by history, change to order from ids list
+                hdas = [ hda for hda in history.datasets if trans.security.encode_id( hda.id ) in ids ]
+                # get the sizes of all the datasets from the object store at once,
+                #   falling back to getting them one by one (recording which hda err's)
+                try:
+                    sizes = trans.app.model.Dataset.get_sizes( [ hda.dataset for hda in hdas ] )
+                except Exception, exc:
+                    log.warning( "Could not get dataset sizes for history %s: %s", history_id, str( exc ) )
+                    sizes = {}
+                for hda in hdas:
                     encoded_hda_id = trans.security.encode_id( hda.id )
-                    if encoded_hda_id in ids:
-                        #TODO: share code with show
-                        try:
-                            rval.append( get_hda_dict( trans, history, hda, for_editing=True ) )
-
-                        except Exception, exc:
-                            # don't fail entire list if hda err's, record and move on
-                            # (making sure http recvr knows it's err'd)
-                            trans.response.status = 500
-                            log.error( "Error in history API at listing contents " +
-                                "with history %s, hda %s: %s", history_id, encoded_hda_id, str( exc ) )
-                            rval.append( self._exception_as_hda_dict( trans, encoded_hda_id, exc ) )
+                    #TODO: share code with show
+                    try:
+                        rval.append( get_hda_dict( trans, history, hda, for_editing=True, file_size=sizes.get( hda.dataset.id ) ) )
+
+                    except Exception, exc:
+                        # don't fail entire list if hda err's, record and move on
+                        # (making sure http recvr knows it's err'd)
+                        trans.response.status = 500
+                        log.error( "Error in history API at listing contents " +
+                            "with history %s, hda %s: %s", history_id, encoded_hda_id, str( exc ) )
+                        rval.append( self._exception_as_hda_dict( trans, encoded_hda_id, exc ) )
 
             else:
                 # if no ids passed, return a _SUMMARY_ of _all_ datasets in the history
@@ -196,8 +203,8 @@ class HistoryContentsController( BaseAPIController, UsesHistoryDatasetAssociatio
 
 
 #TODO: move these into model
-def get_hda_dict( trans, history, hda, for_editing ):
-    hda_dict = hda.get_api_value( view='element' )
+def get_hda_dict( trans, history, hda, for_editing, file_size=None ):
+    hda_dict = hda.get_api_value( view='element', file_size=file_size )
 
     hda_dict[ 'id' ] = trans.security.encode_id( hda.id )
     hda_dict[ 'history_id' ] = trans.security.encode_id( history.id )
@@ -224,7 +231,8 @@ def get_hda_dict( trans, history, hda, for_editing ):
     if not( hda.purged or hda.deleted or hda.dataset.purged ):
         meta_files = []
         for meta_type in hda.metadata.spec.keys():
-            if isinstance( hda.metadata.spec[ meta_type ].param, FileParameter ):
+            spec = hda.metadata.spec[ meta_type ]
+            if isinstance( spec.param, FileParameter ) and spec.get( 'downloadable', True ) and hda.metadata.get( meta_type ):
                 meta_files.append( dict( file_type=meta_type ) )
         if meta_files:
             hda_dict[ 'meta_files' ] = meta_files
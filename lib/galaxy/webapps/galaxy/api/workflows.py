@@ -12,7 +12,7 @@ from galaxy import model
 from galaxy.tools.parameters import visit_input_values, DataToolParameter, RuntimeValue
 from galaxy.web.base.controller import BaseAPIController, url_for
 from galaxy.workflow.modules import module_factory, ToolModule
-from galaxy.jobs.actions.post import ActionBox
+from galaxy.workflow.scheduler import queue_invocation
 from galaxy.model.item_attrs import UsesAnnotations
 
 from ..controllers.workflow import attach_ordered_steps
@@ -220,44 +220,47 @@ class WorkflowsAPIController(BaseAPIController, UsesAnnotations):
                 step.module = module_factory.from_workflow_step( trans, step )
                 step.state = step.module.get_runtime_state()
             step.input_connections_by_name = dict( ( conn.input_name, conn ) for conn in step.input_connections )
-        # Run each step, connecting outputs to inputs
-        workflow_invocation = self.app.model.WorkflowInvocation()
-        workflow_invocation.workflow = workflow
+        # Run the input steps now, and leave creating the jobs for the tool
+        # steps to the workflow scheduler
         outputs = util.odict.odict()
-        rval['history'] = trans.security.encode_id(history.id)
-        rval['outputs'] = []
-        for i, step in enumerate( workflow.steps ):
-            job = None
+        for step in workflow.steps:
             if step.type == 'tool' or step.type is None:
-                tool = self.app.toolbox.get_tool( step.tool_id )
-                def callback( input, value, prefixed_name, prefixed_label ):
-                    if isinstance( input, DataToolParameter ):
-                        if prefixed_name in step.input_connections_by_name:
-                            conn = step.input_connections_by_name[ prefixed_name ]
-                            return outputs[ conn.output_step.id ][ conn.output_name ]
-                visit_input_values( tool.inputs, step.state.inputs, callback )
-                job, out_data = tool.execute( trans, step.state.inputs, history=history)
-                outputs[ step.id ] = out_data
-                for pja in step.post_job_actions:
-                    if pja.action_type in ActionBox.immediate_actions:
-                        ActionBox.execute(self.app, trans.sa_session, pja, job, replacement_dict=None)
-                    else:
-                        job.add_post_job_action(pja)
-                for v in out_data.itervalues():
-                    rval['outputs'].append(trans.security.encode_id(v.id))
-            else:
-                #This is an input step.  Use the dataset inputs from ds_map.
-                job, out_data = step.module.execute( trans, step.state)
-                outputs[step.id] = out_data
-                outputs[step.id]['output'] = ds_map[str(step.id)]['hda']
-            workflow_invocation_step = self.app.model.WorkflowInvocationStep()
-            workflow_invocation_step.workflow_invocation = workflow_invocation
-            workflow_invocation_step.workflow_step = step
-            workflow_invocation_step.job = job
-        trans.sa_session.add( workflow_invocation )
-        trans.sa_session.flush()
+                continue
+            #This is an input step.  Use the dataset inputs from ds_map.
+            job, out_data = step.module.execute( trans, step.state)
+            outputs[step.id] = out_data
+            outputs[step.id]['output'] = ds_map[str(step.id)]['hda']
+        workflow_invocation = queue_invocation( trans, workflow, history, outputs )
+        rval['history'] = trans.security.encode_id(history.id)
+        rval['invocation'] = workflow_invocation.get_api_value( value_mapper={ 'id': trans.security.encode_id,
+                                                                               'workflow_id': trans.security.encode_id,
+                                                                               'history_id': trans.security.encode_id } )
+        rval['invocation']['url'] = url_for( 'workflow_invocation', workflow_id=payload['workflow_id'], id=rval['invocation']['id'] )
         return rval
 
+    @web.expose_api
+    def invocation( self, trans, workflow_id, id, **kwd ):
+        """
+        GET /api/workflows/{encoded_workflow_id}/invocations/{encoded_invocation_id}
+        Displays the progress of scheduling the steps of a workflow invocation:
+        its state ('new' while steps are left to schedule, 'scheduled' or
+        'failed'), and the job and output datasets of each scheduled step.
+        """
+        try:
+            stored_workflow = trans.sa_session.query(self.app.model.StoredWorkflow).get(trans.security.decode_id(workflow_id))
+            invocation = trans.sa_session.query(self.app.model.WorkflowInvocation).get(trans.security.decode_id(id))
+        except TypeError:
+            stored_workflow = invocation = None
+        if stored_workflow is None or invocation is None or invocation.workflow.stored_workflow != stored_workflow:
+            trans.response.status = 400
+            return "Workflow invocation not found."
+        if invocation.user != trans.user and not trans.user_is_admin():
+            trans.response.status = 400
+            return "Workflow invocation is not owned by current user"
+        return invocation.get_api_value( view='element', value_mapper={ 'id': trans.security.encode_id,
+                                                                        'workflow_id': trans.security.encode_id,
+                                                                        'history_id': trans.security.encode_id } )
+
     # ---------------------------------------------------------------------------------------------- #
     # ---------------------------------------------------------------------------------------------- #
     # ---- RPARK EDITS ---- #
@@ -141,6 +141,7 @@ def app_factory( global_conf, **kwargs ):
     # Defines a named route "import_workflow".
     webapp.api_mapper.connect("import_workflow", "/api/workflows/upload", controller="workflows", action="import_new_workflow", conditions=dict(method=["POST"]))
     webapp.api_mapper.connect("workflow_dict", '/api/workflows/download/{workflow_id}', controller='workflows', action='workflow_dict', conditions=dict(method=['GET']))
+    webapp.api_mapper.connect("workflow_invocation", '/api/workflows/{workflow_id}/invocations/{id}', controller='workflows', action='invocation', conditions=dict(method=['GET']))
 
     # Connect logger from app
     if app.trace_logger:
@@ -11,6 +11,7 @@ from galaxy.web.base.controller import *
 from galaxy.web.framework.helpers import time_ago, iff, grids
 from galaxy import util, datatypes, web, model
 from galaxy.datatypes.display_applications.util import encode_dataset_user, decode_dataset_user
+from galaxy.datatypes.metadata import FileParameter
 from galaxy.util.sanitize_html import sanitize_html
 from galaxy.util import inflector
 from galaxy.model.item_attrs import *
@@ -281,11 +282,14 @@ class DatasetInterface( BaseUIController, UsesAnnotations, UsesHistoryMixin, Use
         data = trans.sa_session.query( trans.app.model.HistoryDatasetAssociation ).get( trans.security.decode_id( hda_id ) )
         if not data or not self._can_access_dataset( trans, data ):
             return trans.show_error_message( "You are not allowed to access this dataset" )
+        spec = data.metadata.spec.get( metadata_name )
+        if spec is None or not isinstance( spec.param, FileParameter ) or not spec.get( "downloadable", True ) or not data.metadata.get( metadata_name ):
+            return trans.show_error_message( "This dataset has no %s metadata file" % metadata_name )
 
         valid_chars = '.,^_-()[]0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'
         fname = ''.join(c in valid_chars and c or '_' for c in data.name)[0:150]
 
-        file_ext = data.metadata.spec.get(metadata_name).get("file_ext", metadata_name)
+        file_ext = spec.get("file_ext", metadata_name)
         trans.response.headers["Content-Type"] = "application/octet-stream"
         trans.response.headers["Content-Disposition"] = 'attachment; filename="Galaxy%s-[%s].%s"' % (data.hid, fname, file_ext)
         return open(data.metadata.get(metadata_name).file_name)
@@ -906,7 +910,7 @@ class DatasetInterface( BaseUIController, UsesAnnotations, UsesHistoryMixin, Use
             # HDA is purgeable
             # Decrease disk usage first
             if user:
-                user.total_disk_usage -= hda.quota_amount( user )
+                user.adjust_total_disk_usage( -hda.quota_amount( user ) )
             # Mark purged
             hda.purged = True
             trans.sa_session.add( hda )
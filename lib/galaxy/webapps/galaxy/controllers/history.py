@@ -304,7 +304,7 @@ class HistoryController( BaseUIController, SharableMixin, UsesAnnotations, UsesI
             if purge and trans.app.config.allow_user_dataset_purge:
                 for hda in history.datasets:
                     if trans.user:
-                        trans.user.total_disk_usage -= hda.quota_amount( trans.user )
+                        trans.user.adjust_total_disk_usage( -hda.quota_amount( trans.user ) )
                     hda.purged = True
                     trans.sa_session.add( hda )
                     trans.log_event( "HDA id %s has been purged" % hda.id )
@@ -490,7 +490,7 @@ class HistoryController( BaseUIController, SharableMixin, UsesAnnotations, UsesI
                 if not hda.deleted or hda.purged:
                     continue
                 if trans.user:
-                    trans.user.total_disk_usage -= hda.quota_amount( trans.user )
+                    trans.user.adjust_total_disk_usage( -hda.quota_amount( trans.user ) )
                 hda.purged = True
                 trans.sa_session.add( hda )
                 trans.log_event( "HDA id %s has been purged" % hda.id )
@@ -519,7 +519,7 @@ class HistoryController( BaseUIController, SharableMixin, UsesAnnotations, UsesI
         if purge and trans.app.config.allow_user_dataset_purge:
             for hda in history.datasets:
                 if trans.user:
-                    trans.user.total_disk_usage -= hda.quota_amount( trans.user )
+                    trans.user.adjust_total_disk_usage( -hda.quota_amount( trans.user ) )
                 hda.purged = True
                 trans.sa_session.add( hda )
                 trans.log_event( "HDA id %s has been purged" % hda.id )
@@ -1763,28 +1763,20 @@ class LibraryCommon( BaseUIController, UsesFormDefinitionsMixin ):
                 try:
                     outext = 'zip'
                     if action == 'zip':
-                        # Can't use mkstemp - the file must not exist first
-                        tmpd = tempfile.mkdtemp()
-                        util.umask_fix_perms( tmpd, trans.app.config.umask, 0777, self.app.config.gid )
-                        tmpf = os.path.join( tmpd, 'library_download.' + action )
-                        if ziptype == '64' and trans.app.config.upstream_gzip:
-                            archive = zipfile.ZipFile( tmpf, 'w', zipfile.ZIP_STORED, True )
-                        elif ziptype == '64':
-                            archive = zipfile.ZipFile( tmpf, 'w', zipfile.ZIP_DEFLATED, True )
-                        elif trans.app.config.upstream_gzip:
-                            archive = zipfile.ZipFile( tmpf, 'w', zipfile.ZIP_STORED )
+                        if trans.app.config.upstream_gzip:
+                            compresslevel = 0
                         else:
-                            archive = zipfile.ZipFile( tmpf, 'w', zipfile.ZIP_DEFLATED )
-                        archive.add = lambda x, y: archive.write( x, y.encode('CP437') )
+                            compresslevel = trans.app.config.archive_compression_level
+                        archive = util.streamball.ZipBall( compresslevel=compresslevel, allow_zip64=( ziptype == '64' ) )
                     elif action == 'tgz':
                         if trans.app.config.upstream_gzip:
                             archive = util.streamball.StreamBall( 'w|' )
                             outext = 'tar'
                         else:
-                            archive = util.streamball.StreamBall( 'w|gz' )
+                            archive = util.streamball.StreamBall( 'w|gz', compresslevel=trans.app.config.archive_compression_level )
                             outext = 'tgz'
                     elif action == 'tbz':
-                        archive = util.streamball.StreamBall( 'w|bz2' )
+                        archive = util.streamball.StreamBall( 'w|bz2', compresslevel=trans.app.config.archive_compression_level )
                         outext = 'tbz2'
                     elif action == 'ngxzip':
                         archive = NgxZip( trans.app.config.nginx_x_archive_files_base )
@@ -1862,10 +1854,8 @@ class LibraryCommon( BaseUIController, UsesFormDefinitionsMixin ):
                             lname = 'selected_dataset'
                         fname = lname.replace( ' ', '_' ) + '_files'
                         if action == 'zip':
-                            archive.close()
                             trans.response.set_content_type( "application/x-zip-compressed" )
                             trans.response.headers[ "Content-Disposition" ] = 'attachment; filename="%s.%s"' % (fname,outext)
-                            archive = util.streamball.ZipBall(tmpf, tmpd)
                             archive.wsgi_status = trans.response.wsgi_status()
                             archive.wsgi_headeritems = trans.response.wsgi_headeritems()
                             return archive.stream
@@ -16,13 +16,13 @@ from galaxy.util.sanitize_html import sanitize_html
 from galaxy.util.topsort import topsort, topsort_levels, CycleError
 from galaxy.tool_shed import encoding_util
 from galaxy.workflow.modules import *
+from galaxy.workflow.scheduler import queue_invocation
 from galaxy import model
 from galaxy import util
 from galaxy.model.mapping import desc
 from galaxy.model.orm import *
 from galaxy.model.item_attrs import *
 from galaxy.web.framework.helpers import to_unicode
-from galaxy.jobs.actions.post import ActionBox
 
 class StoredWorkflowListGrid( grids.Grid ):
     class StepsColumn( grids.GridColumn ):
@@ -1401,64 +1401,28 @@ class WorkflowController( BaseUIController, SharableMixin, UsesStoredWorkflowMix
                             target_history = new_history
                         else:
                             target_history = trans.get_history()
-                        # Run each step, connecting outputs to inputs
-                        workflow_invocation = model.WorkflowInvocation()
-                        workflow_invocation.workflow = workflow
+                        # Run the input steps now, and leave creating the jobs
+                        # for the tool steps to the workflow scheduler
                         outputs = odict()
-                        for i, step in enumerate( workflow.steps ):
-                            # Execute module
-                            job = None
+                        for step in workflow.steps:
                             if step.type == 'tool' or step.type is None:
-                                tool = trans.app.toolbox.get_tool( step.tool_id )
-                                # Connect up
-                                def callback( input, value, prefixed_name, prefixed_label ):
-                                    replacement = None
-                                    if isinstance( input, DataToolParameter ):
-                                        if prefixed_name in step.input_connections_by_name:
-                                            conn = step.input_connections_by_name[ prefixed_name ]
-                                            if input.multiple:
-                                                replacement = [outputs[ c.output_step.id ][ c.output_name ] for c in conn]
-                                            else:
-                                                replacement = outputs[ conn[0].output_step.id ][ conn[0].output_name ]
-                                    return replacement
-                                try:
-                                    # Replace DummyDatasets with historydatasetassociations
-                                    visit_input_values( tool.inputs, step.state.inputs, callback )
-                                except KeyError, k:
-                                    error( "Error due to input mapping of '%s' in '%s'.  A common cause of this is conditional outputs that cannot be determined until runtime, please review your workflow." % (tool.name, k.message))
-                                # Execute it
-                                job, out_data = tool.execute( trans, step.state.inputs, history=target_history)
-                                outputs[ step.id ] = out_data
-                                # Create new PJA associations with the created job, to be run on completion.
-                                # PJA Parameter Replacement (only applies to immediate actions-- rename specifically, for now)
-                                # Pass along replacement dict with the execution of the PJA so we don't have to modify the object.
-                                replacement_dict = {}
-                                for k, v in kwargs.iteritems():
-                                    if k.startswith('wf_parm|'):
-                                        replacement_dict[k[8:]] = v
-                                for pja in step.post_job_actions:
-                                    if pja.action_type in ActionBox.immediate_actions:
-                                        ActionBox.execute(trans.app, trans.sa_session, pja, job, replacement_dict)
-                                    else:
-                                        job.add_post_job_action(pja)
-                            else:
-                                job, out_data = step.module.execute( trans, step.state )
-                                outputs[ step.id ] = out_data
-                                if new_history:
-                                    for input_dataset_hda in out_data.values():
-                                        new_hda = input_dataset_hda.copy( copy_children=True )
-                                        new_history.add_dataset(new_hda)
-                                        outputs[ step.id ]['input_ds_copy'] = new_hda
-                            # Record invocation
-                            workflow_invocation_step = model.WorkflowInvocationStep()
-                            workflow_invocation_step.workflow_invocation = workflow_invocation
-                            workflow_invocation_step.workflow_step = step
-                            workflow_invocation_step.job = job
-                        # All jobs ran sucessfully, so we can save now
-                        trans.sa_session.add( workflow_invocation )
-                        invocations.append({'outputs': outputs,
+                                continue
+                            job, out_data = step.module.execute( trans, step.state )
+                            outputs[ step.id ] = out_data
+                            if new_history:
+                                for input_dataset_hda in out_data.values():
+                                    new_hda = input_dataset_hda.copy( copy_children=True )
+                                    new_history.add_dataset(new_hda)
+                                    outputs[ step.id ]['input_ds_copy'] = new_hda
+                        # PJA Parameter Replacement (only applies to immediate actions-- rename specifically, for now)
+                        # Pass along replacement dict with the execution of the PJA so we don't have to modify the object.
+                        replacement_dict = {}
+                        for k, v in kwargs.iteritems():
+                            if k.startswith('wf_parm|'):
+                                replacement_dict[k[8:]] = v
+                        workflow_invocation = queue_invocation( trans, workflow, target_history, outputs, replacement_dict )
+                        invocations.append({'invocation': workflow_invocation,
                                             'new_history': new_history})
-                        trans.sa_session.flush()
                 if invocations:
                     return trans.fill_template( "workflow/run_complete.mako",
                                                     workflow=stored,
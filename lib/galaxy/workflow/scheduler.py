@@ -0,0 +1,262 @@
+"""
+Schedule the steps of workflow invocations in the background.
+
+Running a workflow from the web interface or the API only records a
+WorkflowInvocation holding the runtime state of each of its tool steps (see
+`queue_invocation`) and returns.  The WorkflowScheduler of the Galaxy process
+that recorded the invocation then creates the jobs for its steps a batch at a
+time, scheduling each step as soon as the steps it takes inputs from have
+created their output datasets.  When a workflow is run over many datasets
+into one history, the jobs for each step of all of the invocations are
+created together (see `DefaultToolAction.execute_many`).
+"""
+
+import logging
+import threading
+from Queue import Queue, Empty
+
+from galaxy import model
+from galaxy.jobs import Sleeper
+from galaxy.jobs.actions.post import ActionBox
+from galaxy.jobs.deferred import FakeTrans
+from galaxy.tools import DefaultToolState
+from galaxy.tools.parameters import visit_input_values, DataToolParameter
+from galaxy.util.odict import odict
+
+log = logging.getLogger( __name__ )
+
+def queue_invocation( trans, workflow, history, input_outputs, replacement_dict=None ):
+    """
+    Record an invocation of `workflow` creating its datasets in `history`,
+    and hand it to this process's scheduler.  `input_outputs` maps the id of
+    each input step, which the caller has already run, to a dictionary of
+    the datasets it outputs; the state of each tool step is taken from
+    `step.state`.  `replacement_dict` holds the values of workflow parameters
+    for post job actions.
+    """
+    # Give the datasets of the input steps ids
+    trans.sa_session.flush()
+    invocation = model.WorkflowInvocation( workflow=workflow,
+                                           history=history,
+                                           user=trans.user,
+                                           handler=trans.app.config.server_name,
+                                           params=dict( replacement_dict=replacement_dict ) )
+    for step in workflow.steps:
+        invocation_step = model.WorkflowInvocationStep( workflow_invocation=invocation, workflow_step=step )
+        if step.id in input_outputs:
+            invocation_step.outputs = dict( ( name, data.id ) for name, data in input_outputs[ step.id ].items() )
+            invocation_step.state = model.WorkflowInvocationStep.states.SCHEDULED
+        else:
+            tool = trans.app.toolbox.get_tool( step.tool_id )
+            invocation_step.tool_state = step.state.encode( tool, trans.app, secure=False )
+    trans.sa_session.add( invocation )
+    trans.sa_session.flush()
+    trans.app.workflow_scheduler.put( invocation.id )
+    return invocation
+
+class WorkflowScheduler( object ):
+    """
+    Creates the jobs for the steps of the workflow invocations handled by
+    this Galaxy process in a background thread.
+    """
+    def __init__( self, app ):
+        self.app = app
+        self.sa_session = app.model.context
+        self.batch_size = app.config.workflow_scheduler_batch_size
+        # Ids of new invocations, passed to the monitor thread
+        self.queue = Queue()
+        # Ids of the invocations with steps left to schedule (only use from
+        # monitor thread)
+        self.invocations = []
+        # Helper for interruptable sleep
+        self.sleeper = Sleeper()
+        self.running = True
+        self.monitor_thread = threading.Thread( name="WorkflowScheduler.monitor_thread", target=self.__monitor )
+        self.monitor_thread.setDaemon( True )
+        self.__check_invocations_at_startup()
+        self.monitor_thread.start()
+        log.info( "workflow scheduler started" )
+
+    def __check_invocations_at_startup( self ):
+        """
+        Pick up the invocations this process had not finished scheduling when
+        it last stopped.
+        """
+        for invocation in self.sa_session.query( model.WorkflowInvocation ).enable_eagerloads( False ) \
+                                         .filter( ( model.WorkflowInvocation.state == model.WorkflowInvocation.states.NEW ) \
+                                                  & ( model.WorkflowInvocation.handler == self.app.config.server_name ) ):
+            log.debug( "(%s) Recovered workflow invocation with unscheduled steps" % invocation.id )
+            self.invocations.append( invocation.id )
+
+    def put( self, invocation_id ):
+        """Schedule the steps of a newly recorded invocation"""
+        self.queue.put( invocation_id )
+        self.sleeper.wake()
+
+    def __monitor( self ):
+        """
+        Schedule steps while there are any left, otherwise wait for new
+        invocations.
+        """
+        while self.running:
+            busy = False
+            try:
+                busy = self.__monitor_step()
+            except:
+                log.exception( "Exception in monitor_step" )
+            if not busy:
+                self.sleeper.sleep( 1 )
+        log.info( "workflow scheduler stopped" )
+
+    def __monitor_step( self ):
+        """
+        Schedule the next batch of steps of each invocation, and return
+        whether any invocation still has steps left to schedule.
+        """
+        try:
+            while True:
+                self.invocations.append( self.queue.get_nowait() )
+        except Empty:
+            pass
+        if not self.invocations:
+            return False
+        # Clear the session so we see invocations committed by other threads
+        self.sa_session.expunge_all()
+        invocations = []
+        for invocation_id in self.invocations:
+            invocation = self.sa_session.query( model.WorkflowInvocation ).get( invocation_id )
+            if invocation is not None and invocation.state == invocation.states.NEW:
+                invocations.append( invocation )
+        scheduled = dict( ( invocation.id, 0 ) for invocation in invocations )
+        # Schedule the ready steps in rounds, as each round can make more
+        # steps ready.  The same step of invocations of a workflow into the
+        # same history (e.g. the workflow run over many input datasets) is
+        # scheduled together, creating all of its jobs at once.
+        while True:
+            groups = odict()
+            for invocation in invocations:
+                if invocation.state != invocation.states.NEW:
+                    continue
+                for invocation_step in self.__ready_steps( invocation ):
+                    if scheduled[ invocation.id ] == self.batch_size:
+                        break
+                    key = ( invocation_step.workflow_step_id, invocation.history_id )
+                    groups.setdefault( key, [] ).append( ( invocation, invocation_step ) )
+                    scheduled[ invocation.id ] += 1
+            if not groups:
+                break
+            for group in groups.values():
+                self.__schedule_steps( group )
+        self.invocations = []
+        for invocation in invocations:
+            if invocation.state == invocation.states.NEW:
+                if len( invocation.scheduled_steps ) == len( invocation.steps ):
+                    log.debug( "(%s) Scheduled all %d steps of workflow invocation" % ( invocation.id, len( invocation.steps ) ) )
+                    invocation.state = invocation.states.SCHEDULED
+                    self.sa_session.add( invocation )
+                else:
+                    self.invocations.append( invocation.id )
+        self.sa_session.flush()
+        return bool( self.invocations )
+
+    def __ready_steps( self, invocation ):
+        """
+        The unscheduled steps of `invocation` whose inputs all come from
+        scheduled steps, in workflow order.
+        """
+        scheduled = set( [ invocation_step.workflow_step_id for invocation_step in invocation.scheduled_steps ] )
+        rval = []
+        for invocation_step in invocation.steps:
+            if invocation_step.workflow_step_id in scheduled:
+                continue
+            for conn in invocation_step.workflow_step.input_connections:
+                if conn.output_step_id not in scheduled:
+                    break
+            else:
+                rval.append( invocation_step )
+        rval.sort( key=lambda invocation_step: invocation_step.workflow_step.order_index )
+        return rval
+
+    def __fail( self, invocation, message ):
+        invocation.state = invocation.states.FAILED
+        invocation.message = message
+        self.sa_session.add( invocation )
+        self.sa_session.flush()
+
+    def __schedule_steps( self, group ):
+        """
+        Create the jobs for a list of ( invocation, invocation step ) pairs,
+        all for the same tool step and history, connecting each step's data
+        inputs to the outputs of earlier steps of its invocation.
+        """
+        step = group[0][1].workflow_step
+        tool = self.app.toolbox.get_tool( step.tool_id )
+        ready = []
+        incomings = []
+        for invocation, invocation_step in group:
+            try:
+                if tool is None:
+                    raise Exception( "The tool '%s' used in step %d is not available" % ( step.tool_id, step.order_index + 1 ) )
+                incomings.append( self.__get_tool_inputs( tool, invocation, invocation_step ) )
+                ready.append( ( invocation, invocation_step ) )
+            except Exception, e:
+                log.exception( "(%s) Scheduling workflow invocation failed" % invocation.id )
+                self.__fail( invocation, str( e ) )
+        if not ready:
+            return
+        invocation = ready[0][0]
+        trans = FakeTrans( self.app, history=invocation.history, user=invocation.user )
+        try:
+            results = tool.execute_many( trans, incomings, history=invocation.history )
+        except Exception, e:
+            log.exception( "Scheduling step %d of workflow invocations %s failed" % ( step.order_index + 1, ", ".join( [ str( invocation.id ) for invocation, invocation_step in ready ] ) ) )
+            for invocation, invocation_step in ready:
+                self.__fail( invocation, str( e ) )
+            return
+        for ( invocation, invocation_step ), ( job, out_data ) in zip( ready, results ):
+            # Create new PJA associations with the created job, to be run on completion.
+            replacement_dict = ( invocation.params or {} ).get( 'replacement_dict' )
+            for pja in step.post_job_actions:
+                if pja.action_type in ActionBox.immediate_actions:
+                    ActionBox.execute( self.app, self.sa_session, pja, job, replacement_dict )
+                else:
+                    job.add_post_job_action( pja )
+            invocation_step.job = job
+            invocation_step.outputs = dict( ( name, data.id ) for name, data in out_data.items() )
+            invocation_step.state = invocation_step.states.SCHEDULED
+            self.sa_session.add( invocation_step )
+        self.sa_session.flush()
+
+    def __get_tool_inputs( self, tool, invocation, invocation_step ):
+        """
+        Restore the tool state of a step, with its connected data inputs
+        replaced by the outputs of earlier steps.
+        """
+        step = invocation_step.workflow_step
+        outputs = {}
+        for scheduled_step in invocation.scheduled_steps:
+            outputs[ scheduled_step.workflow_step_id ] = scheduled_step.outputs or {}
+        state = DefaultToolState()
+        state.decode( invocation_step.tool_state, tool, self.app, secure=False )
+        input_connections_by_name = {}
+        for conn in step.input_connections:
+            input_connections_by_name.setdefault( conn.input_name, [] ).append( conn )
+        def callback( input, value, prefixed_name, prefixed_label ):
+            if isinstance( input, DataToolParameter ) and prefixed_name in input_connections_by_name:
+                replacement = [ self.__get_output( outputs, conn, tool ) for conn in input_connections_by_name[ prefixed_name ] ]
+                if input.multiple:
+                    return replacement
+                return replacement[0]
+        visit_input_values( tool.inputs, state.inputs, callback )
+        return state.inputs
+
+    def __get_output( self, outputs, conn, tool ):
+        try:
+            hda_id = outputs[ conn.output_step_id ][ conn.output_name ]
+        except KeyError:
+            raise Exception( "Error due to input mapping of '%s' in '%s'.  A common cause of this is conditional outputs that cannot be determined until runtime, please review your workflow." % ( conn.output_name, tool.name ) )
+        return self.sa_session.query( model.HistoryDatasetAssociation ).get( hda_id )
+
+    def shutdown( self ):
+        self.running = False
+        self.sleeper.wake()
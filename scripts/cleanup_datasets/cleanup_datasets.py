@@ -28,6 +28,9 @@ from galaxy.exceptions import ObjectNotFound
 
 assert sys.version_info[:2] >= ( 2, 4 )
 
+# Number of datasets purge_datasets looks up in the object store at once
+PURGE_BATCH_SIZE = 1000
+
 def main():
     """
     Managing library datasets is a bit complex, so here is a scenario that hopefully provides clarification.  The complexities
@@ -353,14 +356,21 @@ def purge_datasets( app, cutoff_time, remove_from_disk, info_only = False, force
                                                 app.model.Dataset.table.c.purgable==True,
                                                 app.model.Dataset.table.c.purged==False,
                                                 app.model.Dataset.table.c.update_time < cutoff_time ) )
-    for dataset in datasets:
-        file_size = dataset.file_size
-        _purge_dataset( app, dataset, remove_from_disk, info_only = info_only )
-        dataset_count += 1
-        try:
-            disk_space += file_size
-        except:
-            pass
+    datasets = datasets.all()
+    for i in range( 0, len( datasets ), PURGE_BATCH_SIZE ):
+        batch = datasets[ i:i + PURGE_BATCH_SIZE ]
+        file_names = {}
+        if remove_from_disk and not info_only:
+            # Look up the files of the whole batch in the object store at once
+            file_names = app.object_store.get_filenames_many( [ dataset for dataset in batch if not dataset.external_filename ] )
+        for dataset in batch:
+            file_size = dataset.file_size
+            _purge_dataset( app, dataset, remove_from_disk, info_only = info_only, file_name = file_names.get( dataset.id ) )
+            dataset_count += 1
+            try:
+                disk_space += file_size
+            except:
+                pass
     stop = time.time()
     print 'Purged %d datasets' % dataset_count
     if remove_from_disk:
@@ -445,7 +455,8 @@ def _delete_dataset( dataset, app, remove_from_disk, info_only=False, is_deletab
         else:
             print "Dataset %i will be deleted (without 'info_only' mode)" % ( dataset.id )
 
-def _purge_dataset( app, dataset, remove_from_disk, info_only = False ):
+def _purge_dataset( app, dataset, remove_from_disk, info_only = False, file_name = None ):
+    # `file_name` may be given if already looked up, otherwise it is looked up here
     if dataset.deleted:
         try:
             if dataset.purgable and _dataset_is_deletable( dataset ):
@@ -453,8 +464,10 @@ def _purge_dataset( app, dataset, remove_from_disk, info_only = False ):
                     # Remove files from disk and update the database
                     if remove_from_disk:
                         # TODO: should permissions on the dataset be deleted here?
-                        print "Removing disk, file ", dataset.file_name
-                        os.unlink( dataset.file_name )
+                        if file_name is None:
+                            file_name = dataset.file_name
+                        print "Removing disk, file ", file_name
+                        os.unlink( file_name )
                         # Remove associated extra files from disk if they exist
                         if dataset.extra_files_path and os.path.exists( dataset.extra_files_path ):
                             shutil.rmtree( dataset.extra_files_path ) #we need to delete the directory and its contents; os.unlink would always fail on a directory
@@ -463,8 +476,7 @@ def _purge_dataset( app, dataset, remove_from_disk, info_only = False ):
                             if not hda.purged and hda.history.user is not None and hda.history.user not in usage_users:
                                 usage_users.append( hda.history.user )
                         for user in usage_users:
-                            user.total_disk_usage -= dataset.total_size
-                            app.sa_session.add( user )
+                            user.adjust_total_disk_usage( -( dataset.total_size or 0 ) )
                     print "Purging dataset id", dataset.id
                     dataset.purged = True
                     app.sa_session.add( dataset )
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+"""
+Rewrites summary tree datasets written with cPickle by earlier releases in the
+compact, memory-mappable format.  Either converts the summary tree files given
+as arguments, or all summary_tree datasets in the Galaxy database.
+
+Converted files are somewhat larger than the pickles they replace, so run
+set_user_disk_usage.py afterwards if quotas are enabled.
+"""
+
+import os, sys
+from ConfigParser import ConfigParser
+from optparse import OptionParser
+
+default_config = os.path.abspath( os.path.join( os.path.dirname( __file__ ), '..', 'universe_wsgi.ini') )
+
+parser = OptionParser( usage='%prog [options] [summary tree file ...]' )
+parser.add_option( '-c', '--config', dest='config', help='Path to Galaxy config file (universe_wsgi.ini)', default=default_config )
+parser.add_option( '--dry-run', dest='dryrun', help='Dry run (show which datasets would be converted without converting them)', action='store_true', default=False )
+( options, args ) = parser.parse_args()
+
+sys.path.append( os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..', 'lib' ) )
+from galaxy.visualization.tracks.summary import is_compact_summary_tree, convert_summary_tree_file
+
+def init():
+
+    options.config = os.path.abspath( options.config )
+    os.chdir( os.path.dirname( options.config ) )
+    sys.path.append( 'lib' )
+
+    from galaxy import eggs
+    import pkg_resources
+
+    import galaxy.config
+    from galaxy.objectstore import build_object_store_from_config
+
+    config_parser = ConfigParser( dict( here = os.getcwd(),
+                                        database_connection = 'sqlite:///database/universe.sqlite?isolation_level=IMMEDIATE' ) )
+    config_parser.read( os.path.basename( options.config ) )
+
+    config_dict = {}
+    for key, value in config_parser.items( "app:main" ):
+        config_dict[key] = value
+
+    config = galaxy.config.Configuration( **config_dict )
+    object_store = build_object_store_from_config( config )
+
+    from galaxy.model import mapping
+
+    return mapping.init( config.file_path, config.database_connection, create_tables = False, object_store = object_store ), object_store
+
+def convert( filename ):
+    """ Converts filename, returning True if it needed converting. """
+    if is_compact_summary_tree( filename ):
+        return False
+    if not options.dryrun:
+        convert_summary_tree_file( filename )
+    return True
+
+if __name__ == '__main__':
+    if args:
+        for filename in args:
+            if convert( filename ):
+                print 'converted', filename
+            else:
+                print 'already compact:', filename
+        sys.exit( 0 )
+
+    print 'Loading Galaxy model...'
+    model, object_store = init()
+    sa_session = model.context.current
+
+    converted = failed = 0
+    datasets = sa_session.query( model.Dataset ) \
+                         .join( model.Dataset.history_associations ) \
+                         .filter( model.HistoryDatasetAssociation.table.c.extension == 'summary_tree' ) \
+                         .filter( model.Dataset.table.c.purged == False ) \
+                         .filter( model.Dataset.table.c.state == model.Dataset.states.OK ) \
+                         .distinct()
+    for dataset in datasets:
+        filename = dataset.file_name
+        try:
+            if not convert( filename ):
+                continue
+        except Exception, e:
+            print 'dataset %i: unable to convert %s: %s' % ( dataset.id, filename, e )
+            failed += 1
+            continue
+        converted += 1
+        if not options.dryrun:
+            dataset.file_size = os.path.getsize( filename )
+            dataset.set_total_size()
+            sa_session.add( dataset )
+            sa_session.flush()
+        print 'dataset %i: converted %s' % ( dataset.id, filename )
+    object_store.shutdown()
+    print '%i summary trees converted%s, %i failed' % ( converted, options.dryrun and ' (dry run, not written)' or '', failed )
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+"""
+Run a pool of long-lived processes setting metadata for Galaxy's jobs,
+listening on the Unix socket set as metadata_worker_socket in the Galaxy
+config file (or given with --socket).  See
+lib/galaxy/datatypes/metadata_worker.py.
+
+The pool should run as the user Galaxy runs as, on the Galaxy server.  It
+exits on SIGTERM or SIGINT.
+"""
+
+import os, sys, signal, logging
+from ConfigParser import ConfigParser
+from optparse import OptionParser
+
+default_config = os.path.abspath( os.path.join( os.path.dirname( __file__ ), '..', 'universe_wsgi.ini') )
+
+parser = OptionParser()
+parser.add_option( '-c', '--config', dest='config', help='Path to Galaxy config file (universe_wsgi.ini)', default=default_config )
+parser.add_option( '-s', '--socket', dest='socket', help='Unix socket to listen on (default: metadata_worker_socket in the Galaxy config file)' )
+parser.add_option( '-w', '--workers', dest='workers', type='int', default=4, help='Number of worker processes (default: 4)' )
+parser.add_option( '-m', '--max-requests', dest='max_requests', type='int', default=1000, help='Replace each worker after it has handled this many requests (default: 1000)' )
+parser.add_option( '-t', '--timeout', dest='timeout', type='int', help='Abandon requests taking longer than this many seconds' )
+( options, args ) = parser.parse_args()
+
+def init():
+
+    options.config = os.path.abspath( options.config )
+    os.chdir( os.path.dirname( options.config ) )
+    sys.path.append( 'lib' )
+
+    from galaxy import eggs
+    import pkg_resources
+
+    if options.socket is None:
+        config_parser = ConfigParser( dict( here = os.getcwd() ) )
+        config_parser.read( os.path.basename( options.config ) )
+        if config_parser.has_option( 'app:main', 'metadata_worker_socket' ):
+            options.socket = config_parser.get( 'app:main', 'metadata_worker_socket' )
+    if options.socket is None:
+        parser.error( 'no socket given, and metadata_worker_socket is not set in %s' % options.config )
+
+if __name__ == '__main__':
+    logging.basicConfig( level=logging.INFO, format='%(asctime)s %(process)d %(name)s %(levelname)s %(message)s' )
+    init()
+    from galaxy.datatypes.metadata_worker import MetadataWorkerPool
+    pool = MetadataWorkerPool( os.path.abspath( options.socket ),
+                               workers = options.workers,
+                               max_requests = options.max_requests,
+                               timeout = options.timeout )
+    def stop( signum, frame ):
+        pool.stop()
+    signal.signal( signal.SIGTERM, stop )
+    signal.signal( signal.SIGINT, stop )
+    pool.serve_forever()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+"""
+Moves datasets stored by old releases directly in file_path (the flat layout,
+e.g. files/dataset_10.dat and files/dataset_10_files/) into the hashed layout
+used for new datasets (files/000/dataset_10.dat), then marks file_path as
+hashed-only so that Galaxy stops looking for datasets in the flat layout.
+
+Galaxy must not be running while datasets are moved.  With a distributed
+object store every disk backend is migrated.
+"""
+
+import os, re, sys, shutil
+from ConfigParser import ConfigParser
+from optparse import OptionParser
+
+default_config = os.path.abspath( os.path.join( os.path.dirname( __file__ ), '..', 'universe_wsgi.ini') )
+
+parser = OptionParser()
+parser.add_option( '-c', '--config', dest='config', help='Path to Galaxy config file (universe_wsgi.ini)', default=default_config )
+parser.add_option( '--dry-run', dest='dryrun', help='Dry run (show which datasets would be moved without moving them)', action='store_true', default=False )
+( options, args ) = parser.parse_args()
+
+flat_name_re = re.compile( r'^dataset_(\d+)(\.dat|_files)$' )
+
+def init():
+
+    options.config = os.path.abspath( options.config )
+    os.chdir( os.path.dirname( options.config ) )
+    sys.path.append( 'lib' )
+
+    from galaxy import eggs
+    import pkg_resources
+
+    import galaxy.config
+    from galaxy.objectstore import build_object_store_from_config
+
+    config_parser = ConfigParser( dict( here = os.getcwd(),
+                                        database_connection = 'sqlite:///database/universe.sqlite?isolation_level=IMMEDIATE' ) )
+    config_parser.read( os.path.basename( options.config ) )
+
+    config_dict = {}
+    for key, value in config_parser.items( "app:main" ):
+        config_dict[key] = value
+
+    config = galaxy.config.Configuration( **config_dict )
+    return build_object_store_from_config( config )
+
+def migrate( file_path ):
+    """
+    Move the flat layout datasets in `file_path`, returning the numbers of
+    datasets moved and left in place because the hashed path was taken.
+    """
+    moved = conflicts = 0
+    for name in sorted( os.listdir( file_path ) ):
+        match = flat_name_re.match( name )
+        if not match:
+            continue
+        path = os.path.join( file_path, name )
+        new_dir = os.path.join( file_path, *directory_hash_id( int( match.group( 1 ) ) ) )
+        new_path = os.path.join( new_dir, name )
+        if os.path.exists( new_path ):
+            print 'not moving %s, %s already exists' % ( path, new_path )
+            conflicts += 1
+            continue
+        if not options.dryrun:
+            if not os.path.exists( new_dir ):
+                os.makedirs( new_dir )
+            shutil.move( path, new_path )
+        moved += 1
+    return moved, conflicts
+
+if __name__ == '__main__':
+    print 'Loading Galaxy config...'
+    object_store = init()
+    from galaxy.model import directory_hash_id
+    from galaxy.objectstore import DiskObjectStore, DistributedObjectStore, HASHED_ONLY_MARKER
+
+    if isinstance( object_store, DistributedObjectStore ):
+        stores = object_store.backends.values()
+    else:
+        stores = [ object_store ]
+    for store in stores:
+        if not isinstance( store, DiskObjectStore ):
+            print 'skipping %s, only disk object stores have a flat layout' % store.__class__.__name__
+            continue
+        if store.hashed_only:
+            print '%s is already hashed-only' % store.file_path
+            continue
+        moved, conflicts = migrate( store.file_path )
+        print '%s: %i datasets moved%s' % ( store.file_path, moved, options.dryrun and ' (dry run, not moved)' or '' )
+        if conflicts:
+            print '%s: %i datasets could not be moved, not marking it hashed-only' % ( store.file_path, conflicts )
+        elif not options.dryrun:
+            open( os.path.join( store.file_path, HASHED_ONLY_MARKER ), 'w' ).close()
+            print '%s marked hashed-only' % store.file_path
+    object_store.shutdown()
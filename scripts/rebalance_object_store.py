@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+"""
+Moves datasets between the backends of a distributed object store, e.g. off
+a backend that is nearly full or slow, while Galaxy is running.
+
+Each dataset is copied to its new backend and its object_store_id updated,
+after which Galaxy uses the new copy.  The old copies are removed once
+`--grace` seconds have passed, so that requests and jobs that looked up the
+old path just before the move can finish with it.  Datasets being written or
+read by jobs that have not finished are not moved, and old copies are not
+removed while such jobs read them.  Metadata files are not moved, they
+record their own object_store_id.
+"""
+
+import os, sys, time
+from ConfigParser import ConfigParser
+from optparse import OptionParser
+
+default_config = os.path.abspath( os.path.join( os.path.dirname( __file__ ), '..', 'universe_wsgi.ini') )
+
+parser = OptionParser()
+parser.add_option( '-c', '--config', dest='config', help='Path to Galaxy config file (universe_wsgi.ini)', default=default_config )
+parser.add_option( '-f', '--from', dest='source', help='Id of the backend to move datasets from' )
+parser.add_option( '-t', '--to', dest='target', help='Id of the backend to move datasets to (default: chosen for each dataset by the placement policy)' )
+parser.add_option( '-p', '--until-percent', dest='until_percent', type='float', help='Stop once the source backend is less than this percentage full' )
+parser.add_option( '-l', '--limit', dest='limit', type='int', help='Move at most this many datasets' )
+parser.add_option( '-g', '--grace', dest='grace', type='int', default=600, help='Seconds to keep the old copies of moved datasets for (default: 600)' )
+parser.add_option( '--dry-run', dest='dryrun', help='Dry run (show which datasets would be moved without moving them)', action='store_true', default=False )
+( options, args ) = parser.parse_args()
+
+def init():
+
+    options.config = os.path.abspath( options.config )
+    os.chdir( os.path.dirname( options.config ) )
+    sys.path.append( 'lib' )
+
+    from galaxy import eggs
+    import pkg_resources
+
+    import galaxy.config
+    from galaxy.objectstore import build_object_store_from_config
+
+    config_parser = ConfigParser( dict( here = os.getcwd(),
+                                        database_connection = 'sqlite:///database/universe.sqlite?isolation_level=IMMEDIATE' ) )
+    config_parser.read( os.path.basename( options.config ) )
+
+    config_dict = {}
+    for key, value in config_parser.items( "app:main" ):
+        config_dict[key] = value
+
+    config = galaxy.config.Configuration( **config_dict )
+    object_store = build_object_store_from_config( config )
+
+    from galaxy.model import mapping
+
+    return mapping.init( config.file_path, config.database_connection, create_tables = False, object_store = object_store ), object_store
+
+def in_use( model, dataset ):
+    """ Whether a job that has not finished reads or writes `dataset` """
+    from sqlalchemy.sql.expression import select, and_, func
+    active_states = [ model.Job.states.NEW, model.Job.states.UPLOAD, model.Job.states.WAITING,
+                      model.Job.states.QUEUED, model.Job.states.RUNNING, model.Job.states.PAUSED ]
+    job = model.Job.table
+    hda = model.HistoryDatasetAssociation.table
+    ldda = model.LibraryDatasetDatasetAssociation.table
+    for association, instance, column in ( ( model.JobToInputDatasetAssociation.table, hda, 'dataset_id' ),
+                                           ( model.JobToOutputDatasetAssociation.table, hda, 'dataset_id' ),
+                                           ( model.JobToInputLibraryDatasetAssociation.table, ldda, 'ldda_id' ),
+                                           ( model.JobToOutputLibraryDatasetAssociation.table, ldda, 'ldda_id' ) ):
+        count = select( [ func.count( association.c.id ) ],
+                        and_( association.c.job_id == job.c.id,
+                              association.c[ column ] == instance.c.id,
+                              instance.c.dataset_id == dataset.id,
+                              job.c.state.in_( active_states ) ) ).execute().scalar()
+        if count:
+            return True
+    return False
+
+def extra_dir( dataset ):
+    return dataset._extra_files_path or "dataset_%d_files" % dataset.id
+
+def remove_old_copies( model, object_store, moved ):
+    """
+    Remove the old copies of the ( time moved, dataset, backend id ) in
+    `moved` that have been kept for the grace period and are not used by
+    unfinished jobs, returning the rest.
+    """
+    kept = []
+    for moved_time, dataset, object_store_id in moved:
+        if time.time() - moved_time > options.grace and not in_use( model, dataset ):
+            object_store.delete_from_backend( dataset, object_store_id, extra_dir=extra_dir( dataset ) )
+        else:
+            kept.append( ( moved_time, dataset, object_store_id ) )
+    return kept
+
+if __name__ == '__main__':
+    if not options.source:
+        parser.error( 'the backend to move datasets from (--from) is required' )
+    print 'Loading Galaxy model...'
+    model, object_store = init()
+    sa_session = model.context.current
+    from galaxy.objectstore import CachingObjectStore, DistributedObjectStore
+
+    # Datasets are moved between the backends of a cached store, the copies in
+    # the cache stay where they are
+    cache = None
+    if isinstance( object_store, CachingObjectStore ):
+        cache, object_store = object_store, object_store.backend
+    if not isinstance( object_store, DistributedObjectStore ):
+        print 'Datasets can only be moved between the backends of a distributed object store'
+        sys.exit( 1 )
+    for id in [ options.source, options.target ]:
+        if id is not None and id not in object_store.backends:
+            print "No backend '%s' in %s" % ( id, object_store.distributed_config )
+            sys.exit( 1 )
+    source = object_store.backends[ options.source ]
+
+    finished_states = [ model.Dataset.states.OK, model.Dataset.states.EMPTY, model.Dataset.states.ERROR,
+                        model.Dataset.states.DISCARDED, model.Dataset.states.FAILED_METADATA ]
+    datasets = sa_session.query( model.Dataset ) \
+                         .filter( model.Dataset.table.c.object_store_id == options.source ) \
+                         .filter( model.Dataset.table.c.purged == False ) \
+                         .filter( model.Dataset.table.c.state.in_( finished_states ) ) \
+                         .order_by( model.Dataset.table.c.id )
+    moved = []
+    count = skipped = 0
+    for dataset in datasets:
+        if options.limit is not None and count >= options.limit:
+            break
+        if options.until_percent is not None and source.get_store_usage_percent() < options.until_percent:
+            print "Backend '%s' is less than %.1f%% full" % ( options.source, options.until_percent )
+            break
+        if dataset.external_filename or in_use( model, dataset ):
+            skipped += 1
+            continue
+        if cache is not None and not cache.is_durable( dataset ):
+            # Changes not yet written back would go to the source backend
+            print 'dataset %i has changes in the cache not yet written back' % dataset.id
+            skipped += 1
+            continue
+        target = options.target
+        if target is None:
+            target = object_store.choose_backend( size_hint=dataset.file_size, exclude=[ options.source ] )
+        if options.dryrun:
+            print 'would move dataset %i to %s' % ( dataset.id, target )
+        else:
+            try:
+                object_store.migrate( dataset, target, extra_dir=extra_dir( dataset ) )
+            except Exception, e:
+                print 'could not move dataset %i to %s: %s' % ( dataset.id, target, e )
+                skipped += 1
+                continue
+            moved.append( ( time.time(), dataset, options.source ) )
+            moved = remove_old_copies( model, object_store, moved )
+        count += 1
+    print '%i datasets moved%s, %i skipped' % ( count, options.dryrun and ' (dry run, not moved)' or '', skipped )
+    if moved:
+        print 'Waiting to remove the old copies of %i datasets...' % len( moved )
+        while moved:
+            time.sleep( min( options.grace, 60 ) )
+            moved = remove_old_copies( model, object_store, moved )
+    ( cache or object_store ).shutdown()
@@ -19,17 +19,27 @@ def init():
     from galaxy import eggs
     import pkg_resources
 
-    config = ConfigParser( dict( file_path = 'database/files',
-                                 database_connection = 'sqlite:///database/universe.sqlite?isolation_level=IMMEDIATE' ) )
-    config.read( os.path.basename( options.config ) )
+    import galaxy.config
+    from galaxy.objectstore import build_object_store_from_config
+
+    config_parser = ConfigParser( dict( here = os.getcwd(),
+                                        database_connection = 'sqlite:///database/universe.sqlite?isolation_level=IMMEDIATE' ) )
+    config_parser.read( os.path.basename( options.config ) )
+
+    config_dict = {}
+    for key, value in config_parser.items( "app:main" ):
+        config_dict[key] = value
+
+    config = galaxy.config.Configuration( **config_dict )
+    object_store = build_object_store_from_config( config )
 
     from galaxy.model import mapping
 
-    return mapping.init( config.get( 'app:main', 'file_path' ), config.get( 'app:main', 'database_connection' ), create_tables = False )
+    return mapping.init( config.file_path, config.database_connection, create_tables = False, object_store = object_store ), object_store
 
 if __name__ == '__main__':
     print 'Loading Galaxy model...'
-    model = init()
+    model, object_store = init()
     sa_session = model.context.current
 
     set = 0
@@ -38,16 +48,23 @@ if __name__ == '__main__':
     percent = 0
     print 'Completed %i%%' % percent,
     sys.stdout.flush()
+    batch = []
     for i, dataset in enumerate( sa_session.query( model.Dataset ).enable_eagerloads( False ).yield_per( 1000 ) ):
         if dataset.total_size is None:
-            dataset.set_total_size()
-            set += 1
-            if not set % 1000:
-                sa_session.flush()
+            batch.append( dataset )
+        if len( batch ) == 1000:
+            # The object store checks the whole batch at once
+            model.Dataset.set_total_sizes( batch )
+            set += len( batch )
+            batch = []
+            sa_session.flush()
         new_percent = int( float(i) / dataset_count * 100 )
         if new_percent != percent:
             percent = new_percent
             print '\rCompleted %i%%' % percent,
             sys.stdout.flush()
+    model.Dataset.set_total_sizes( batch )
+    set += len( batch )
     sa_session.flush()
+    object_store.shutdown()
     print 'Completed 100%%'
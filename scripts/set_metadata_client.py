@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+"""
+Have the metadata worker pool (scripts/metadata_worker.py) listening on a
+Unix socket set metadata, given the socket and then the arguments of
+set_metadata.sh.  If the pool cannot be reached or fails to handle the
+request, set_metadata.sh is run instead.
+
+This only uses the standard library so that it starts quickly, it should not
+be called directly: Galaxy adds it to job command lines when
+metadata_worker_socket is set in universe_wsgi.ini.
+"""
+
+import os
+import sys
+import socket
+
+# Keep in sync with lib/galaxy/datatypes/metadata_worker.py
+REQUEST_SEPARATOR = '\0'
+
+def request( socket_path, args ):
+    """ Return ( handled, error message ) for setting metadata with `args` """
+    sock = socket.socket( socket.AF_UNIX, socket.SOCK_STREAM )
+    try:
+        sock.connect( socket_path )
+        sock.sendall( REQUEST_SEPARATOR.join( args ) )
+        sock.shutdown( socket.SHUT_WR )
+        chunks = []
+        while True:
+            chunk = sock.recv( 4096 )
+            if not chunk:
+                break
+            chunks.append( chunk )
+    finally:
+        sock.close()
+    reply = ''.join( chunks ).strip()
+    if reply == 'ok':
+        return True, None
+    return False, reply[ len( 'error ' ): ] or 'no reply'
+
+def __main__():
+    if len( sys.argv ) < 2:
+        print >> sys.stderr, 'usage: %s <socket> <set_metadata.sh arguments>' % sys.argv[0]
+        sys.exit( 1 )
+    socket_path = sys.argv[1]
+    args = sys.argv[2:]
+    try:
+        handled, message = request( socket_path, args )
+    except socket.error, e:
+        handled, message = False, 'cannot reach the metadata workers at %s: %s' % ( socket_path, e )
+    if handled:
+        return
+    print >> sys.stderr, '%s, running set_metadata.sh' % message
+    set_metadata = os.path.join( os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) ), 'set_metadata.sh' )
+    os.execv( '/bin/sh', [ 'sh', set_metadata ] + args )
+
+__main__()
@@ -11,6 +11,8 @@ parser.add_option( '-c', '--config', dest='config', help='Path to Galaxy config
 parser.add_option( '-u', '--username', dest='username', help='Username of user to update', default='all' )
 parser.add_option( '-e', '--email', dest='email', help='Email address of user to update', default='all' )
 parser.add_option( '--dry-run', dest='dryrun', help='Dry run (show changes but do not save to database)', action='store_true', default=False )
+parser.add_option( '--chunk-size', dest='chunk_size', type='int', help='Number of users to recalculate per query when updating all users', default=1000 )
+parser.add_option( '-p', '--processes', dest='processes', type='int', help='Number of processes to recalculate with when updating all users', default=1 )
 ( options, args ) = parser.parse_args()
 
 def init():
@@ -46,45 +48,18 @@ def init():
 
     from galaxy.model import mapping
 
-    return mapping.init( config.file_path, config.database_connection, create_tables = False, object_store = object_store ), object_store, config.database_connection.split(':')[0]
-
-def pgcalc( sa_session, id ):
-    sql = """
-           UPDATE galaxy_user
-              SET disk_usage = (SELECT COALESCE(SUM(total_size), 0)
-                                  FROM (  SELECT d.total_size
-                                            FROM history_dataset_association hda
-                                                 JOIN history h ON h.id = hda.history_id
-                                                 JOIN dataset d ON hda.dataset_id = d.id
-                                           WHERE h.user_id = :id
-                                                 AND h.purged = false
-                                                 AND hda.purged = false
-                                                 AND d.purged = false
-                                                 AND d.id NOT IN (SELECT dataset_id
-                                                                    FROM library_dataset_dataset_association)
-                                        GROUP BY d.id) sizes)
-            WHERE id = :id
-        RETURNING disk_usage;
-    """
-    r = sa_session.execute(sql, {'id':id})
-    new = r.fetchone()[0]
-    if options.dryrun:
-        sa_session.rollback()
-    return new
+    return mapping.init( config.file_path, config.database_connection, create_tables = False, object_store = object_store ), object_store
 
-def quotacheck( sa_session, users, engine ):
+def quotacheck( sa_session, user ):
     sa_session.refresh( user )
     current = user.get_disk_usage()
     print user.username, '<' + user.email + '>:',
-    if engine != 'postgres':
-        new = user.calculate_disk_usage()
-        sa_session.refresh( user )
-        # usage changed while calculating, do it again
-        if user.get_disk_usage() != current:
-            print 'usage changed while calculating, trying again...'
-            return quotacheck( sa_session, user, engine )
-    else:
-        new = pgcalc( sa_session, user.id )
+    new = user.calculate_disk_usage()
+    sa_session.refresh( user )
+    # usage changed while calculating, do it again
+    if user.get_disk_usage() != current:
+        print 'usage changed while calculating, trying again...'
+        return quotacheck( sa_session, user )
     # yes, still a small race condition between here and the flush
     print 'old usage:', nice_size( current ), 'change:',
     if new in ( current, None ):
@@ -94,23 +69,95 @@ def quotacheck( sa_session, users, engine ):
             print '+%s' % ( nice_size( new - current ) )
         else:
             print '-%s' % ( nice_size( current - new ) )
-        if not options.dryrun and engine != 'postgres':
+        if not options.dryrun:
             user.set_disk_usage( new )
             sa_session.add( user )
             sa_session.flush()
 
+def recalculate_chunk( user_ids ):
+    """
+    Recalculate and store the disk usage of `user_ids` with one aggregate
+    query, returning ( user_id, old usage, new usage ) for each user whose
+    stored usage was wrong.
+    """
+    model = worker_model
+    sa_session = model.context.current
+    user_table = model.User.table
+    dataset_table = model.Dataset.table
+    history_table = model.History.table
+    hda_table = model.HistoryDatasetAssociation.table
+    # Datasets created before total_size existed need it computed first
+    unsized = select( [ hda_table.c.dataset_id ],
+                      and_( history_table.c.user_id.in_( user_ids ),
+                            hda_table.c.history_id == history_table.c.id,
+                            hda_table.c.purged == False ) )
+    for dataset in sa_session.query( model.Dataset ).enable_eagerloads( False ) \
+                             .filter( and_( dataset_table.c.id.in_( unsized ),
+                                            dataset_table.c.total_size == None,
+                                            dataset_table.c.file_size != None,
+                                            dataset_table.c.purged == False ) ):
+        dataset.get_total_size()
+    current = dict( [ ( row[0], int( row[1] or 0 ) ) for row in
+                      sa_session.execute( select( [ user_table.c.id, user_table.c.disk_usage ], user_table.c.id.in_( user_ids ) ) ) ] )
+    new = dict( [ ( user_id, 0 ) for user_id in user_ids ] )
+    new.update( [ ( row[0], int( row[1] ) ) for row in sa_session.execute( model.User.disk_usage_query( user_ids ) ) ] )
+    drift = []
+    for user_id in user_ids:
+        if current.get( user_id, 0 ) != new[ user_id ]:
+            drift.append( ( user_id, current.get( user_id, 0 ), new[ user_id ] ) )
+            if not options.dryrun:
+                sa_session.execute( user_table.update( user_table.c.id == user_id, values={ user_table.c.disk_usage: new[ user_id ] } ) )
+    sa_session.expunge_all()
+    return drift
+
+def init_worker():
+    global worker_model
+    worker_model, object_store = init()
+
+def recalculate_all( model ):
+    sa_session = model.context.current
+    user_ids = [ row[0] for row in sa_session.execute( select( [ model.User.table.c.id ] ).order_by( model.User.table.c.id ) ) ]
+    chunks = [ user_ids[ i:i + options.chunk_size ] for i in range( 0, len( user_ids ), options.chunk_size ) ]
+    print 'Processing %i users in %i chunks with %i process(es)...' % ( len( user_ids ), len( chunks ), options.processes )
+    if options.processes > 1:
+        import multiprocessing
+        # Workers open their own database connections
+        model.engine.dispose()
+        pool = multiprocessing.Pool( options.processes, init_worker )
+        results = pool.imap_unordered( recalculate_chunk, chunks )
+    else:
+        global worker_model
+        worker_model = model
+        results = ( recalculate_chunk( chunk ) for chunk in chunks )
+    changed = []
+    done = 0
+    for drift in results:
+        changed.extend( drift )
+        done += 1
+        print '%3i%% (%i users changed so far)' % ( int( float( done ) / len( chunks ) * 100 ), len( changed ) )
+    if options.processes > 1:
+        pool.close()
+        pool.join()
+    # Report how far the stored values had drifted
+    print '100% complete'
+    print '%i of %i users had incorrect usage%s' % ( len( changed ), len( user_ids ), options.dryrun and ' (dry run, not updated)' or '' )
+    if changed:
+        too_high = sum( [ old - new for user_id, old, new in changed if old > new ] )
+        too_low = sum( [ new - old for user_id, old, new in changed if new > old ] )
+        print 'total overcounted: %s, total undercounted: %s' % ( nice_size( too_high ), nice_size( too_low ) )
+        changed.sort( key=lambda c: abs( c[2] - c[1] ), reverse=True )
+        print 'largest changes:'
+        for user_id, old, new in changed[:10]:
+            print '  user %i: %s -> %s' % ( user_id, nice_size( old ), nice_size( new ) )
+
 if __name__ == '__main__':
     print 'Loading Galaxy model...'
-    model, object_store, engine = init()
+    model, object_store = init()
+    from sqlalchemy.sql.expression import select, and_
     sa_session = model.context.current
 
     if not options.username and not options.email:
-        user_count = sa_session.query( model.User ).count()
-        print 'Processing %i users...' % user_count
-        for i, user in enumerate( sa_session.query( model.User ).enable_eagerloads( False ).yield_per( 1000 ) ):
-            print '%3i%%' % int( float(i) / user_count * 100 ),
-            quotacheck( sa_session, user, engine )
-        print '100% complete'
+        recalculate_all( model )
         object_store.shutdown()
         sys.exit( 0 )
     elif options.username:
@@ -121,4 +168,4 @@ if __name__ == '__main__':
         print 'User not found'
         sys.exit( 1 )
     object_store.shutdown()
-    quotacheck( sa_session, user, engine )
+    quotacheck( sa_session, user )
@@ -55,7 +55,8 @@ var TabularDataset = Dataset.extend({
         chunk_url: null,
         first_data_chunk: null,
         chunk_index: -1,
-        at_eof: false
+        at_eof: false,
+        fetching: false
     }),
 
     initialize: function(options) {
@@ -78,21 +79,24 @@ var TabularDataset = Dataset.extend({
      * Returns a jQuery Deferred object that resolves to the next data chunk or null if at EOF.
      */
     get_next_chunk: function() {
-        // If already at end of file, do nothing.
-        if (this.attributes.at_eof) {
+        // If already at end of file or fetching a chunk, do nothing.
+        if (this.attributes.at_eof || this.attributes.fetching) {
             return null;
         }
 
         // Get next chunk.
         var self = this,
             next_chunk = $.Deferred();
+        this.attributes.fetching = true;
         $.getJSON(this.attributes.chunk_url, {
-            chunk: self.attributes.chunk_index++
+            chunk: self.attributes.chunk_index
         }).success(function(chunk) {
             var rval;
             if (chunk.ck_data !== '') {
-                // Found chunk.
+                // Found chunk; the server gives the index of the next one, as
+                // chunks inside long lines are skipped.
                 rval = chunk;
+                self.attributes.chunk_index = chunk.ck_index;
             }
             else {
                 // At EOF.
@@ -100,6 +104,8 @@ var TabularDataset = Dataset.extend({
                 rval = null;
             }
             next_chunk.resolve(rval);
+        }).complete(function() {
+            self.attributes.fetching = false;
         });
 
         return next_chunk;
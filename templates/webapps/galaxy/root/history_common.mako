@@ -6,7 +6,7 @@
     %>
     %if not data.purged:
         ## Check for downloadable metadata files
-        <% meta_files = [ k for k in data.metadata.spec.keys() if isinstance( data.metadata.spec[k].param, FileParameter ) ] %>
+        <% meta_files = [ k for k in data.metadata.spec.keys() if isinstance( data.metadata.spec[k].param, FileParameter ) and data.metadata.spec[k].get( 'downloadable', True ) and data.metadata.get( k ) ] %>
         %if meta_files:
             <div popupmenu="dataset-${dataset_id}-popup">
                 <a class="action-button" href="${h.url_for( controller='dataset', action='display', dataset_id=dataset_id, \
@@ -99,8 +99,10 @@ def add_file( dataset, registry, json_file, output_path ):
             dataset.is_multi_byte = util.is_multi_byte( codecs.open( dataset.path, 'r', 'utf-8' ).read( 100 ) )
         except UnicodeDecodeError, e:
             dataset.is_multi_byte = False
+    # Read the start of the file once for the checks below
+    file_prefix = sniff.FilePrefix( dataset.path )
     # Is dataset an image?
-    image = check_image( dataset.path )
+    image = check_image( file_prefix.binary_io() )
     if image:
         if not PIL:
             image = None
@@ -110,16 +112,18 @@ def add_file( dataset, registry, json_file, output_path ):
     # Is dataset content multi-byte?
     elif dataset.is_multi_byte:
         data_type = 'multi-byte char'
-        ext = sniff.guess_ext( dataset.path, is_multi_byte=True )
+        ext = sniff.guess_ext( dataset.path, registry.sniff_order, is_multi_byte=True )
     # Is dataset content supported sniffable binary?
     else:
-        type_info = Binary.is_sniffable_binary( dataset.path )
+        type_info = Binary.is_sniffable_binary( file_prefix )
         if type_info:
             data_type = type_info[0]
             ext = type_info[1]
     if not data_type:
         # See if we have a gzipped file, which, if it passes our restrictions, we'll uncompress
-        is_gzipped, is_valid = check_gzip( dataset.path )
+        is_gzipped, is_valid = False, False
+        if file_prefix.startswith( util.gzip_magic ):
+            is_gzipped, is_valid = check_gzip( dataset.path )
         if is_gzipped and not is_valid:
             file_err( 'The gzipped uploaded file contains inappropriate content', dataset, json_file )
             return
@@ -152,7 +156,9 @@ def add_file( dataset, registry, json_file, output_path ):
             data_type = 'gzip'
         if not data_type and bz2 is not None:
             # See if we have a bz2 file, much like gzip
-            is_bzipped, is_valid = check_bz2( dataset.path )
+            is_bzipped, is_valid = False, False
+            if file_prefix.startswith( util.bz2_magic ):
+                is_bzipped, is_valid = check_bz2( dataset.path )
             if is_bzipped and not is_valid:
                 file_err( 'The gzipped uploaded file contains inappropriate content', dataset, json_file )
                 return
@@ -241,7 +247,7 @@ def add_file( dataset, registry, json_file, output_path ):
                         dataset.name = uncompressed_name
                 data_type = 'zip'
         if not data_type:
-            if check_binary( dataset.path ):
+            if check_binary( file_prefix.contents_header, file_path=False ):
                 # We have a binary dataset, but it is not Bam, Sff or Pdf
                 data_type = 'binary'
                 #binary_ok = False
@@ -257,7 +263,7 @@ def add_file( dataset, registry, json_file, output_path ):
                         return
         if not data_type:
             # We must have a text file
-            if check_html( dataset.path ):
+            if check_html( dataset.path, chunk=file_prefix.string_io() ):
                 file_err( 'The uploaded file contains inappropriate HTML content', dataset, json_file )
                 return
         if data_type != 'binary':